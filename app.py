@@ -1,16 +1,29 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, session, send_from_directory
+from flask import Flask, Response, stream_with_context, render_template, request, redirect, url_for, flash, jsonify, send_file, session, send_from_directory
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
-from database import app, db, Usuario, Estudiante, Ruta, Pago, Gasto, Ingreso, Vehiculo, Notificacion, Asistencia, UbicacionVehiculo, UbicacionHistorial, PushSubscription, AsistenciaManual, TicketSoporte, crear_usuarios_ejemplo
-from datetime import datetime, timedelta
+from database import app, db, Usuario, Estudiante, Ruta, Pago, Gasto, Ingreso, Vehiculo, Notificacion, Asistencia, UbicacionHistorial, PushSubscription, AsistenciaManual, TicketSoporte, Geocerca, EventoGeocerca, ResumenFinanzasDia, TrabajoReporte, crear_usuarios_ejemplo
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import contains_eager, joinedload
+from migraciones import aplicar_migraciones
+from posiciones import almacen_posiciones
+import metricas
+from metricas import instalar_metricas
+from notificaciones_push import encolar_push, encolar_push_individuales, despachador_push, estadisticas_suscripciones
+from geoespacial import IndiceGrilla, distancia_metros, poligono_circular
+from geocercas import motor_geocercas
+from eta import motor_eta, aprendizaje_eta, secuencia_paradas
+import finanzas
+import exportaciones
+import importacion
+import sincronizacion
+import trabajos_reportes
+from trabajos_reportes import generador_reportes
+from historial_gps import mantenimiento_historial, recorrido, limitar_puntos, codificar_polyline, a_epoch
+from datetime import datetime, timedelta, timezone
+import base64
 import json
 import os
-from io import BytesIO
-from pywebpush import webpush, WebPushException
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
-from reportlab.lib.styles import getSampleStyleSheet
+import threading
+import time
 import calendar
 
 # ==================== INICIALIZAR DB EN PRODUCCIÓN ====================
@@ -18,6 +31,7 @@ def init_db():
     try:
         with app.app_context():
             db.create_all()
+            aplicar_migraciones()
             crear_usuarios_ejemplo()
     except Exception as e:
         print(f"DB init error: {e}")
@@ -33,6 +47,9 @@ login_manager.login_view = 'login'
 def load_user(user_id):
     return Usuario.query.get(int(user_id))
 
+# ==================== MÉTRICAS (opcional, METRICAS_ACTIVAS=1) ====================
+instalar_metricas(app, db)
+
 # ==================== FUNCIONES AUXILIARES ====================
 def crear_notificacion(usuario_id, tipo, mensaje, link=None):
     """Crear una notificación para un usuario"""
@@ -44,41 +61,93 @@ def crear_notificacion(usuario_id, tipo, mensaje, link=None):
         fecha=datetime.utcnow()
     )
     db.session.add(notif)
-    db.session.commit()
+    ajustar_sin_leer([usuario_id], 1)
     enviar_push_usuario(usuario_id, 'Camley Transporte', mensaje, link)
+    db.session.commit()
+    despachador_push.despertar()
     return notif
 
-def enviar_push_usuario(usuario_id, titulo, mensaje, url=None):
-    """Enviar notificación push a un usuario"""
-    vapid_public = os.getenv('VAPID_PUBLIC_KEY')
-    vapid_private = os.getenv('VAPID_PRIVATE_KEY')
-    vapid_email = os.getenv('VAPID_EMAIL', 'mailto:admin@camley.com')
-    if not vapid_public or not vapid_private:
+def crear_notificaciones_masivas(usuario_ids, tipo, mensaje, link=None, confirmar=True):
+    """Crear la misma notificación para muchos usuarios de una sola vez.
+
+    Elimina duplicados (un padre con varios hijos recibe una sola), inserta
+    todas las filas con un único INSERT y encola un solo trabajo push para
+    todos los destinatarios. Con confirmar=False no hace commit: quien llama
+    confirma y luego despierta al despachador. Devuelve la cantidad de
+    usuarios notificados.
+    """
+    ids = sorted({int(u) for u in usuario_ids if u})
+    if not ids:
+        return 0
+
+    fecha = datetime.utcnow()
+    db.session.execute(Notificacion.__table__.insert().values([{
+        'usuario_id': uid,
+        'tipo': tipo,
+        'mensaje': mensaje,
+        'link': link,
+        'fecha': fecha,
+        'leida': False
+    } for uid in ids]))
+    ajustar_sin_leer(ids, 1)
+    encolar_push(ids, 'Camley Transporte', mensaje, link)
+    if confirmar:
+        db.session.commit()
+        despachador_push.despertar()
+    return len(ids)
+
+def crear_notificaciones_individuales(mensajes, tipo, link=None):
+    """Crear una notificación distinta para cada usuario ({usuario_id: mensaje}).
+
+    Todas las filas van en un único INSERT y los push se encolan con otro;
+    no hace commit, así quien llama las confirma junto con sus propios
+    cambios y luego despierta al despachador. Devuelve cuántas se crearon.
+    """
+    if not mensajes:
+        return 0
+    fecha = datetime.utcnow()
+    db.session.execute(Notificacion.__table__.insert(), [{
+        'usuario_id': usuario_id,
+        'tipo': tipo,
+        'mensaje': mensaje,
+        'link': link,
+        'fecha': fecha,
+        'leida': False
+    } for usuario_id, mensaje in mensajes.items()])
+    ajustar_sin_leer(list(mensajes), 1)
+    encolar_push_individuales(mensajes, 'Camley Transporte', link)
+    return len(mensajes)
+
+def ajustar_sin_leer(usuario_ids, delta):
+    """Sumar (o restar) al contador de notificaciones sin leer. No hace commit.
+
+    Se actualiza con un UPDATE atómico para no pisar incrementos
+    concurrentes y nunca baja de cero.
+    """
+    if not usuario_ids or not delta:
         return
+    nuevo = Usuario.notificaciones_sin_leer + delta
+    Usuario.query.filter(Usuario.id.in_(list(usuario_ids))).update({
+        'notificaciones_sin_leer': db.case((nuevo < 0, 0), else_=nuevo)
+    }, synchronize_session=False)
+
+def padres_de_ruta(ruta_id):
+    """IDs (sin repetir) de los padres con hijos en la ruta"""
+    filas = db.session.query(Estudiante.padre_id).filter(
+        Estudiante.ruta_id == ruta_id,
+        Estudiante.padre_id.isnot(None)
+    ).distinct().all()
+    return [fila[0] for fila in filas]
 
-    subs = PushSubscription.query.filter_by(usuario_id=usuario_id).all()
-    payload = json.dumps({
-        'title': titulo,
-        'body': mensaje,
-        'url': url or '/'
-    })
-    for sub in subs:
-        try:
-            webpush(
-                subscription_info={
-                    "endpoint": sub.endpoint,
-                    "keys": {
-                        "p256dh": sub.p256dh,
-                        "auth": sub.auth
-                    }
-                },
-                data=payload,
-                vapid_private_key=vapid_private,
-                vapid_claims={"sub": vapid_email}
-            )
-        except WebPushException:
-            # Si falla la suscripción, se ignora para no romper el flujo
-            continue
+def enviar_push_usuario(usuario_id, titulo, mensaje, url=None):
+    """Encolar una notificación push para un usuario.
+
+    El envío real lo hace el despachador en segundo plano (ver
+    notificaciones_push.py), así la petición no espera al servicio push.
+    """
+    return encolar_push([usuario_id], titulo, mensaje, url)
+
+MONTO_INSCRIPCION = 50.00
 
 def calcular_vencimiento(semanas=1):
     """Calcular fecha de vencimiento basada en semanas"""
@@ -104,11 +173,404 @@ def es_ajax():
     return request.headers.get('X-Requested-With') == 'XMLHttpRequest' or \
         request.accept_mimetypes['application/json'] > request.accept_mimetypes['text/html']
 
+# ==================== PAGINACIÓN ====================
+TAMANO_PAGINA = 50
+MAX_TAMANO_PAGINA = 200
+
+def codificar_cursor(fecha, id):
+    """Cursor opaco con la clave (fecha, id) de la última fila entregada"""
+    crudo = f'{fecha.isoformat()}|{id}'
+    return base64.urlsafe_b64encode(crudo.encode()).decode().rstrip('=')
+
+def decodificar_cursor(cursor, solo_fecha=False):
+    """Inverso de codificar_cursor; lanza ValueError si el cursor no es válido"""
+    try:
+        crudo = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        fecha, id = crudo.rsplit('|', 1)
+        fecha = datetime.fromisoformat(fecha)
+        return (fecha.date() if solo_fecha else fecha), int(id)
+    except ValueError:
+        raise ValueError('Cursor inválido')
+
+def paginar_keyset(query, col_fecha, col_id, cursor=None, limite=TAMANO_PAGINA, descendente=True):
+    """Página de `query` ordenada por (col_fecha, col_id) a partir del cursor.
+
+    En vez de OFFSET filtra con una comparación de tuplas sobre la clave, así
+    que con un índice que termine en (fecha, id) cualquier página cuesta lo
+    mismo que la primera. Devuelve (filas, siguiente_cursor o None).
+    """
+    if cursor:
+        solo_fecha = not isinstance(col_fecha.type, db.DateTime)
+        fecha, ultimo_id = decodificar_cursor(cursor, solo_fecha)
+        clave = db.tuple_(col_fecha, col_id)
+        limite_clave = db.tuple_(db.literal(fecha, col_fecha.type), db.literal(ultimo_id, col_id.type))
+        query = query.filter(clave < limite_clave if descendente else clave > limite_clave)
+
+    if descendente:
+        query = query.order_by(col_fecha.desc(), col_id.desc())
+    else:
+        query = query.order_by(col_fecha.asc(), col_id.asc())
+
+    filas = query.limit(limite + 1).all()
+    if len(filas) <= limite:
+        return filas, None
+    filas = filas[:limite]
+    ultima = filas[-1]
+    return filas, codificar_cursor(getattr(ultima, col_fecha.key), getattr(ultima, col_id.key))
+
+def pagina_solicitada(query, col_fecha, col_id, descendente=True):
+    """paginar_keyset con ?cursor= y ?limite= de la petición actual"""
+    limite = request.args.get('limite', TAMANO_PAGINA, type=int)
+    limite = max(1, min(limite, MAX_TAMANO_PAGINA))
+    return paginar_keyset(query, col_fecha, col_id, request.args.get('cursor'), limite, descendente)
+
+# ==================== UBICACIONES GPS ====================
+MAX_PUNTOS_LOTE = 500
+TOLERANCIA_RELOJ_DISPOSITIVO = timedelta(minutes=5)
+MAX_PUNTOS_HISTORIAL = 5000
+MAX_VENTANA_HISTORIAL = timedelta(days=31)
+MAX_ANTIGUEDAD_DISPOSITIVO = timedelta(days=30)
+
+def parsear_fecha_dispositivo(valor, ahora=None, max_antiguedad=MAX_ANTIGUEDAD_DISPOSITIVO):
+    """Convertir la marca de tiempo enviada por el teléfono a datetime UTC naive.
+
+    Acepta epoch en milisegundos o segundos y cadenas ISO 8601. Si no viene
+    fecha se usa la hora del servidor; si el reloj del dispositivo va
+    adelantado más de la tolerancia se recorta a la hora del servidor.
+    Lanza ValueError si la fecha no se puede convertir o es más vieja que
+    `max_antiguedad` (un reloj en 0, un booleano), para que quien llama
+    rechace solo ese punto; las consultas de historial pasan None.
+    """
+    ahora = ahora or datetime.utcnow()
+    if valor in (None, ''):
+        return ahora
+    if isinstance(valor, bool):
+        raise ValueError('Fecha inválida')
+
+    try:
+        if isinstance(valor, (int, float)) or (isinstance(valor, str) and valor.replace('.', '', 1).isdigit()):
+            segundos = float(valor)
+            if segundos > 1e11:
+                segundos = segundos / 1000.0
+            fecha = datetime.utcfromtimestamp(segundos)
+        else:
+            texto = str(valor).strip()
+            if texto.endswith('Z'):
+                texto = texto[:-1] + '+00:00'
+            try:
+                fecha = datetime.fromisoformat(texto)
+            except ValueError:
+                raise ValueError('Fecha inválida')
+            if fecha.tzinfo is not None:
+                fecha = fecha.astimezone(timezone.utc).replace(tzinfo=None)
+    except (OverflowError, OSError):
+        raise ValueError('Fecha fuera de rango')
+
+    if max_antiguedad is not None and fecha < ahora - max_antiguedad:
+        raise ValueError('Fecha demasiado antigua')
+    if fecha > ahora + TOLERANCIA_RELOJ_DISPOSITIVO:
+        return ahora
+    return fecha
+
+
+def parsear_hasta(valor):
+    """`hasta` de una consulta de historial; un día sin hora (YYYY-MM-DD) se
+    toma completo, igual que en las exportaciones"""
+    try:
+        dia = datetime.strptime(valor.strip(), '%Y-%m-%d')
+    except (AttributeError, ValueError):
+        return parsear_fecha_dispositivo(valor, max_antiguedad=None)
+    return dia + timedelta(days=1) - timedelta(microseconds=1)
+
+
+def validar_punto_gps(lat, lng):
+    """Validar y convertir un par lat/lng; lanza ValueError si es inválido"""
+    lat = float(lat)
+    lng = float(lng)
+    if not (-90.0 <= lat <= 90.0) or not (-180.0 <= lng <= 180.0):
+        raise ValueError('Coordenadas fuera de rango')
+    return lat, lng
+
+def registrar_ubicaciones(conductor_id, puntos):
+    """Guardar uno o varios puntos GPS de un conductor. No hace commit.
+
+    `puntos` es una lista de dicts con lat, lng y fecha (datetime). Todo el
+    historial se escribe con un solo INSERT multi-fila. Después del commit
+    quien llama debe pasar los mismos puntos a publicar_ubicaciones().
+    """
+    if not puntos:
+        return
+
+    db.session.execute(
+        UbicacionHistorial.__table__.insert(),
+        [{
+            'conductor_id': conductor_id,
+            'lat': p['lat'],
+            'lng': p['lng'],
+            'fecha': p['fecha']
+        } for p in puntos]
+    )
+
+# Los eventos de geocerca más viejos que esto (puntos que llegan tarde desde
+# la cola offline) se guardan pero no se avisan a los padres
+VENTANA_AVISOS_GEOCERCA = timedelta(minutes=5)
+
+def publicar_ubicaciones(conductor_id, puntos):
+    """Llevar puntos ya confirmados a la posición en vivo, la ETA y las geocercas.
+
+    Solo el punto más reciente pasa al almacén de posiciones en vivo, siempre
+    que sea más nuevo que el guardado (los puntos atrasados de un buffer
+    offline no retroceden la posición); `UbicacionVehiculo` se actualiza
+    después en segundo plano. La ETA y los avisos de geocerca hacen su propio
+    commit; solo se avisan los eventos dentro de VENTANA_AVISOS_GEOCERCA.
+    """
+    if not puntos:
+        return None
+
+    ultimo = max(puntos, key=lambda p: p['fecha'])
+    almacen_posiciones.actualizar(conductor_id, ultimo['lat'], ultimo['lng'], ultimo['fecha'])
+    try:
+        motor_eta.procesar(conductor_id, puntos)
+    except Exception as e:
+        # Los puntos ya están guardados; la ETA se recalcula con el siguiente
+        db.session.rollback()
+        app.logger.warning('Error actualizando ETA del conductor %s: %s', conductor_id, e)
+    try:
+        notificar_eventos_geocerca(motor_geocercas.procesar(conductor_id, puntos),
+                                   datetime.utcnow() - VENTANA_AVISOS_GEOCERCA)
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning('Error procesando geocercas del conductor %s: %s', conductor_id, e)
+    return ultimo
+
+def notificar_eventos_geocerca(eventos, avisar_desde=None):
+    """Guardar los eventos de geocerca y avisar a los padres afectados.
+
+    Escuela: padres de la ruta de la geocerca o, si es general, de las
+    rutas del conductor. Parada: el padre del estudiante o, si la parada no
+    es de un estudiante, los padres de la ruta. Los eventos anteriores a
+    `avisar_desde` solo se guardan. Eventos, avisos y el estado de
+    geocercas que dejó motor_geocercas.procesar van en un solo commit.
+    """
+    if not eventos:
+        db.session.commit()
+        return
+    db.session.execute(EventoGeocerca.__table__.insert(), [{
+        'geocerca_id': e['geocerca_id'],
+        'conductor_id': e['conductor_id'],
+        'evento': e['evento'],
+        'lat': e['lat'],
+        'lng': e['lng'],
+        'fecha': e['fecha']
+    } for e in eventos])
+
+    for e in eventos:
+        if avisar_desde is not None and e['fecha'] < avisar_desde:
+            continue
+        entrada = e['evento'] == 'entrada'
+        estudiante = db.session.get(Estudiante, e['estudiante_id']) if e['estudiante_id'] else None
+        if estudiante:
+            destinatarios = [estudiante.padre_id]
+        else:
+            rutas = [e['ruta_id']] if e['ruta_id'] else e['rutas']
+            destinatarios = [p for rid in rutas for p in padres_de_ruta(rid)]
+
+        if e['tipo'] == 'escuela':
+            mensaje = f"🏫 La unidad llegó a {e['nombre']}." if entrada else f"🚌 La unidad salió de {e['nombre']}."
+        elif estudiante:
+            mensaje = (f'🚏 El bus llegó a la parada de {estudiante.nombre}.' if entrada
+                       else f'🚌 El bus salió de la parada de {estudiante.nombre}.')
+        else:
+            mensaje = f"🚏 El bus llegó a {e['nombre']}." if entrada else f"🚌 El bus salió de {e['nombre']}."
+        crear_notificaciones_masivas(destinatarios, 'llegada' if entrada else 'salida', mensaje,
+                                     url_for('padre_dashboard'), confirmar=False)
+    db.session.commit()
+    despachador_push.despertar()
+
+_metadatos_conductores = {'expira': 0, 'datos': {}}
+TTL_METADATOS_CONDUCTORES = 30
+
+def metadatos_conductores():
+    """Nombre, estado y ruta de cada conductor, cacheados unos segundos.
+
+    Cambian muy poco, así que el mapa en vivo no necesita consultarlos en
+    cada actualización. invalidar_metadatos_conductores() solo limpia la
+    copia de este proceso; los demás workers ven el cambio cuando vence
+    TTL_METADATOS_CONDUCTORES.
+    """
+    ahora = time.monotonic()
+    if _metadatos_conductores['expira'] > ahora:
+        return _metadatos_conductores['datos']
+
+    rutas_por_conductor = {
+        r.conductor_id: r.nombre for r in Ruta.query.filter(Ruta.conductor_id.isnot(None)).all()
+    }
+    datos = {
+        c.id: {
+            'nombre': c.nombre,
+            'activo': bool(c.activo),
+            'ruta': rutas_por_conductor.get(c.id, '')
+        } for c in Usuario.query.filter_by(rol='conductor').all()
+    }
+    _metadatos_conductores['datos'] = datos
+    _metadatos_conductores['expira'] = ahora + TTL_METADATOS_CONDUCTORES
+    return datos
+
+def invalidar_metadatos_conductores():
+    _metadatos_conductores['expira'] = 0
+    invalidar_resumen_dashboard()
+    motor_eta.invalidar()
+    motor_geocercas.invalidar()
+
+def conductores_autorizados_padre(padre_id):
+    """IDs de los conductores de las rutas donde viajan los hijos del padre"""
+    filas = db.session.query(Ruta.conductor_id).join(
+        Estudiante, Estudiante.ruta_id == Ruta.id
+    ).filter(
+        Estudiante.padre_id == padre_id,
+        Ruta.conductor_id.isnot(None)
+    ).distinct().all()
+    return {fila[0] for fila in filas}
+
+_paradas = {'expira': 0, 'indice': None, 'datos': {}}
+
+def indice_paradas():
+    """Índice espacial de las paradas de estudiantes activos, cacheado como
+    los metadatos de conductores e invalidado al crear/editar estudiantes"""
+    ahora = time.monotonic()
+    if _paradas['indice'] is not None and _paradas['expira'] > ahora:
+        return _paradas['indice'], _paradas['datos']
+
+    indice = IndiceGrilla()
+    datos = {}
+    for eid, nombre, ruta_id, padre_id, lat, lng in db.session.query(
+        Estudiante.id, Estudiante.nombre, Estudiante.ruta_id, Estudiante.padre_id,
+        Estudiante.parada_lat, Estudiante.parada_lng
+    ).filter_by(activo=True).filter(Estudiante.parada_lat.isnot(None), Estudiante.parada_lng.isnot(None)):
+        indice.actualizar(eid, lat, lng)
+        datos[eid] = {
+            'estudiante_id': eid, 'nombre': nombre, 'ruta_id': ruta_id,
+            'padre_id': padre_id, 'lat': lat, 'lng': lng
+        }
+    # Se reemplaza entero: los hilos que leen el anterior no ven cambios a medias
+    _paradas['indice'], _paradas['datos'] = indice, datos
+    _paradas['expira'] = ahora + TTL_METADATOS_CONDUCTORES
+    return indice, datos
+
+def invalidar_paradas():
+    _paradas['expira'] = 0
+    motor_eta.invalidar()
+    motor_geocercas.invalidar()
+
+def paradas_cercanas(lat, lng, radio_metros, ruta_id=None):
+    """Paradas a menos de `radio_metros` del punto, opcionalmente de una sola ruta"""
+    indice, datos = indice_paradas()
+    return [
+        dict(datos[eid], distancia_metros=round(d, 1))
+        for d, eid in indice.en_radio(lat, lng, radio_metros)
+        if ruta_id is None or datos[eid]['ruta_id'] == ruta_id
+    ]
+
+def leer_parada(form):
+    """(lat, lng) de la parada desde un formulario; (None, None) si viene vacía"""
+    lat = (form.get('parada_lat') or '').strip()
+    lng = (form.get('parada_lng') or '').strip()
+    if not lat and not lng:
+        return None, None
+    return validar_punto_gps(lat, lng)
+
+def leer_orden_parada(form):
+    """Orden de la parada en la ruta (entero >= 1) o None si viene vacío"""
+    valor = (form.get('orden_parada') or '').strip()
+    if not valor:
+        return None
+    orden = int(valor)
+    if orden < 1:
+        raise ValueError('Orden de parada inválido')
+    return orden
+
+def texto_eta(parada):
+    if parada.get('pasada'):
+        return 'Ya pasó'
+    if parada.get('segundos') is None:
+        return ''
+    minutos = round(parada['segundos'] / 60)
+    return 'Llegando' if minutos < 1 else f'≈ {minutos} min'
+
+def eta_para_estudiante(estudiante):
+    """Paradas de la ruta del estudiante con su ETA, tal como las ve el padre.
+
+    La estimación es la compartida de la ruta (motor_eta); aquí solo se
+    quitan los estudiantes de cada parada y se marca la del hijo. Sin
+    posición del bus se devuelven las paradas sin tiempos.
+    """
+    ruta = estudiante.ruta
+    if not ruta:
+        return None, []
+    resultado = None
+    if ruta.conductor_id:
+        posicion = almacen_posiciones.obtener(ruta.conductor_id)
+        resultado = motor_eta.estimacion(ruta.id, ruta.conductor_id, posicion)
+    paradas_ruta = resultado['paradas'] if resultado else secuencia_paradas(ruta.id)
+
+    paradas = []
+    for p in paradas_ruta:
+        propia = estudiante.id in p['estudiantes']
+        paradas.append({
+            'orden': p['orden'],
+            'lat': p['lat'],
+            'lng': p['lng'],
+            'propia': propia,
+            'nombre': f"Parada {p['orden']}" + (f' · {estudiante.nombre}' if propia else ''),
+            'pasada': p.get('pasada', False),
+            'segundos': p.get('segundos'),
+            'eta': p.get('eta'),
+            'hora': texto_eta(p)
+        })
+    return resultado, paradas
+
+DURACION_STREAM_SEGUNDOS = 300
+ESPERA_STREAM_SEGUNDOS = 1
+LATIDO_STREAM_SEGUNDOS = 15
+# Cada stream ocupa un hilo de gthread mientras dura; por encima de este
+# cupo por worker el cliente recibe 503 y pasa a la consulta periódica
+MAX_STREAMS_POR_WORKER = int(os.getenv('MAX_STREAMS_POR_WORKER', '4'))
+cupos_stream = threading.BoundedSemaphore(MAX_STREAMS_POR_WORKER)
+
+@app.before_request
+def iniciar_despachador_push():
+    """Asegurar que este worker tenga su despachador push corriendo"""
+    despachador_push.iniciar()
+
+@app.before_request
+def iniciar_mantenimiento_historial():
+    """Compactación y retención periódica del historial GPS en este worker"""
+    mantenimiento_historial.iniciar()
+
+@app.before_request
+def iniciar_aprendizaje_eta():
+    """Aprendizaje de los modelos de ETA en segundo plano en este worker"""
+    aprendizaje_eta.iniciar()
+
+@app.before_request
+def iniciar_generador_reportes():
+    """Asegurar que este worker tenga su generador de reportes corriendo"""
+    generador_reportes.iniciar()
+
 @app.context_processor
 def inject_now():
     """Inyectar fecha actual en todas las plantillas"""
     return {'now': datetime.utcnow()}
 
+@app.context_processor
+def inject_notificaciones_navbar():
+    """Últimas 5 notificaciones del usuario para el menú de la barra superior"""
+    if not current_user.is_authenticated:
+        return {}
+    return {'notificaciones_navbar': Notificacion.query.filter_by(
+        usuario_id=current_user.id
+    ).order_by(Notificacion.fecha.desc(), Notificacion.id.desc()).limit(5).all()}
+
 # ==================== RUTAS PRINCIPALES ====================
 @app.route('/')
 def index():
@@ -151,6 +613,8 @@ def push_subscribe():
         existente.usuario_id = current_user.id
         existente.p256dh = p256dh
         existente.auth = auth
+        existente.fallos_consecutivos = 0
+        existente.ultimo_fallo = None
     else:
         sub = PushSubscription(
             usuario_id=current_user.id,
@@ -175,6 +639,32 @@ def push_unsubscribe():
         db.session.commit()
     return jsonify({'success': True})
 
+@app.route('/admin/metricas')
+@login_required
+def admin_metricas():
+    """Consultas SQL, tiempos y tamaño de respuesta acumulados por endpoint"""
+    if current_user.rol != 'admin':
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+    if not metricas.ACTIVAS:
+        return jsonify({'success': False, 'error': 'Métricas desactivadas (METRICAS_ACTIVAS=1)'}), 404
+    return jsonify({'success': True, 'endpoints': metricas.resumen()})
+
+@app.route('/admin/metricas/reiniciar', methods=['POST'])
+@login_required
+def reiniciar_metricas():
+    if current_user.rol != 'admin':
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+    metricas.reiniciar()
+    return jsonify({'success': True})
+
+@app.route('/api/push/estadisticas')
+@login_required
+def push_estadisticas():
+    """Suscripciones push activas, en pausa por fallos y eliminadas"""
+    if current_user.rol != 'admin':
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+    return jsonify({'success': True, **estadisticas_suscripciones()})
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     """Página de login general"""
@@ -271,6 +761,10 @@ def registro():
         
         db.session.add(nuevo_usuario)
         db.session.commit()
+        if rol == 'conductor':
+            invalidar_metadatos_conductores()
+        else:
+            invalidar_resumen_dashboard()
         
         admin = Usuario.query.filter_by(rol='admin').first()
         if rol == 'conductor':
@@ -317,42 +811,68 @@ def admin_dashboard():
         flash('⚠️ No tienes permisos de administrador', 'error')
         return redirect(url_for('index'))
     
-    total_estudiantes = Estudiante.query.count()
-    total_rutas = Ruta.query.filter_by(activa=True).count()
-    total_conductores = Usuario.query.filter_by(rol='conductor', activo=True).count()
-    
-    pagos_pendientes = Pago.query.filter_by(estado='pendiente').count()
-    pagos_vencidos = Pago.query.filter(
-        Pago.estado == 'pendiente',
-        Pago.fecha_vencimiento < datetime.utcnow()
-    ).count()
-    
+    return render_template('admin/dashboard.html', **resumen_dashboard())
+
+_resumen_dashboard = {'expira': 0, 'datos': None}
+TTL_RESUMEN_DASHBOARD = 15
+
+def resumen_dashboard():
+    """Datos del dashboard de admin, cacheados unos segundos.
+
+    Todos los contadores salen de un solo SELECT con subconsultas escalares
+    (cada una usa su índice) y los últimos pagos de otra consulta con su
+    estudiante. Las rutas que crean o cambian estudiantes, rutas,
+    conductores, pagos, ingresos o gastos llaman a invalidar_resumen_dashboard().
+    """
+    ahora_monotonic = time.monotonic()
+    if _resumen_dashboard['datos'] is not None and _resumen_dashboard['expira'] > ahora_monotonic:
+        return _resumen_dashboard['datos']
+
+    ahora = datetime.utcnow()
     inicio_semana, fin_semana = obtener_semana_actual()
-    ingresos_semana = db.session.query(db.func.sum(Ingreso.monto)).filter(
-        Ingreso.fecha >= inicio_semana
-    ).scalar() or 0
-    gastos_semana = db.session.query(db.func.sum(Gasto.monto)).filter(
-        Gasto.fecha >= inicio_semana
-    ).scalar() or 0
-    
-    conductores_pendientes = Usuario.query.filter_by(rol='conductor', activo=False).count()
-    
-    notificaciones = Notificacion.query.order_by(Notificacion.fecha.desc()).limit(5).all()
-    ultimos_pagos = Pago.query.order_by(Pago.fecha_creacion.desc()).limit(5).all()
-    
-    return render_template('admin/dashboard.html',
-                        estudiantes=total_estudiantes,
-                        rutas=total_rutas,
-                        conductores=total_conductores,
-                        pagos_pendientes=pagos_pendientes,
-                        pagos_vencidos=pagos_vencidos,
-                        ingresos_semana=ingresos_semana,
-                        gastos_semana=gastos_semana,
-                        conductores_pendientes=conductores_pendientes,
-                        notificaciones=notificaciones,
-                        ultimos_pagos=ultimos_pagos,
-                        inicio_semana=inicio_semana,
-                        fin_semana=fin_semana)
+
+    def contar(modelo, *condiciones):
+        consulta = db.select(db.func.count()).select_from(modelo)
+        if condiciones:
+            consulta = consulta.where(*condiciones)
+        return consulta.scalar_subquery()
+
+    def sumar_semana(tipo):
+        return db.select(db.func.coalesce(db.func.sum(ResumenFinanzasDia.total), 0)).where(
+            ResumenFinanzasDia.tipo == tipo, ResumenFinanzasDia.dia >= inicio_semana
+        ).scalar_subquery()
+
+    fila = db.session.execute(db.select(
+        contar(Estudiante).label('estudiantes'),
+        contar(Ruta, Ruta.activa == True).label('rutas'),
+        contar(Usuario, Usuario.rol == 'conductor', Usuario.activo == True).label('conductores'),
+        contar(Usuario, Usuario.rol == 'conductor', Usuario.activo == False).label('conductores_pendientes'),
+        contar(Pago, Pago.estado == 'pendiente').label('pagos_pendientes'),
+        contar(Pago, Pago.estado == 'pendiente', Pago.fecha_vencimiento < ahora).label('pagos_vencidos'),
+        sumar_semana('ingreso').label('ingresos_semana'),
+        sumar_semana('gasto').label('gastos_semana')
+    )).one()
+
+    # Diccionarios y no objetos ORM: el caché sobrevive a la sesión de la petición
+    ultimos_pagos = [{
+        'monto': p.monto,
+        'estado': p.estado,
+        'fecha_pago': p.fecha_pago,
+        'fecha_creacion': p.fecha_creacion,
+        'fecha_vencimiento': p.fecha_vencimiento,
+        'estudiante': {'nombre': p.estudiante.nombre} if p.estudiante else None
+    } for p in Pago.query.options(joinedload(Pago.estudiante)).order_by(
+        Pago.fecha_creacion.desc(), Pago.id.desc()
+    ).limit(5)]
+
+    datos = dict(fila._mapping, ultimos_pagos=ultimos_pagos,
+                 inicio_semana=inicio_semana, fin_semana=fin_semana)
+    _resumen_dashboard['datos'] = datos
+    _resumen_dashboard['expira'] = ahora_monotonic + TTL_RESUMEN_DASHBOARD
+    return datos
+
+def invalidar_resumen_dashboard():
+    _resumen_dashboard['expira'] = 0
 
 # ==================== GESTIÓN DE ESTUDIANTES ====================
 @app.route('/admin/estudiantes')
@@ -408,6 +928,11 @@ def agregar_estudiante():
         
         if not genero:
             return jsonify({'success': False, 'error': 'Género requerido'}), 400
+        try:
+            parada_lat, parada_lng = leer_parada(request.form)
+            orden_parada = leer_orden_parada(request.form)
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Coordenadas u orden de parada inválidos'}), 400
 
         existente = Estudiante.query.filter_by(
             nombre=nombre,
@@ -427,6 +952,9 @@ def agregar_estudiante():
             condicion=condicion,
             padre_id=int(padre_id) if padre_id else None,
             ruta_id=int(ruta_id) if ruta_id else None,
+            parada_lat=parada_lat,
+            parada_lng=parada_lng,
+            orden_parada=orden_parada,
             fecha_inscripcion=datetime.utcnow()
         )
         
@@ -436,7 +964,7 @@ def agregar_estudiante():
         vencimiento = calcular_vencimiento(1)
         nuevo_pago = Pago(
             estudiante_id=nuevo_estudiante.id,
-            monto=50.00,
+            monto=MONTO_INSCRIPCION,
             fecha_vencimiento=vencimiento,
             estado='pendiente',
             meses_cubiertos=1,
@@ -456,6 +984,8 @@ def agregar_estudiante():
                 )
         
         db.session.commit()
+        invalidar_paradas()
+        invalidar_resumen_dashboard()
         
         if es_ajax():
             return jsonify({
@@ -471,6 +1001,65 @@ def agregar_estudiante():
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/admin/estudiantes/importar', methods=['POST'])
+@login_required
+def importar_estudiantes():
+    """Importar estudiantes desde un CSV (ver importacion.py).
+
+    Las filas válidas se insertan en una sola transacción junto con su
+    primer pago y la notificación a cada padre; las inválidas se devuelven
+    con su número de línea. Con solo_validar=1 no se guarda nada.
+    """
+    if current_user.rol != 'admin':
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+
+    archivo = request.files.get('archivo')
+    if not archivo or not archivo.filename:
+        return jsonify({'success': False, 'error': 'Selecciona un archivo CSV'}), 400
+    solo_validar = request.form.get('solo_validar') in ('1', 'true', 'on')
+
+    try:
+        filas = importacion.leer_csv(archivo.read())
+        estudiantes, padres_nuevos, errores = importacion.preparar(filas)
+        importados = 0
+        if estudiantes and not solo_validar:
+            vencimiento = calcular_vencimiento(1)
+            hijos = importacion.insertar(estudiantes, padres_nuevos, MONTO_INSCRIPCION, vencimiento)
+            crear_notificaciones_individuales({
+                padre_id: f'📚 {", ".join(nombres)} {"ha" if len(nombres) == 1 else "han"} sido inscrito(a)s. '
+                          f'Primer pago vence {vencimiento.strftime("%d/%m/%Y")}'
+                for padre_id, nombres in hijos.items()
+            }, 'estudiante', url_for('padre_dashboard'))
+            db.session.commit()
+            importados = len(estudiantes)
+            invalidar_paradas()
+            invalidar_resumen_dashboard()
+            despachador_push.despertar()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+    resultado = {
+        'success': True,
+        'validos': len(estudiantes),
+        'importados': importados,
+        'padres_creados': len(padres_nuevos) if importados else 0,
+        'errores': errores
+    }
+    if es_ajax():
+        return jsonify(resultado)
+
+    if importados:
+        flash(f'✅ {importados} estudiantes importados', 'success')
+    for error in errores[:20]:
+        flash(f'Fila {error["fila"]} ({error["nombre"]}): {error["error"]}', 'error')
+    if len(errores) > 20:
+        flash(f'... y {len(errores) - 20} filas más con errores', 'error')
+    return redirect(url_for('admin_estudiantes'))
+
 @app.route('/admin/estudiantes/editar/<int:id>', methods=['GET', 'POST'])
 @login_required
 def editar_estudiante(id):
@@ -489,8 +1078,17 @@ def editar_estudiante(id):
         estudiante.condicion = request.form.get('condicion', '') or request.form.get('observaciones', '')
         estudiante.padre_id = int(request.form['padre_id']) if request.form['padre_id'] else None
         estudiante.ruta_id = int(request.form['ruta_id']) if request.form['ruta_id'] else None
+        try:
+            estudiante.parada_lat, estudiante.parada_lng = leer_parada(request.form)
+            estudiante.orden_parada = leer_orden_parada(request.form)
+        except ValueError:
+            db.session.rollback()
+            flash('Coordenadas u orden de parada inválidos', 'error')
+            return redirect(url_for('editar_estudiante', id=id))
         
         db.session.commit()
+        invalidar_paradas()
+        invalidar_resumen_dashboard()
         flash('✅ Estudiante actualizado exitosamente', 'success')
         return redirect(url_for('admin_estudiantes'))
     
@@ -525,6 +1123,8 @@ def eliminar_estudiante(id):
         
         db.session.delete(estudiante)
         db.session.commit()
+        invalidar_paradas()
+        invalidar_resumen_dashboard()
         
         return jsonify({
             'success': True,
@@ -544,10 +1144,31 @@ def admin_pagos():
         return redirect(url_for('index'))
     
     estado = request.args.get('estado', 'todos')
-    estudiante_id = request.args.get('estudiante_id')
     
+    try:
+        pagos, siguiente_cursor = pagina_solicitada(
+            consulta_pagos_admin(estado, request.args.get('estudiante_id')),
+            Pago.fecha_vencimiento, Pago.id, descendente=False
+        )
+    except ValueError:
+        flash('Enlace de página inválido', 'error')
+        return redirect(url_for('admin_pagos'))
+    
+    estudiantes = Estudiante.query.order_by(Estudiante.nombre.asc()).all()
+    
+    return render_template('admin/pagos.html',
+                        pagos=pagos,
+                        siguiente_cursor=siguiente_cursor,
+                        estudiantes=estudiantes,
+                        estado_actual=estado,
+                        now=datetime.utcnow())
+
+def consulta_pagos_admin(estado, estudiante_id):
+    """Pagos filtrados por estado/estudiante, con el estudiante ya cargado"""
     # Consulta con JOIN para obtener estudiante
-    query = Pago.query.join(Estudiante, Pago.estudiante_id == Estudiante.id)
+    query = Pago.query.join(Estudiante, Pago.estudiante_id == Estudiante.id).options(
+        contains_eager(Pago.estudiante)
+    )
     
     if estado != 'todos':
         if estado == 'vencido':
@@ -561,18 +1182,38 @@ def admin_pagos():
     if estudiante_id and estudiante_id.isdigit():
         query = query.filter(Pago.estudiante_id == int(estudiante_id))
     
-    pagos = query.order_by(
-        Pago.estado,
-        Pago.fecha_vencimiento.asc()
-    ).all()
+    return query
+
+@app.route('/api/admin/pagos')
+@login_required
+def api_admin_pagos():
+    """Pagos paginados por (fecha_vencimiento, id) con los mismos filtros del panel"""
+    if current_user.rol != 'admin':
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
     
-    estudiantes = Estudiante.query.order_by(Estudiante.nombre.asc()).all()
+    try:
+        pagos, siguiente_cursor = pagina_solicitada(
+            consulta_pagos_admin(request.args.get('estado', 'todos'), request.args.get('estudiante_id')),
+            Pago.fecha_vencimiento, Pago.id, descendente=False
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     
-    return render_template('admin/pagos.html',
-                        pagos=pagos,
-                        estudiantes=estudiantes,
-                        estado_actual=estado,
-                        now=datetime.utcnow())
+    return jsonify({
+        'success': True,
+        'pagos': [{
+            'id': p.id,
+            'estudiante_id': p.estudiante_id,
+            'estudiante': p.estudiante.nombre,
+            'monto': p.monto,
+            'estado': p.estado,
+            'fecha_vencimiento': p.fecha_vencimiento.strftime('%Y-%m-%d'),
+            'fecha_pago': p.fecha_pago.strftime('%Y-%m-%d') if p.fecha_pago else None,
+            'metodo_pago': p.metodo_pago,
+            'referencia': p.referencia
+        } for p in pagos],
+        'siguiente_cursor': siguiente_cursor
+    })
 
 @app.route('/admin/pagos/registrar', methods=['POST'])
 @login_required
@@ -635,6 +1276,7 @@ def registrar_pago_admin():
                     fecha=datetime.utcnow()
                 )
                 db.session.add(nuevo_ingreso)
+                finanzas.registrar_ingreso(nuevo_ingreso)
         
         if estudiante.padre_id:
             crear_notificacion(
@@ -645,6 +1287,7 @@ def registrar_pago_admin():
             )
         
         db.session.commit()
+        invalidar_resumen_dashboard()
         flash(f'✅ Pago de C$ {monto} registrado para {estudiante.nombre}', 'success')
         
     except Exception as e:
@@ -682,8 +1325,10 @@ def marcar_pago_pagado(pago_id):
                 fecha=datetime.utcnow()
             )
             db.session.add(nuevo_ingreso)
+            finanzas.registrar_ingreso(nuevo_ingreso)
         
         db.session.commit()
+        invalidar_resumen_dashboard()
         
         return jsonify({
             'success': True,
@@ -716,6 +1361,7 @@ def eliminar_pago(pago_id):
         estudiante_nombre = pago.estudiante.nombre
         db.session.delete(pago)
         db.session.commit()
+        invalidar_resumen_dashboard()
         
         return jsonify({
             'success': True,
@@ -740,6 +1386,7 @@ def limpiar_pagos_vencidos():
         ).delete()
         
         db.session.commit()
+        invalidar_resumen_dashboard()
         
         return jsonify({
             'success': True,
@@ -781,6 +1428,7 @@ def editar_pago(pago_id):
             pago.fecha_pago = datetime.utcnow()
         
         db.session.commit()
+        invalidar_resumen_dashboard()
         
         return jsonify({
             'success': True,
@@ -798,21 +1446,16 @@ def admin_finanzas():
     if current_user.rol != 'admin':
         return redirect(url_for('index'))
     
-    total_ingresos = db.session.query(db.func.sum(Ingreso.monto)).scalar() or 0
-    total_gastos = db.session.query(db.func.sum(Gasto.monto)).scalar() or 0
+    totales = finanzas.totales_periodos(obtener_semana_actual()[0], obtener_mes_actual()[0])
+    total_ingresos = totales['ingreso']['total']
+    total_gastos = totales['gasto']['total']
     balance = total_ingresos - total_gastos
     
     ingresos = Ingreso.query.order_by(Ingreso.fecha.desc()).limit(10).all()
     gastos = Gasto.query.order_by(Gasto.fecha.desc()).limit(10).all()
     
-    hoy = datetime.utcnow()
-    inicio_mes = hoy.replace(day=1)
-    ingresos_mes = db.session.query(db.func.sum(Ingreso.monto)).filter(
-        Ingreso.fecha >= inicio_mes
-    ).scalar() or 0
-    gastos_mes = db.session.query(db.func.sum(Gasto.monto)).filter(
-        Gasto.fecha >= inicio_mes
-    ).scalar() or 0
+    ingresos_mes = totales['ingreso']['mes']
+    gastos_mes = totales['gasto']['mes']
     
     return render_template('admin/finanzas.html',
                         total_ingresos=total_ingresos,
@@ -843,7 +1486,9 @@ def agregar_ingreso():
         )
         
         db.session.add(nuevo_ingreso)
+        finanzas.registrar_ingreso(nuevo_ingreso)
         db.session.commit()
+        invalidar_resumen_dashboard()
         
         return jsonify({
             'success': True,
@@ -875,7 +1520,9 @@ def agregar_gasto():
         )
         
         db.session.add(nuevo_gasto)
+        finanzas.registrar_gasto(nuevo_gasto)
         db.session.commit()
+        invalidar_resumen_dashboard()
         
         return jsonify({
             'success': True,
@@ -890,69 +1537,11 @@ def agregar_gasto():
 @app.route('/admin/reporte_finanzas')
 @login_required
 def generar_reporte_finanzas():
-    """Generar reporte PDF de finanzas"""
+    """Reporte PDF de finanzas (opcional ?desde=AAAA-MM-DD&hasta=AAAA-MM-DD), en segundo plano"""
     if current_user.rol != 'admin':
         return redirect(url_for('index'))
     
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
-    elementos = []
-    estilos = getSampleStyleSheet()
-    
-    titulo = Paragraph("Reporte de Finanzas - Sistema de Transporte", estilos['Title'])
-    elementos.append(titulo)
-    
-    fecha = Paragraph(f"Generado: {datetime.now().strftime('%d/%m/%Y %H:%M')}", estilos['Normal'])
-    elementos.append(fecha)
-    elementos.append(Paragraph("<br/><br/>", estilos['Normal']))
-    
-    total_ingresos = db.session.query(db.func.sum(Ingreso.monto)).scalar() or 0
-    total_gastos = db.session.query(db.func.sum(Gasto.monto)).scalar() or 0
-    balance = total_ingresos - total_gastos
-    
-    datos_totales = [
-        ['Concepto', 'Monto'],
-        ['Total Ingresos', f'C$ {total_ingresos:.2f}'],
-        ['Total Gastos', f'C$ {total_gastos:.2f}'],
-        ['Balance General', f'C$ {balance:.2f}']
-    ]
-    
-    tabla_totales = Table(datos_totales)
-    tabla_totales.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-    ]))
-    elementos.append(tabla_totales)
-    
-    elementos.append(Paragraph("<br/><br/><b>Últimos Ingresos:</b>", estilos['Normal']))
-    ingresos = Ingreso.query.order_by(Ingreso.fecha.desc()).limit(10).all()
-    
-    if ingresos:
-        datos_ingresos = [['Descripción', 'Monto', 'Fecha', 'Fuente']]
-        for ingreso in ingresos:
-            datos_ingresos.append([
-                ingreso.descripcion,
-                f'C$ {ingreso.monto:.2f}',
-                ingreso.fecha.strftime('%d/%m/%Y'),
-                ingreso.fuente
-            ])
-        
-        tabla_ingresos = Table(datos_ingresos)
-        tabla_ingresos.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.lightblue),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        elementos.append(tabla_ingresos)
-    
-    doc.build(elementos)
-    buffer.seek(0)
-    
-    return send_file(buffer,
-                    as_attachment=True,
-                    download_name=f'reporte_finanzas_{datetime.now().strftime("%Y%m%d")}.pdf',
-                    mimetype='application/pdf')
+    return pedir_reporte('finanzas', request.args, url_for('admin_finanzas'))
 
 # ==================== CONDUCTORES ====================
 @app.route('/admin/conductores')
@@ -1012,6 +1601,7 @@ def activar_conductor(id):
         )
         
         db.session.commit()
+        invalidar_metadatos_conductores()
         
         return jsonify({
             'success': True,
@@ -1040,6 +1630,7 @@ def aprobar_conductor(id):
             url_for('conductor_dashboard')
         )
         db.session.commit()
+        invalidar_metadatos_conductores()
         return jsonify({'success': True, 'message': '✅ Conductor aprobado'})
     except Exception as e:
         db.session.rollback()
@@ -1061,6 +1652,7 @@ def desactivar_conductor(id):
             '⚠️ Tu cuenta ha sido desactivada por el administrador'
         )
         db.session.commit()
+        invalidar_metadatos_conductores()
         return jsonify({'success': True, 'message': '✅ Conductor desactivado'})
     except Exception as e:
         db.session.rollback()
@@ -1127,6 +1719,7 @@ def editar_conductor_admin(id):
             conductor.activo = (activo == 'true')
         
         db.session.commit()
+        invalidar_metadatos_conductores()
         return jsonify({'success': True, 'message': '✅ Conductor actualizado'})
     except Exception as e:
         db.session.rollback()
@@ -1146,70 +1739,230 @@ def actualizar_ubicacion_conductor():
         return jsonify({'success': False, 'error': 'Lat/Lng requeridos'}), 400
     
     try:
-        registro = UbicacionVehiculo.query.filter_by(conductor_id=current_user.id).first()
-        if registro:
-            registro.lat = float(lat)
-            registro.lng = float(lng)
-            registro.ultima_actualizacion = datetime.utcnow()
-        else:
-            registro = UbicacionVehiculo(
-                conductor_id=current_user.id,
-                lat=float(lat),
-                lng=float(lng),
-                ultima_actualizacion=datetime.utcnow()
-            )
-            db.session.add(registro)
-        
-        historial = UbicacionHistorial(
-            conductor_id=current_user.id,
-            lat=float(lat),
-            lng=float(lng),
-            fecha=datetime.utcnow()
-        )
-        db.session.add(historial)
+        lat, lng = validar_punto_gps(lat, lng)
+        fecha = parsear_fecha_dispositivo(data.get('fecha'))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Coordenadas o fecha inválidas'}), 400
 
+    try:
+        puntos = [{'lat': lat, 'lng': lng, 'fecha': fecha}]
+        registrar_ubicaciones(current_user.id, puntos)
         db.session.commit()
+        publicar_ubicaciones(current_user.id, puntos)
         return jsonify({'success': True, 'message': 'Ubicación actualizada'})
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/conductor/ubicacion/lote', methods=['POST'])
+@login_required
+def actualizar_ubicacion_lote():
+    """Recibir un lote de puntos GPS (incluye puntos guardados sin conexión)"""
+    if current_user.rol != 'conductor':
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+
+    data = request.get_json(silent=True) or {}
+    puntos_raw = data.get('puntos')
+    if not isinstance(puntos_raw, list) or not puntos_raw:
+        return jsonify({'success': False, 'error': 'Lista de puntos requerida'}), 400
+    if len(puntos_raw) > MAX_PUNTOS_LOTE:
+        return jsonify({'success': False, 'error': f'Máximo {MAX_PUNTOS_LOTE} puntos por lote'}), 400
+
+    ahora = datetime.utcnow()
+    puntos = []
+    rechazados = 0
+    for p in puntos_raw:
+        try:
+            lat, lng = validar_punto_gps(p.get('lat'), p.get('lng'))
+            fecha = parsear_fecha_dispositivo(p.get('fecha'), ahora)
+        except (AttributeError, TypeError, ValueError):
+            rechazados += 1
+            continue
+        puntos.append({'lat': lat, 'lng': lng, 'fecha': fecha})
+
+    if not puntos:
+        return jsonify({'success': False, 'error': 'Ningún punto válido', 'rechazados': rechazados}), 400
+
+    try:
+        registrar_ubicaciones(current_user.id, puntos)
+        db.session.commit()
+        publicar_ubicaciones(current_user.id, puntos)
+        return jsonify({
+            'success': True,
+            'guardados': len(puntos),
+            'rechazados': rechazados
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/conductor/<int:id>/ubicacion')
 @login_required
 def api_conductor_ubicacion(id):
     """Obtener última ubicación de un conductor"""
     if current_user.rol == 'padre':
-        hijos = Estudiante.query.filter_by(padre_id=current_user.id).all()
-        conductor_ids = {hijo.ruta.conductor_id for hijo in hijos if hijo.ruta}
-        if id not in conductor_ids:
+        if id not in conductores_autorizados_padre(current_user.id):
             return jsonify({'success': False, 'error': 'No autorizado'}), 403
     
-    ubicacion = UbicacionVehiculo.query.filter_by(conductor_id=id).first()
+    ubicacion = almacen_posiciones.obtener(id)
     if not ubicacion:
         return jsonify({'success': False, 'error': 'Sin ubicación'}), 404
     
     return jsonify({
         'success': True,
-        'lat': ubicacion.lat,
-        'lng': ubicacion.lng,
-        'ultima_actualizacion': ubicacion.ultima_actualizacion.strftime('%Y-%m-%d %H:%M:%S')
+        'lat': ubicacion['lat'],
+        'lng': ubicacion['lng'],
+        'ultima_actualizacion': ubicacion['ultima_actualizacion'].strftime('%Y-%m-%d %H:%M:%S')
+    })
+
+@app.route('/api/ubicaciones/stream')
+@login_required
+def stream_ubicaciones():
+    """Server-Sent Events con las posiciones en vivo.
+
+    Envía primero un evento `snapshot` con las posiciones visibles para el
+    usuario y después un evento `posicion` por cada cambio. Admin ve todos
+    los conductores, un padre solo los de las rutas de sus hijos y un
+    conductor solo a sí mismo. La conexión se cierra tras unos minutos y el
+    navegador (EventSource) reconecta solo, lo que vuelve a validar permisos.
+
+    Cada conexión abierta retiene un hilo del worker, así que solo se
+    admiten MAX_STREAMS_POR_WORKER a la vez; las demás reciben 503 y la
+    página consulta la posición periódicamente.
+    """
+    if current_user.rol == 'admin':
+        conductor_ids = None
+    elif current_user.rol == 'padre':
+        conductor_ids = conductores_autorizados_padre(current_user.id)
+    elif current_user.rol == 'conductor':
+        conductor_ids = {current_user.id}
+    else:
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+
+    if not cupos_stream.acquire(blocking=False):
+        return jsonify({'success': False, 'error': 'Demasiadas conexiones en vivo'}), 503, {'Retry-After': '60'}
+
+    es_admin = current_user.rol == 'admin'
+    try:
+        metadatos = dict(metadatos_conductores()) if es_admin else {}
+    except Exception:
+        cupos_stream.release()
+        raise
+    # Liberar la conexión a la BD antes de empezar a transmitir
+    db.session.remove()
+
+    def serializar(p):
+        data = {
+            'conductor_id': p['conductor_id'],
+            'lat': p['lat'],
+            'lng': p['lng'],
+            'ultima_actualizacion': p['ultima_actualizacion'].strftime('%d/%m/%Y %H:%M:%S')
+        }
+        if es_admin:
+            meta = metadatos.get(p['conductor_id'], {})
+            data['nombre'] = meta.get('nombre', 'Conductor')
+            data['activo'] = meta.get('activo', False)
+            data['ruta'] = meta.get('ruta', '')
+        return data
+
+    def evento(nombre, data):
+        return f'event: {nombre}\ndata: {json.dumps(data)}\n\n'
+
+    def generar():
+        cambios, version = almacen_posiciones.cambios_desde(0, conductor_ids)
+        yield 'retry: 3000\n\n'
+        yield evento('snapshot', [serializar(p) for p in cambios])
+
+        fin = time.monotonic() + DURACION_STREAM_SEGUNDOS
+        ultimo_envio = time.monotonic()
+        while time.monotonic() < fin:
+            almacen_posiciones.esperar_cambio(ESPERA_STREAM_SEGUNDOS)
+            cambios, actual = almacen_posiciones.cambios_desde(version, conductor_ids)
+            if actual < version:
+                # El almacén compartido cambió de worker y numera de nuevo: reenviar todo
+                cambios, actual = almacen_posiciones.cambios_desde(0, conductor_ids)
+            version = actual
+            for p in cambios:
+                yield evento('posicion', serializar(p))
+            if cambios:
+                ultimo_envio = time.monotonic()
+            elif time.monotonic() - ultimo_envio >= LATIDO_STREAM_SEGUNDOS:
+                yield ': ping\n\n'
+                ultimo_envio = time.monotonic()
+
+    respuesta = Response(generar(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
     })
+    # El servidor cierra la respuesta al terminar o al cortarse el cliente
+    respuesta.call_on_close(cupos_stream.release)
+    return respuesta
 
 @app.route('/api/conductores/<int:id>/historial')
 @login_required
 def api_conductor_historial(id):
-    """Historial reciente de ubicaciones de un conductor"""
+    """Historial de ubicaciones de un conductor.
+
+    Sin desde/hasta devuelve los últimos `limit` puntos crudos; con ventana
+    lee también los días ya compactados. `tolerancia` (metros) simplifica
+    con Douglas-Peucker, `max_puntos` acota la respuesta y
+    `formato=polyline` la entrega como polyline codificada.
+    """
     if current_user.rol != 'admin':
         return jsonify({'success': False, 'error': 'No autorizado'}), 403
 
-    limit = int(request.args.get('limit', 200))
-    puntos = UbicacionHistorial.query.filter_by(conductor_id=id).order_by(UbicacionHistorial.fecha.desc()).limit(limit).all()
+    try:
+        limit = int(request.args.get('limit', 200))
+        max_puntos = int(request.args.get('max_puntos', MAX_PUNTOS_HISTORIAL))
+        tolerancia = float(request.args.get('tolerancia', 0))
+        if not 1 <= limit <= MAX_PUNTOS_HISTORIAL:
+            raise ValueError(f'limit debe estar entre 1 y {MAX_PUNTOS_HISTORIAL}')
+        if not 2 <= max_puntos <= MAX_PUNTOS_HISTORIAL:
+            raise ValueError(f'max_puntos debe estar entre 2 y {MAX_PUNTOS_HISTORIAL}')
+        if not 0 <= tolerancia <= 1000:
+            raise ValueError('tolerancia debe estar entre 0 y 1000 metros')
+
+        if request.args.get('desde') or request.args.get('hasta'):
+            hasta = parsear_hasta(request.args.get('hasta'))
+            desde = parsear_fecha_dispositivo(request.args.get('desde'), max_antiguedad=None) if request.args.get('desde') \
+                else hasta - timedelta(days=1)
+            if desde > hasta:
+                raise ValueError('desde debe ser anterior a hasta')
+            if hasta - desde > MAX_VENTANA_HISTORIAL:
+                raise ValueError(f'La ventana debe ser de como mucho {MAX_VENTANA_HISTORIAL.days} días')
+            puntos = recorrido(id, desde, hasta)
+        else:
+            # Sin ventana: los últimos `limit` puntos crudos
+            filas = db.session.query(
+                UbicacionHistorial.lat, UbicacionHistorial.lng, UbicacionHistorial.fecha
+            ).filter(UbicacionHistorial.conductor_id == id).order_by(
+                UbicacionHistorial.fecha.desc()
+            ).limit(limit).all()
+            puntos = [[lat, lng, fecha] for lat, lng, fecha in reversed(filas)]
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    originales = len(puntos)
+    puntos = limitar_puntos(puntos, max_puntos, tolerancia)
+
+    if request.args.get('formato') == 'polyline':
+        # Tiempos: el primero en epoch y el resto como diferencias en segundos
+        tiempos = [a_epoch(p[2]) for p in puntos]
+        return jsonify({
+            'success': True,
+            'formato': 'polyline',
+            'polyline': codificar_polyline(puntos),
+            'tiempos': tiempos[:1] + [round(b - a, 6) for a, b in zip(tiempos, tiempos[1:])],
+            'cantidad': len(puntos),
+            'cantidad_original': originales
+        })
+
     data = [{
-        'lat': p.lat,
-        'lng': p.lng,
-        'fecha': p.fecha.strftime('%Y-%m-%d %H:%M:%S')
-    } for p in reversed(puntos)]
-    return jsonify({'success': True, 'puntos': data})
+        'lat': lat,
+        'lng': lng,
+        'fecha': fecha.strftime('%Y-%m-%d %H:%M:%S')
+    } for lat, lng, fecha in puntos]
+    return jsonify({'success': True, 'puntos': data, 'cantidad_original': originales})
 
 @app.route('/admin/conductores/asignar_ruta/<int:id>', methods=['POST'])
 @login_required
@@ -1237,6 +1990,7 @@ def asignar_ruta_conductor(id):
         
         ruta.conductor_id = conductor.id
         db.session.commit()
+        invalidar_metadatos_conductores()
         
         crear_notificacion(
             conductor.id,
@@ -1273,9 +2027,34 @@ def admin_padres():
     padres_activos = [p for p in padres if p.activo]
     padres_pendientes = Usuario.query.filter_by(rol='padre', activo=False).all()
     
+    # Hijos con su ruta y vehículo en una sola consulta
+    ids_padres = [p.id for p in padres_activos]
+    hijos_por_padre = {}
+    if ids_padres:
+        hijos_todos = Estudiante.query.options(
+            joinedload(Estudiante.ruta).joinedload(Ruta.vehiculo)
+        ).filter(Estudiante.padre_id.in_(ids_padres)).order_by(Estudiante.id).all()
+        for hijo in hijos_todos:
+            hijos_por_padre.setdefault(hijo.padre_id, []).append(hijo)
+    
+    # Último pago de cada hijo con una sola consulta (ROW_NUMBER por estudiante)
+    ultimo_pago_por_hijo = {}
+    if hijos_por_padre:
+        orden = db.func.row_number().over(
+            partition_by=Pago.estudiante_id,
+            order_by=(Pago.fecha_vencimiento.desc(), Pago.id.desc())
+        ).label('orden')
+        subconsulta = db.session.query(Pago.id.label('pago_id'), orden).join(
+            Estudiante, Pago.estudiante_id == Estudiante.id
+        ).filter(Estudiante.padre_id.in_(ids_padres)).subquery()
+        ultimos = Pago.query.join(
+            subconsulta, Pago.id == subconsulta.c.pago_id
+        ).filter(subconsulta.c.orden == 1).all()
+        ultimo_pago_por_hijo = {pago.estudiante_id: pago for pago in ultimos}
+    
     datos_padres = []
     for padre in padres_activos:
-        hijos = Estudiante.query.filter_by(padre_id=padre.id).all()
+        hijos = hijos_por_padre.get(padre.id, [])
         
         hijos_info = []
         for hijo in hijos:
@@ -1283,9 +2062,7 @@ def admin_padres():
             if hijo.ruta and hijo.ruta.vehiculo:
                 vehiculo_info = f"{hijo.ruta.vehiculo.modelo} - Placa: {hijo.ruta.vehiculo.placa}"
             
-            ultimo_pago = Pago.query.filter_by(
-                estudiante_id=hijo.id
-            ).order_by(Pago.fecha_vencimiento.desc()).first()
+            ultimo_pago = ultimo_pago_por_hijo.get(hijo.id)
             
             dias_restantes = 0
             if ultimo_pago and ultimo_pago.fecha_vencimiento:
@@ -1373,9 +2150,10 @@ def padre_ruta(estudiante_id):
     
     ubicacion_vehiculo = None
     if conductor:
-        ubicacion_vehiculo = UbicacionVehiculo.query.filter_by(conductor_id=conductor.id).first()
+        ubicacion_vehiculo = almacen_posiciones.obtener(conductor.id)
     
     asistencias_recientes = Asistencia.query.filter_by(estudiante_id=estudiante.id).order_by(Asistencia.fecha.desc()).limit(5).all()
+    _, paradas = eta_para_estudiante(estudiante)
     
     return render_template('padres/ruta.html',
                         estudiante=estudiante,
@@ -1383,7 +2161,29 @@ def padre_ruta(estudiante_id):
                         conductor=conductor,
                         ubicacion_vehiculo=ubicacion_vehiculo,
                         asistencias_recientes=asistencias_recientes,
-                        paradas=[])
+                        paradas=paradas)
+
+@app.route('/api/padre/ruta/<int:estudiante_id>/eta')
+@login_required
+def api_padre_ruta_eta(estudiante_id):
+    """ETA del bus a las paradas de la ruta del estudiante (su padre o admin)"""
+    estudiante = Estudiante.query.get_or_404(estudiante_id)
+    if current_user.rol != 'admin' and not (current_user.rol == 'padre' and estudiante.padre_id == current_user.id):
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+    if not estudiante.ruta:
+        return jsonify({'success': False, 'error': 'El estudiante no tiene ruta asignada'}), 404
+
+    resultado, paradas = eta_para_estudiante(estudiante)
+    propia = next((p for p in paradas if p['propia']), None)
+    return jsonify({
+        'success': True,
+        'ruta_id': estudiante.ruta.id,
+        'posicion': resultado['posicion'] if resultado else None,
+        'velocidad_kmh': resultado['velocidad_kmh'] if resultado else None,
+        'siguiente_parada': resultado['siguiente_parada'] if resultado else None,
+        'parada_estudiante': propia,
+        'paradas': paradas
+    })
 
 @app.route('/admin/padres/<int:id>/activar', methods=['POST'])
 @login_required
@@ -1448,6 +2248,13 @@ def conductor_dashboard():
                         hoy=hoy,
                         asistencia_manual=asistencia_manual)
 
+ESTADOS_ASISTENCIA = ('presente', 'ausente', 'tardanza', 'justificado')
+TEXTO_ESTADO_ASISTENCIA = {
+    'presente': '✅ presente',
+    'ausente': '❌ ausente',
+    'tardanza': '⚠️ con tardanza'
+}
+
 @app.route('/conductor/registrar_asistencia', methods=['POST'])
 @login_required
 def registrar_asistencia():
@@ -1487,11 +2294,7 @@ def registrar_asistencia():
             db.session.add(nueva_asistencia)
         
         if estudiante.padre_id:
-            estado_texto = {
-                'presente': '✅ presente',
-                'ausente': '❌ ausente',
-                'tardanza': '⚠️ con tardanza'
-            }.get(estado, estado)
+            estado_texto = TEXTO_ESTADO_ASISTENCIA.get(estado, estado)
             
             crear_notificacion(
                 estudiante.padre_id,
@@ -1517,6 +2320,254 @@ def registrar_asistencia_alias():
     """Alias para compatibilidad con frontend"""
     return registrar_asistencia()
 
+@app.route('/conductor/asistencia/lista', methods=['POST'])
+@login_required
+def registrar_lista_asistencia():
+    """Registrar la lista completa del día en una sola petición.
+
+    Recibe {"asistencias": [{"estudiante_id", "estado", "observaciones"?}, ...]}.
+    Una consulta valida toda la lista contra las rutas del conductor y trae
+    la asistencia de hoy de cada estudiante; luego se insertan las nuevas y
+    se actualizan las que cambiaron de estado en bloque, y los padres de
+    esas se notifican con un INSERT (el push sale por el despachador). Si
+    algún estudiante no es de la ruta no se guarda nada.
+    """
+    if current_user.rol != 'conductor':
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+
+    data = request.get_json(silent=True) or {}
+    lista = data.get('asistencias')
+    if not isinstance(lista, list) or not lista:
+        return jsonify({'success': False, 'error': 'Lista de asistencias vacía'}), 400
+
+    marcas = {}
+    try:
+        for item in lista:
+            estudiante_id = int(item['estudiante_id'])
+            estado = item.get('estado', 'presente')
+            if estado not in ESTADOS_ASISTENCIA:
+                return jsonify({'success': False, 'error': f'Estado inválido: {estado}'}), 400
+            if estudiante_id in marcas:
+                return jsonify({'success': False, 'error': f'Estudiante {estudiante_id} repetido en la lista'}), 400
+            marcas[estudiante_id] = (estado, (item.get('observaciones') or '').strip())
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return jsonify({'success': False, 'error': 'Formato de lista inválido'}), 400
+
+    try:
+        ahora = datetime.utcnow()
+        hoy = ahora.date()
+        filas = db.session.query(
+            Estudiante.id, Estudiante.nombre, Estudiante.padre_id, Asistencia.id, Asistencia.estado
+        ).join(Ruta, Estudiante.ruta_id == Ruta.id).outerjoin(
+            Asistencia, (Asistencia.estudiante_id == Estudiante.id) & (Asistencia.fecha == hoy)
+        ).filter(
+            Ruta.conductor_id == current_user.id,
+            Estudiante.id.in_(list(marcas))
+        ).all()
+
+        fuera_de_ruta = sorted(set(marcas) - {f[0] for f in filas})
+        if fuera_de_ruta:
+            return jsonify({
+                'success': False,
+                'error': 'Estudiantes no en tu ruta',
+                'estudiantes': fuera_de_ruta
+            }), 400
+
+        nuevas, cambios, mensajes, vistos = [], [], {}, set()
+        for estudiante_id, nombre, padre_id, asistencia_id, estado_actual in filas:
+            if estudiante_id in vistos:  # duplicados ya existentes: se actualiza el primero
+                continue
+            vistos.add(estudiante_id)
+            estado, observaciones = marcas[estudiante_id]
+            if asistencia_id is None:
+                nuevas.append({
+                    'estudiante_id': estudiante_id,
+                    'fecha': hoy,
+                    'hora': ahora.time(),
+                    'estado': estado,
+                    'observaciones': observaciones,
+                    'conductor_id': current_user.id
+                })
+            elif estado_actual != estado:
+                cambios.append({
+                    'id': asistencia_id,
+                    'estado': estado,
+                    'observaciones': observaciones,
+                    'hora': ahora.time(),
+                    'conductor_id': current_user.id
+                })
+            else:
+                continue
+            if padre_id:
+                texto = f'📝 {nombre} marcado como {TEXTO_ESTADO_ASISTENCIA.get(estado, estado)} hoy'
+                mensajes[padre_id] = f'{mensajes[padre_id]}\n{texto}' if padre_id in mensajes else texto
+
+        if nuevas:
+            db.session.execute(Asistencia.__table__.insert(), nuevas)
+        if cambios:
+            db.session.execute(db.update(Asistencia), cambios)
+        notificados = crear_notificaciones_individuales(mensajes, 'asistencia', url_for('padre_dashboard'))
+        db.session.commit()
+        if notificados:
+            despachador_push.despertar()
+
+        return jsonify({
+            'success': True,
+            'registradas': len(nuevas),
+            'actualizadas': len(cambios),
+            'sin_cambios': len(marcas) - len(nuevas) - len(cambios),
+            'padres_notificados': notificados,
+            'message': f'Asistencia guardada: {len(nuevas) + len(cambios)} cambios'
+        })
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def leer_operacion_offline(cliente_id, tipo, op, ahora, marcas, puntos):
+    """Validar una operación de la cola offline.
+
+    Las válidas se agregan a `marcas` o `puntos`; las inválidas devuelven
+    ('rechazada', motivo).
+    """
+    datos = op.get('datos') if isinstance(op.get('datos'), dict) else {}
+    try:
+        fecha = parsear_fecha_dispositivo(op.get('fecha'), ahora)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return ('rechazada', 'Fecha inválida')
+    if fecha < ahora - sincronizacion.MAX_ANTIGUEDAD:
+        return ('rechazada', 'Operación demasiado antigua')
+    if tipo == 'ubicacion':
+        try:
+            lat, lng = validar_punto_gps(datos.get('lat'), datos.get('lng'))
+        except (TypeError, ValueError):
+            return ('rechazada', 'Coordenadas inválidas')
+        puntos.append({'id': cliente_id, 'lat': lat, 'lng': lng, 'fecha': fecha})
+        return None
+    if tipo == 'asistencia':
+        try:
+            estudiante_id = int(datos.get('estudiante_id'))
+        except (TypeError, ValueError):
+            estudiante_id = None
+        estado = datos.get('estado', 'presente')
+        if estudiante_id is None or estado not in ESTADOS_ASISTENCIA:
+            return ('rechazada', 'Datos de asistencia inválidos')
+        marcas.append({
+            'id': cliente_id,
+            'fecha': fecha,
+            'estudiante_id': estudiante_id,
+            'estado': estado,
+            'observaciones': str(datos.get('observaciones') or '').strip()
+        })
+        return None
+    return ('rechazada', 'Tipo de operación desconocido')
+
+@app.route('/conductor/sincronizar', methods=['POST'])
+@login_required
+def sincronizar_conductor():
+    """Aplicar la cola offline del teléfono (ver sincronizacion.py).
+
+    Recibe {"operaciones": [{"id", "tipo": "asistencia"|"ubicacion",
+    "fecha", "datos"}, ...]} con el id generado en el cliente y la hora
+    original. Responde un resultado por id (aplicada, descartada o
+    rechazada); los ids que ya habían llegado devuelven el mismo resultado
+    sin aplicarse de nuevo, así el teléfono puede reintentar sin riesgo.
+    Una operación inválida queda rechazada sin frenar al resto del lote.
+
+    El registro de ids, la asistencia y los puntos GPS se confirman en un
+    solo commit; la posición en vivo, la ETA y las geocercas se actualizan
+    después (publicar_ubicaciones).
+    """
+    if current_user.rol != 'conductor':
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+
+    data = request.get_json(silent=True) or {}
+    operaciones = data.get('operaciones')
+    if not isinstance(operaciones, list) or not operaciones:
+        return jsonify({'success': False, 'error': 'Lista de operaciones requerida'}), 400
+    if len(operaciones) > sincronizacion.MAX_OPERACIONES:
+        return jsonify({'success': False, 'error': f'Máximo {sincronizacion.MAX_OPERACIONES} operaciones por lote'}), 400
+
+    ahora = datetime.utcnow()
+    tipos, resultados, marcas, puntos = {}, {}, [], []
+    invalidas, ignoradas = {}, 0
+    for op in operaciones:
+        cliente_id = str(op.get('id') or '').strip() if isinstance(op, dict) else ''
+        if not cliente_id:
+            ignoradas += 1  # sin id no hay con qué responderle al teléfono
+            continue
+        if len(cliente_id) > 64:
+            invalidas[cliente_id] = ('rechazada', 'Id de operación inválido')
+            continue
+        if cliente_id in tipos:
+            continue
+        tipo = op.get('tipo')
+        tipos[cliente_id] = tipo if tipo in sincronizacion.TIPOS else 'desconocido'
+        try:
+            resultado = leer_operacion_offline(cliente_id, tipo, op, ahora, marcas, puntos)
+        except Exception as e:
+            # Una operación con datos inesperados no frena al resto del lote
+            app.logger.warning('Operación offline %s inválida: %s', cliente_id, e)
+            resultado = ('rechazada', 'Operación inválida')
+        if resultado:
+            resultados[cliente_id] = resultado
+
+    try:
+        previas = sincronizacion.ya_procesadas(current_user.id, tipos)
+        for cliente_id in previas:
+            resultados.pop(cliente_id, None)
+        marcas = [m for m in marcas if m['id'] not in previas]
+        puntos = [p for p in puntos if p['id'] not in previas]
+
+        aplicadas, avisos = sincronizacion.aplicar_asistencias(current_user.id, marcas)
+        resultados.update(aplicadas)
+        resultados.update({p['id']: ('aplicada', None) for p in puntos})
+        sincronizacion.registrar(current_user.id, tipos, resultados)
+
+        mensajes = {}
+        for padre_id, nombre, estado, dia in avisos:
+            cuando = 'hoy' if dia == ahora.date() else f'el {dia.strftime("%d/%m/%Y")}'
+            texto = f'📝 {nombre} marcado como {TEXTO_ESTADO_ASISTENCIA.get(estado, estado)} {cuando}'
+            mensajes[padre_id] = f'{mensajes[padre_id]}\n{texto}' if padre_id in mensajes else texto
+        notificados = crear_notificaciones_individuales(mensajes, 'asistencia', url_for('padre_dashboard'))
+
+        registrar_ubicaciones(current_user.id, puntos)
+        db.session.commit()
+    except IntegrityError:
+        # Otro envío del mismo lote se está aplicando a la vez; al reintentar saldrán como ya procesadas
+        db.session.rollback()
+        return jsonify({'success': False, 'error': 'Sincronización en curso, reintenta en unos segundos'}), 409
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+    if notificados:
+        despachador_push.despertar()
+    try:
+        publicar_ubicaciones(current_user.id, puntos)
+    except Exception as e:
+        # Los puntos ya están confirmados; la posición en vivo se pone al día con el siguiente
+        app.logger.warning('Error publicando puntos sincronizados del conductor %s: %s', current_user.id, e)
+    try:
+        sincronizacion.limpiar_si_toca()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning('Error limpiando operaciones sincronizadas: %s', e)
+
+    resultados.update(previas)
+    resultados.update(invalidas)
+    return jsonify({
+        'success': True,
+        'resultados': [
+            dict({'id': cliente_id, 'resultado': resultado, 'repetida': cliente_id in previas},
+                 **({'error': error} if error else {}))
+            for cliente_id, (resultado, error) in resultados.items()
+        ],
+        'aplicadas': sum(1 for c, (r, _) in resultados.items() if r == 'aplicada' and c not in previas),
+        'ignoradas': ignoradas,
+        'padres_notificados': notificados
+    })
+
 @app.route('/conductor/asistencia_manual', methods=['POST'])
 @login_required
 def guardar_asistencia_manual():
@@ -1564,18 +2615,12 @@ def notificar_retraso():
         if not ruta:
             return jsonify({'success': False, 'error': 'No tienes ruta asignada'})
         
-        estudiantes = Estudiante.query.filter_by(ruta_id=ruta.id).all()
-        
-        notificaciones_enviadas = 0
-        for estudiante in estudiantes:
-            if estudiante.padre_id:
-                crear_notificacion(
-                    estudiante.padre_id,
-                    'retraso',
-                    f'⏰ Retraso en la ruta: {motivo}. Tiempo estimado: {tiempo_estimado}',
-                    url_for('padre_dashboard')
-                )
-                notificaciones_enviadas += 1
+        notificaciones_enviadas = crear_notificaciones_masivas(
+            padres_de_ruta(ruta.id),
+            'retraso',
+            f'⏰ Retraso en la ruta: {motivo}. Tiempo estimado: {tiempo_estimado}',
+            url_for('padre_dashboard')
+        )
         
         admin = Usuario.query.filter_by(rol='admin').first()
         if admin:
@@ -1611,9 +2656,6 @@ def conductor_reportar():
     if not ruta:
         return jsonify({'success': False, 'error': 'No tienes ruta asignada'}), 400
     
-    estudiantes = Estudiante.query.filter_by(ruta_id=ruta.id).all()
-    padres_ids = {e.padre_id for e in estudiantes if e.padre_id}
-    
     try:
         mensajes_defecto = {
             'retraso': 'Lamentamos informarles estimados padres de que la unidad tendrá un pequeño retraso en llegar.',
@@ -1632,13 +2674,12 @@ def conductor_reportar():
                     url_for('admin_dashboard')
                 )
         else:
-            for padre_id in padres_ids:
-                crear_notificacion(
-                    padre_id,
-                    tipo,
-                    f'🚍 {mensaje_final}',
-                    url_for('padre_dashboard')
-                )
+            crear_notificaciones_masivas(
+                padres_de_ruta(ruta.id),
+                tipo,
+                f'🚍 {mensaje_final}',
+                url_for('padre_dashboard')
+            )
         
         db.session.commit()
         return jsonify({'success': True, 'message': 'Reporte enviado correctamente'})
@@ -1699,6 +2740,7 @@ def agregar_ruta():
         
         db.session.add(nueva_ruta)
         db.session.commit()
+        invalidar_metadatos_conductores()
         
         if conductor_id:
             crear_notificacion(
@@ -1772,6 +2814,7 @@ def editar_ruta(ruta_id):
         ruta.conductor_id = int(conductor_id) if conductor_id else None
         ruta.vehiculo_id = int(vehiculo_id) if vehiculo_id else None
         db.session.commit()
+        invalidar_metadatos_conductores()
         return jsonify({'success': True})
     except Exception as e:
         db.session.rollback()
@@ -1940,22 +2983,293 @@ def api_conductores_ubicaciones():
     if current_user.rol != 'admin':
         return jsonify({'success': False, 'error': 'No autorizado'}), 403
 
-    ubicaciones = UbicacionVehiculo.query.join(Usuario, UbicacionVehiculo.conductor_id == Usuario.id).all()
-    rutas = Ruta.query.all()
-    rutas_por_conductor = {r.conductor_id: r for r in rutas if r.conductor_id}
+    metadatos = metadatos_conductores()
     data = []
-    for u in ubicaciones:
+    for u in almacen_posiciones.todas():
+        meta = metadatos.get(u['conductor_id'])
+        if meta is None:
+            continue
         data.append({
-            'conductor_id': u.conductor_id,
-            'nombre': u.conductor.nombre if u.conductor else 'Conductor',
-            'activo': bool(u.conductor.activo) if u.conductor else False,
-            'ruta': rutas_por_conductor.get(u.conductor_id).nombre if rutas_por_conductor.get(u.conductor_id) else '',
-            'lat': u.lat,
-            'lng': u.lng,
-            'ultima_actualizacion': u.ultima_actualizacion.strftime('%d/%m/%Y %H:%M:%S')
+            'conductor_id': u['conductor_id'],
+            'nombre': meta['nombre'],
+            'activo': meta['activo'],
+            'ruta': meta['ruta'],
+            'lat': u['lat'],
+            'lng': u['lng'],
+            'ultima_actualizacion': u['ultima_actualizacion'].strftime('%d/%m/%Y %H:%M:%S')
         })
     return jsonify({'success': True, 'ubicaciones': data})
 
+MAX_VEHICULOS_CERCANOS = 500
+MAX_RADIO_METROS = 50000
+
+def leer_numero(nombre, convertir=float, defecto=None):
+    """Parámetro numérico de la petición, o `defecto` si no viene; ValueError si no es un número"""
+    valor = request.args.get(nombre)
+    if valor is None:
+        return defecto
+    try:
+        return convertir(valor)
+    except ValueError:
+        raise ValueError(f'{nombre} inválido')
+
+def leer_radio(defecto=None):
+    """`radio` (metros) de la petición; ValueError si no está en (0, MAX_RADIO_METROS]"""
+    radio = leer_numero('radio', float, defecto)
+    if radio is not None and not 0 < radio <= MAX_RADIO_METROS:
+        raise ValueError(f'radio debe estar entre 0 y {MAX_RADIO_METROS} metros')
+    return radio
+
+def serializar_cercano(u, metadatos):
+    meta = metadatos.get(u['conductor_id'], {})
+    return {
+        'conductor_id': u['conductor_id'],
+        'nombre': meta.get('nombre', ''),
+        'ruta': meta.get('ruta', ''),
+        'lat': u['lat'],
+        'lng': u['lng'],
+        'distancia_metros': u['distancia_metros'],
+        'ultima_actualizacion': u['ultima_actualizacion'].strftime('%d/%m/%Y %H:%M:%S')
+    }
+
+@app.route('/api/vehiculos/cercanos')
+@login_required
+def api_vehiculos_cercanos():
+    """Vehículos más cercanos a un punto (admin).
+
+    Con `n` devuelve los n más cercanos (opcionalmente dentro de `radio`);
+    solo con `radio` devuelve todos los que estén dentro, en metros.
+    """
+    if current_user.rol != 'admin':
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+
+    try:
+        lat, lng = validar_punto_gps(request.args.get('lat'), request.args.get('lng'))
+        radio = leer_radio()
+        n = leer_numero('n', int)
+        if n is not None and not 1 <= n <= MAX_VEHICULOS_CERCANOS:
+            raise ValueError(f'n debe estar entre 1 y {MAX_VEHICULOS_CERCANOS}')
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    if n is None and radio is not None:
+        encontrados = almacen_posiciones.en_radio(lat, lng, radio)[:MAX_VEHICULOS_CERCANOS]
+    else:
+        encontrados = almacen_posiciones.cercanos(lat, lng, n or 5, radio)
+
+    metadatos = metadatos_conductores()
+    return jsonify({'success': True, 'vehiculos': [serializar_cercano(u, metadatos) for u in encontrados]})
+
+@app.route('/api/estudiantes/<int:id>/proximidad')
+@login_required
+def api_estudiante_proximidad(id):
+    """Distancia del bus de la ruta a la parada del estudiante (admin o su padre)"""
+    estudiante = Estudiante.query.get_or_404(id)
+    if current_user.rol != 'admin' and not (current_user.rol == 'padre' and estudiante.padre_id == current_user.id):
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+    if estudiante.parada_lat is None or estudiante.parada_lng is None:
+        return jsonify({'success': False, 'error': 'El estudiante no tiene parada registrada'}), 404
+    try:
+        radio = leer_radio(500)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    conductor_id = estudiante.ruta.conductor_id if estudiante.ruta else None
+    bus = None
+    if conductor_id:
+        pos = almacen_posiciones.obtener(conductor_id)
+        if pos:
+            distancia = distancia_metros(estudiante.parada_lat, estudiante.parada_lng, pos['lat'], pos['lng'])
+            bus = {
+                'conductor_id': conductor_id,
+                'lat': pos['lat'],
+                'lng': pos['lng'],
+                'distancia_metros': round(distancia, 1),
+                'cerca': distancia <= radio,
+                'ultima_actualizacion': pos['ultima_actualizacion'].strftime('%d/%m/%Y %H:%M:%S')
+            }
+
+    resultado = {
+        'success': True,
+        'parada': {'lat': estudiante.parada_lat, 'lng': estudiante.parada_lng},
+        'radio_metros': radio,
+        'bus': bus
+    }
+    if current_user.rol == 'admin':
+        metadatos = metadatos_conductores()
+        resultado['vehiculos_en_radio'] = [
+            serializar_cercano(u, metadatos)
+            for u in almacen_posiciones.en_radio(estudiante.parada_lat, estudiante.parada_lng, radio)
+        ]
+    return jsonify(resultado)
+
+@app.route('/api/conductores/<int:id>/paradas_cercanas')
+@login_required
+def api_conductor_paradas_cercanas(id):
+    """Paradas de la ruta del conductor dentro de `radio` metros del bus"""
+    if current_user.rol != 'admin' and current_user.id != id:
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+    try:
+        radio = leer_radio(300)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    pos = almacen_posiciones.obtener(id)
+    if not pos:
+        return jsonify({'success': False, 'error': 'Ubicación no disponible'}), 404
+    ruta = Ruta.query.filter_by(conductor_id=id).first()
+    if not ruta:
+        return jsonify({'success': True, 'paradas': []})
+
+    paradas = paradas_cercanas(pos['lat'], pos['lng'], radio, ruta.id)
+    return jsonify({'success': True, 'paradas': [
+        {k: p[k] for k in ('estudiante_id', 'nombre', 'lat', 'lng', 'distancia_metros')} for p in paradas
+    ]})
+
+# ==================== GEOCERCAS ====================
+TIPOS_GEOCERCA = ('escuela', 'parada')
+MAX_VERTICES_GEOCERCA = 200
+MAX_LADO_GEOCERCA_GRADOS = 0.2
+RADIO_GEOCERCA_PARADA = 60
+
+def serializar_geocerca(g):
+    return {
+        'id': g.id,
+        'nombre': g.nombre,
+        'tipo': g.tipo,
+        'poligono': json.loads(g.poligono),
+        'ruta_id': g.ruta_id,
+        'estudiante_id': g.estudiante_id,
+        'activa': bool(g.activa)
+    }
+
+def leer_poligono(data, estudiante=None):
+    """Vértices [[lat, lng], ...] desde `poligono`, o un círculo desde lat/lng/radio.
+
+    Para una parada de estudiante sin coordenadas se usa su parada. Lanza
+    ValueError si el polígono es inválido o demasiado grande.
+    """
+    if data.get('poligono'):
+        vertices = [validar_punto_gps(v[0], v[1]) for v in data['poligono']]
+    else:
+        radio = float(data.get('radio') or RADIO_GEOCERCA_PARADA)
+        if not 10 <= radio <= 2000:
+            raise ValueError('El radio debe estar entre 10 y 2000 metros')
+        if data.get('lat') is not None and data.get('lng') is not None:
+            lat, lng = validar_punto_gps(data['lat'], data['lng'])
+        elif estudiante and estudiante.parada_lat is not None:
+            lat, lng = estudiante.parada_lat, estudiante.parada_lng
+        else:
+            raise ValueError('Indica un polígono o un centro (lat, lng)')
+        vertices = poligono_circular(lat, lng, radio)
+
+    if not 3 <= len(vertices) <= MAX_VERTICES_GEOCERCA:
+        raise ValueError(f'El polígono debe tener entre 3 y {MAX_VERTICES_GEOCERCA} vértices')
+    lats = [v[0] for v in vertices]
+    lngs = [v[1] for v in vertices]
+    if max(lats) - min(lats) > MAX_LADO_GEOCERCA_GRADOS or max(lngs) - min(lngs) > MAX_LADO_GEOCERCA_GRADOS:
+        raise ValueError('El polígono es demasiado grande')
+    return [[round(lat, 7), round(lng, 7)] for lat, lng in vertices]
+
+@app.route('/api/admin/geocercas')
+@login_required
+def api_admin_geocercas():
+    """Geocercas activas"""
+    if current_user.rol != 'admin':
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+    geocercas = Geocerca.query.filter_by(activa=True).order_by(Geocerca.id).all()
+    return jsonify({'success': True, 'geocercas': [serializar_geocerca(g) for g in geocercas]})
+
+@app.route('/api/admin/geocercas', methods=['POST'])
+@login_required
+def crear_geocerca():
+    """Crear una geocerca de escuela o parada (JSON)"""
+    if current_user.rol != 'admin':
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+
+    data = request.get_json(silent=True) or {}
+    nombre = (data.get('nombre') or '').strip()
+    tipo = data.get('tipo')
+    if not nombre or tipo not in TIPOS_GEOCERCA:
+        return jsonify({'success': False, 'error': 'Nombre y tipo (escuela o parada) requeridos'}), 400
+
+    ruta = estudiante = None
+    if data.get('ruta_id'):
+        ruta = db.session.get(Ruta, data['ruta_id'])
+        if not ruta:
+            return jsonify({'success': False, 'error': 'Ruta no encontrada'}), 404
+    if data.get('estudiante_id'):
+        estudiante = db.session.get(Estudiante, data['estudiante_id'])
+        if not estudiante:
+            return jsonify({'success': False, 'error': 'Estudiante no encontrado'}), 404
+
+    try:
+        vertices = leer_poligono(data, estudiante)
+    except (TypeError, ValueError, IndexError) as e:
+        return jsonify({'success': False, 'error': f'Polígono inválido: {e}'}), 400
+
+    try:
+        geocerca = Geocerca(
+            nombre=nombre,
+            tipo=tipo,
+            poligono=json.dumps(vertices),
+            ruta_id=ruta.id if ruta else None,
+            estudiante_id=estudiante.id if estudiante else None
+        )
+        db.session.add(geocerca)
+        db.session.commit()
+        motor_geocercas.invalidar()
+        return jsonify({'success': True, 'geocerca': serializar_geocerca(geocerca)})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/admin/geocercas/<int:id>', methods=['DELETE'])
+@login_required
+def eliminar_geocerca(id):
+    """Desactivar una geocerca (sus eventos se conservan)"""
+    if current_user.rol != 'admin':
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+    geocerca = Geocerca.query.get_or_404(id)
+    try:
+        geocerca.activa = False
+        db.session.commit()
+        motor_geocercas.invalidar()
+        return jsonify({'success': True, 'message': 'Geocerca eliminada'})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/admin/geocercas/eventos')
+@login_required
+def api_admin_eventos_geocerca():
+    """Entradas y salidas registradas, más nuevas primero, paginadas por (fecha, id)"""
+    if current_user.rol != 'admin':
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+    query = EventoGeocerca.query.options(joinedload(EventoGeocerca.geocerca))
+    conductor_id = request.args.get('conductor_id', type=int)
+    if conductor_id:
+        query = query.filter(EventoGeocerca.conductor_id == conductor_id)
+    try:
+        eventos, siguiente_cursor = pagina_solicitada(query, EventoGeocerca.fecha, EventoGeocerca.id)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({
+        'success': True,
+        'eventos': [{
+            'id': e.id,
+            'geocerca_id': e.geocerca_id,
+            'geocerca': e.geocerca.nombre,
+            'tipo': e.geocerca.tipo,
+            'conductor_id': e.conductor_id,
+            'evento': e.evento,
+            'lat': e.lat,
+            'lng': e.lng,
+            'fecha': e.fecha.strftime('%d/%m/%Y %H:%M:%S')
+        } for e in eventos],
+        'siguiente_cursor': siguiente_cursor
+    })
+
 @app.route('/admin/vehiculos/<int:vehiculo_id>/editar', methods=['POST'])
 @login_required
 def editar_vehiculo(vehiculo_id):
@@ -2002,6 +3316,7 @@ def eliminar_ruta(ruta_id):
         Estudiante.query.filter_by(ruta_id=ruta.id).update({'ruta_id': None})
         db.session.delete(ruta)
         db.session.commit()
+        invalidar_metadatos_conductores()
         return jsonify({'success': True})
     except Exception as e:
         db.session.rollback()
@@ -2014,8 +3329,10 @@ def eliminar_ingreso(ingreso_id):
         return jsonify({'success': False, 'error': 'No autorizado'}), 403
     ingreso = Ingreso.query.get_or_404(ingreso_id)
     try:
+        finanzas.registrar_ingreso(ingreso, signo=-1)
         db.session.delete(ingreso)
         db.session.commit()
+        invalidar_resumen_dashboard()
         return jsonify({'success': True})
     except Exception as e:
         db.session.rollback()
@@ -2028,13 +3345,45 @@ def eliminar_gasto(gasto_id):
         return jsonify({'success': False, 'error': 'No autorizado'}), 403
     gasto = Gasto.query.get_or_404(gasto_id)
     try:
+        finanzas.registrar_gasto(gasto, signo=-1)
         db.session.delete(gasto)
         db.session.commit()
+        invalidar_resumen_dashboard()
         return jsonify({'success': True})
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/admin/finanzas/verificar')
+@login_required
+def verificar_resumen_finanzas():
+    """Comparar el resumen diario con un recálculo completo desde ingreso y gasto"""
+    if current_user.rol != 'admin':
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+    diferencias = finanzas.verificar(db.session.connection())
+    return jsonify({
+        'success': True,
+        'coincide': not diferencias,
+        'diferencias': [{
+            'dia': dia.isoformat(), 'tipo': tipo, 'concepto': concepto,
+            'resumen': round(guardado, 2), 'real': round(real, 2)
+        } for dia, tipo, concepto, guardado, real in diferencias]
+    })
+
+@app.route('/api/admin/finanzas/recalcular', methods=['POST'])
+@login_required
+def recalcular_resumen_finanzas():
+    """Reconstruir el resumen diario desde cero"""
+    if current_user.rol != 'admin':
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+    try:
+        filas = finanzas.recalcular(db.session.connection())
+        db.session.commit()
+        return jsonify({'success': True, 'filas': filas})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 # ==================== MODO OSCURO ====================
 @app.route('/toggle_modo_oscuro', methods=['POST', 'GET'])
 def toggle_modo_oscuro():
@@ -2053,9 +3402,13 @@ def obtener_notificaciones(usuario_id):
     if current_user.id != usuario_id and current_user.rol != 'admin':
         return jsonify({'error': 'No autorizado'}), 403
     
-    notificaciones = Notificacion.query.filter_by(
-        usuario_id=usuario_id
-    ).order_by(Notificacion.fecha.desc()).limit(20).all()
+    try:
+        notificaciones, siguiente_cursor = pagina_solicitada(
+            Notificacion.query.filter_by(usuario_id=usuario_id),
+            Notificacion.fecha, Notificacion.id
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     
     resultado = []
     for notif in notificaciones:
@@ -2068,7 +3421,7 @@ def obtener_notificaciones(usuario_id):
             'leida': notif.leida
         })
     
-    return jsonify(resultado)
+    return jsonify({'success': True, 'notificaciones': resultado, 'siguiente_cursor': siguiente_cursor})
 
 @app.route('/api/notificaciones/marcar_leida/<int:notif_id>', methods=['POST'])
 @login_required
@@ -2079,7 +3432,10 @@ def marcar_notificacion_leida(notif_id):
     if notificacion.usuario_id != current_user.id and current_user.rol != 'admin':
         return jsonify({'success': False, 'error': 'No autorizado'}), 403
     
-    notificacion.leida = True
+    marcadas = Notificacion.query.filter_by(id=notif_id, leida=False).update(
+        {'leida': True}, synchronize_session=False
+    )
+    ajustar_sin_leer([notificacion.usuario_id], -marcadas)
     db.session.commit()
     
     return jsonify({'success': True})
@@ -2088,7 +3444,10 @@ def marcar_notificacion_leida(notif_id):
 @login_required
 def marcar_todas_leidas():
     """Marcar todas las notificaciones como leídas"""
-    Notificacion.query.filter_by(usuario_id=current_user.id, leida=False).update({'leida': True})
+    marcadas = Notificacion.query.filter_by(usuario_id=current_user.id, leida=False).update(
+        {'leida': True}, synchronize_session=False
+    )
+    ajustar_sin_leer([current_user.id], -marcadas)
     db.session.commit()
     return jsonify({'success': True})
 
@@ -2099,15 +3458,23 @@ def contar_notificaciones(usuario_id):
     if current_user.id != usuario_id and current_user.rol != 'admin':
         return jsonify({'error': 'No autorizado'}), 403
     
-    count = Notificacion.query.filter_by(usuario_id=usuario_id, leida=False).count()
-    return jsonify({'count': count})
+    usuario = current_user if current_user.id == usuario_id else Usuario.query.get_or_404(usuario_id)
+    return jsonify({'count': usuario.notificaciones_sin_leer or 0})
 
 @app.route('/notificaciones')
 @login_required
 def notificaciones():
     """Buzón de notificaciones"""
-    notificaciones = Notificacion.query.filter_by(usuario_id=current_user.id).order_by(Notificacion.fecha.desc()).all()
-    return render_template('notificaciones.html', notificaciones=notificaciones)
+    try:
+        notificaciones, siguiente_cursor = pagina_solicitada(
+            Notificacion.query.filter_by(usuario_id=current_user.id),
+            Notificacion.fecha, Notificacion.id
+        )
+    except ValueError:
+        flash('Enlace de página inválido', 'error')
+        return redirect(url_for('notificaciones'))
+    return render_template('notificaciones.html', notificaciones=notificaciones,
+                        siguiente_cursor=siguiente_cursor)
 
 @app.route('/api/pagos/<int:pago_id>/marcar_visto', methods=['POST'])
 @login_required
@@ -2154,9 +3521,46 @@ def contactar_admin():
 def admin_soporte():
     if current_user.rol != 'admin':
         return redirect(url_for('index'))
-    tickets = TicketSoporte.query.order_by(TicketSoporte.fecha.desc()).all()
+    try:
+        tickets, siguiente_cursor = pagina_solicitada(
+            TicketSoporte.query.options(joinedload(TicketSoporte.remitente)),
+            TicketSoporte.fecha, TicketSoporte.id
+        )
+    except ValueError:
+        flash('Enlace de página inválido', 'error')
+        return redirect(url_for('admin_soporte'))
     conductores = Usuario.query.filter_by(rol='conductor', activo=True).all()
-    return render_template('admin/soporte.html', tickets=tickets, conductores=conductores)
+    return render_template('admin/soporte.html', tickets=tickets, conductores=conductores,
+                        siguiente_cursor=siguiente_cursor)
+
+@app.route('/api/admin/soporte')
+@login_required
+def api_admin_soporte():
+    """Tickets de soporte paginados por (fecha, id), más nuevos primero"""
+    if current_user.rol != 'admin':
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+    try:
+        tickets, siguiente_cursor = pagina_solicitada(
+            TicketSoporte.query.options(joinedload(TicketSoporte.remitente)),
+            TicketSoporte.fecha, TicketSoporte.id
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({
+        'success': True,
+        'tickets': [{
+            'id': t.id,
+            'fecha': t.fecha.strftime('%d/%m/%Y %H:%M'),
+            'remitente_id': t.remitente_id,
+            'remitente': t.remitente.nombre,
+            'remitente_rol': t.remitente_rol,
+            'mensaje': t.mensaje,
+            'estado': t.estado,
+            'respuesta': t.respuesta,
+            'conductor_id': t.conductor_id
+        } for t in tickets],
+        'siguiente_cursor': siguiente_cursor
+    })
 
 @app.route('/admin/soporte/<int:ticket_id>/responder', methods=['POST'])
 @login_required
@@ -2217,8 +3621,15 @@ def eliminar_ticket_soporte(ticket_id):
 def conductor_soporte():
     if current_user.rol != 'conductor':
         return redirect(url_for('index'))
-    tickets = TicketSoporte.query.filter_by(conductor_id=current_user.id).order_by(TicketSoporte.fecha.desc()).all()
-    return render_template('conductor/soporte.html', tickets=tickets)
+    try:
+        tickets, siguiente_cursor = pagina_solicitada(
+            TicketSoporte.query.filter_by(conductor_id=current_user.id).options(joinedload(TicketSoporte.remitente)),
+            TicketSoporte.fecha, TicketSoporte.id
+        )
+    except ValueError:
+        flash('Enlace de página inválido', 'error')
+        return redirect(url_for('conductor_soporte'))
+    return render_template('conductor/soporte.html', tickets=tickets, siguiente_cursor=siguiente_cursor)
 
 @app.route('/conductor/soporte/<int:ticket_id>/responder', methods=['POST'])
 @login_required
@@ -2268,108 +3679,232 @@ def admin_asistencias():
     fecha_str = request.args.get('fecha', datetime.utcnow().strftime('%Y-%m-%d'))
     fecha = datetime.strptime(fecha_str, '%Y-%m-%d').date()
     
-    asistencias = Asistencia.query.filter_by(fecha=fecha).all()
+    try:
+        asistencias, siguiente_cursor = pagina_solicitada(
+            consulta_asistencias_dia(fecha), Asistencia.fecha, Asistencia.id, descendente=False
+        )
+    except ValueError:
+        flash('Enlace de página inválido', 'error')
+        return redirect(url_for('admin_asistencias', fecha=fecha_str))
     asistencias_manuales = AsistenciaManual.query.filter_by(fecha=fecha).all()
-    estudiantes = Estudiante.query.all()
+    total_estudiantes = Estudiante.query.count()
+
+    # Los totales se calculan sobre todo el día, no solo sobre la página
+    claves = {'presente': 'presentes', 'ausente': 'ausentes', 'tardanza': 'tardanzas'}
+    resumen = {'presentes': 0, 'ausentes': 0, 'tardanzas': 0, 'total': 0}
+    for estado, cantidad in db.session.query(Asistencia.estado, db.func.count()).filter(
+        Asistencia.fecha == fecha
+    ).group_by(Asistencia.estado):
+        resumen['total'] += cantidad
+        if estado in claves:
+            resumen[claves[estado]] += cantidad
+
+    resumen_rutas = {}
+    for ruta_nombre, estado, cantidad in db.session.query(Ruta.nombre, Asistencia.estado, db.func.count()).join(
+        Estudiante, Asistencia.estudiante_id == Estudiante.id
+    ).join(Ruta, Estudiante.ruta_id == Ruta.id).filter(
+        Asistencia.fecha == fecha
+    ).group_by(Ruta.nombre, Asistencia.estado):
+        datos = resumen_rutas.setdefault(ruta_nombre, {'presentes': 0, 'ausentes': 0, 'tardanzas': 0})
+        if estado in claves:
+            datos[claves[estado]] += cantidad
 
     conductores_map = {}
-    for a in asistencias:
-        if not a.conductor:
-            continue
-        cid = a.conductor.id
-        if cid not in conductores_map:
-            conductores_map[cid] = {
-                'id': cid,
-                'nombre': a.conductor.nombre,
-                'presentes': 0,
-                'ausentes': 0,
-                'tardanzas': 0
-            }
-        if a.estado == 'presente':
-            conductores_map[cid]['presentes'] += 1
-        elif a.estado == 'ausente':
-            conductores_map[cid]['ausentes'] += 1
-        elif a.estado == 'tardanza':
-            conductores_map[cid]['tardanzas'] += 1
+    for cid, nombre, estado, cantidad in db.session.query(
+        Usuario.id, Usuario.nombre, Asistencia.estado, db.func.count()
+    ).join(Usuario, Asistencia.conductor_id == Usuario.id).filter(
+        Asistencia.fecha == fecha
+    ).group_by(Usuario.id, Usuario.nombre, Asistencia.estado):
+        datos = conductores_map.setdefault(cid, {
+            'id': cid,
+            'nombre': nombre,
+            'presentes': 0,
+            'ausentes': 0,
+            'tardanzas': 0
+        })
+        if estado in claves:
+            datos[claves[estado]] += cantidad
     
     return render_template('admin/asistencias.html',
                         asistencias=asistencias,
+                        siguiente_cursor=siguiente_cursor,
+                        resumen=resumen,
+                        resumen_rutas=resumen_rutas,
                         asistencias_manuales=asistencias_manuales,
-                        estudiantes=estudiantes,
+                        total_estudiantes=total_estudiantes,
                         conductores_reportes=list(conductores_map.values()),
+                        conductores=db.session.query(Usuario.id, Usuario.nombre).filter_by(
+                            rol='conductor').order_by(Usuario.nombre).all(),
                         fecha=fecha)
 
+def consulta_asistencias_dia(fecha):
+    """Asistencias de un día con estudiante, ruta y conductor ya cargados"""
+    return Asistencia.query.filter_by(fecha=fecha).options(
+        joinedload(Asistencia.estudiante).joinedload(Estudiante.ruta),
+        joinedload(Asistencia.conductor)
+    )
+
+@app.route('/api/admin/asistencias')
+@login_required
+def api_admin_asistencias():
+    """Asistencias de un día paginadas por (fecha, id)"""
+    if current_user.rol != 'admin':
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+    
+    try:
+        fecha = datetime.strptime(request.args.get('fecha', datetime.utcnow().strftime('%Y-%m-%d')), '%Y-%m-%d').date()
+        asistencias, siguiente_cursor = pagina_solicitada(
+            consulta_asistencias_dia(fecha), Asistencia.fecha, Asistencia.id, descendente=False
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    return jsonify({
+        'success': True,
+        'asistencias': [{
+            'id': a.id,
+            'estudiante_id': a.estudiante_id,
+            'estudiante': a.estudiante.nombre,
+            'ruta': a.estudiante.ruta.nombre if a.estudiante.ruta else None,
+            'estado': a.estado,
+            'hora': a.hora.strftime('%H:%M') if a.hora else None,
+            'conductor_id': a.conductor_id,
+            'conductor': a.conductor.nombre if a.conductor else None,
+            'observaciones': a.observaciones
+        } for a in asistencias],
+        'siguiente_cursor': siguiente_cursor
+    })
+
 @app.route('/admin/asistencias/reporte')
 @login_required
 def admin_reporte_asistencia():
-    """Generar reporte PDF de asistencias por conductor y fecha"""
+    """Reporte PDF de asistencias por conductor y fecha, en segundo plano"""
     if current_user.rol != 'admin':
         return redirect(url_for('index'))
 
-    conductor_id = request.args.get('conductor_id')
-    fecha_str = request.args.get('fecha', datetime.utcnow().strftime('%Y-%m-%d'))
-    fecha = datetime.strptime(fecha_str, '%Y-%m-%d').date()
+    parametros = {
+        'conductor_id': request.args.get('conductor_id'),
+        'fecha': request.args.get('fecha', datetime.utcnow().strftime('%Y-%m-%d'))
+    }
+    return pedir_reporte('asistencia', parametros, url_for('admin_asistencias'))
 
-    if not conductor_id or not conductor_id.isdigit():
-        flash('Conductor inválido', 'error')
-        return redirect(url_for('admin_asistencias'))
+@app.route('/admin/asistencias/reporte_lote')
+@login_required
+def admin_reporte_asistencia_lote():
+    """Reportes de asistencia de varios conductores y días, en un ZIP o un solo PDF"""
+    if current_user.rol != 'admin':
+        return redirect(url_for('index'))
 
-    conductor = Usuario.query.get(int(conductor_id))
-    if not conductor:
-        flash('Conductor no encontrado', 'error')
-        return redirect(url_for('admin_asistencias'))
+    parametros = {
+        'conductor_ids': request.args.getlist('conductor_id'),
+        'desde': request.args.get('desde'),
+        'hasta': request.args.get('hasta'),
+        'formato': request.args.get('formato', 'zip')
+    }
+    return pedir_reporte('asistencia_lote', parametros, url_for('admin_asistencias'))
+
+# ==================== REPORTES EN SEGUNDO PLANO ====================
+def serializar_trabajo_reporte(trabajo):
+    datos = trabajos_reportes.serializar(trabajo)
+    datos['url_estado'] = url_for('estado_trabajo_reporte', trabajo_id=trabajo.id)
+    if trabajo.estado == 'listo':
+        datos['url_descarga'] = url_for('descargar_trabajo_reporte', trabajo_id=trabajo.id)
+    return datos
+
+def enviar_reporte(trabajo):
+    return send_file(trabajos_reportes.ruta_archivo(trabajo.clave, trabajo.nombre),
+                     as_attachment=True,
+                     download_name=trabajo.nombre)
+
+def pedir_reporte(tipo, parametros, volver):
+    """Encolar el reporte; si ya está en caché se descarga de inmediato"""
+    try:
+        trabajo = trabajos_reportes.solicitar(tipo, parametros, current_user.id)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(volver)
+    if trabajos_reportes.disponible(trabajo):
+        return enviar_reporte(trabajo)
+    return render_template('admin/reporte_trabajo.html',
+                        trabajo=serializar_trabajo_reporte(trabajo),
+                        volver=volver)
+
+def notificar_reporte_listo(trabajo):
+    """Avisar a quien pidió el reporte (se llama desde el hilo generador)"""
+    with app.test_request_context():
+        link = url_for('descargar_trabajo_reporte', trabajo_id=trabajo.id)
+    crear_notificacion(trabajo.usuario_id, 'sistema', f'📄 Tu reporte {trabajo.nombre} está listo', link)
+
+generador_reportes.notificar = notificar_reporte_listo
+
+@app.route('/api/admin/reportes', methods=['POST'])
+@login_required
+def api_solicitar_reporte():
+    """Pedir un reporte: {"tipo": "finanzas"|"asistencia", "parametros": {...}}"""
+    if current_user.rol != 'admin':
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
 
-    asistencias = Asistencia.query.filter_by(
-        fecha=fecha,
-        conductor_id=conductor.id
-    ).all()
+    data = request.get_json(silent=True) or {}
+    try:
+        trabajo = trabajos_reportes.solicitar(data.get('tipo'), data.get('parametros'), current_user.id)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({
+        'success': True,
+        'trabajo': serializar_trabajo_reporte(trabajo)
+    }), 200 if trabajo.estado == 'listo' else 202
 
-    presentes = sum(1 for a in asistencias if a.estado == 'presente')
-    ausentes = sum(1 for a in asistencias if a.estado == 'ausente')
-    tardanzas = sum(1 for a in asistencias if a.estado == 'tardanza')
+@app.route('/api/admin/reportes/<int:trabajo_id>')
+@login_required
+def estado_trabajo_reporte(trabajo_id):
+    """Estado de un reporte pedido (para consultar hasta que esté listo)"""
+    if current_user.rol != 'admin':
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
 
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
-    styles = getSampleStyleSheet()
-    elements = []
+    trabajo = TrabajoReporte.query.get_or_404(trabajo_id)
+    return jsonify({'success': True, 'trabajo': serializar_trabajo_reporte(trabajo)})
 
-    title = Paragraph(f'Reporte de Asistencia - {conductor.nombre}', styles['Title'])
-    subtitle = Paragraph(f'Fecha: {fecha.strftime("%d/%m/%Y")}', styles['Normal'])
-    resumen = Paragraph(
-        f'Resumen: Presentes {presentes} | Ausentes {ausentes} | Tardanzas {tardanzas}',
-        styles['Normal']
-    )
-    elements.extend([title, subtitle, resumen])
-
-    data = [['Estudiante', 'Estado', 'Hora', 'Observaciones']]
-    for a in asistencias:
-        hora = a.hora.strftime('%H:%M') if a.hora else '-'
-        data.append([
-            a.estudiante.nombre,
-            a.estado,
-            hora,
-            a.observaciones or ''
-        ])
-
-    table = Table(data, repeatRows=1)
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0,0), (-1,0), colors.lightgrey),
-        ('GRID', (0,0), (-1,-1), 0.5, colors.grey),
-        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-        ('ALIGN', (1,1), (-1,-1), 'LEFT')
-    ]))
-    elements.append(table)
-
-    doc.build(elements)
-    buffer.seek(0)
-
-    filename = f'reporte_asistencia_{conductor.nombre}_{fecha.strftime("%Y%m%d")}.pdf'
-    return send_file(
-        buffer,
-        as_attachment=True,
-        download_name=filename,
-        mimetype='application/pdf'
-    )
+@app.route('/admin/reportes/<int:trabajo_id>/descargar')
+@login_required
+def descargar_trabajo_reporte(trabajo_id):
+    """Descargar el PDF de un reporte ya generado"""
+    if current_user.rol != 'admin':
+        return redirect(url_for('index'))
+
+    trabajo = TrabajoReporte.query.get_or_404(trabajo_id)
+    if not trabajos_reportes.disponible(trabajo):
+        flash('El reporte ya no está disponible; vuelve a generarlo', 'error')
+        return redirect(url_for('admin_dashboard'))
+    return enviar_reporte(trabajo)
+
+# ==================== EXPORTACIONES ====================
+@app.route('/api/admin/exportar/<tabla>')
+@login_required
+def exportar_tabla(tabla):
+    """Exportar pagos, asistencias, ingresos, gastos o ubicaciones de un rango de fechas.
+
+    ?formato=csv|parquet&desde=AAAA-MM-DD&hasta=AAAA-MM-DD (fechas opcionales)
+    """
+    if current_user.rol != 'admin':
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+
+    formato = request.args.get('formato', 'csv')
+    try:
+        desde, hasta = (datetime.strptime(request.args[campo], '%Y-%m-%d').date() if request.args.get(campo) else None
+                        for campo in ('desde', 'hasta'))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Fechas inválidas'}), 400
+    if desde and hasta and desde > hasta:
+        return jsonify({'success': False, 'error': 'La fecha inicial es posterior a la final'}), 400
+    try:
+        partes = exportaciones.exportar(tabla, formato, desde, hasta)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    nombre = exportaciones.nombre_archivo(tabla, formato, desde, hasta)
+    return Response(stream_with_context(partes),
+                    content_type=exportaciones.FORMATOS[formato][0],
+                    headers={'Content-Disposition': f'attachment; filename={nombre}'})
 
 # ==================== ERROR HANDLERS ====================
 @app.errorhandler(404)
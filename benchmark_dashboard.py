@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Medir la latencia del dashboard de admin con muchos estudiantes.
+
+Llena una base VACÍA con datos sintéticos (por defecto 10.000 estudiantes,
+12 pagos por estudiante y dos años de ingresos y gastos) y compara:
+
+    consultas anteriores  -> los ~10 COUNT/SUM que hacía admin_dashboard
+                             (más la carga perezosa del estudiante de cada pago)
+    resumen sin caché     -> resumen_dashboard() recalculado en cada llamada
+    resumen con caché     -> resumen_dashboard() servido desde el caché TTL
+    GET /admin/dashboard  -> la petición completa, en frío y con caché
+
+Para cada caso muestra la mediana en ms y cuántas sentencias SQL ejecuta.
+
+Uso:
+    python benchmark_dashboard.py                       # SQLite temporal
+    python benchmark_dashboard.py --estudiantes 50000 --repeticiones 30
+    python benchmark_dashboard.py --url postgresql://u:p@localhost/camley_bench
+
+Nunca apuntar --url a una base con datos reales: el script se niega si la
+tabla usuario ya tiene filas.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+
+def preparar_entorno():
+    parser = argparse.ArgumentParser(description='Benchmark del dashboard de admin de Camley')
+    parser.add_argument('--url', help='base VACÍA a usar (por defecto un SQLite temporal)')
+    parser.add_argument('--estudiantes', type=int, default=10000)
+    parser.add_argument('--repeticiones', type=int, default=50)
+    args = parser.parse_args()
+    if not args.url:
+        args.url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='camley_bench_'), 'bench.db')
+    # database.py lee DATABASE_URL al importarse
+    os.environ['DATABASE_URL'] = args.url
+    return args
+
+
+def llenar(db, n_estudiantes):
+    from database import Usuario, Ruta, Estudiante, Pago, Ingreso, Gasto, Notificacion
+    from finanzas import recalcular
+
+    rnd = random.Random(42)
+    n_conductores = max(2, n_estudiantes // 60)
+    n_padres = max(2, n_estudiantes * 6 // 10)
+    ahora = datetime.utcnow()
+
+    def insertar(modelo, filas, lote=5000):
+        for i in range(0, len(filas), lote):
+            db.session.execute(modelo.__table__.insert(), filas[i:i + lote])
+
+    insertar(Usuario, [{
+        'nombre': f'Usuario {i}', 'email': f'bench{i}@camley.test', 'password': 'x',
+        'rol': 'conductor' if i < n_conductores else 'padre', 'activo': rnd.random() < 0.95,
+        'notificaciones_sin_leer': 0
+    } for i in range(n_conductores + n_padres)])
+    ids = [u for (u,) in db.session.execute(db.select(Usuario.id).order_by(Usuario.id))]
+    conductores, padres = ids[:n_conductores], ids[n_conductores:]
+
+    insertar(Ruta, [{'nombre': f'Ruta {i}', 'conductor_id': c, 'activa': True} for i, c in enumerate(conductores)])
+    rutas = [r for (r,) in db.session.execute(db.select(Ruta.id))]
+
+    insertar(Estudiante, [{
+        'nombre': f'Estudiante {i}', 'padre_id': rnd.choice(padres), 'ruta_id': rnd.choice(rutas), 'activo': True
+    } for i in range(n_estudiantes)])
+    estudiantes = [e for (e,) in db.session.execute(db.select(Estudiante.id))]
+
+    insertar(Pago, [{
+        'estudiante_id': e, 'monto': 50.0, 'estado': 'pagado' if m < 10 else 'pendiente',
+        'fecha_vencimiento': ahora - timedelta(days=30 * (11 - m)),
+        'fecha_creacion': ahora - timedelta(days=30 * (12 - m), minutes=rnd.randint(0, 1440))
+    } for e in estudiantes for m in range(12)])
+
+    insertar(Ingreso, [{
+        'descripcion': 'Pago', 'monto': 50.0, 'fuente': rnd.choice(['pago_estudiante', 'otros']),
+        'fecha': ahora - timedelta(minutes=rnd.randint(0, 730 * 1440))
+    } for _ in range(n_estudiantes * 10)])
+    insertar(Gasto, [{
+        'descripcion': 'Gasto', 'monto': rnd.randint(10, 500),
+        'categoria': rnd.choice(['mantenimiento', 'salarios', 'combustible', 'otros']),
+        'fecha': ahora - timedelta(minutes=rnd.randint(0, 730 * 1440))
+    } for _ in range(n_estudiantes)])
+
+    insertar(Notificacion, [{
+        'usuario_id': rnd.choice(padres), 'tipo': 'sistema', 'mensaje': 'x',
+        'fecha': ahora - timedelta(minutes=i), 'leida': True
+    } for i in range(n_estudiantes * 5)])
+
+    recalcular(db.session.connection())
+    db.session.commit()
+
+
+def consultas_anteriores(db):
+    """Lo que hacía admin_dashboard antes del resumen, consulta por consulta"""
+    from database import Usuario, Ruta, Estudiante, Pago, Ingreso, Gasto, Notificacion
+
+    inicio_semana = (datetime.utcnow() - timedelta(days=datetime.utcnow().weekday())).date()
+    datos = {
+        'estudiantes': Estudiante.query.count(),
+        'rutas': Ruta.query.filter_by(activa=True).count(),
+        'conductores': Usuario.query.filter_by(rol='conductor', activo=True).count(),
+        'pagos_pendientes': Pago.query.filter_by(estado='pendiente').count(),
+        'pagos_vencidos': Pago.query.filter(Pago.estado == 'pendiente',
+                                            Pago.fecha_vencimiento < datetime.utcnow()).count(),
+        'ingresos_semana': db.session.query(db.func.sum(Ingreso.monto)).filter(
+            Ingreso.fecha >= inicio_semana).scalar() or 0,
+        'gastos_semana': db.session.query(db.func.sum(Gasto.monto)).filter(
+            Gasto.fecha >= inicio_semana).scalar() or 0,
+        'conductores_pendientes': Usuario.query.filter_by(rol='conductor', activo=False).count(),
+        'notificaciones': Notificacion.query.order_by(Notificacion.fecha.desc()).limit(5).all(),
+        'ultimos_pagos': Pago.query.order_by(Pago.fecha_creacion.desc()).limit(5).all(),
+    }
+    # La plantilla leía pago.estudiante.nombre: una consulta más por pago
+    for pago in datos['ultimos_pagos']:
+        pago.estudiante.nombre
+    db.session.expire_all()
+    return datos
+
+
+class ContadorSQL:
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.total = 0
+        event.listen(engine, 'before_cursor_execute', self._contar)
+
+    def _contar(self, *args, **kwargs):
+        self.total += 1
+
+
+def medir(funcion, repeticiones, contador):
+    funcion()  # calentar
+    antes = contador.total
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tiempos), (contador.total - antes) / repeticiones
+
+
+def main():
+    args = preparar_entorno()
+    from database import app, db, Usuario
+    from migraciones import aplicar_migraciones
+
+    with app.app_context():
+        if db.inspect(db.engine).has_table('usuario') and db.session.query(Usuario.id).first():
+            sys.exit('❌ La base no está vacía; usa una base desechable para el benchmark')
+        db.create_all()
+        aplicar_migraciones()
+        print(f'📦 Llenando {db.engine.url.render_as_string(hide_password=True)} '
+              f'con {args.estudiantes} estudiantes ...')
+        inicio = time.perf_counter()
+        llenar(db, args.estudiantes)
+        with db.engine.begin() as conn:
+            conn.execute(db.text('ANALYZE'))
+        print(f'   listo en {time.perf_counter() - inicio:.1f} s')
+
+    # app.py crea los usuarios de ejemplo (admin@camley.com) al importarse
+    import app as aplicacion
+
+    cliente = aplicacion.app.test_client()
+    cliente.post('/login', data={'email': 'admin@camley.com', 'password': 'admin123'})
+    with app.app_context():
+        contador = ContadorSQL(db.engine)
+
+    def sin_cache():
+        aplicacion.invalidar_resumen_dashboard()
+        aplicacion.resumen_dashboard()
+
+    def peticion_fria():
+        aplicacion.invalidar_resumen_dashboard()
+        assert cliente.get('/admin/dashboard').status_code == 200
+
+    def peticion_caliente():
+        assert cliente.get('/admin/dashboard').status_code == 200
+
+    resultados = []
+    with app.app_context():
+        resultados.append(('consultas anteriores', *medir(lambda: consultas_anteriores(db), args.repeticiones, contador)))
+        resultados.append(('resumen sin caché', *medir(sin_cache, args.repeticiones, contador)))
+        resultados.append(('resumen con caché', *medir(aplicacion.resumen_dashboard, args.repeticiones, contador)))
+    resultados.append(('GET /admin/dashboard (frío)', *medir(peticion_fria, args.repeticiones, contador)))
+    resultados.append(('GET /admin/dashboard (caché)', *medir(peticion_caliente, args.repeticiones, contador)))
+
+    print()
+    print(f'{"caso":32} {"mediana ms":>11} {"sentencias":>11}')
+    for nombre, ms, sentencias in resultados:
+        print(f'{nombre:32} {ms:11.2f} {sentencias:11.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Comparar planes y tiempos de las consultas frecuentes antes y después de
+las migraciones de índices.
+
+Llena una base VACÍA con datos sintéticos, elimina los índices que crean
+las migraciones indicadas, mide cada consulta (plan + mediana de tiempo),
+vuelve a aplicar las migraciones con aplicar_migraciones() y mide de nuevo.
+
+Uso:
+    python benchmark_indices.py                                   # SQLite temporal
+    python benchmark_indices.py --url postgresql://u:p@localhost/camley_bench
+    python benchmark_indices.py --escala 5 --repeticiones 50
+
+Nunca apuntar --url a una base con datos reales: el script se niega si la
+tabla usuario ya tiene filas.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+# (nombre, SQL, parámetros); las mismas búsquedas que hace app.py
+CONSULTAS = [
+    ('no leídas del usuario',
+     'SELECT id FROM notificacion WHERE usuario_id = :usuario AND leida = :falso ORDER BY fecha DESC',
+     lambda d: {'usuario': d['padre'], 'falso': False}),
+    ('pagos pendientes del estudiante',
+     "SELECT id, monto FROM pago WHERE estudiante_id = :estudiante AND estado = 'pendiente' "
+     'ORDER BY fecha_vencimiento',
+     lambda d: {'estudiante': d['estudiante']}),
+    ('asistencias del estudiante en el mes',
+     'SELECT id, estado FROM asistencia WHERE estudiante_id = :estudiante AND fecha BETWEEN :desde AND :hasta',
+     lambda d: {'estudiante': d['estudiante'], 'desde': d['hoy'] - timedelta(days=30), 'hasta': d['hoy']}),
+    ('asistencias del conductor en el día',
+     'SELECT id, estado FROM asistencia WHERE conductor_id = :conductor AND fecha = :dia',
+     lambda d: {'conductor': d['conductor'], 'dia': d['hoy'] - timedelta(days=3)}),
+    ('historial GPS del conductor',
+     'SELECT lat, lng, fecha FROM ubicacion_historial WHERE conductor_id = :conductor '
+     'ORDER BY fecha DESC LIMIT 200',
+     lambda d: {'conductor': d['conductor']}),
+    ('rutas del conductor',
+     'SELECT id, nombre FROM ruta WHERE conductor_id = :conductor',
+     lambda d: {'conductor': d['conductor']}),
+    ('hijos del padre',
+     'SELECT id, nombre FROM estudiante WHERE padre_id = :usuario',
+     lambda d: {'usuario': d['padre']}),
+    ('estudiantes de la ruta',
+     'SELECT id, nombre FROM estudiante WHERE ruta_id = :ruta',
+     lambda d: {'ruta': d['ruta']}),
+]
+
+
+def preparar_entorno():
+    parser = argparse.ArgumentParser(description='Benchmark de índices de Camley')
+    parser.add_argument('--url', help='base VACÍA a usar (por defecto un SQLite temporal)')
+    parser.add_argument('--escala', type=float, default=1.0, help='multiplicador del volumen de datos')
+    parser.add_argument('--repeticiones', type=int, default=20)
+    parser.add_argument('--desde-version', type=int, default=2,
+                        help='quitar los índices de esta migración en adelante para el "antes"')
+    args = parser.parse_args()
+    if not args.url:
+        args.url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='camley_bench_'), 'bench.db')
+    # database.py lee DATABASE_URL al importarse
+    os.environ['DATABASE_URL'] = args.url
+    return args
+
+
+def llenar(db, escala):
+    """Insertar datos sintéticos y devolver ids representativos para las consultas"""
+    from database import Usuario, Ruta, Estudiante, Pago, Notificacion, Asistencia, UbicacionHistorial
+
+    rnd = random.Random(42)
+    n_conductores = max(2, int(40 * escala))
+    n_padres = max(2, int(1500 * escala))
+    n_estudiantes = max(2, int(2500 * escala))
+    hoy = date.today()
+    ahora = datetime.utcnow()
+
+    def insertar(modelo, filas, lote=5000):
+        for i in range(0, len(filas), lote):
+            db.session.execute(modelo.__table__.insert(), filas[i:i + lote])
+
+    insertar(Usuario, [{
+        'nombre': f'Usuario {i}', 'email': f'bench{i}@camley.test', 'password': 'x',
+        'rol': 'conductor' if i < n_conductores else 'padre', 'activo': True,
+        'notificaciones_sin_leer': 0
+    } for i in range(n_conductores + n_padres)])
+    ids_usuarios = [u for (u,) in db.session.execute(db.select(Usuario.id).order_by(Usuario.id))]
+    conductores, padres = ids_usuarios[:n_conductores], ids_usuarios[n_conductores:]
+
+    insertar(Ruta, [{'nombre': f'Ruta {i}', 'conductor_id': c, 'activa': True} for i, c in enumerate(conductores)])
+    rutas = [r for (r,) in db.session.execute(db.select(Ruta.id))]
+
+    insertar(Estudiante, [{
+        'nombre': f'Estudiante {i}', 'padre_id': rnd.choice(padres), 'ruta_id': rnd.choice(rutas), 'activo': True
+    } for i in range(n_estudiantes)])
+    estudiantes = [e for (e,) in db.session.execute(db.select(Estudiante.id))]
+
+    insertar(Pago, [{
+        'estudiante_id': e, 'monto': 50.0, 'estado': 'pagado' if m < 10 else 'pendiente',
+        'fecha_vencimiento': ahora - timedelta(days=30 * (12 - m)), 'fecha_creacion': ahora
+    } for e in estudiantes for m in range(12)])
+
+    dias = [hoy - timedelta(days=d) for d in range(60)]
+    ruta_conductor = dict(zip(rutas, conductores))
+    insertar(Asistencia, [{
+        'estudiante_id': e, 'fecha': dia, 'estado': 'presente', 'conductor_id': rnd.choice(conductores)
+    } for e in estudiantes for dia in dias])
+
+    insertar(Notificacion, [{
+        'usuario_id': rnd.choice(padres), 'tipo': 'sistema', 'mensaje': 'x',
+        'fecha': ahora - timedelta(minutes=i), 'leida': rnd.random() < 0.8
+    } for i in range(int(150000 * escala))])
+
+    insertar(UbicacionHistorial, [{
+        'conductor_id': c, 'lat': 12.1, 'lng': -86.2, 'fecha': ahora - timedelta(seconds=10 * i)
+    } for c in conductores for i in range(int(5000 * escala))])
+
+    db.session.commit()
+    return {
+        'padre': padres[0], 'estudiante': estudiantes[0], 'conductor': ruta_conductor[rutas[0]],
+        'ruta': rutas[0], 'hoy': hoy
+    }
+
+
+def plan(conn, sql, params):
+    from database import db
+    if conn.dialect.name == 'postgresql':
+        filas = conn.execute(db.text('EXPLAIN ' + sql), params)
+        return [f[0] for f in filas]
+    filas = conn.execute(db.text('EXPLAIN QUERY PLAN ' + sql), params)
+    return [f[-1] for f in filas]
+
+
+def medir(db, datos, repeticiones):
+    resultados = {}
+    with db.engine.begin() as conn:
+        conn.execute(db.text('ANALYZE'))
+    with db.engine.connect() as conn:
+        for nombre, sql, parametros in CONSULTAS:
+            params = parametros(datos)
+            tiempos = []
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                conn.execute(db.text(sql), params).fetchall()
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+            resultados[nombre] = (statistics.median(tiempos), plan(conn, sql, params))
+    return resultados
+
+
+def main():
+    args = preparar_entorno()
+    from database import app, db, Usuario, EsquemaVersion
+    from migraciones import MIGRACIONES, INDICES_PAGINACION, INDICES_BUSQUEDAS, aplicar_migraciones
+
+    indices_por_version = {2: INDICES_PAGINACION, 3: INDICES_BUSQUEDAS}
+
+    with app.app_context():
+        if db.inspect(db.engine).has_table('usuario') and db.session.query(Usuario.id).first():
+            sys.exit('❌ La base no está vacía; usa una base desechable para el benchmark')
+        db.create_all()
+        aplicar_migraciones()
+
+        print(f'📦 Llenando {db.engine.url.render_as_string(hide_password=True)} ...')
+        inicio = time.perf_counter()
+        datos = llenar(db, args.escala)
+        print(f'   listo en {time.perf_counter() - inicio:.1f} s')
+
+        # "Antes": sin los índices de las migraciones >= desde_version
+        quitadas = [v for v, _, _ in MIGRACIONES if v >= args.desde_version and v in indices_por_version]
+        with db.engine.begin() as conn:
+            for version in quitadas:
+                for nombre, _, _ in indices_por_version[version]:
+                    conn.execute(db.text(f'DROP INDEX IF EXISTS {nombre}'))
+                conn.execute(EsquemaVersion.__table__.delete().where(EsquemaVersion.version == version))
+        antes = medir(db, datos, args.repeticiones)
+
+        inicio = time.perf_counter()
+        aplicadas = aplicar_migraciones()
+        print(f'🛠️  Migraciones {aplicadas} aplicadas en {time.perf_counter() - inicio:.2f} s')
+        despues = medir(db, datos, args.repeticiones)
+
+    print()
+    print(f'{"consulta":40} {"antes ms":>10} {"después ms":>11} {"x":>7}')
+    for nombre, _, _ in CONSULTAS:
+        t_antes, t_despues = antes[nombre][0], despues[nombre][0]
+        print(f'{nombre:40} {t_antes:10.3f} {t_despues:11.3f} {t_antes / max(t_despues, 1e-6):7.1f}')
+
+    print('\nPlanes:')
+    for nombre, _, _ in CONSULTAS:
+        print(f'\n• {nombre}')
+        print('  antes:   ' + '\n           '.join(antes[nombre][1]))
+        print('  después: ' + '\n           '.join(despues[nombre][1]))
+
+
+if __name__ == '__main__':
+    main()
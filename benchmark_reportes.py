@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Medir tiempo y memoria del reporte PDF de finanzas según la cantidad de filas.
+
+Llena una base VACÍA con ingresos y gastos sintéticos (uno por minuto) y, para
+cada tamaño, genera el reporte del periodo que cubre esa cantidad de filas en
+un proceso hijo, para que el pico de RSS de un tamaño no contamine al
+siguiente. Compara:
+
+    streaming  -> reportes.reporte_finanzas() escrito a un archivo temporal
+    platypus   -> SimpleDocTemplate con todo el detalle en tablas (lo que
+                  haría falta para un reporte completo con el código anterior)
+
+Muestra segundos, ms por cada 10k filas, RSS pico y su aumento sobre el
+proceso ya inicializado.
+
+Uso:
+    python benchmark_reportes.py                          # SQLite temporal
+    python benchmark_reportes.py --filas 10000 100000 400000 --sin-platypus
+    python benchmark_reportes.py --url postgresql://u:p@localhost/camley_bench
+
+Nunca apuntar --url a una base con datos reales: el script se niega si la
+tabla ingreso ya tiene filas.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+INICIO = datetime(2020, 1, 1)
+
+
+def argumentos():
+    parser = argparse.ArgumentParser(description='Benchmark del reporte PDF de finanzas de Camley')
+    parser.add_argument('--url', help='base VACÍA a usar (por defecto un SQLite temporal)')
+    parser.add_argument('--filas', type=int, nargs='+', default=[10000, 50000, 100000, 200000],
+                        help='filas (ingresos + gastos) de cada reporte')
+    parser.add_argument('--sin-platypus', action='store_true', help='no medir la versión en memoria')
+    parser.add_argument('--max-platypus', type=int, default=50000,
+                        help='no medir platypus por encima de estas filas (es lento)')
+    parser.add_argument('--hijo', choices=['streaming', 'platypus'], help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def rss_pico_mb():
+    # ru_maxrss está en KB en Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def llenar(db, filas):
+    """Ingresos y gastos alternados, uno por minuto desde INICIO"""
+    from database import Ingreso, Gasto
+    from finanzas import recalcular
+
+    for modelo, extra, paridad in ((Ingreso, {'fuente': 'pago_estudiante'}, 0), (Gasto, {'categoria': 'combustible'}, 1)):
+        minutos = range(paridad, filas, 2)
+        for i in range(0, len(minutos), 10000):
+            db.session.execute(modelo.__table__.insert(), [
+                dict(extra, descripcion=f'Movimiento sintético {m}', monto=10 + m % 90,
+                     fecha=INICIO + timedelta(minutes=m))
+                for m in minutos[i:i + 10000]
+            ])
+    recalcular(db.session.connection())
+    db.session.commit()
+
+
+def reporte_platypus(desde, hasta, destino):
+    """Reporte completo al estilo anterior: toda la historia en tablas de platypus"""
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
+    from database import db, Ingreso, Gasto
+    from reportes import lotes_movimientos
+
+    estilos = getSampleStyleSheet()
+    elementos = [Paragraph('Reporte de Finanzas - Sistema de Transporte', estilos['Title'])]
+    for titulo, modelo, concepto in (('Ingresos', Ingreso, Ingreso.fuente), ('Gastos', Gasto, Gasto.categoria)):
+        elementos.append(Paragraph(titulo, estilos['Heading2']))
+        for filas in lotes_movimientos(modelo, concepto, desde, hasta):
+            datos = [['Fecha', 'Descripción', 'Concepto', 'Monto']] + [
+                [f.fecha.strftime('%d/%m/%Y'), f.descripcion, f[3], f'C$ {f.monto:.2f}'] for f in filas]
+            tabla = Table(datos, repeatRows=1)
+            tabla.setStyle(TableStyle([('GRID', (0, 0), (-1, -1), 0.5, colors.black)]))
+            elementos.append(tabla)
+    SimpleDocTemplate(destino, pagesize=letter).build(elementos)
+
+
+def hijo(args):
+    """Generar un reporte y reportar tiempo y memoria como JSON en stdout"""
+    from database import app
+    import reportes
+
+    filas = args.filas[0]
+    desde = INICIO.date()
+    hasta = (INICIO + timedelta(minutes=filas - 1)).date()
+    with app.app_context():
+        # El rango cubre días completos: contar las filas reales del periodo
+        from database import db, Ingreso, Gasto
+        fin = datetime.combine(hasta + timedelta(days=1), datetime.min.time())
+        reales = sum(db.session.query(m).filter(m.fecha < fin).count() for m in (Ingreso, Gasto))
+        base = rss_pico_mb()
+        with tempfile.TemporaryFile() as destino:
+            inicio = time.perf_counter()
+            if args.hijo == 'streaming':
+                reportes.guardar(reportes.reporte_finanzas(desde, hasta), destino)
+            else:
+                reporte_platypus(desde, hasta, destino)
+            segundos = time.perf_counter() - inicio
+            tamano = destino.tell()
+    print(json.dumps({'filas': reales, 'segundos': segundos, 'rss_base': base,
+                      'rss_pico': rss_pico_mb(), 'bytes': tamano}))
+
+
+def main():
+    args = argumentos()
+    if not args.url:
+        args.url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='camley_bench_'), 'bench.db')
+    # database.py lee DATABASE_URL al importarse
+    os.environ['DATABASE_URL'] = args.url
+    if args.hijo:
+        return hijo(args)
+
+    from database import app, db, Ingreso
+    from migraciones import aplicar_migraciones
+
+    with app.app_context():
+        if db.inspect(db.engine).has_table('ingreso') and db.session.query(Ingreso.id).first():
+            sys.exit('❌ La base no está vacía; usa una base desechable para el benchmark')
+        db.create_all()
+        aplicar_migraciones()
+        total = max(args.filas)
+        print(f'📦 Llenando {db.engine.url.render_as_string(hide_password=True)} con {total} movimientos ...')
+        inicio = time.perf_counter()
+        llenar(db, total)
+        print(f'   listo en {time.perf_counter() - inicio:.1f} s')
+
+    modos = ['streaming'] + ([] if args.sin_platypus else ['platypus'])
+    print()
+    print(f'{"modo":10} {"filas":>8} {"s":>7} {"ms/10k":>8} {"RSS MB":>8} {"+MB":>7} {"PDF MB":>7}')
+    for filas in sorted(args.filas):
+        for modo in modos:
+            if modo == 'platypus' and filas > args.max_platypus:
+                continue
+            salida = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--hijo', modo, '--url', args.url, '--filas', str(filas)],
+                capture_output=True, text=True, check=True
+            ).stdout.strip().splitlines()[-1]
+            r = json.loads(salida)
+            print(f'{modo:10} {r["filas"]:8} {r["segundos"]:7.2f} {r["segundos"] * 1e7 / r["filas"]:8.0f} '
+                  f'{r["rss_pico"]:8.1f} {r["rss_pico"] - r["rss_base"]:7.1f} {r["bytes"] / 2**20:7.1f}')
+
+
+if __name__ == '__main__':
+    main()
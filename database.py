@@ -20,6 +20,9 @@ db = SQLAlchemy(app)
 class Usuario(db.Model):
     """Modelo de usuario para todos los roles"""
     __tablename__ = 'usuario'
+    __table_args__ = (
+        db.Index('ix_usuario_rol_activo', 'rol', 'activo'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(100), nullable=False)
@@ -31,6 +34,7 @@ class Usuario(db.Model):
     rol = db.Column(db.String(20), nullable=False)  # 'admin', 'padre', 'conductor'
     activo = db.Column(db.Boolean, default=True)
     fecha_registro = db.Column(db.DateTime, default=datetime.utcnow)
+    notificaciones_sin_leer = db.Column(db.Integer, default=0, nullable=False)
     
     # Relaciones SIMPLIFICADAS (sin duplicados)
     # Estudiantes hijos (solo para padres)
@@ -74,8 +78,11 @@ class Estudiante(db.Model):
     grado = db.Column(db.String(50))
     escuela = db.Column(db.String(200))
     condicion = db.Column(db.String(200))
-    padre_id = db.Column(db.Integer, db.ForeignKey('usuario.id'))
-    ruta_id = db.Column(db.Integer, db.ForeignKey('ruta.id'))
+    padre_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), index=True)
+    ruta_id = db.Column(db.Integer, db.ForeignKey('ruta.id'), index=True)
+    parada_lat = db.Column(db.Float)  # punto donde el bus recoge/deja al estudiante
+    parada_lng = db.Column(db.Float)
+    orden_parada = db.Column(db.Integer)  # posición de la parada en el recorrido de la ruta
     fecha_inscripcion = db.Column(db.DateTime, default=datetime.utcnow)
     activo = db.Column(db.Boolean, default=True)
     
@@ -97,7 +104,7 @@ class Ruta(db.Model):
     descripcion = db.Column(db.Text)
     hora_inicio = db.Column(db.String(10))  # formato: "07:00"
     hora_fin = db.Column(db.String(10))     # formato: "08:30"
-    conductor_id = db.Column(db.Integer, db.ForeignKey('usuario.id'))
+    conductor_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), index=True)
     vehiculo_id = db.Column(db.Integer, db.ForeignKey('vehiculo.id'))
     activa = db.Column(db.Boolean, default=True)
     
@@ -136,6 +143,15 @@ class Vehiculo(db.Model):
 class Pago(db.Model):
     """Modelo de pago - ¡CORREGIDO!"""
     __tablename__ = 'pago'
+    __table_args__ = (
+        # Paginación por (fecha_vencimiento, id), con y sin filtro de estado/estudiante
+        db.Index('ix_pago_vencimiento_id', 'fecha_vencimiento', 'id'),
+        db.Index('ix_pago_estado_vencimiento_id', 'estado', 'fecha_vencimiento', 'id'),
+        db.Index('ix_pago_estudiante_vencimiento_id', 'estudiante_id', 'fecha_vencimiento', 'id'),
+        db.Index('ix_pago_estudiante_estado_vencimiento', 'estudiante_id', 'estado', 'fecha_vencimiento'),
+        # Últimos pagos del dashboard
+        db.Index('ix_pago_fecha_creacion_id', 'fecha_creacion', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     estudiante_id = db.Column(db.Integer, db.ForeignKey('estudiante.id'), nullable=False)
@@ -159,6 +175,10 @@ class Pago(db.Model):
 class Gasto(db.Model):
     """Modelo de gasto"""
     __tablename__ = 'gasto'
+    __table_args__ = (
+        # Reporte de finanzas: recorrido por lotes en orden (fecha, id)
+        db.Index('ix_gasto_fecha_id', 'fecha', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     descripcion = db.Column(db.String(200), nullable=False)
@@ -173,6 +193,10 @@ class Gasto(db.Model):
 class Ingreso(db.Model):
     """Modelo de ingreso"""
     __tablename__ = 'ingreso'
+    __table_args__ = (
+        # Reporte de finanzas: recorrido por lotes en orden (fecha, id)
+        db.Index('ix_ingreso_fecha_id', 'fecha', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     descripcion = db.Column(db.String(200), nullable=False)
@@ -183,9 +207,35 @@ class Ingreso(db.Model):
     def __repr__(self):
         return f'<Ingreso ${self.monto} - {self.fuente}>'
 
+class ResumenFinanzasDia(db.Model):
+    """Totales por día de ingresos (por fuente) y gastos (por categoría).
+
+    Lo mantienen las rutas que crean o borran ingresos y gastos (ver
+    finanzas.py); los paneles suman estas filas en vez de las tablas completas.
+    """
+    __tablename__ = 'resumen_finanzas_dia'
+    __table_args__ = (
+        db.UniqueConstraint('dia', 'tipo', 'concepto', name='uq_resumen_finanzas_dia'),
+        db.Index('ix_resumen_finanzas_tipo_dia', 'tipo', 'dia'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    dia = db.Column(db.Date, nullable=False)
+    tipo = db.Column(db.String(10), nullable=False)  # ingreso, gasto
+    concepto = db.Column(db.String(50), nullable=False, default='')  # fuente o categoría
+    total = db.Column(db.Float, nullable=False, default=0)
+    cantidad = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ResumenFinanzasDia {self.dia} {self.tipo}/{self.concepto}: {self.total}>'
+
 class Notificacion(db.Model):
     """Modelo de notificación"""
     __tablename__ = 'notificacion'
+    __table_args__ = (
+        db.Index('ix_notificacion_usuario_fecha_id', 'usuario_id', 'fecha', 'id'),
+        db.Index('ix_notificacion_usuario_leida_fecha', 'usuario_id', 'leida', 'fecha'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
@@ -201,6 +251,11 @@ class Notificacion(db.Model):
 class Asistencia(db.Model):
     """Modelo de asistencia"""
     __tablename__ = 'asistencia'
+    __table_args__ = (
+        db.Index('ix_asistencia_fecha_id', 'fecha', 'id'),
+        db.Index('ix_asistencia_estudiante_fecha', 'estudiante_id', 'fecha'),
+        db.Index('ix_asistencia_conductor_fecha', 'conductor_id', 'fecha'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     estudiante_id = db.Column(db.Integer, db.ForeignKey('estudiante.id'), nullable=False)
@@ -209,6 +264,7 @@ class Asistencia(db.Model):
     estado = db.Column(db.String(20))  # presente, ausente, tardanza, justificado
     observaciones = db.Column(db.Text)
     conductor_id = db.Column(db.Integer, db.ForeignKey('usuario.id'))
+    actualizado = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # versión de los reportes
     
     conductor = db.relationship('Usuario', foreign_keys=[conductor_id])
     
@@ -231,6 +287,10 @@ class AsistenciaManual(db.Model):
 class TicketSoporte(db.Model):
     """Mensajes de soporte enviados por padres"""
     __tablename__ = 'ticket_soporte'
+    __table_args__ = (
+        db.Index('ix_ticket_soporte_fecha_id', 'fecha', 'id'),
+        db.Index('ix_ticket_soporte_conductor_fecha_id', 'conductor_id', 'fecha', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     remitente_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
@@ -265,6 +325,9 @@ class UbicacionVehiculo(db.Model):
 class UbicacionHistorial(db.Model):
     """Historial de ubicaciones por conductor"""
     __tablename__ = 'ubicacion_historial'
+    __table_args__ = (
+        db.Index('ix_ubicacion_historial_conductor_fecha', 'conductor_id', 'fecha'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     conductor_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
@@ -274,6 +337,88 @@ class UbicacionHistorial(db.Model):
     
     conductor = db.relationship('Usuario', foreign_keys=[conductor_id])
 
+class UbicacionHistorialDia(db.Model):
+    """Recorrido simplificado de un conductor en un día (historial compactado)"""
+    __tablename__ = 'ubicacion_historial_dia'
+    __table_args__ = (
+        db.UniqueConstraint('conductor_id', 'dia', name='uq_ubicacion_historial_dia_conductor_dia'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    conductor_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
+    dia = db.Column(db.Date, nullable=False)
+    puntos = db.Column(db.Text, nullable=False)  # JSON: [[lat, lng, epoch_segundos], ...]
+    cantidad = db.Column(db.Integer, default=0)
+    cantidad_original = db.Column(db.Integer, default=0)
+    actualizado = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<UbicacionHistorialDia {self.conductor_id} - {self.dia}>'
+
+class EstadoEtaRuta(db.Model):
+    """Modelo aprendido y avance del viaje de una ruta, compartido por los workers (ver eta.py)"""
+    __tablename__ = 'estado_eta_ruta'
+
+    ruta_id = db.Column(db.Integer, db.ForeignKey('ruta.id', ondelete='CASCADE'), primary_key=True, autoincrement=False)
+    conductor_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
+    firma = db.Column(db.String(64), nullable=False)  # sha256 de las coordenadas de las paradas
+    segmentos = db.Column(db.Text)  # JSON: segundos de cada tramo (null sin datos)
+    velocidad = db.Column(db.Float)  # m/s
+    modelo_fecha = db.Column(db.DateTime)  # NULL = falta aprender
+    siguiente = db.Column(db.Integer, default=0)
+    pases = db.Column(db.Text)  # JSON: {índice de parada: epoch del paso}
+    ultimo_lat = db.Column(db.Float)
+    ultimo_lng = db.Column(db.Float)
+    ultimo_fecha = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<EstadoEtaRuta {self.ruta_id}>'
+
+class Geocerca(db.Model):
+    """Polígono de una escuela o parada que genera avisos de llegada/salida"""
+    __tablename__ = 'geocerca'
+
+    id = db.Column(db.Integer, primary_key=True)
+    nombre = db.Column(db.String(100), nullable=False)
+    tipo = db.Column(db.String(20), nullable=False)  # escuela, parada
+    poligono = db.Column(db.Text, nullable=False)  # JSON: [[lat, lng], ...]
+    ruta_id = db.Column(db.Integer, db.ForeignKey('ruta.id'), index=True)  # NULL = todas las rutas
+    estudiante_id = db.Column(db.Integer, db.ForeignKey('estudiante.id'), index=True)
+    activa = db.Column(db.Boolean, default=True)
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Geocerca {self.nombre}>'
+
+class EventoGeocerca(db.Model):
+    """Entrada o salida de un vehículo de una geocerca"""
+    __tablename__ = 'evento_geocerca'
+    __table_args__ = (
+        db.Index('ix_evento_geocerca_fecha_id', 'fecha', 'id'),
+        db.Index('ix_evento_geocerca_conductor_fecha', 'conductor_id', 'fecha'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    geocerca_id = db.Column(db.Integer, db.ForeignKey('geocerca.id', ondelete='CASCADE'), nullable=False)
+    conductor_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
+    evento = db.Column(db.String(10), nullable=False)  # entrada, salida
+    lat = db.Column(db.Float, nullable=False)
+    lng = db.Column(db.Float, nullable=False)
+    fecha = db.Column(db.DateTime, nullable=False)
+
+    geocerca = db.relationship('Geocerca')
+
+class EstadoGeocerca(db.Model):
+    """Si un conductor está dentro de una geocerca y cuándo fue su último aviso (ver geocercas.py)"""
+    __tablename__ = 'estado_geocerca'
+
+    conductor_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), primary_key=True, autoincrement=False)
+    geocerca_id = db.Column(db.Integer, db.ForeignKey('geocerca.id', ondelete='CASCADE'), primary_key=True,
+                            autoincrement=False)
+    dentro = db.Column(db.Boolean, nullable=False, default=False)
+    fecha = db.Column(db.DateTime, nullable=False)  # punto que fijó el estado
+    ultimo_evento = db.Column(db.DateTime)
+
 class PushSubscription(db.Model):
     """Suscripciones Web Push"""
     __tablename__ = 'push_subscription'
@@ -284,9 +429,95 @@ class PushSubscription(db.Model):
     p256dh = db.Column(db.String(256), nullable=False)
     auth = db.Column(db.String(256), nullable=False)
     fecha = db.Column(db.DateTime, default=datetime.utcnow)
+    fallos_consecutivos = db.Column(db.Integer, default=0)
+    ultimo_fallo = db.Column(db.DateTime)
     
     usuario = db.relationship('Usuario', foreign_keys=[usuario_id])
 
+class PushSuscripcionPodada(db.Model):
+    """Registro de suscripciones push eliminadas por el despachador"""
+    __tablename__ = 'push_suscripcion_podada'
+
+    id = db.Column(db.Integer, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'))
+    motivo = db.Column(db.String(20), nullable=False)  # expirada, fallos
+    codigo = db.Column(db.Integer)  # último código HTTP recibido
+    fecha = db.Column(db.DateTime, default=datetime.utcnow)
+
+class PushPendiente(db.Model):
+    """Cola (outbox) de notificaciones push pendientes de enviar"""
+    __tablename__ = 'push_pendiente'
+
+    id = db.Column(db.Integer, primary_key=True)
+    destinatarios = db.Column(db.Text, nullable=False)  # JSON: lista de usuario_id
+    suscripciones = db.Column(db.Text)  # JSON: ids de suscripción que faltan tras un fallo
+    titulo = db.Column(db.String(100), nullable=False)
+    mensaje = db.Column(db.Text, nullable=False)
+    url = db.Column(db.String(200))
+    estado = db.Column(db.String(20), default='pendiente')  # pendiente, enviando, enviado, fallido
+    intentos = db.Column(db.Integer, default=0)
+    proximo_intento = db.Column(db.DateTime, default=datetime.utcnow)
+    bloqueado_por = db.Column(db.String(32))
+    bloqueado_hasta = db.Column(db.DateTime)
+    ultimo_error = db.Column(db.Text)
+    fecha = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<PushPendiente {self.id} - {self.estado}>'
+
+class TrabajoReporte(db.Model):
+    """Reporte PDF pedido para generarse en segundo plano (ver trabajos_reportes.py)"""
+    __tablename__ = 'trabajo_reporte'
+    __table_args__ = (
+        db.Index('ix_trabajo_reporte_clave_estado', 'clave', 'estado'),
+        db.Index('ix_trabajo_reporte_estado_fecha', 'estado', 'fecha_creacion'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(30), nullable=False)  # finanzas, asistencia
+    parametros = db.Column(db.Text, nullable=False)  # JSON normalizado
+    clave = db.Column(db.String(64), nullable=False)  # sha256 de tipo + parámetros + versión de los datos
+    nombre = db.Column(db.String(200), nullable=False)  # nombre del archivo al descargar
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
+    estado = db.Column(db.String(20), default='pendiente')  # pendiente, generando, listo, error
+    intentos = db.Column(db.Integer, default=0)
+    tamano = db.Column(db.Integer)
+    error = db.Column(db.Text)
+    bloqueado_por = db.Column(db.String(32))
+    bloqueado_hasta = db.Column(db.DateTime)
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+    fecha_fin = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<TrabajoReporte {self.id} {self.tipo} - {self.estado}>'
+
+class OperacionSincronizada(db.Model):
+    """Operación offline de un conductor ya procesada (ver sincronizacion.py)"""
+    __tablename__ = 'operacion_sincronizada'
+    __table_args__ = (
+        db.UniqueConstraint('conductor_id', 'cliente_id', name='uq_operacion_sincronizada_conductor_cliente'),
+        db.Index('ix_operacion_sincronizada_fecha', 'fecha'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    conductor_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
+    cliente_id = db.Column(db.String(64), nullable=False)  # id generado en el teléfono
+    tipo = db.Column(db.String(20), nullable=False)  # asistencia, ubicacion
+    resultado = db.Column(db.String(20), nullable=False)  # aplicada, descartada, rechazada
+    error = db.Column(db.String(200))
+    fecha = db.Column(db.DateTime, default=datetime.utcnow)  # cuándo llegó al servidor
+
+    def __repr__(self):
+        return f'<OperacionSincronizada {self.cliente_id} - {self.resultado}>'
+
+class EsquemaVersion(db.Model):
+    """Migraciones de esquema ya aplicadas (ver migraciones.py)"""
+    __tablename__ = 'esquema_version'
+
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    descripcion = db.Column(db.String(200), nullable=False)
+    aplicada_en = db.Column(db.DateTime, default=datetime.utcnow)
+
 # ==================== FUNCIONES AUXILIARES ====================
 
 def crear_usuarios_ejemplo():
@@ -337,10 +568,12 @@ def crear_usuarios_ejemplo():
 
 def inicializar_base_datos():
     """Crear tablas si no existen"""
+    from migraciones import aplicar_migraciones
     with app.app_context():
         try:
             # Crear tablas
             db.create_all()
+            aplicar_migraciones()
             
             # Crear usuarios
             crear_usuarios_ejemplo()
@@ -0,0 +1,197 @@
+"""
+Escritor Parquet mínimo, por grupos de filas, sin dependencias externas.
+
+Igual que EscritorPDF en maquetacion_pdf.py, el archivo se produce en orden:
+iniciar() devuelve la cabecera, grupo(filas) un row group completo y
+cerrar() el pie con los metadatos (Thrift compact). Solo se guardan los
+metadatos de cada grupo ya escrito, así que la memoria depende del tamaño
+del grupo y no del total de filas.
+
+Alcance: columnas planas y opcionales (nulos con niveles de definición
+RLE), codificación PLAIN, una página por columna y grupo, compresión GZIP.
+Lo leen pyarrow, pandas, DuckDB y Spark.
+
+Tipos de columna:
+    entero      INT64
+    decimal     DOUBLE
+    texto       BYTE_ARRAY (UTF8)
+    booleano    BOOLEAN
+    fecha       INT32 (DATE, días desde 1970-01-01)
+    fecha_hora  INT64 (TIMESTAMP_MILLIS, en UTC como las guarda la app)
+    hora        INT32 (TIME_MILLIS)
+"""
+
+import gzip
+import struct
+from datetime import date, datetime, timedelta
+from itertools import groupby
+
+MAGIA = b'PAR1'
+EPOCA = datetime(1970, 1, 1)
+EPOCA_DIA = date(1970, 1, 1)
+
+# Tipos físicos y convertidos de parquet.thrift
+BOOLEAN, INT32, INT64, DOUBLE, BYTE_ARRAY = 0, 1, 2, 5, 6
+UTF8, DATE, TIME_MILLIS, TIMESTAMP_MILLIS = 0, 6, 7, 9
+OPTIONAL = 1
+PLAIN, RLE = 0, 3
+GZIP = 2
+DATA_PAGE = 0
+
+# Tipos del protocolo Thrift compact
+T_I32, T_I64, T_BINARIO, T_LISTA, T_STRUCT = 5, 6, 8, 9, 12
+
+
+def _ms(valor):
+    return (valor - EPOCA) // timedelta(milliseconds=1)
+
+
+# tipo -> (físico, convertido, conversión del valor de Python, formato struct)
+TIPOS = {
+    'entero': (INT64, None, int, 'q'),
+    'decimal': (DOUBLE, None, float, 'd'),
+    'texto': (BYTE_ARRAY, UTF8, lambda v: str(v).encode('utf-8'), None),
+    'booleano': (BOOLEAN, None, bool, None),
+    'fecha': (INT32, DATE, lambda v: (v - EPOCA_DIA).days, 'i'),
+    'fecha_hora': (INT64, TIMESTAMP_MILLIS, _ms, 'q'),
+    'hora': (INT32, TIME_MILLIS,
+             lambda v: ((v.hour * 60 + v.minute) * 60 + v.second) * 1000 + v.microsecond // 1000, 'i'),
+}
+
+
+# ==================== THRIFT COMPACT ====================
+
+def _varint(n):
+    salida = bytearray()
+    while n > 0x7F:
+        salida.append((n & 0x7F) | 0x80)
+        n >>= 7
+    salida.append(n)
+    return bytes(salida)
+
+
+def _entero(n):
+    return _varint((n << 1) ^ (n >> 63))  # zigzag
+
+
+def _binario(valor):
+    datos = valor.encode('utf-8') if isinstance(valor, str) else valor
+    return _varint(len(datos)) + datos
+
+
+def _lista(tipo, elementos):
+    elementos = list(elementos)
+    cabecera = bytes([(len(elementos) << 4) | tipo]) if len(elementos) < 15 else \
+        bytes([0xF0 | tipo]) + _varint(len(elementos))
+    codificar = {T_I32: _entero, T_I64: _entero, T_BINARIO: _binario, T_STRUCT: bytes}[tipo]
+    return cabecera + b''.join(codificar(e) for e in elementos)
+
+
+def _struct(*campos):
+    """campos: (id, tipo thrift, valor ya codificado o entero); los None se omiten"""
+    salida = bytearray()
+    anterior = 0
+    for campo, tipo, valor in campos:
+        if valor is None:
+            continue
+        salida.append(((campo - anterior) << 4) | tipo)  # ids crecientes y cercanos
+        salida += _entero(valor) if tipo in (T_I32, T_I64) else valor
+        anterior = campo
+    salida.append(0)
+    return bytes(salida)
+
+
+# ==================== PÁGINAS ====================
+
+def _niveles(definidos):
+    """Niveles de definición (0 nulo, 1 presente) en RLE de ancho 1, con su largo delante"""
+    datos = b''.join(_varint(sum(1 for _ in grupo) << 1) + bytes([nivel]) for nivel, grupo in groupby(definidos))
+    return struct.pack('<I', len(datos)) + datos
+
+
+def _plain(tipo, valores):
+    fisico, _, _, formato = TIPOS[tipo]
+    if fisico == BYTE_ARRAY:
+        return b''.join(struct.pack('<I', len(v)) + v for v in valores)
+    if fisico == BOOLEAN:
+        bits = bytearray((len(valores) + 7) // 8)
+        for i, v in enumerate(valores):
+            if v:
+                bits[i // 8] |= 1 << (i % 8)
+        return bytes(bits)
+    return struct.pack(f'<{len(valores)}{formato}', *valores)
+
+
+class EscritorParquet:
+    """Parquet que se produce en orden: iniciar(), grupo() por cada lote de filas, cerrar()"""
+
+    def __init__(self, columnas, creado_por='camley'):
+        self.columnas = columnas  # [(nombre, tipo)]
+        self.creado_por = creado_por
+        self._posicion = 0
+        self._grupos = []
+        self._filas = 0
+
+    def iniciar(self):
+        self._posicion = len(MAGIA)
+        return MAGIA
+
+    def grupo(self, filas):
+        """Bytes de un row group con `filas` (tuplas en el orden de las columnas)"""
+        if not filas:
+            return b''
+        partes, metadatos, total = [], [], 0
+        for i, (nombre, tipo) in enumerate(self.columnas):
+            convertir = TIPOS[tipo][2]
+            valores = [convertir(f[i]) for f in filas if f[i] is not None]
+            datos = _niveles(1 if f[i] is not None else 0 for f in filas) + _plain(tipo, valores)
+            comprimido = gzip.compress(datos, mtime=0)
+            cabecera = _struct(
+                (1, T_I32, DATA_PAGE),
+                (2, T_I32, len(datos)),
+                (3, T_I32, len(comprimido)),
+                (5, T_STRUCT, _struct((1, T_I32, len(filas)), (2, T_I32, PLAIN), (3, T_I32, RLE), (4, T_I32, RLE)))
+            )
+            inicio = self._posicion
+            partes += [cabecera, comprimido]
+            self._posicion += len(cabecera) + len(comprimido)
+            total += len(cabecera) + len(datos)
+            metadatos.append(_struct(
+                (2, T_I64, inicio),
+                (3, T_STRUCT, _struct(
+                    (1, T_I32, TIPOS[tipo][0]),
+                    (2, T_LISTA, _lista(T_I32, [PLAIN, RLE])),
+                    (3, T_LISTA, _lista(T_BINARIO, [nombre])),
+                    (4, T_I32, GZIP),
+                    (5, T_I64, len(filas)),
+                    (6, T_I64, len(cabecera) + len(datos)),
+                    (7, T_I64, len(cabecera) + len(comprimido)),
+                    (9, T_I64, inicio)
+                ))
+            ))
+        self._grupos.append(_struct(
+            (1, T_LISTA, _lista(T_STRUCT, metadatos)),
+            (2, T_I64, total),
+            (3, T_I64, len(filas))
+        ))
+        self._filas += len(filas)
+        return b''.join(partes)
+
+    def cerrar(self):
+        esquema = [_struct((4, T_BINARIO, _binario('schema')), (5, T_I32, len(self.columnas)))]
+        for nombre, tipo in self.columnas:
+            fisico, convertido, _, _ = TIPOS[tipo]
+            esquema.append(_struct(
+                (1, T_I32, fisico),
+                (3, T_I32, OPTIONAL),
+                (4, T_BINARIO, _binario(nombre)),
+                (6, T_I32, convertido)
+            ))
+        pie = _struct(
+            (1, T_I32, 1),
+            (2, T_LISTA, _lista(T_STRUCT, esquema)),
+            (3, T_I64, self._filas),
+            (4, T_LISTA, _lista(T_STRUCT, self._grupos)),
+            (6, T_BINARIO, _binario(self.creado_por))
+        )
+        return pie + struct.pack('<I', len(pie)) + MAGIA
@@ -0,0 +1,480 @@
+"""
+Estimación de la hora de llegada (ETA) del bus a cada parada de su ruta.
+
+Partes:
+    secuencia de paradas -> las paradas de los estudiantes activos de la
+        ruta, en el orden indicado por `Estudiante.orden_parada` (las que no
+        tienen orden se encadenan por vecino más cercano al final). Paradas
+        a menos de RADIO_AGRUPAR_METROS se funden en una sola.
+    modelo aprendido     -> tiempo típico (mediana) de cada tramo parada i
+        -> i+1 y velocidad de crucero, sacados del historial GPS de los
+        últimos ETA_DIAS_APRENDIZAJE días. Lo calcula el hilo
+        AprendizajeETA, nunca una petición GPS: hasta tenerlo se estima con
+        la distancia y VELOCIDAD_DEFECTO. Se reaprende cada TTL_MODELO y
+        cada tramo recorrido en vivo corrige su tiempo con una media móvil.
+    estado del viaje     -> cuál es la siguiente parada. Solo avanza hacia
+        adelante; un hueco largo entre puntos empieza un viaje nuevo.
+
+Modelo y estado del viaje viven en `estado_eta_ruta` (una fila por ruta),
+así todos los workers avanzan el mismo viaje aunque los puntos del bus
+lleguen a procesos distintos. Cada punto GPS nuevo lee la fila con FOR
+UPDATE, la avanza y recalcula la estimación (O(paradas)); cada proceso
+guarda esa estimación y los padres la leen ya calculada mientras no haya
+un punto más nuevo, así que muchos padres consultando la misma ruta
+comparten un único cálculo.
+"""
+
+import hashlib
+import json
+import math
+import os
+import statistics
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from database import app, db, Estudiante, Ruta, EstadoEtaRuta
+from geoespacial import IndiceGrilla, distancia_metros
+from historial_gps import recorrido, muestrear, a_epoch, desde_epoch
+
+RADIO_LLEGADA_METROS = float(os.getenv('ETA_RADIO_LLEGADA_METROS', '80'))
+RADIO_AGRUPAR_METROS = 30
+DIAS_APRENDIZAJE = int(os.getenv('ETA_DIAS_APRENDIZAJE', '14'))
+TTL_MODELO = 6 * 3600
+TTL_PARADAS = 30
+INTERVALO_APRENDIZAJE = 600
+PAUSA_NUEVO_VIAJE = timedelta(minutes=45)
+# Velocidad por defecto (20 km/h) y cuánto más largo es ir por calles que en línea recta
+VELOCIDAD_DEFECTO = 20 / 3.6
+FACTOR_RECORRIDO = 1.3
+# Peso de cada tramo observado en vivo sobre el tiempo aprendido
+PESO_OBSERVACION = 0.3
+MAX_TRAMO_SEGUNDOS = 3600
+
+
+def secuencia_paradas(ruta_id):
+    """Paradas de la ruta en orden: [{'orden', 'lat', 'lng', 'estudiantes'}]"""
+    filas = db.session.query(
+        Estudiante.id, Estudiante.parada_lat, Estudiante.parada_lng, Estudiante.orden_parada
+    ).filter(
+        Estudiante.ruta_id == ruta_id,
+        Estudiante.activo == True,
+        Estudiante.parada_lat.isnot(None),
+        Estudiante.parada_lng.isnot(None)
+    ).all()
+
+    con_orden = sorted((f for f in filas if f.orden_parada is not None), key=lambda f: (f.orden_parada, f.id))
+    sin_orden = sorted((f for f in filas if f.orden_parada is None), key=lambda f: f.id)
+    ordenadas = list(con_orden)
+    while sin_orden:
+        if ordenadas:
+            ultima = ordenadas[-1]
+            sin_orden.sort(key=lambda f: distancia_metros(ultima.parada_lat, ultima.parada_lng,
+                                                           f.parada_lat, f.parada_lng))
+        ordenadas.append(sin_orden.pop(0))
+
+    paradas = []
+    for f in ordenadas:
+        for p in paradas:
+            if distancia_metros(p['lat'], p['lng'], f.parada_lat, f.parada_lng) <= RADIO_AGRUPAR_METROS:
+                p['estudiantes'].append(f.id)
+                break
+        else:
+            paradas.append({'orden': len(paradas) + 1, 'lat': f.parada_lat, 'lng': f.parada_lng,
+                            'estudiantes': [f.id]})
+    return paradas
+
+
+def firma_paradas(paradas):
+    """Huella de la secuencia de paradas; si cambia, el modelo y el viaje guardados no valen"""
+    return hashlib.sha256(json.dumps([[p['lat'], p['lng']] for p in paradas]).encode()).hexdigest()
+
+
+def _pases(puntos, paradas, indice):
+    """Primer instante (epoch) en que el tramo entre dos puntos pasa cerca de cada parada.
+
+    Se mira la distancia mínima de la parada al segmento, no solo a los
+    vértices, porque los días compactados tienen pocos puntos.
+    """
+    pases = {}
+    for (lat1, lng1, t1), (lat2, lng2, t2) in zip(puntos, puntos[1:]):
+        largo = distancia_metros(lat1, lng1, lat2, lng2)
+        candidatas = indice.en_radio((lat1 + lat2) / 2, (lng1 + lng2) / 2, largo / 2 + RADIO_LLEGADA_METROS)
+        for _, i in candidatas:
+            if i in pases:
+                continue
+            p = paradas[i]
+            # Proyección plana local: suficiente a escala de una cuadra
+            escala = max(math.cos(math.radians(p['lat'])), 0.01)
+            dx, dy = (lng2 - lng1) * escala, lat2 - lat1
+            px, py = (p['lng'] - lng1) * escala, p['lat'] - lat1
+            largo2 = dx * dx + dy * dy
+            f = 0.0 if largo2 == 0 else min(1.0, max(0.0, (px * dx + py * dy) / largo2))
+            if distancia_metros(p['lat'], p['lng'], lat1 + f * (lat2 - lat1), lng1 + f * (lng2 - lng1)) \
+                    <= RADIO_LLEGADA_METROS:
+                pases[i] = t1 + f * (t2 - t1)
+    return pases
+
+
+def _viajes(puntos):
+    """Partir una lista [lat, lng, epoch] ordenada donde hay pausas largas"""
+    pausa = PAUSA_NUEVO_VIAJE.total_seconds()
+    viaje = []
+    for p in puntos:
+        if viaje and p[2] - viaje[-1][2] > pausa:
+            yield viaje
+            viaje = []
+        viaje.append(p)
+    if viaje:
+        yield viaje
+
+
+def aprender(conductor_id, paradas, ahora=None):
+    """Tiempos de tramo (segundos, None si no hay datos) y velocidad de crucero (m/s)"""
+    ahora = ahora or datetime.utcnow()
+    crudos = recorrido(conductor_id, ahora - timedelta(days=DIAS_APRENDIZAJE), ahora)
+    puntos = muestrear([[lat, lng, a_epoch(fecha)] for lat, lng, fecha in crudos], 10)
+
+    indice = IndiceGrilla()
+    for i, p in enumerate(paradas):
+        indice.actualizar(i, p['lat'], p['lng'])
+
+    observaciones = [[] for _ in paradas[1:]]
+    distancia = tiempo = 0.0
+    for viaje in _viajes(puntos):
+        pases = _pases(viaje, paradas, indice)
+        for i, obs in enumerate(observaciones):
+            if i in pases and i + 1 in pases and 0 < pases[i + 1] - pases[i] <= MAX_TRAMO_SEGUNDOS:
+                obs.append(pases[i + 1] - pases[i])
+        for (lat1, lng1, t1), (lat2, lng2, t2) in zip(viaje, viaje[1:]):
+            dt = t2 - t1
+            if 0 < dt <= 120:
+                d = distancia_metros(lat1, lng1, lat2, lng2)
+                # Solo en movimiento; descarta saltos de GPS
+                if 0.5 <= d / dt <= 35:
+                    distancia += d
+                    tiempo += dt
+
+    velocidad = distancia / tiempo if tiempo > 60 else VELOCIDAD_DEFECTO
+    segmentos = [statistics.median(obs) if obs else None for obs in observaciones]
+    return segmentos, velocidad
+
+
+def aprender_pendientes(ahora=None):
+    """Aprender los modelos que faltan o vencieron; devuelve cuántos se aprendieron.
+
+    Cada ruta se reclama con un UPDATE condicional sobre modelo_fecha, así
+    que con varios workers solo uno recorre su historial.
+    """
+    ahora = ahora or datetime.utcnow()
+    vencidas = db.session.execute(
+        db.select(EstadoEtaRuta.ruta_id, EstadoEtaRuta.conductor_id, EstadoEtaRuta.firma, EstadoEtaRuta.modelo_fecha)
+        .where(db.or_(EstadoEtaRuta.modelo_fecha.is_(None),
+                      EstadoEtaRuta.modelo_fecha < ahora - timedelta(seconds=TTL_MODELO)))
+    ).all()
+    aprendidos = 0
+    for ruta_id, conductor_id, firma, anterior in vencidas:
+        paradas = secuencia_paradas(ruta_id)
+        if firma_paradas(paradas) != firma:
+            continue  # el próximo punto GPS reinicia la fila con las paradas nuevas
+        misma = db.and_(EstadoEtaRuta.ruta_id == ruta_id, EstadoEtaRuta.conductor_id == conductor_id,
+                        EstadoEtaRuta.firma == firma)
+        reclamo = db.session.execute(
+            db.update(EstadoEtaRuta)
+            .where(misma, EstadoEtaRuta.modelo_fecha.is_(None) if anterior is None
+                   else EstadoEtaRuta.modelo_fecha == anterior)
+            .values(modelo_fecha=ahora)
+        )
+        db.session.commit()
+        if reclamo.rowcount != 1:
+            continue  # la aprende otro worker
+        try:
+            segmentos, velocidad = aprender(conductor_id, paradas, ahora)
+        except Exception:
+            db.session.rollback()
+            db.session.execute(db.update(EstadoEtaRuta).where(misma, EstadoEtaRuta.modelo_fecha == ahora)
+                               .values(modelo_fecha=anterior))
+            db.session.commit()
+            raise
+        db.session.execute(db.update(EstadoEtaRuta).where(misma)
+                           .values(segmentos=json.dumps(segmentos), velocidad=velocidad))
+        db.session.commit()
+        aprendidos += 1
+    return aprendidos
+
+
+class _EstadoRuta:
+    """Paradas, modelo y avance del viaje de una ruta, tal como están en EstadoEtaRuta"""
+
+    def __init__(self, ruta_id, conductor_id, paradas, firma, fila=None):
+        self.ruta_id = ruta_id
+        self.conductor_id = conductor_id
+        self.paradas = paradas
+        self.firma = firma
+        self.segmentos = [None] * max(len(paradas) - 1, 0)
+        self.velocidad = VELOCIDAD_DEFECTO
+        self.modelo_fecha = None
+        self.siguiente = 0
+        self.pases = {}
+        self.ultimo = None  # (lat, lng, fecha) del último punto procesado
+        # Otro conductor u otra secuencia de paradas: el modelo y el avance guardados no valen
+        if fila is not None and fila.conductor_id == conductor_id and fila.firma == firma:
+            if fila.segmentos:
+                self.segmentos = json.loads(fila.segmentos)
+            self.velocidad = fila.velocidad or VELOCIDAD_DEFECTO
+            self.modelo_fecha = fila.modelo_fecha
+            self.siguiente = fila.siguiente or 0
+            self.pases = {int(i): desde_epoch(t) for i, t in json.loads(fila.pases or '{}').items()}
+            if fila.ultimo_fecha is not None:
+                self.ultimo = (fila.ultimo_lat, fila.ultimo_lng, fila.ultimo_fecha)
+
+    def guardar(self, fila):
+        fila.conductor_id = self.conductor_id
+        fila.firma = self.firma
+        fila.segmentos = json.dumps(self.segmentos)
+        fila.velocidad = self.velocidad
+        fila.modelo_fecha = self.modelo_fecha
+        fila.siguiente = self.siguiente
+        fila.pases = json.dumps({str(i): a_epoch(f) for i, f in self.pases.items()})
+        fila.ultimo_lat, fila.ultimo_lng, fila.ultimo_fecha = self.ultimo or (None, None, None)
+
+    def tiempo_tramo(self, i):
+        """Segundos estimados de la parada i a la i+1"""
+        aprendido = self.segmentos[i] if i < len(self.segmentos) else None
+        if aprendido is not None:
+            return aprendido
+        a, b = self.paradas[i], self.paradas[i + 1]
+        return distancia_metros(a['lat'], a['lng'], b['lat'], b['lng']) * FACTOR_RECORRIDO / self.velocidad
+
+
+class MotorETA:
+    """Estimaciones por ruta a partir del estado compartido en EstadoEtaRuta.
+
+    Thread-safe: las cachés de este proceso (paradas, rutas y última
+    estimación por ruta) tienen un lock; el estado del viaje se serializa
+    con el FOR UPDATE de su fila.
+    """
+
+    def __init__(self):
+        self._paradas = {}  # ruta_id -> (expira, paradas, firma)
+        self._resultados = {}  # ruta_id -> {'expira', 'conductor_id', 'fecha', 'resultado'}
+        self._rutas_conductor = {'expira': 0, 'datos': {}}
+        self._lock = threading.Lock()
+
+    def invalidar(self):
+        """Releer paradas y rutas en el próximo uso (tras editar estudiantes o rutas)"""
+        with self._lock:
+            self._rutas_conductor['expira'] = 0
+            self._paradas.clear()
+            self._resultados.clear()
+
+    def _rutas_de(self, conductor_id):
+        ahora = time.monotonic()
+        with self._lock:
+            if self._rutas_conductor['expira'] <= ahora:
+                datos = {}
+                for rid, cid in db.session.query(Ruta.id, Ruta.conductor_id).filter(
+                    Ruta.conductor_id.isnot(None), Ruta.activa == True
+                ):
+                    datos.setdefault(cid, []).append(rid)
+                self._rutas_conductor = {'expira': ahora + TTL_PARADAS, 'datos': datos}
+            return self._rutas_conductor['datos'].get(conductor_id, [])
+
+    def _paradas_de(self, ruta_id):
+        """(paradas, firma) de la ruta, releídas cada TTL_PARADAS"""
+        ahora = time.monotonic()
+        with self._lock:
+            guardadas = self._paradas.get(ruta_id)
+        if guardadas is not None and guardadas[0] > ahora:
+            return guardadas[1], guardadas[2]
+        paradas = secuencia_paradas(ruta_id)
+        firma = firma_paradas(paradas)
+        with self._lock:
+            self._paradas[ruta_id] = (ahora + TTL_PARADAS, paradas, firma)
+        return paradas, firma
+
+    def _avanzar(self, estado, lat, lng, fecha):
+        """Mover el puntero de siguiente parada con un punto nuevo"""
+        if estado.ultimo is not None:
+            if fecha <= estado.ultimo[2]:
+                return
+            if fecha - estado.ultimo[2] > PAUSA_NUEVO_VIAJE or fecha.date() != estado.ultimo[2].date():
+                estado.siguiente = 0
+                estado.pases = {}
+        estado.ultimo = (lat, lng, fecha)
+
+        # La parada más avanzada dentro del radio (se saltan las de ausentes)
+        llegada = None
+        for i in range(estado.siguiente, len(estado.paradas)):
+            p = estado.paradas[i]
+            if distancia_metros(lat, lng, p['lat'], p['lng']) <= RADIO_LLEGADA_METROS:
+                llegada = i
+        if llegada is None:
+            return
+
+        anterior = llegada - 1
+        if anterior in estado.pases:
+            observado = (fecha - estado.pases[anterior]).total_seconds()
+            if 0 < observado <= MAX_TRAMO_SEGUNDOS:
+                previo = estado.segmentos[anterior]
+                estado.segmentos[anterior] = observado if previo is None else \
+                    (1 - PESO_OBSERVACION) * previo + PESO_OBSERVACION * observado
+        estado.pases.setdefault(llegada, fecha)
+        estado.siguiente = llegada + 1
+
+    def _estimar(self, estado):
+        """Estimación desde el último punto; O(paradas)"""
+        if estado.ultimo is None:
+            return None
+        lat, lng, fecha = estado.ultimo
+        paradas = []
+        acumulado = None
+        for i, p in enumerate(estado.paradas):
+            fila = {'orden': p['orden'], 'lat': p['lat'], 'lng': p['lng'], 'estudiantes': p['estudiantes']}
+            if i < estado.siguiente:
+                fila.update(pasada=True, segundos=None, eta=None,
+                            llegada=estado.pases[i].isoformat() if i in estado.pases else None)
+            else:
+                if acumulado is None:
+                    # Primer tramo: fracción del tiempo aprendido según lo que falta
+                    restante = distancia_metros(lat, lng, p['lat'], p['lng'])
+                    acumulado = restante * FACTOR_RECORRIDO / estado.velocidad
+                    if i > 0 and estado.segmentos[i - 1] is not None:
+                        a = estado.paradas[i - 1]
+                        largo = distancia_metros(a['lat'], a['lng'], p['lat'], p['lng'])
+                        if largo > 0:
+                            acumulado = estado.segmentos[i - 1] * min(1.0, restante / largo)
+                else:
+                    acumulado += estado.tiempo_tramo(i - 1)
+                fila.update(pasada=False, segundos=round(acumulado),
+                            eta=(fecha + timedelta(seconds=acumulado)).isoformat())
+            paradas.append(fila)
+
+        return {
+            'ruta_id': estado.ruta_id,
+            'conductor_id': estado.conductor_id,
+            'posicion': {'lat': lat, 'lng': lng, 'fecha': fecha.isoformat()},
+            'velocidad_kmh': round(estado.velocidad * 3.6, 1),
+            'siguiente_parada': estado.paradas[estado.siguiente]['orden']
+                if estado.siguiente < len(estado.paradas) else None,
+            'paradas': paradas
+        }
+
+    def _recordar(self, estado):
+        """Calcular la estimación y guardarla para los lectores de este proceso"""
+        resultado = self._estimar(estado)
+        with self._lock:
+            self._resultados[estado.ruta_id] = {
+                'expira': time.monotonic() + TTL_PARADAS,
+                'conductor_id': estado.conductor_id,
+                'fecha': estado.ultimo[2] if estado.ultimo else datetime.min,
+                'resultado': resultado
+            }
+        return resultado
+
+    def _avanzar_guardado(self, ruta_id, conductor_id, paradas, firma, puntos):
+        """Avanzar la fila de la ruta con los puntos y confirmarla (un commit)"""
+        for intento in range(2):
+            fila = db.session.get(EstadoEtaRuta, ruta_id, with_for_update=True, populate_existing=True)
+            estado = _EstadoRuta(ruta_id, conductor_id, paradas, firma, fila)
+            for p in puntos:
+                self._avanzar(estado, p['lat'], p['lng'], p['fecha'])
+            if fila is None:
+                fila = EstadoEtaRuta(ruta_id=ruta_id)
+                db.session.add(fila)
+            estado.guardar(fila)
+            try:
+                db.session.commit()
+                return estado
+            except IntegrityError:
+                # Otro worker creó la fila de la ruta a la vez: releerla
+                db.session.rollback()
+                if intento:
+                    raise
+
+    def procesar(self, conductor_id, puntos):
+        """Incorporar puntos nuevos del conductor (dicts con lat, lng, fecha). Hace commit."""
+        rutas = self._rutas_de(conductor_id)
+        if not rutas or not puntos:
+            return
+        ordenados = sorted(puntos, key=lambda p: p['fecha'])
+        sin_modelo = False
+        for ruta_id in rutas:
+            paradas, firma = self._paradas_de(ruta_id)
+            if not paradas:
+                with self._lock:
+                    self._resultados.pop(ruta_id, None)
+                continue
+            estado = self._avanzar_guardado(ruta_id, conductor_id, paradas, firma, ordenados)
+            sin_modelo = sin_modelo or estado.modelo_fecha is None
+            self._recordar(estado)
+        if sin_modelo:
+            aprendizaje_eta.despertar()
+
+    def estimacion(self, ruta_id, conductor_id, posicion=None):
+        """Última estimación de la ruta (compartida entre todos los lectores).
+
+        `posicion` es la del almacén en vivo. Mientras no sea más nueva que
+        la última estimación de este proceso se devuelve esa; si lo es (el
+        punto llegó a otro worker) se relee la fila compartida. No escribe.
+        """
+        with self._lock:
+            guardada = self._resultados.get(ruta_id)
+        if guardada is not None and guardada['expira'] > time.monotonic() \
+                and guardada['conductor_id'] == conductor_id \
+                and (not posicion or posicion['ultima_actualizacion'] <= guardada['fecha']):
+            return guardada['resultado']
+
+        paradas, firma = self._paradas_de(ruta_id)
+        if not paradas:
+            return None
+        fila = db.session.get(EstadoEtaRuta, ruta_id, populate_existing=True)
+        estado = _EstadoRuta(ruta_id, conductor_id, paradas, firma, fila)
+        if posicion:
+            # Si su worker todavía no guardó el punto, se usa solo para esta estimación
+            self._avanzar(estado, posicion['lat'], posicion['lng'], posicion['ultima_actualizacion'])
+        return self._recordar(estado)
+
+
+class AprendizajeETA:
+    """Hilo por proceso que aprende los modelos de ETA fuera de las peticiones GPS"""
+
+    def __init__(self):
+        self._evento = threading.Event()
+        self._hilo = None
+        self._pid = None
+
+    def iniciar(self):
+        if self._hilo is not None and self._hilo.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._hilo = threading.Thread(target=self._bucle, name='eta-aprendizaje', daemon=True)
+        self._hilo.start()
+
+    def despertar(self):
+        """Avisar que hay una ruta sin modelo (llamar después del commit)"""
+        self.iniciar()
+        self._evento.set()
+
+    def _bucle(self):
+        while True:
+            self._evento.wait(INTERVALO_APRENDIZAJE)
+            self._evento.clear()
+            try:
+                self.ejecutar()
+            except Exception as e:
+                app.logger.warning('Error aprendiendo modelos de ETA: %s', e)
+
+    def ejecutar(self):
+        with app.app_context():
+            try:
+                return aprender_pendientes()
+            except Exception:
+                db.session.rollback()
+                raise
+
+
+motor_eta = MotorETA()
+aprendizaje_eta = AprendizajeETA()
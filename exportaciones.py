@@ -0,0 +1,208 @@
+"""
+Exportación de tablas para contabilidad y análisis, en streaming.
+
+Cada tabla se lee para un rango de fechas con `yield_per` (cursor del
+lado del servidor en PostgreSQL, con stream_results) y se entrega como
+CSV por partes o como Parquet por grupos de filas. Solo se leen columnas,
+sin crear objetos del ORM, y en memoria está como mucho un lote (CSV) o
+un grupo de filas (Parquet), así que exportar un año de historial GPS no
+carga el año en el proceso.
+
+Las ubicaciones combinan los días ya compactados (ubicacion_historial_dia,
+un recorrido por fila que se expande aquí) con los puntos crudos recientes;
+la columna `compactado` indica de cuál vienen.
+
+Variables de entorno:
+    EXPORTACION_LOTE          filas por lote leído de la base (5000)
+    EXPORTACION_FILAS_GRUPO   filas por row group de Parquet (50000)
+"""
+
+import csv
+import io
+import json
+import os
+from datetime import date, datetime, time, timedelta
+
+from database import db, Pago, Asistencia, Ingreso, Gasto, UbicacionHistorial, UbicacionHistorialDia
+from escritor_parquet import EscritorParquet
+from historial_gps import desde_epoch
+
+LOTE = int(os.getenv('EXPORTACION_LOTE', '5000'))
+FILAS_GRUPO = int(os.getenv('EXPORTACION_FILAS_GRUPO', '50000'))
+LOTE_DIAS_GPS = 50  # recorridos compactados por lote (cada uno es un día completo)
+
+FORMATOS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+# tabla -> (modelo, columna del rango de fechas, [(columna, tipo)])
+TABLAS = {
+    'pagos': (Pago, Pago.fecha_vencimiento, [
+        (Pago.id, 'entero'),
+        (Pago.estudiante_id, 'entero'),
+        (Pago.monto, 'decimal'),
+        (Pago.estado, 'texto'),
+        (Pago.fecha_creacion, 'fecha_hora'),
+        (Pago.fecha_vencimiento, 'fecha_hora'),
+        (Pago.fecha_pago, 'fecha_hora'),
+        (Pago.meses_cubiertos, 'entero'),
+        (Pago.metodo_pago, 'texto'),
+        (Pago.referencia, 'texto'),
+        (Pago.descripcion, 'texto'),
+        (Pago.visto_padre, 'booleano'),
+    ]),
+    'asistencias': (Asistencia, Asistencia.fecha, [
+        (Asistencia.id, 'entero'),
+        (Asistencia.estudiante_id, 'entero'),
+        (Asistencia.conductor_id, 'entero'),
+        (Asistencia.fecha, 'fecha'),
+        (Asistencia.hora, 'hora'),
+        (Asistencia.estado, 'texto'),
+        (Asistencia.observaciones, 'texto'),
+    ]),
+    'ingresos': (Ingreso, Ingreso.fecha, [
+        (Ingreso.id, 'entero'),
+        (Ingreso.descripcion, 'texto'),
+        (Ingreso.monto, 'decimal'),
+        (Ingreso.fuente, 'texto'),
+        (Ingreso.fecha, 'fecha_hora'),
+    ]),
+    'gastos': (Gasto, Gasto.fecha, [
+        (Gasto.id, 'entero'),
+        (Gasto.descripcion, 'texto'),
+        (Gasto.monto, 'decimal'),
+        (Gasto.categoria, 'texto'),
+        (Gasto.fecha, 'fecha_hora'),
+        (Gasto.comprobante, 'texto'),
+    ]),
+}
+
+COLUMNAS_UBICACIONES = [
+    ('conductor_id', 'entero'),
+    ('lat', 'decimal'),
+    ('lng', 'decimal'),
+    ('fecha', 'fecha_hora'),
+    ('compactado', 'booleano'),
+]
+
+
+def columnas(tabla):
+    """[(nombre, tipo)] de la exportación"""
+    if tabla == 'ubicaciones':
+        return COLUMNAS_UBICACIONES
+    return [(col.key, tipo) for col, tipo in TABLAS[tabla][2]]
+
+
+def _rango(columna, desde, hasta):
+    """Condiciones del rango [desde, hasta] (días completos) sobre la columna"""
+    condiciones = []
+    es_dia = isinstance(columna.type, db.Date)
+    if desde:
+        condiciones.append(columna >= (desde if es_dia else datetime.combine(desde, time.min)))
+    if hasta:
+        condiciones.append(columna <= hasta if es_dia else
+                           columna < datetime.combine(hasta + timedelta(days=1), time.min))
+    return condiciones
+
+
+def _lotes_tabla(tabla, desde, hasta):
+    modelo, columna_fecha, cols = TABLAS[tabla]
+    consulta = (db.select(*[col for col, _ in cols])
+                .where(*_rango(columna_fecha, desde, hasta))
+                .order_by(columna_fecha, modelo.id)
+                .execution_options(yield_per=LOTE))
+    for particion in db.session.execute(consulta).partitions():
+        yield [tuple(fila) for fila in particion]
+
+
+def _lotes_ubicaciones(desde, hasta):
+    """Puntos compactados y crudos, por conductor y fecha"""
+    inicio = datetime.combine(desde, time.min) if desde else None
+    fin = datetime.combine(hasta + timedelta(days=1), time.min) if hasta else None
+
+    dias = (db.select(UbicacionHistorialDia.conductor_id, UbicacionHistorialDia.puntos)
+            .where(*_rango(UbicacionHistorialDia.dia, desde, hasta))
+            .order_by(UbicacionHistorialDia.conductor_id, UbicacionHistorialDia.dia)
+            .execution_options(yield_per=LOTE_DIAS_GPS))
+    lote = []
+    for particion in db.session.execute(dias).partitions():
+        for conductor_id, puntos in particion:
+            for lat, lng, segundos in json.loads(puntos):
+                fecha = desde_epoch(segundos)
+                if (inicio is None or fecha >= inicio) and (fin is None or fecha < fin):
+                    lote.append((conductor_id, lat, lng, fecha, True))
+            if len(lote) >= LOTE:
+                yield lote
+                lote = []
+    if lote:
+        yield lote
+
+    crudos = (db.select(UbicacionHistorial.conductor_id, UbicacionHistorial.lat,
+                        UbicacionHistorial.lng, UbicacionHistorial.fecha)
+              .where(*_rango(UbicacionHistorial.fecha, desde, hasta))
+              .order_by(UbicacionHistorial.conductor_id, UbicacionHistorial.fecha)
+              .execution_options(yield_per=LOTE))
+    for particion in db.session.execute(crudos).partitions():
+        yield [(c, lat, lng, fecha, False) for c, lat, lng, fecha in particion]
+
+
+def lotes(tabla, desde=None, hasta=None):
+    """Listas de tuplas de la tabla en el rango, de a LOTE filas aprox."""
+    if tabla == 'ubicaciones':
+        return _lotes_ubicaciones(desde, hasta)
+    return _lotes_tabla(tabla, desde, hasta)
+
+
+# ==================== FORMATOS ====================
+
+def _texto_csv(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, (datetime, date, time)):
+        return valor.isoformat()
+    return valor
+
+
+def csv_por_partes(cols, lotes_filas):
+    """CSV UTF-8 (con BOM para Excel), un bloque de bytes por lote"""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow([nombre for nombre, _ in cols])
+    yield '\ufeff'.encode('utf-8') + buffer.getvalue().encode('utf-8')
+    for filas in lotes_filas:
+        buffer.seek(0)
+        buffer.truncate()
+        escritor.writerows([_texto_csv(v) for v in fila] for fila in filas)
+        yield buffer.getvalue().encode('utf-8')
+
+
+def parquet_por_partes(cols, lotes_filas, filas_grupo=None):
+    """Parquet con un row group cada `filas_grupo` filas"""
+    filas_grupo = filas_grupo or FILAS_GRUPO
+    escritor = EscritorParquet(cols)
+    yield escritor.iniciar()
+    pendientes = []
+    for filas in lotes_filas:
+        pendientes.extend(filas)
+        while len(pendientes) >= filas_grupo:
+            yield escritor.grupo(pendientes[:filas_grupo])
+            del pendientes[:filas_grupo]
+    if pendientes:
+        yield escritor.grupo(pendientes)
+    yield escritor.cerrar()
+
+
+def exportar(tabla, formato, desde=None, hasta=None):
+    """Generador de bytes con la tabla en el formato pedido"""
+    if tabla not in TABLAS and tabla != 'ubicaciones':
+        raise ValueError('Tabla no válida')
+    if formato not in FORMATOS:
+        raise ValueError('Formato no válido')
+    generar = csv_por_partes if formato == 'csv' else parquet_por_partes
+    return generar(columnas(tabla), lotes(tabla, desde, hasta))
+
+
+def nombre_archivo(tabla, formato, desde=None, hasta=None):
+    rango = '_'.join(d.isoformat() for d in (desde, hasta) if d) or 'completo'
+    return f'{tabla}_{rango}.{FORMATOS[formato][1]}'
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Resumen diario de finanzas (tabla resumen_finanzas_dia).
+
+Cada ingreso suma a la fila (día, 'ingreso', fuente) y cada gasto a
+(día, 'gasto', categoría); borrar resta. Las rutas llaman a acumular() en
+la misma transacción que escribe el Ingreso/Gasto, así el resumen nunca
+queda a medias. Los totales de los paneles cuestan O(días) en vez de
+O(filas).
+
+recalcular() reconstruye el resumen desde cero y verificar() lo compara con
+un recálculo completo sin modificarlo.
+
+Uso:
+    python finanzas.py --verificar    # listar diferencias (código 1 si hay)
+    python finanzas.py --recalcular   # reconstruir el resumen
+"""
+
+import argparse
+import sys
+from datetime import date, datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from database import app, db, Ingreso, Gasto, ResumenFinanzasDia
+
+TOLERANCIA = 0.005
+
+
+def _dia(fecha):
+    return fecha.date() if isinstance(fecha, datetime) else fecha
+
+
+def acumular(tipo, concepto, fecha, monto, cantidad=1):
+    """Sumar `monto` (negativo para restar) al resumen del día. No hace commit.
+
+    UPDATE atómico de la fila; si aún no existe se inserta dentro de un
+    savepoint y, si otro proceso la insertó primero, se repite el UPDATE.
+    """
+    clave = {'dia': _dia(fecha), 'tipo': tipo, 'concepto': concepto or ''}
+    tabla = ResumenFinanzasDia.__table__
+
+    def actualizar():
+        return db.session.execute(
+            tabla.update().where(
+                tabla.c.dia == clave['dia'], tabla.c.tipo == tipo, tabla.c.concepto == clave['concepto']
+            ).values(total=tabla.c.total + monto, cantidad=tabla.c.cantidad + cantidad)
+        ).rowcount
+
+    if actualizar():
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.execute(tabla.insert().values(total=monto, cantidad=cantidad, **clave))
+    except IntegrityError:
+        actualizar()
+
+
+def registrar_ingreso(ingreso, signo=1):
+    acumular('ingreso', ingreso.fuente, ingreso.fecha, signo * ingreso.monto, signo)
+
+
+def registrar_gasto(gasto, signo=1):
+    acumular('gasto', gasto.categoria, gasto.fecha, signo * gasto.monto, signo)
+
+
+def totales_periodos(inicio_semana, inicio_mes):
+    """Totales histórico, del mes y de la semana de ingresos y gastos en una consulta"""
+    tabla = ResumenFinanzasDia
+    filas = db.session.query(
+        tabla.tipo,
+        db.func.sum(tabla.total),
+        db.func.sum(db.case((tabla.dia >= inicio_mes, tabla.total), else_=0)),
+        db.func.sum(db.case((tabla.dia >= inicio_semana, tabla.total), else_=0))
+    ).group_by(tabla.tipo).all()
+
+    resultado = {t: {'total': 0, 'mes': 0, 'semana': 0} for t in ('ingreso', 'gasto')}
+    for tipo, total, mes, semana in filas:
+        resultado[tipo] = {'total': total or 0, 'mes': mes or 0, 'semana': semana or 0}
+    return resultado
+
+
+def totales_por_concepto(desde=None, hasta=None):
+    """[(tipo, concepto, total, cantidad)] en el rango de días (inclusive)"""
+    tabla = ResumenFinanzasDia
+    query = db.session.query(
+        tabla.tipo, tabla.concepto, db.func.sum(tabla.total), db.func.sum(tabla.cantidad)
+    )
+    if desde:
+        query = query.filter(tabla.dia >= desde)
+    if hasta:
+        query = query.filter(tabla.dia <= hasta)
+    return query.group_by(tabla.tipo, tabla.concepto).order_by(tabla.tipo, tabla.concepto).all()
+
+
+def _calcular(conn):
+    """Resumen real {(dia, tipo, concepto): (total, cantidad)} agrupando las tablas completas"""
+    resultado = {}
+    for tipo, modelo, columna in (('ingreso', Ingreso, Ingreso.fuente), ('gasto', Gasto, Gasto.categoria)):
+        dia = db.func.date(modelo.fecha)
+        consulta = db.select(dia, columna, db.func.sum(modelo.monto), db.func.count()).group_by(dia, columna)
+        for d, concepto, total, cantidad in conn.execute(consulta):
+            if isinstance(d, str):  # SQLite devuelve date() como texto
+                d = date.fromisoformat(d)
+            clave = (d, tipo, concepto or '')
+            anterior = resultado.get(clave, (0, 0))
+            resultado[clave] = (anterior[0] + total, anterior[1] + cantidad)
+    return resultado
+
+
+def recalcular(conn):
+    """Reconstruir resumen_finanzas_dia desde ingreso y gasto; devuelve las filas escritas"""
+    tabla = ResumenFinanzasDia.__table__
+    filas = [{'dia': d, 'tipo': t, 'concepto': c, 'total': total, 'cantidad': cantidad}
+             for (d, t, c), (total, cantidad) in _calcular(conn).items()]
+    conn.execute(tabla.delete())
+    if filas:
+        conn.execute(tabla.insert(), filas)
+    return len(filas)
+
+
+def verificar(conn):
+    """Diferencias entre el resumen guardado y un recálculo completo.
+
+    Devuelve [(dia, tipo, concepto, guardado, real)]; vacía si coinciden.
+    """
+    tabla = ResumenFinanzasDia.__table__
+    guardado = {
+        (f.dia, f.tipo, f.concepto): f.total
+        for f in conn.execute(db.select(tabla.c.dia, tabla.c.tipo, tabla.c.concepto, tabla.c.total))
+    }
+    real = {clave: total for clave, (total, _) in _calcular(conn).items()}
+    diferencias = []
+    for clave in sorted(guardado.keys() | real.keys()):
+        a, b = guardado.get(clave, 0), real.get(clave, 0)
+        if abs(a - b) > TOLERANCIA:
+            diferencias.append((*clave, a, b))
+    return diferencias
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Resumen diario de finanzas de Camley')
+    grupo = parser.add_mutually_exclusive_group(required=True)
+    grupo.add_argument('--verificar', action='store_true', help='comparar con un recálculo completo')
+    grupo.add_argument('--recalcular', action='store_true', help='reconstruir el resumen')
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.recalcular:
+            with db.engine.begin() as conn:
+                filas = recalcular(conn)
+            print(f'✅ Resumen reconstruido: {filas} filas')
+            return
+        with db.engine.connect() as conn:
+            diferencias = verificar(conn)
+        for dia, tipo, concepto, guardado, real in diferencias:
+            print(f'❌ {dia} {tipo}/{concepto or "-"}: resumen {guardado:.2f} != real {real:.2f}')
+        if diferencias:
+            sys.exit(1)
+        print('✅ El resumen coincide con las tablas')
+
+
+if __name__ == '__main__':
+    main()
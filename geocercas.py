@@ -0,0 +1,188 @@
+"""
+Geocercas: avisos automáticos de llegada y salida de escuelas y paradas.
+
+Cada punto GPS de un conductor se compara solo contra los polígonos de su
+celda de la grilla (IndicePoligonos), así que el costo por punto no crece
+con el total de geocercas. El estado dentro/fuera y el último aviso se
+guardan por (conductor, geocerca) en `estado_geocerca`, compartido por
+todos los workers; los eventos son la diferencia entre las geocercas donde
+estaba y las del punto nuevo.
+
+El primer punto de un conductor (o el primero tras una pausa larga, según
+su historial GPS) solo fija el estado, sin eventos: encender el GPS dentro
+de la escuela no es una llegada. Un lote con puntos más viejos que el
+último guardado del conductor no genera eventos. Para que el ruido del GPS
+en el borde no dispare avisos repetidos, un cambio a menos de
+SEGUNDOS_ENTRE_EVENTOS del último evento de la misma geocerca y conductor
+se ignora (el estado no cambia y se reevalúa con el punto siguiente).
+
+Cada cambio se guarda con un UPDATE condicional sobre el estado leído (o un
+INSERT que choca con la clave primaria), así que si dos workers procesan
+puntos del mismo conductor a la vez solo uno emite el evento.
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from database import db, Estudiante, Geocerca, Ruta, EstadoGeocerca, UbicacionHistorial
+from geoespacial import IndicePoligonos
+
+TTL_GEOCERCAS = 30
+PAUSA_REINICIO = timedelta(minutes=45)
+SEGUNDOS_ENTRE_EVENTOS = int(os.getenv('GEOCERCAS_SEGUNDOS_ENTRE_EVENTOS', '120'))
+
+
+class MotorGeocercas:
+    """Detección de transiciones contra el estado guardado. Thread-safe.
+
+    En memoria solo quedan las geocercas y las rutas de cada conductor,
+    releídas cada TTL_GEOCERCAS.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indice = IndicePoligonos()
+        self._geocercas = {}
+        self._rutas_conductor = {}
+        self._expira = 0
+
+    def invalidar(self):
+        with self._lock:
+            self._expira = 0
+
+    def _cargar(self):
+        """(índice, geocercas, rutas por conductor), releídos si venció el TTL"""
+        with self._lock:
+            ahora = time.monotonic()
+            if self._expira > ahora:
+                return self._indice, self._geocercas, self._rutas_conductor
+            indice = IndicePoligonos()
+            geocercas = {}
+            # La parada de un estudiante sigue a la ruta actual del estudiante
+            for g, ruta_estudiante in db.session.query(Geocerca, Estudiante.ruta_id).outerjoin(
+                Estudiante, Estudiante.id == Geocerca.estudiante_id
+            ).filter(Geocerca.activa == True):
+                if g.estudiante_id and ruta_estudiante is None:
+                    continue  # estudiante sin ruta: ningún bus pasa por su parada
+                indice.agregar(g.id, [tuple(v) for v in json.loads(g.poligono)])
+                geocercas[g.id] = {
+                    'id': g.id, 'nombre': g.nombre, 'tipo': g.tipo,
+                    'ruta_id': ruta_estudiante if g.estudiante_id else g.ruta_id,
+                    'estudiante_id': g.estudiante_id
+                }
+            rutas = {}
+            for rid, cid in db.session.query(Ruta.id, Ruta.conductor_id).filter(Ruta.conductor_id.isnot(None)):
+                rutas.setdefault(cid, set()).add(rid)
+            self._indice, self._geocercas, self._rutas_conductor = indice, geocercas, rutas
+            self._expira = ahora + TTL_GEOCERCAS
+            return indice, geocercas, rutas
+
+    @staticmethod
+    def _aplicables(geocercas, rutas, claves):
+        """Quitar las geocercas de rutas que no son del conductor"""
+        return {
+            g for g in claves
+            if g in geocercas and (geocercas[g]['ruta_id'] is None or geocercas[g]['ruta_id'] in rutas)
+        }
+
+    @staticmethod
+    def _vecinos(conductor_id, primero, ultimo):
+        """(punto guardado justo antes de `primero`, el más nuevo después de `ultimo`) del conductor"""
+        fecha = UbicacionHistorial.fecha
+        del_conductor = UbicacionHistorial.conductor_id == conductor_id
+        return db.session.execute(db.select(
+            db.select(db.func.max(fecha)).where(del_conductor, fecha < primero).scalar_subquery(),
+            db.select(db.func.max(fecha)).where(del_conductor, fecha > ultimo).scalar_subquery()
+        )).one()
+
+    @staticmethod
+    def _guardar(conductor_id, leidos, estados):
+        """Guardar los estados que cambiaron; devuelve las geocercas cuyo cambio quedó guardado"""
+        guardadas, nuevas = set(), []
+        for g, estado in estados.items():
+            fila = leidos.get(g)
+            if fila is None:
+                nuevas.append(dict(estado, conductor_id=conductor_id, geocerca_id=g))
+                continue
+            if (estado['dentro'], estado['fecha'], estado['ultimo_evento']) == \
+                    (fila.dentro, fila.fecha, fila.ultimo_evento):
+                continue
+            # Solo si nadie lo cambió desde que se leyó
+            cambio = db.session.execute(db.update(EstadoGeocerca).where(
+                EstadoGeocerca.conductor_id == conductor_id,
+                EstadoGeocerca.geocerca_id == g,
+                EstadoGeocerca.dentro == fila.dentro,
+                EstadoGeocerca.fecha == fila.fecha
+            ).values(**estado))
+            if cambio.rowcount == 1:
+                guardadas.add(g)
+        if nuevas:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(EstadoGeocerca.__table__.insert(), nuevas)
+                guardadas.update(n['geocerca_id'] for n in nuevas)
+            except IntegrityError:
+                pass  # otro worker las creó a la vez y avisó él
+        return guardadas
+
+    def procesar(self, conductor_id, puntos):
+        """Eventos de entrada/salida que producen los puntos (dicts con lat, lng, fecha).
+
+        No hace commit: quien llama confirma el estado junto con los eventos.
+        """
+        if not puntos:
+            return []
+        indice, geocercas, rutas_conductor = self._cargar()
+        rutas = rutas_conductor.get(conductor_id, set())
+        ordenados = sorted(puntos, key=lambda p: p['fecha'])
+        previo, posterior = self._vecinos(conductor_id, ordenados[0]['fecha'], ordenados[-1]['fecha'])
+        if posterior is not None:
+            return []  # puntos atrasados de un buffer offline: ya se procesaron otros más nuevos
+
+        por_punto = [self._aplicables(geocercas, rutas, indice.contienen(p['lat'], p['lng'])) for p in ordenados]
+        leidos = {e.geocerca_id: e for e in EstadoGeocerca.query.filter(
+            EstadoGeocerca.conductor_id == conductor_id,
+            db.or_(EstadoGeocerca.dentro == True, EstadoGeocerca.geocerca_id.in_(set().union(*por_punto)))
+        ).with_for_update()}
+        # Geocercas borradas desde el último punto: salir sin aviso
+        estados = {g: {'dentro': e.dentro and g in geocercas, 'fecha': e.fecha, 'ultimo_evento': e.ultimo_evento}
+                   for g, e in leidos.items()}
+
+        eventos = []
+        anterior = previo
+        for p, dentro in zip(ordenados, por_punto):
+            reinicio = anterior is None or p['fecha'] - anterior > PAUSA_REINICIO
+            anterior = p['fecha']
+            actuales = {g for g, e in estados.items() if e['dentro']}
+            cambios = [(g, 'entrada') for g in sorted(dentro - actuales)] + \
+                      [(g, 'salida') for g in sorted(actuales - dentro)]
+            for g, evento in cambios:
+                estado = estados.setdefault(g, {'dentro': False, 'fecha': p['fecha'], 'ultimo_evento': None})
+                if not reinicio:
+                    previo_evento = estado['ultimo_evento']
+                    if previo_evento is not None and \
+                            (p['fecha'] - previo_evento).total_seconds() < SEGUNDOS_ENTRE_EVENTOS:
+                        continue
+                    estado['ultimo_evento'] = p['fecha']
+                    eventos.append(dict(geocercas[g], geocerca_id=g, evento=evento,
+                                        conductor_id=conductor_id, lat=p['lat'], lng=p['lng'], fecha=p['fecha'],
+                                        rutas=sorted(rutas)))
+                estado.update(dentro=evento == 'entrada', fecha=p['fecha'])
+
+        guardadas = self._guardar(conductor_id, leidos, estados)
+        return [e for e in eventos if e['geocerca_id'] in guardadas]
+
+    def dentro(self, conductor_id):
+        """IDs de las geocercas donde está ahora el conductor"""
+        return set(db.session.execute(
+            db.select(EstadoGeocerca.geocerca_id)
+            .where(EstadoGeocerca.conductor_id == conductor_id, EstadoGeocerca.dentro == True)
+        ).scalars())
+
+
+motor_geocercas = MotorGeocercas()
@@ -0,0 +1,206 @@
+"""
+Índice espacial en memoria para posiciones de vehículos y paradas.
+
+Grilla uniforme de celdas lat/lng (como un geohash de precisión fija): cada
+punto vive en la celda floor(lat / TAMANO), floor(lng / TAMANO). Mover un
+punto cuesta O(1) y una búsqueda solo mira las celdas que tocan el círculo
+pedido, así que con cientos de vehículos responde en microsegundos.
+
+Las distancias se calculan con haversine en metros.
+"""
+
+import heapq
+import math
+
+RADIO_TIERRA_METROS = 6371008.8
+# ~1,1 km de lado en latitud; del orden de la distancia entre paradas
+TAMANO_CELDA_GRADOS = 0.01
+METROS_POR_GRADO_LAT = RADIO_TIERRA_METROS * math.pi / 180
+
+
+def distancia_metros(lat1, lng1, lat2, lng2):
+    """Distancia haversine en metros"""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * RADIO_TIERRA_METROS * math.asin(min(1.0, math.sqrt(a)))
+
+
+class IndiceGrilla:
+    """Índice id -> (lat, lng) con búsquedas por radio y k vecinos más cercanos.
+
+    No es thread-safe por sí mismo: quien lo use debe protegerlo con su
+    propio lock (TablaPosiciones ya lo hace).
+    """
+
+    def __init__(self, tamano_celda=TAMANO_CELDA_GRADOS):
+        self.tamano = tamano_celda
+        self._celdas = {}
+        self._puntos = {}
+
+    def __len__(self):
+        return len(self._puntos)
+
+    def _celda(self, lat, lng):
+        return (math.floor(lat / self.tamano), math.floor(lng / self.tamano))
+
+    def actualizar(self, clave, lat, lng):
+        anterior = self._puntos.get(clave)
+        celda = self._celda(lat, lng)
+        if anterior is not None:
+            celda_anterior = self._celda(*anterior)
+            if celda_anterior != celda:
+                miembros = self._celdas.get(celda_anterior)
+                if miembros is not None:
+                    miembros.discard(clave)
+                    if not miembros:
+                        del self._celdas[celda_anterior]
+        self._celdas.setdefault(celda, set()).add(clave)
+        self._puntos[clave] = (lat, lng)
+
+    def quitar(self, clave):
+        anterior = self._puntos.pop(clave, None)
+        if anterior is None:
+            return
+        celda = self._celda(*anterior)
+        miembros = self._celdas.get(celda)
+        if miembros is not None:
+            miembros.discard(clave)
+            if not miembros:
+                del self._celdas[celda]
+
+    def _anillo(self, centro, r):
+        """Celdas a distancia de Chebyshev exactamente r del centro"""
+        ci, cj = centro
+        if r == 0:
+            yield centro
+            return
+        for dj in range(-r, r + 1):
+            yield (ci - r, cj + dj)
+            yield (ci + r, cj + dj)
+        for di in range(-r + 1, r):
+            yield (ci + di, cj - r)
+            yield (ci + di, cj + r)
+
+    def _metros_por_anillo(self, lat):
+        # Lado más corto de una celda a esa latitud (la longitud se encoge)
+        return self.tamano * METROS_POR_GRADO_LAT * max(math.cos(math.radians(lat)), 0.01)
+
+    def en_radio(self, lat, lng, radio_metros):
+        """[(distancia, clave)] dentro del radio, de la más cercana a la más lejana"""
+        centro = self._celda(lat, lng)
+        # Un punto en el anillo k está al menos a (k - 1) celdas del centro
+        anillos = math.ceil(radio_metros / self._metros_por_anillo(lat)) + 1
+        resultado = []
+        for r in range(anillos + 1):
+            for celda in self._anillo(centro, r):
+                for clave in self._celdas.get(celda, ()):
+                    d = distancia_metros(lat, lng, *self._puntos[clave])
+                    if d <= radio_metros:
+                        resultado.append((d, clave))
+        resultado.sort()
+        return resultado
+
+    def cercanos(self, lat, lng, n, radio_metros=None):
+        """Los `n` más cercanos [(distancia, clave)], opcionalmente dentro de un radio.
+
+        Recorre anillos de celdas hacia afuera y se detiene cuando el anillo
+        siguiente ya no puede contener nada más cerca que el n-ésimo hallado.
+        """
+        if n <= 0 or not self._puntos:
+            return []
+        centro = self._celda(lat, lng)
+        paso = self._metros_por_anillo(lat)
+        max_anillos = self._max_anillos(centro)
+        if radio_metros is not None:
+            max_anillos = min(max_anillos, math.ceil(radio_metros / paso) + 1)
+
+        mejores = []  # max-heap por distancia: (-d, clave)
+        for r in range(max_anillos + 1):
+            # Todo punto del anillo r en adelante está a más de (r - 1) * paso
+            if len(mejores) == n and -mejores[0][0] <= (r - 1) * paso:
+                break
+            for celda in self._anillo(centro, r):
+                for clave in self._celdas.get(celda, ()):
+                    d = distancia_metros(lat, lng, *self._puntos[clave])
+                    if radio_metros is not None and d > radio_metros:
+                        continue
+                    if len(mejores) < n:
+                        heapq.heappush(mejores, (-d, clave))
+                    elif d < -mejores[0][0]:
+                        heapq.heapreplace(mejores, (-d, clave))
+        return sorted((-d, clave) for d, clave in mejores)
+
+    def _max_anillos(self, centro):
+        """Anillos necesarios para cubrir todas las celdas ocupadas"""
+        if not self._celdas:
+            return 0
+        return max(max(abs(i - centro[0]), abs(j - centro[1])) for i, j in self._celdas)
+
+
+def punto_en_poligono(lat, lng, vertices):
+    """Ray casting sobre [(lat, lng), ...]; el polígono se cierra solo"""
+    dentro = False
+    j = len(vertices) - 1
+    for i in range(len(vertices)):
+        lat_i, lng_i = vertices[i]
+        lat_j, lng_j = vertices[j]
+        if (lat_i > lat) != (lat_j > lat):
+            cruce = lng_i + (lat - lat_i) * (lng_j - lng_i) / (lat_j - lat_i)
+            if lng < cruce:
+                dentro = not dentro
+        j = i
+    return dentro
+
+
+def poligono_circular(lat, lng, radio_metros, lados=16):
+    """Polígono regular que aproxima un círculo (para geocercas de parada)"""
+    dlat = radio_metros / METROS_POR_GRADO_LAT
+    dlng = dlat / max(math.cos(math.radians(lat)), 0.01)
+    return [
+        (lat + dlat * math.sin(2 * math.pi * k / lados), lng + dlng * math.cos(2 * math.pi * k / lados))
+        for k in range(lados)
+    ]
+
+
+class IndicePoligonos:
+    """Índice de polígonos por celdas de la misma grilla.
+
+    Cada polígono se registra en todas las celdas que toca su rectángulo
+    envolvente; una consulta solo prueba los polígonos de la celda del
+    punto, así que su costo depende de cuántos polígonos hay cerca y no del
+    total. Igual que IndiceGrilla, la sincronización queda a cargo de quien
+    lo usa.
+    """
+
+    def __init__(self, tamano_celda=TAMANO_CELDA_GRADOS):
+        self.tamano = tamano_celda
+        self._celdas = {}
+        self._poligonos = {}
+
+    def __len__(self):
+        return len(self._poligonos)
+
+    def _celda(self, lat, lng):
+        return (math.floor(lat / self.tamano), math.floor(lng / self.tamano))
+
+    def agregar(self, clave, vertices):
+        lats = [v[0] for v in vertices]
+        lngs = [v[1] for v in vertices]
+        caja = (min(lats), min(lngs), max(lats), max(lngs))
+        self._poligonos[clave] = (list(vertices), caja)
+        i0, j0 = self._celda(caja[0], caja[1])
+        i1, j1 = self._celda(caja[2], caja[3])
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                self._celdas.setdefault((i, j), []).append(clave)
+
+    def contienen(self, lat, lng):
+        """Claves de los polígonos que contienen el punto"""
+        resultado = set()
+        for clave in self._celdas.get(self._celda(lat, lng), ()):
+            vertices, (lat0, lng0, lat1, lng1) = self._poligonos[clave]
+            if lat0 <= lat <= lat1 and lng0 <= lng <= lng1 and punto_en_poligono(lat, lng, vertices):
+                resultado.add(clave)
+        return resultado
@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+"""
+Historial GPS particionado por día y compactado con el tiempo.
+
+Los puntos crudos entran a `ubicacion_historial` (ver registrar_ubicaciones
+en app.py). Pasados DIAS_CRUDOS días, cada día de cada conductor se
+compacta en una sola fila de `ubicacion_historial_dia` con el recorrido
+simplificado, y los puntos crudos de ese día se eliminan. Los recorridos
+compactados se conservan RETENCION_DIAS días y luego se borran, así que el
+almacenamiento queda acotado por la flota y no por la antigüedad.
+
+Almacenamiento según el motor:
+    PostgreSQL -> `ubicacion_historial` es una tabla particionada por rango
+                  de `fecha`, una partición por día (ubicacion_historial_pAAAAMMDD)
+                  más una DEFAULT. Las particiones se crean con anticipación.
+                  Una partición vieja primero se separa (DETACH), así los puntos
+                  que lleguen tarde para ese día caen en la DEFAULT; después se
+                  compacta lo que quedó en ella y se elimina con DROP TABLE.
+    SQLite     -> una sola tabla cruda con índice (conductor_id, fecha); los
+                  días viejos viven como filas resumen (rollup) en
+                  `ubicacion_historial_dia` y los crudos se borran por rango.
+
+Los crudos que no están en una partición separada (SQLite, la DEFAULT) se
+borran con DELETE ... RETURNING y se compacta justo lo que devolvió el
+DELETE: un punto que llega mientras tanto queda para la pasada siguiente y
+nunca se borra sin haberse compactado.
+
+En ambos casos reproducir un viaje lee como mucho una fila compactada por
+día más un rango del índice crudo, sin importar cuánto historial exista.
+
+Variables de entorno:
+    HISTORIAL_DIAS_CRUDOS        días que se guardan los puntos crudos (7)
+    HISTORIAL_RETENCION_DIAS     días que se guardan los recorridos compactados (400)
+    HISTORIAL_COMPACTACION       douglas_peucker | intervalo (douglas_peucker)
+    HISTORIAL_TOLERANCIA_METROS  tolerancia de Douglas-Peucker (10)
+    HISTORIAL_INTERVALO_SEGUNDOS separación mínima al muestrear por intervalo (30)
+
+Uso manual:
+    python historial_gps.py           # compactar y aplicar la retención ahora
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy.exc import DBAPIError, IntegrityError
+
+from database import app, db, UbicacionHistorial, UbicacionHistorialDia
+
+DIAS_CRUDOS = int(os.getenv('HISTORIAL_DIAS_CRUDOS', '7'))
+RETENCION_DIAS = int(os.getenv('HISTORIAL_RETENCION_DIAS', '400'))
+COMPACTACION = os.getenv('HISTORIAL_COMPACTACION', 'douglas_peucker')
+TOLERANCIA_METROS = float(os.getenv('HISTORIAL_TOLERANCIA_METROS', '10'))
+INTERVALO_SEGUNDOS = float(os.getenv('HISTORIAL_INTERVALO_SEGUNDOS', '30'))
+DIAS_PARTICIONES_ADELANTE = 7
+INTERVALO_MANTENIMIENTO = 3600
+
+RADIO_TIERRA_METROS = 6371008.8
+EPOCA = datetime(1970, 1, 1)
+
+
+# ==================== SIMPLIFICACIÓN ====================
+
+def simplificar(puntos, tolerancia_metros):
+    """Douglas-Peucker sobre puntos (lat, lng, ...) con tolerancia en metros.
+
+    Proyecta a un plano local (equirectangular), suficiente para recorridos
+    de una ciudad. Iterativo para no chocar con el límite de recursión en
+    días largos. Conserva siempre el primer y el último punto.
+    """
+    n = len(puntos)
+    if n < 3 or tolerancia_metros <= 0:
+        return list(puntos)
+
+    lat_media = math.radians(sum(p[0] for p in puntos) / n)
+    kx = RADIO_TIERRA_METROS * math.cos(lat_media) * math.pi / 180
+    ky = RADIO_TIERRA_METROS * math.pi / 180
+    xy = [(p[1] * kx, p[0] * ky) for p in puntos]
+
+    conservar = [False] * n
+    conservar[0] = conservar[-1] = True
+    pila = [(0, n - 1)]
+    while pila:
+        inicio, fin = pila.pop()
+        if fin <= inicio + 1:
+            continue
+        x1, y1 = xy[inicio]
+        x2, y2 = xy[fin]
+        dx, dy = x2 - x1, y2 - y1
+        largo2 = dx * dx + dy * dy
+        distancia_max, indice = -1.0, inicio
+        for k in range(inicio + 1, fin):
+            x, y = xy[k]
+            if largo2 == 0:
+                d = math.hypot(x - x1, y - y1)
+            else:
+                t = max(0.0, min(1.0, ((x - x1) * dx + (y - y1) * dy) / largo2))
+                d = math.hypot(x - (x1 + t * dx), y - (y1 + t * dy))
+            if d > distancia_max:
+                distancia_max, indice = d, k
+        if distancia_max > tolerancia_metros:
+            conservar[indice] = True
+            pila.append((inicio, indice))
+            pila.append((indice, fin))
+
+    return [p for p, c in zip(puntos, conservar) if c]
+
+
+def muestrear(puntos, intervalo_segundos):
+    """Quedarse con un punto cada `intervalo_segundos` (más el último)"""
+    if len(puntos) < 3:
+        return list(puntos)
+    resultado = [puntos[0]]
+    for p in puntos[1:-1]:
+        if p[2] - resultado[-1][2] >= intervalo_segundos:
+            resultado.append(p)
+    resultado.append(puntos[-1])
+    return resultado
+
+
+def compactar_puntos(puntos):
+    """Aplicar el método configurado a una lista [lat, lng, epoch] ordenada"""
+    if COMPACTACION == 'intervalo':
+        return muestrear(puntos, INTERVALO_SEGUNDOS)
+    return simplificar(puntos, TOLERANCIA_METROS)
+
+
+def limitar_puntos(puntos, max_puntos, tolerancia_metros=0):
+    """Simplificar hasta que queden como mucho `max_puntos`.
+
+    Parte de la tolerancia pedida y la duplica mientras sobren puntos; si
+    aun así no alcanza (recorridos muy enredados) se diezma uniformemente.
+    """
+    resultado = simplificar(puntos, tolerancia_metros) if tolerancia_metros > 0 else list(puntos)
+    tolerancia = max(tolerancia_metros, 1.0)
+    while len(resultado) > max_puntos and tolerancia < 5000:
+        tolerancia *= 2
+        resultado = simplificar(puntos, tolerancia)
+    if len(resultado) > max_puntos:
+        paso = math.ceil((len(resultado) - 1) / max(max_puntos - 1, 1))
+        resultado = resultado[:-1:paso] + [resultado[-1]]
+    return resultado
+
+
+def codificar_polyline(puntos, precision=5):
+    """Encoded Polyline Algorithm (formato de Google) para [(lat, lng, ...)]"""
+    factor = 10 ** precision
+    salida = []
+    anterior_lat = anterior_lng = 0
+    for p in puntos:
+        lat, lng = int(round(p[0] * factor)), int(round(p[1] * factor))
+        for delta in (lat - anterior_lat, lng - anterior_lng):
+            valor = ~(delta << 1) if delta < 0 else delta << 1
+            while valor >= 0x20:
+                salida.append(chr((0x20 | (valor & 0x1f)) + 63))
+                valor >>= 5
+            salida.append(chr(valor + 63))
+        anterior_lat, anterior_lng = lat, lng
+    return ''.join(salida)
+
+
+def a_epoch(fecha):
+    """Segundos desde 1970 con la precisión completa de la fecha (entero si no hay fracción).
+
+    Los instantes se comparan por este valor al fundir días compactados con
+    crudos, así que no se trunca: dos puntos en el mismo segundo son distintos.
+    """
+    micro = (fecha - EPOCA) // timedelta(microseconds=1)
+    return micro // 1000000 if micro % 1000000 == 0 else micro / 1000000
+
+
+def desde_epoch(segundos):
+    return EPOCA + timedelta(seconds=segundos)
+
+
+# ==================== PARTICIONES (PostgreSQL) ====================
+
+def es_postgres(conn=None):
+    return (conn.dialect.name if conn is not None else db.engine.dialect.name) == 'postgresql'
+
+
+def nombre_particion(dia):
+    return f'ubicacion_historial_p{dia:%Y%m%d}'
+
+
+def particionado(conn):
+    """¿`ubicacion_historial` ya es una tabla particionada?"""
+    return bool(conn.execute(db.text(
+        "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+        "WHERE c.relname = 'ubicacion_historial'"
+    )).scalar())
+
+
+def crear_particiones(conn, desde_dia, hasta_dia):
+    """Crear las particiones diarias que falten en [desde_dia, hasta_dia]"""
+    dia = desde_dia
+    while dia <= hasta_dia:
+        # Si la DEFAULT ya tiene filas de ese día PostgreSQL rechaza la
+        # partición; esas filas se quedan en la DEFAULT y se compactan igual.
+        try:
+            with conn.begin_nested():
+                conn.execute(db.text(
+                    f"CREATE TABLE IF NOT EXISTS {nombre_particion(dia)} PARTITION OF ubicacion_historial "
+                    f"FOR VALUES FROM ('{dia.isoformat()}') TO ('{(dia + timedelta(days=1)).isoformat()}')"
+                ))
+        except DBAPIError as e:
+            app.logger.warning('No se pudo crear la partición %s: %s', nombre_particion(dia), e)
+        dia += timedelta(days=1)
+
+
+def _por_dia(nombres):
+    particiones = {}
+    for nombre in nombres:
+        sufijo = nombre.rsplit('_p', 1)[-1]
+        if sufijo.isdigit() and len(sufijo) == 8:
+            particiones[datetime.strptime(sufijo, '%Y%m%d').date()] = nombre
+    return particiones
+
+
+def particiones_existentes(conn):
+    """{día: nombre} de las particiones diarias de ubicacion_historial"""
+    return _por_dia(nombre for (nombre,) in conn.execute(db.text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = 'ubicacion_historial'"
+    )))
+
+
+def particiones_separadas(conn):
+    """{día: nombre} de particiones ya separadas pero sin eliminar (una pasada interrumpida)"""
+    return _por_dia(nombre for (nombre,) in conn.execute(db.text(
+        "SELECT c.relname FROM pg_class c "
+        "WHERE c.relkind = 'r' AND c.relname LIKE 'ubicacion\\_historial\\_p%' "
+        "AND NOT c.relispartition"
+    )))
+
+
+def particionar_historial(conn):
+    """Migración: convertir ubicacion_historial en tabla particionada por día.
+
+    No hace nada fuera de PostgreSQL o si ya está particionada. Copia las
+    filas existentes a la tabla nueva y conserva la secuencia de ids.
+    """
+    if not es_postgres(conn) or particionado(conn):
+        return
+
+    conn.execute(db.text('ALTER TABLE ubicacion_historial RENAME TO ubicacion_historial_anterior'))
+    conn.execute(db.text('ALTER SEQUENCE IF EXISTS ubicacion_historial_id_seq RENAME TO ubicacion_historial_anterior_id_seq'))
+    conn.execute(db.text('ALTER INDEX IF EXISTS ix_ubicacion_historial_conductor_fecha RENAME TO ix_ubicacion_historial_anterior_conductor_fecha'))
+    conn.execute(db.text(
+        'CREATE TABLE ubicacion_historial ('
+        ' id SERIAL,'
+        ' conductor_id INTEGER NOT NULL REFERENCES usuario (id),'
+        ' lat DOUBLE PRECISION NOT NULL,'
+        ' lng DOUBLE PRECISION NOT NULL,'
+        ' fecha TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE \'utc\'),'
+        ' PRIMARY KEY (id, fecha)'
+        ') PARTITION BY RANGE (fecha)'
+    ))
+    conn.execute(db.text('CREATE TABLE ubicacion_historial_default PARTITION OF ubicacion_historial DEFAULT'))
+    conn.execute(db.text('CREATE INDEX ix_ubicacion_historial_conductor_fecha ON ubicacion_historial (conductor_id, fecha)'))
+
+    hoy = datetime.utcnow().date()
+    primero = conn.execute(db.text('SELECT MIN(fecha) FROM ubicacion_historial_anterior')).scalar()
+    desde = min(primero.date(), hoy) if primero else hoy
+    crear_particiones(conn, desde, hoy + timedelta(days=DIAS_PARTICIONES_ADELANTE))
+
+    conn.execute(db.text(
+        'INSERT INTO ubicacion_historial (id, conductor_id, lat, lng, fecha) '
+        "SELECT id, conductor_id, lat, lng, COALESCE(fecha, now() AT TIME ZONE 'utc') FROM ubicacion_historial_anterior"
+    ))
+    conn.execute(db.text(
+        "SELECT setval(pg_get_serial_sequence('ubicacion_historial', 'id'), "
+        'COALESCE((SELECT MAX(id) FROM ubicacion_historial), 0) + 1, false)'
+    ))
+    conn.execute(db.text('DROP TABLE ubicacion_historial_anterior'))
+
+
+# ==================== COMPACTACIÓN Y RETENCIÓN ====================
+
+def _como_fecha(valor):
+    # func.date() devuelve texto en SQLite y date en PostgreSQL
+    return date.fromisoformat(valor) if isinstance(valor, str) else valor
+
+
+def _tabla_cruda(nombre):
+    """Una partición separada, con las columnas de ubicacion_historial que se leen"""
+    return db.table(nombre, db.column('conductor_id'), db.column('lat'), db.column('lng'), db.column('fecha'))
+
+
+def compactar_dia(conductor_id, dia, particion=None):
+    """Fundir los puntos crudos de un conductor/día en su fila compactada.
+
+    Sin `particion` los crudos se borran de ubicacion_historial con
+    DELETE ... RETURNING y se compacta exactamente lo borrado. Con
+    `particion` (el nombre de una partición ya separada, donde no entran
+    puntos nuevos) solo se leen: se van con el DROP de la partición.
+
+    Si el día ya estaba compactado (llegaron puntos tarde o una pasada
+    anterior se interrumpió) se mezclan ambos sin duplicar instantes.
+    Devuelve (puntos crudos leídos, puntos guardados).
+    """
+    inicio = datetime.combine(dia, datetime.min.time())
+    fin = inicio + timedelta(days=1)
+    tabla = UbicacionHistorial.__table__ if particion is None else _tabla_cruda(particion)
+    rango = db.and_(tabla.c.conductor_id == conductor_id, tabla.c.fecha >= inicio, tabla.c.fecha < fin)
+    if particion is None:
+        consulta = tabla.delete().where(rango).returning(tabla.c.lat, tabla.c.lng, tabla.c.fecha)
+    else:
+        consulta = db.select(tabla.c.lat, tabla.c.lng, tabla.c.fecha).where(rango)
+    crudos = sorted(([lat, lng, a_epoch(fecha)] for lat, lng, fecha in db.session.execute(consulta)),
+                    key=lambda p: p[2])
+
+    fila = UbicacionHistorialDia.query.filter_by(conductor_id=conductor_id, dia=dia).first()
+    originales = len(crudos)
+    if fila is not None:
+        por_instante = {p[2]: p for p in json.loads(fila.puntos)}
+        por_instante.update({p[2]: p for p in crudos})
+        crudos = [por_instante[t] for t in sorted(por_instante)]
+        originales += fila.cantidad_original or 0
+
+    puntos = [[round(lat, 6), round(lng, 6), t] for lat, lng, t in compactar_puntos(crudos)]
+    if fila is None:
+        fila = UbicacionHistorialDia(conductor_id=conductor_id, dia=dia)
+        db.session.add(fila)
+    fila.puntos = json.dumps(puntos, separators=(',', ':'))
+    fila.cantidad = len(puntos)
+    fila.cantidad_original = originales
+    fila.actualizado = datetime.utcnow()
+    db.session.commit()
+    return originales, len(puntos)
+
+
+def _compactar_pares(pares, resumen, particion=None):
+    for conductor_id, dia in pares:
+        try:
+            leidos, guardados = compactar_dia(conductor_id, dia, particion)
+        except IntegrityError:
+            # Otro worker creó la fila compactada al mismo tiempo
+            db.session.rollback()
+            if particion is None:
+                continue  # el DELETE se deshizo: los crudos quedan para la pasada siguiente
+            # La partición se elimina después: fundir ahora sobre la fila del otro worker
+            leidos, guardados = compactar_dia(conductor_id, dia, particion)
+        resumen['dias'] += 1
+        resumen['crudos'] += leidos
+        resumen['guardados'] += guardados
+
+
+def _compactar_particiones(limite_dia, resumen):
+    """Separar, compactar y eliminar las particiones diarias anteriores a limite_dia.
+
+    Incluye las que una pasada anterior separó y no llegó a eliminar.
+    """
+    with db.engine.begin() as conn:
+        adjuntas = {d: n for d, n in particiones_existentes(conn).items() if d < limite_dia}
+        separadas = {d: n for d, n in particiones_separadas(conn).items() if d < limite_dia}
+
+    for dia, nombre in sorted(adjuntas.items()):
+        try:
+            # Desde aquí los puntos que lleguen tarde para ese día van a la DEFAULT
+            with db.engine.begin() as conn:
+                conn.execute(db.text(f'ALTER TABLE ubicacion_historial DETACH PARTITION {nombre}'))
+        except DBAPIError as e:
+            app.logger.warning('No se pudo separar la partición %s: %s', nombre, e)
+            continue
+        separadas[dia] = nombre
+
+    for dia, nombre in sorted(separadas.items()):
+        tabla = _tabla_cruda(nombre)
+        conductores = db.session.execute(db.select(tabla.c.conductor_id).distinct()).scalars().all()
+        _compactar_pares([(cid, dia) for cid in conductores], resumen, nombre)
+        with db.engine.begin() as conn:
+            conn.execute(db.text(f'DROP TABLE IF EXISTS {nombre}'))
+
+
+def compactar(hoy=None):
+    """Compactar todos los días con puntos crudos más viejos que DIAS_CRUDOS"""
+    hoy = hoy or datetime.utcnow().date()
+    limite_dia = hoy - timedelta(days=DIAS_CRUDOS)
+    limite = datetime.combine(limite_dia, datetime.min.time())
+    postgres = es_postgres()
+
+    resumen = {'dias': 0, 'crudos': 0, 'guardados': 0}
+    if postgres:
+        _compactar_particiones(limite_dia, resumen)
+
+    # SQLite, o en PostgreSQL los puntos de días sin partición (DEFAULT)
+    dia_sql = db.func.date(UbicacionHistorial.fecha)
+    pares = db.session.query(UbicacionHistorial.conductor_id, dia_sql).filter(
+        UbicacionHistorial.fecha < limite
+    ).group_by(UbicacionHistorial.conductor_id, dia_sql).all()
+    _compactar_pares([(cid, _como_fecha(dia)) for cid, dia in pares], resumen)
+
+    if postgres:
+        with db.engine.begin() as conn:
+            crear_particiones(conn, hoy, hoy + timedelta(days=DIAS_PARTICIONES_ADELANTE))
+    return resumen
+
+
+def aplicar_retencion(hoy=None):
+    """Borrar los recorridos compactados más viejos que RETENCION_DIAS"""
+    hoy = hoy or datetime.utcnow().date()
+    borrados = UbicacionHistorialDia.query.filter(
+        UbicacionHistorialDia.dia < hoy - timedelta(days=RETENCION_DIAS)
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return borrados
+
+
+# ==================== LECTURA ====================
+
+def recorrido(conductor_id, desde, hasta):
+    """Puntos [lat, lng, fecha] del conductor entre desde y hasta, en orden.
+
+    Los días ya compactados salen de una fila de ubicacion_historial_dia;
+    el resto, de un rango del índice (conductor_id, fecha) de los crudos.
+    """
+    puntos = {}
+    for fila in UbicacionHistorialDia.query.filter(
+        UbicacionHistorialDia.conductor_id == conductor_id,
+        UbicacionHistorialDia.dia >= desde.date(),
+        UbicacionHistorialDia.dia <= hasta.date()
+    ):
+        for lat, lng, t in json.loads(fila.puntos):
+            puntos[t] = (lat, lng, t)
+
+    for lat, lng, fecha in db.session.query(
+        UbicacionHistorial.lat, UbicacionHistorial.lng, UbicacionHistorial.fecha
+    ).filter(
+        UbicacionHistorial.conductor_id == conductor_id,
+        UbicacionHistorial.fecha >= desde,
+        UbicacionHistorial.fecha <= hasta
+    ):
+        t = a_epoch(fecha)
+        puntos[t] = (lat, lng, t)
+
+    inicio, fin = a_epoch(desde), a_epoch(hasta)
+    return [[lat, lng, desde_epoch(t)] for lat, lng, t in (puntos[k] for k in sorted(puntos)) if inicio <= t <= fin]
+
+
+# ==================== MANTENIMIENTO ====================
+
+class MantenimientoHistorial:
+    """Hilo por proceso que compacta y aplica la retención cada hora"""
+
+    def __init__(self):
+        self._hilo = None
+        self._pid = None
+
+    def iniciar(self):
+        if self._hilo is not None and self._hilo.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._hilo = threading.Thread(target=self._bucle, name='historial-mantenimiento', daemon=True)
+        self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            try:
+                self.ejecutar()
+            except Exception as e:
+                app.logger.warning('Error en mantenimiento del historial GPS: %s', e)
+            time.sleep(INTERVALO_MANTENIMIENTO)
+
+    def ejecutar(self):
+        with app.app_context():
+            try:
+                resumen = compactar()
+                resumen['recorridos_borrados'] = aplicar_retencion()
+                return resumen
+            except Exception:
+                db.session.rollback()
+                raise
+
+
+mantenimiento_historial = MantenimientoHistorial()
+
+
+if __name__ == '__main__':
+    inicio = time.perf_counter()
+    resumen = mantenimiento_historial.ejecutar()
+    print(f'✅ Historial GPS: {resumen} en {time.perf_counter() - inicio:.1f} s')
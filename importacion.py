@@ -0,0 +1,252 @@
+"""
+Importación masiva de estudiantes (con sus padres y rutas) desde un CSV.
+
+El flujo es validar -> resolver -> insertar:
+
+1. leer_csv() decodifica el archivo (UTF-8 con o sin BOM, o Latin-1;
+   separador coma o punto y coma) y normaliza los encabezados.
+2. preparar() valida cada fila igual que el formulario de agregar_estudiante
+   y resuelve las claves naturales en bloque: padres por email, rutas por
+   nombre y duplicados por (nombre, grado, escuela, padre) con una consulta
+   por tipo, no una por fila. Las filas con problemas se devuelven aparte
+   con su número de línea y no detienen al resto.
+3. insertar() crea los padres nuevos, los estudiantes y su primer pago con
+   INSERT multi-fila. El monto y el vencimiento del pago los pasa quien
+   llama (los mismos de agregar_estudiante en app.py). No hace commit: quien
+   llama agrega las notificaciones y confirma todo en una sola transacción.
+
+Columnas (los encabezados no distinguen mayúsculas ni acentos):
+    nombre, edad, grado, genero                         obligatorias
+    escuela, condicion, parada_lat, parada_lng, orden_parada
+    ruta                                                nombre de una ruta existente
+    padre_email                                         padre existente o nuevo
+    padre_nombre, padre_password, padre_telefono        para crear el padre si no existe
+"""
+
+import csv
+import io
+import unicodedata
+from datetime import datetime
+
+from sqlalchemy import func, insert
+
+from database import db, Usuario, Estudiante, Ruta, Pago
+
+MAX_FILAS = 5000
+GENEROS = ('masculino', 'femenino')
+OBLIGATORIAS = ('nombre', 'edad', 'grado', 'genero')
+
+
+def _clave_encabezado(texto):
+    sin_acentos = unicodedata.normalize('NFKD', texto or '').encode('ascii', 'ignore').decode()
+    return sin_acentos.strip().lower().replace(' ', '_')
+
+
+def leer_csv(datos):
+    """Lista de (número de línea, dict) a partir de los bytes del archivo"""
+    try:
+        texto = datos.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        texto = datos.decode('latin-1')
+    primera = texto.split('\n', 1)[0]
+    separador = ';' if primera.count(';') > primera.count(',') else ','
+    lector = csv.reader(io.StringIO(texto), delimiter=separador)
+    encabezados = [_clave_encabezado(h) for h in next(lector, [])]
+    faltantes = [c for c in OBLIGATORIAS if c not in encabezados]
+    if faltantes:
+        raise ValueError(f'Faltan columnas obligatorias: {", ".join(faltantes)}')
+
+    filas = []
+    for fila in lector:
+        if not any(v.strip() for v in fila):
+            continue
+        if len(filas) >= MAX_FILAS:
+            raise ValueError(f'El archivo supera el máximo de {MAX_FILAS} estudiantes')
+        filas.append((lector.line_num, {h: (v or '').strip() for h, v in zip(encabezados, fila)}))
+    if not filas:
+        raise ValueError('El archivo no tiene estudiantes')
+    return filas
+
+
+def _validar(fila):
+    """Estudiante (dict de columnas) a partir de la fila; ValueError si no es válida"""
+    faltantes = [c for c in OBLIGATORIAS if not fila.get(c)]
+    if faltantes:
+        raise ValueError(f'Falta {", ".join(faltantes)}')
+    try:
+        edad = int(fila['edad'])
+    except ValueError:
+        raise ValueError('Edad inválida')
+    genero = fila['genero'].lower()
+    if genero not in GENEROS:
+        raise ValueError('Género inválido (masculino o femenino)')
+
+    lat, lng = fila.get('parada_lat'), fila.get('parada_lng')
+    if lat or lng:
+        try:
+            lat, lng = float(lat), float(lng)
+        except (TypeError, ValueError):
+            raise ValueError('Coordenadas de parada inválidas')
+        if not (-90.0 <= lat <= 90.0) or not (-180.0 <= lng <= 180.0):
+            raise ValueError('Coordenadas de parada fuera de rango')
+    else:
+        lat = lng = None
+
+    orden = fila.get('orden_parada')
+    if orden:
+        try:
+            orden = int(orden)
+        except ValueError:
+            orden = 0
+        if orden < 1:
+            raise ValueError('Orden de parada inválido')
+
+    return {
+        'nombre': fila['nombre'],
+        'edad': edad,
+        'genero': genero,
+        'grado': fila['grado'],
+        'escuela': fila.get('escuela', ''),
+        'condicion': fila.get('condicion', ''),
+        'parada_lat': lat,
+        'parada_lng': lng,
+        'orden_parada': orden or None,
+    }
+
+
+def _buscar_padres(emails):
+    if not emails:
+        return {}
+    padres = db.session.execute(
+        db.select(func.lower(Usuario.email), Usuario.id, Usuario.rol)
+        .where(func.lower(Usuario.email).in_(emails))
+    ).all()
+    return {email: (uid, rol) for email, uid, rol in padres}
+
+
+def _buscar_rutas(nombres):
+    if not nombres:
+        return {}
+    rutas = {}
+    for nombre, ruta_id in db.session.execute(
+        db.select(func.lower(Ruta.nombre), Ruta.id).where(func.lower(Ruta.nombre).in_(nombres))
+    ):
+        rutas.setdefault(nombre, []).append(ruta_id)
+    return rutas
+
+
+def _existentes(nombres):
+    """Claves (nombre, grado, escuela, padre_id) de estudiantes ya registrados"""
+    if not nombres:
+        return set()
+    return set(db.session.execute(
+        db.select(Estudiante.nombre, Estudiante.grado, Estudiante.escuela, Estudiante.padre_id)
+        .where(Estudiante.nombre.in_(nombres))
+    ).all())
+
+
+def preparar(filas):
+    """Validar y resolver las filas de leer_csv().
+
+    Devuelve (estudiantes, padres_nuevos, errores). Cada estudiante lleva
+    `padre_id` o `padre_email` (si el padre se crea en esta importación) y
+    `ruta_id`; los errores son dicts {'fila', 'nombre', 'error'}.
+    """
+    emails = {f['padre_email'].lower() for _, f in filas if f.get('padre_email')}
+    nombres_ruta = {f['ruta'].lower() for _, f in filas if f.get('ruta')}
+    padres = _buscar_padres(emails)
+    rutas = _buscar_rutas(nombres_ruta)
+    existentes = _existentes({f['nombre'] for _, f in filas if f.get('nombre')})
+
+    estudiantes, padres_nuevos, errores, vistos = [], {}, [], set()
+    for linea, fila in filas:
+        try:
+            estudiante = _validar(fila)
+
+            email = fila.get('padre_email', '').lower()
+            estudiante['padre_id'] = None
+            if email in padres:
+                padre_id, rol = padres[email]
+                if rol != 'padre':
+                    raise ValueError(f'{email} no es una cuenta de padre')
+                estudiante['padre_id'] = padre_id
+            elif email:
+                if email not in padres_nuevos:
+                    if not fila.get('padre_nombre') or not fila.get('padre_password'):
+                        raise ValueError(f'Padre {email} no registrado (indique padre_nombre y padre_password para crearlo)')
+                    padres_nuevos[email] = {
+                        'nombre': fila['padre_nombre'],
+                        'email': email,
+                        'password': fila['padre_password'],
+                        'telefono': fila.get('padre_telefono', ''),
+                    }
+                estudiante['padre_email'] = email
+
+            estudiante['ruta_id'] = None
+            if fila.get('ruta'):
+                candidatas = rutas.get(fila['ruta'].lower(), [])
+                if not candidatas:
+                    raise ValueError(f'Ruta "{fila["ruta"]}" no encontrada')
+                if len(candidatas) > 1:
+                    raise ValueError(f'Hay varias rutas llamadas "{fila["ruta"]}"')
+                estudiante['ruta_id'] = candidatas[0]
+
+            clave = (estudiante['nombre'], estudiante['grado'], estudiante['escuela'],
+                     estudiante['padre_id'] if estudiante['padre_id'] else email or None)
+            if clave in vistos:
+                raise ValueError('Estudiante repetido en el archivo')
+            if estudiante['padre_id'] or not email:
+                if clave in existentes:
+                    raise ValueError('Estudiante ya existe con los mismos datos')
+            vistos.add(clave)
+            estudiantes.append(estudiante)
+        except ValueError as e:
+            errores.append({'fila': linea, 'nombre': fila.get('nombre', ''), 'error': str(e)})
+
+    # No crear padres cuyos hijos fallaron todos
+    usados = {e['padre_email'] for e in estudiantes if e.get('padre_email')}
+    return estudiantes, [p for email, p in padres_nuevos.items() if email in usados], errores
+
+
+def insertar(estudiantes, padres_nuevos, monto, vencimiento):
+    """Insertar padres nuevos, estudiantes y su primer pago. No hace commit.
+
+    Devuelve {padre_id: [nombres de hijos]} para las notificaciones.
+    """
+    ahora = datetime.utcnow()
+    ids_padres = {}
+    if padres_nuevos:
+        # Los crea el admin, así que entran aprobados
+        filas = db.session.execute(
+            insert(Usuario).returning(Usuario.id, Usuario.email),
+            [dict(p, rol='padre', activo=True, fecha_registro=ahora, notificaciones_sin_leer=0) for p in padres_nuevos]
+        ).all()
+        ids_padres = {email: uid for uid, email in filas}
+
+    for estudiante in estudiantes:
+        email = estudiante.pop('padre_email', None)
+        if email:
+            estudiante['padre_id'] = ids_padres[email]
+        estudiante['fecha_inscripcion'] = ahora
+        estudiante['activo'] = True
+
+    ids = db.session.execute(
+        insert(Estudiante).returning(Estudiante.id),
+        estudiantes
+    ).scalars().all()
+
+    db.session.execute(Pago.__table__.insert(), [{
+        'estudiante_id': estudiante_id,
+        'monto': monto,
+        'fecha_vencimiento': vencimiento,
+        'estado': 'pendiente',
+        'meses_cubiertos': 1,
+        'fecha_creacion': ahora,
+        'visto_padre': False,
+    } for estudiante_id in ids])
+
+    hijos = {}
+    for estudiante in estudiantes:
+        if estudiante['padre_id']:
+            hijos.setdefault(estudiante['padre_id'], []).append(estudiante['nombre'])
+    return hijos
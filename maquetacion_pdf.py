@@ -0,0 +1,261 @@
+"""
+Escritura de PDF por partes y maquetación de páginas, sin acceso a la base.
+
+EscritorPDF produce el archivo en orden (iniciar(), pagina() por cada
+página, cerrar()) y Maquetador coloca renglones y tablas cortando páginas.
+reportes.py arma con esto los reportes a partir de la base de datos.
+
+Este módulo solo importa reportlab (métricas de las fuentes) y zlib: es lo
+único que cargan los procesos del pool de reportes.reporte_asistencia_lote,
+que reciben y devuelven datos simples (paginas_asistencia).
+"""
+
+import zlib
+
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+MARGEN = 50
+ALTO_FILA = 14
+
+# estilo -> (recurso en la página, fuente base, número de objeto)
+FUENTES = {
+    'normal': ('F1', 'Helvetica', 3),
+    'negrita': ('F2', 'Helvetica-Bold', 4),
+}
+PRIMER_OBJETO_LIBRE = 5
+
+
+def _literal(texto):
+    """Cadena literal PDF en WinAnsi (cp1252)"""
+    datos = ' '.join(str(texto).split()).encode('cp1252', 'replace')
+    return b'(' + datos.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+def _recortar(texto, ancho, fuente, tamano):
+    """Acortar `texto` con '...' hasta que quepa en `ancho` puntos"""
+    texto = ' '.join(str(texto).split())
+    if stringWidth(texto, fuente, tamano) <= ancho:
+        return texto
+    while texto and stringWidth(texto + '...', fuente, tamano) > ancho:
+        texto = texto[:-1]
+    return texto + '...'
+
+
+class Pagina:
+    """Flujo de contenido de una página; coordenadas en puntos desde abajo a la izquierda"""
+
+    def __init__(self):
+        self._ops = []
+
+    def texto(self, x, y, texto, tamano=9, estilo='normal', alinear='izquierda', ancho=None):
+        recurso, fuente, _ = FUENTES[estilo]
+        if ancho is not None:
+            texto = _recortar(texto, ancho, fuente, tamano)
+        if alinear == 'derecha':
+            x -= stringWidth(str(texto), fuente, tamano)
+        elif alinear == 'centro':
+            x -= stringWidth(str(texto), fuente, tamano) / 2
+        self._ops.append(b'BT /%s %d Tf %.2f %.2f Td %s Tj ET' % (
+            recurso.encode(), tamano, x, y, _literal(texto)))
+
+    def linea(self, x1, y1, x2, y2, grosor=0.5):
+        self._ops.append(b'%.2f w %.2f %.2f m %.2f %.2f l S' % (grosor, x1, y1, x2, y2))
+
+    def rectangulo(self, x, y, ancho, alto, gris=0.85):
+        self._ops.append(b'%.2f g %.2f %.2f %.2f %.2f re f 0 g' % (gris, x, y, ancho, alto))
+
+    def contenido(self):
+        return b'\n'.join(self._ops)
+
+
+class EscritorPDF:
+    """PDF que se produce en orden: iniciar(), pagina() por cada página, cerrar().
+
+    El catálogo (1) y las fuentes se escriben al inicio; el árbol de páginas
+    (2) se reserva y se escribe al cerrar, cuando ya se conocen sus hijas.
+    """
+
+    def __init__(self, tamano=letter):
+        self.ancho, self.alto = tamano
+        self._posicion = 0
+        self._offsets = [0] * PRIMER_OBJETO_LIBRE
+        self._paginas = []
+
+    def _objeto(self, numero, cuerpo):
+        if numero == len(self._offsets):
+            self._offsets.append(self._posicion)
+        else:
+            self._offsets[numero] = self._posicion
+        datos = b'%d 0 obj\n%s\nendobj\n' % (numero, cuerpo)
+        self._posicion += len(datos)
+        return datos
+
+    def iniciar(self):
+        cabecera = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+        self._posicion = len(cabecera)
+        partes = [cabecera, self._objeto(1, b'<< /Type /Catalog /Pages 2 0 R >>')]
+        for _, fuente, numero in FUENTES.values():
+            partes.append(self._objeto(
+                numero, b'<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>' % fuente.encode()))
+        return b''.join(partes)
+
+    def pagina(self, pagina):
+        return self.pagina_comprimida(zlib.compress(pagina.contenido()))
+
+    def pagina_comprimida(self, flujo):
+        """Agregar una página cuyo flujo de contenido ya viene comprimido (zlib)"""
+        contenido = len(self._offsets)
+        datos = self._objeto(contenido, b'<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream' % (
+            len(flujo), flujo))
+        fuentes = b' '.join(b'/%s %d 0 R' % (r.encode(), n) for r, _, n in FUENTES.values())
+        self._paginas.append(contenido + 1)
+        return datos + self._objeto(contenido + 1, (
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.2f %.2f] '
+            b'/Resources << /Font << %s >> >> /Contents %d 0 R >>' % (self.ancho, self.alto, fuentes, contenido)))
+
+    def cerrar(self):
+        hijas = b' '.join(b'%d 0 R' % p for p in self._paginas)
+        datos = self._objeto(2, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (hijas, len(self._paginas)))
+        inicio_xref = self._posicion
+        xref = [b'xref\n0 %d\n0000000000 65535 f \n' % len(self._offsets)]
+        xref.extend(b'%010d 00000 n \n' % offset for offset in self._offsets[1:])
+        return datos + b''.join(xref) + b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (
+            len(self._offsets), inicio_xref)
+
+
+class ColectorPaginas(EscritorPDF):
+    """En lugar de escribir un PDF, devuelve el flujo comprimido de cada página.
+
+    Permite maquetar en otro proceso y después pasar las páginas a un
+    EscritorPDF con pagina_comprimida(), en un documento propio o en uno
+    combinado.
+    """
+
+    def iniciar(self):
+        return b''
+
+    def pagina(self, pagina):
+        return zlib.compress(pagina.contenido())
+
+    def cerrar(self):
+        return b''
+
+
+class Maquetador:
+    """Coloca renglones de arriba hacia abajo y corta páginas.
+
+    Las páginas terminadas quedan en espera hasta vaciar(); el generador del
+    reporte las entrega después de cada lote, así nunca hay más de un lote
+    de páginas en memoria.
+    """
+
+    def __init__(self, titulo, pdf=None):
+        self.pdf = pdf or EscritorPDF()
+        self.titulo = titulo
+        self.numero = 0
+        self.columnas = None  # [(título, ancho, alinear)] de la tabla en curso
+        self._listas = [self.pdf.iniciar()]
+        self._nueva_pagina()
+
+    @property
+    def ancho_util(self):
+        return self.pdf.ancho - 2 * MARGEN
+
+    def _nueva_pagina(self):
+        self.numero += 1
+        self.pagina = Pagina()
+        self.y = self.pdf.alto - MARGEN
+        if self.numero > 1:
+            self.pagina.texto(MARGEN, self.y, self.titulo, 8)
+            self.y -= ALTO_FILA * 1.5
+            if self.columnas:
+                self._encabezado_tabla()
+
+    def _terminar_pagina(self):
+        self.pagina.texto(self.pdf.ancho / 2, MARGEN / 2, f'Página {self.numero}', 8, alinear='centro')
+        self._listas.append(self.pdf.pagina(self.pagina))
+
+    def espacio(self, alto):
+        """Asegurar `alto` puntos libres, cortando página si hace falta"""
+        if self.y - alto < MARGEN:
+            self._terminar_pagina()
+            self._nueva_pagina()
+
+    def parrafo(self, texto, tamano=10, estilo='normal', separacion=4):
+        self.espacio(tamano + separacion)
+        self.y -= tamano + separacion
+        self.pagina.texto(MARGEN, self.y, texto, tamano, estilo, ancho=self.ancho_util)
+
+    def _encabezado_tabla(self):
+        self.y -= ALTO_FILA
+        self.pagina.rectangulo(MARGEN, self.y - 4, self.ancho_util, ALTO_FILA)
+        self._celdas([titulo for titulo, _, _ in self.columnas], 'negrita')
+
+    def _celdas(self, valores, estilo='normal'):
+        x = MARGEN
+        for valor, (_, ancho, alinear) in zip(valores, self.columnas):
+            if valor == '':
+                x += ancho
+                continue
+            if alinear == 'derecha':
+                self.pagina.texto(x + ancho - 4, self.y, valor, 9, estilo, 'derecha')
+            else:
+                self.pagina.texto(x + 4, self.y, valor, 9, estilo, ancho=ancho - 8)
+            x += ancho
+
+    def tabla(self, columnas):
+        """Empezar una tabla; su encabezado se repite en cada página nueva"""
+        self.columnas = columnas
+        self.espacio(ALTO_FILA * 2)
+        self._encabezado_tabla()
+
+    def fila(self, valores, estilo='normal'):
+        self.espacio(ALTO_FILA)
+        self.y -= ALTO_FILA
+        self._celdas(valores, estilo)
+
+    def fin_tabla(self):
+        self.pagina.linea(MARGEN, self.y - 4, MARGEN + self.ancho_util, self.y - 4)
+        self.columnas = None
+        self.y -= ALTO_FILA
+
+    def vaciar(self):
+        listas, self._listas = self._listas, []
+        return listas
+
+    def cerrar(self):
+        self._terminar_pagina()
+        return self.vaciar() + [self.pdf.cerrar()]
+
+
+def maquetar_asistencia(maq, nombre, fecha, filas):
+    """filas: [(estudiante, estado, hora 'HH:MM' o None, observaciones)]"""
+    presentes = sum(1 for f in filas if f[1] == 'presente')
+    ausentes = sum(1 for f in filas if f[1] == 'ausente')
+    tardanzas = sum(1 for f in filas if f[1] == 'tardanza')
+
+    maq.parrafo(f'Reporte de Asistencia - {nombre}', 16, 'negrita')
+    maq.parrafo(f'Fecha: {fecha:%d/%m/%Y}', separacion=10)
+    maq.parrafo(f'Resumen: Presentes {presentes} | Ausentes {ausentes} | Tardanzas {tardanzas}', separacion=6)
+    maq.y -= ALTO_FILA
+    maq.tabla([('Estudiante', 180, 'izquierda'), ('Estado', 80, 'izquierda'),
+               ('Hora', 60, 'izquierda'), ('Observaciones', 192, 'izquierda')])
+    for estudiante, estado, hora, observaciones in filas:
+        maq.fila([estudiante, estado or '-', hora or '-', observaciones or ''])
+    if not filas:
+        maq.fila(['Sin asistencias registradas', '', '', ''])
+    maq.fin_tabla()
+
+
+def paginas_asistencia(reportes_tarea):
+    """[(nombre, fecha, filas)] -> páginas comprimidas de cada reporte.
+
+    Corre en los procesos del pool: recibe y devuelve solo datos simples.
+    """
+    resultado = []
+    for nombre, fecha, filas in reportes_tarea:
+        maq = Maquetador(f'Reporte de Asistencia - {nombre} - {fecha:%d/%m/%Y}', ColectorPaginas())
+        maquetar_asistencia(maq, nombre, fecha, filas)
+        resultado.append([p for p in maq.cerrar() if p])
+    return resultado
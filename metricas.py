@@ -0,0 +1,134 @@
+"""
+Métricas por endpoint: cantidad de consultas SQL, tiempo en SQL, tiempo de
+render de plantillas, tamaño de la respuesta y latencia total.
+
+Se activan con METRICAS_ACTIVAS=1. Desactivadas no se registra ningún
+hook, así que no cuestan nada. Activadas, cada petición deja una línea en
+el logger `camley.metricas` y los acumulados se consultan en
+/admin/metricas.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+
+ACTIVAS = os.getenv('METRICAS_ACTIVAS', '0').lower() in ('1', 'true', 'si')
+
+logger = logging.getLogger('camley.metricas')
+
+_acumulado = {}
+_lock = threading.Lock()
+
+
+def _sumar(endpoint, datos):
+    with _lock:
+        m = _acumulado.get(endpoint)
+        if m is None:
+            m = _acumulado[endpoint] = {
+                'peticiones': 0, 'consultas': 0, 'sql_ms': 0.0,
+                'render_ms': 0.0, 'total_ms': 0.0, 'bytes': 0,
+                'max_ms': 0.0, 'max_consultas': 0
+            }
+        m['peticiones'] += 1
+        m['consultas'] += datos['consultas']
+        m['sql_ms'] += datos['sql_ms']
+        m['render_ms'] += datos['render_ms']
+        m['total_ms'] += datos['total_ms']
+        m['bytes'] += datos['bytes']
+        m['max_ms'] = max(m['max_ms'], datos['total_ms'])
+        m['max_consultas'] = max(m['max_consultas'], datos['consultas'])
+
+
+def resumen():
+    """Acumulados por endpoint con promedios, ordenados por tiempo total"""
+    with _lock:
+        copia = {k: dict(v) for k, v in _acumulado.items()}
+    filas = []
+    for endpoint, m in copia.items():
+        n = m['peticiones'] or 1
+        filas.append({
+            'endpoint': endpoint,
+            **{k: round(v, 2) if isinstance(v, float) else v for k, v in m.items()},
+            'consultas_promedio': round(m['consultas'] / n, 2),
+            'sql_ms_promedio': round(m['sql_ms'] / n, 2),
+            'render_ms_promedio': round(m['render_ms'] / n, 2),
+            'total_ms_promedio': round(m['total_ms'] / n, 2),
+            'bytes_promedio': int(m['bytes'] / n)
+        })
+    filas.sort(key=lambda f: f['total_ms'], reverse=True)
+    return filas
+
+
+def reiniciar():
+    with _lock:
+        _acumulado.clear()
+
+
+def instalar_metricas(app, db):
+    """Registrar los hooks de Flask y SQLAlchemy (solo si están activas)"""
+    if not ACTIVAS:
+        return False
+
+    if not logger.handlers:
+        manejador = logging.StreamHandler()
+        manejador.setFormatter(logging.Formatter('%(asctime)s %(name)s %(message)s'))
+        logger.addHandler(manejador)
+    logger.setLevel(logging.INFO)
+
+    with app.app_context():
+        motor = db.engine
+
+    @event.listens_for(motor, 'before_cursor_execute')
+    def _antes_sql(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and 'metricas' in g:
+            conn.info.setdefault('metricas_inicio', []).append(time.perf_counter())
+
+    @event.listens_for(motor, 'after_cursor_execute')
+    def _despues_sql(conn, cursor, statement, parameters, context, executemany):
+        inicios = conn.info.get('metricas_inicio')
+        if not inicios or not has_request_context() or 'metricas' not in g:
+            return
+        g.metricas['consultas'] += 1
+        g.metricas['sql_ms'] += (time.perf_counter() - inicios.pop()) * 1000
+
+    def _antes_render(sender, template, context, **extra):
+        if 'metricas' in g:
+            g.metricas['render_inicio'] = time.perf_counter()
+
+    def _despues_render(sender, template, context, **extra):
+        if 'metricas' in g and g.metricas.get('render_inicio'):
+            g.metricas['render_ms'] += (time.perf_counter() - g.metricas.pop('render_inicio')) * 1000
+
+    before_render_template.connect(_antes_render, app, weak=False)
+    template_rendered.connect(_despues_render, app, weak=False)
+
+    @app.before_request
+    def _iniciar_metricas():
+        g.metricas = {'inicio': time.perf_counter(), 'consultas': 0, 'sql_ms': 0.0, 'render_ms': 0.0}
+
+    @app.after_request
+    def _registrar_metricas(response):
+        m = g.pop('metricas', None)
+        if m is None:
+            return response
+        datos = {
+            'consultas': m['consultas'],
+            'sql_ms': m['sql_ms'],
+            'render_ms': m['render_ms'],
+            'total_ms': (time.perf_counter() - m['inicio']) * 1000,
+            'bytes': 0 if response.is_streamed else (response.calculate_content_length() or 0)
+        }
+        endpoint = request.endpoint or 'desconocido'
+        _sumar(endpoint, datos)
+        logger.info(
+            'endpoint=%s status=%s total_ms=%.1f sql=%d sql_ms=%.1f render_ms=%.1f bytes=%d',
+            endpoint, response.status_code, datos['total_ms'], datos['consultas'],
+            datos['sql_ms'], datos['render_ms'], datos['bytes']
+        )
+        return response
+
+    return True
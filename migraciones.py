@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Migraciones versionadas del esquema.
+
+db.create_all() crea las tablas que faltan pero nunca modifica las que ya
+existen: no agrega columnas ni índices. Cada cambio sobre tablas existentes
+se escribe aquí como una migración numerada; se aplica una sola vez, en
+orden, y queda registrada en la tabla `esquema_version`.
+
+Las migraciones deben ser idempotentes: en una base recién creada por
+create_all() el cambio ya existe (los modelos lo declaran) y solo se
+registra la versión. Por eso las columnas se revisan antes del ALTER TABLE
+y los índices usan CREATE INDEX IF NOT EXISTS.
+
+Para agregar un cambio: declararlo en el modelo de database.py y añadir al
+final de MIGRACIONES una entrada con el siguiente número de versión.
+
+Uso:
+    python migraciones.py            # aplicar las pendientes
+    python migraciones.py --estado   # listar aplicadas y pendientes
+"""
+
+import argparse
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from database import app, db, EsquemaVersion, ResumenFinanzasDia
+from finanzas import recalcular as recalcular_resumen_finanzas
+from historial_gps import particionar_historial
+
+# Clave del advisory lock de PostgreSQL que serializa a los workers que
+# arrancan a la vez. En SQLite el empate lo resuelve la clave primaria de
+# esquema_version (ver el except en aplicar_migraciones).
+CLAVE_BLOQUEO = 4711
+
+
+def _agregar_columna(conn, tabla, columna, tipo, relleno=None, parametros=None):
+    existentes = {c['name'] for c in db.inspect(conn).get_columns(tabla)}
+    if columna in existentes:
+        return
+    conn.execute(db.text(f'ALTER TABLE {tabla} ADD COLUMN {columna} {tipo}'))
+    if relleno:
+        conn.execute(db.text(relleno), parametros or {})
+
+
+def _crear_indices(indices):
+    def migrar(conn):
+        for nombre, tabla, columnas in indices:
+            conn.execute(db.text(
+                f'CREATE INDEX IF NOT EXISTS {nombre} ON {tabla} ({", ".join(columnas)})'
+            ))
+    return migrar
+
+
+def _columnas_push_y_contador(conn):
+    _agregar_columna(conn, 'push_subscription', 'fallos_consecutivos', 'INTEGER DEFAULT 0')
+    _agregar_columna(conn, 'push_subscription', 'ultimo_fallo', 'TIMESTAMP')
+    _agregar_columna(
+        conn, 'usuario', 'notificaciones_sin_leer', 'INTEGER NOT NULL DEFAULT 0',
+        'UPDATE usuario SET notificaciones_sin_leer = ('
+        'SELECT COUNT(*) FROM notificacion '
+        'WHERE notificacion.usuario_id = usuario.id AND notificacion.leida = :falso)',
+        {'falso': False}
+    )
+
+
+def _columnas_parada_estudiante(conn):
+    _agregar_columna(conn, 'estudiante', 'parada_lat', 'FLOAT')
+    _agregar_columna(conn, 'estudiante', 'parada_lng', 'FLOAT')
+
+
+def _columna_orden_parada(conn):
+    _agregar_columna(conn, 'estudiante', 'orden_parada', 'INTEGER')
+
+
+def _columna_actualizado_asistencia(conn):
+    _agregar_columna(conn, 'asistencia', 'actualizado', 'TIMESTAMP')
+
+
+def _resumen_finanzas(conn):
+    # Por si se aplica sin un create_all() previo
+    ResumenFinanzasDia.__table__.create(bind=conn, checkfirst=True)
+    recalcular_resumen_finanzas(conn)
+
+
+# (nombre, tabla, columnas); deben coincidir con los declarados en los modelos
+INDICES_PAGINACION = [
+    ('ix_notificacion_usuario_fecha_id', 'notificacion', ['usuario_id', 'fecha', 'id']),
+    ('ix_pago_vencimiento_id', 'pago', ['fecha_vencimiento', 'id']),
+    ('ix_pago_estado_vencimiento_id', 'pago', ['estado', 'fecha_vencimiento', 'id']),
+    ('ix_pago_estudiante_vencimiento_id', 'pago', ['estudiante_id', 'fecha_vencimiento', 'id']),
+    ('ix_asistencia_fecha_id', 'asistencia', ['fecha', 'id']),
+    ('ix_ticket_soporte_fecha_id', 'ticket_soporte', ['fecha', 'id']),
+    ('ix_ticket_soporte_conductor_fecha_id', 'ticket_soporte', ['conductor_id', 'fecha', 'id']),
+]
+
+INDICES_BUSQUEDAS = [
+    ('ix_notificacion_usuario_leida_fecha', 'notificacion', ['usuario_id', 'leida', 'fecha']),
+    ('ix_pago_estudiante_estado_vencimiento', 'pago', ['estudiante_id', 'estado', 'fecha_vencimiento']),
+    ('ix_asistencia_estudiante_fecha', 'asistencia', ['estudiante_id', 'fecha']),
+    ('ix_asistencia_conductor_fecha', 'asistencia', ['conductor_id', 'fecha']),
+    ('ix_ubicacion_historial_conductor_fecha', 'ubicacion_historial', ['conductor_id', 'fecha']),
+    ('ix_ruta_conductor_id', 'ruta', ['conductor_id']),
+    ('ix_estudiante_padre_id', 'estudiante', ['padre_id']),
+    ('ix_estudiante_ruta_id', 'estudiante', ['ruta_id']),
+]
+
+INDICES_DASHBOARD = [
+    ('ix_usuario_rol_activo', 'usuario', ['rol', 'activo']),
+    ('ix_pago_fecha_creacion_id', 'pago', ['fecha_creacion', 'id']),
+]
+
+INDICES_REPORTES = [
+    ('ix_ingreso_fecha_id', 'ingreso', ['fecha', 'id']),
+    ('ix_gasto_fecha_id', 'gasto', ['fecha', 'id']),
+]
+
+# (versión, descripción, función que recibe la conexión)
+MIGRACIONES = [
+    (1, 'Estado de suscripciones push y contador de no leídas', _columnas_push_y_contador),
+    (2, 'Índices para paginación por (fecha, id)', _crear_indices(INDICES_PAGINACION)),
+    (3, 'Índices de búsquedas frecuentes por FK y fecha', _crear_indices(INDICES_BUSQUEDAS)),
+    (4, 'Historial GPS particionado por día (solo PostgreSQL)', particionar_historial),
+    (5, 'Coordenadas de la parada de cada estudiante', _columnas_parada_estudiante),
+    (6, 'Orden de la parada dentro de la ruta', _columna_orden_parada),
+    (7, 'Resumen diario de ingresos y gastos', _resumen_finanzas),
+    (8, 'Índices de los contadores del dashboard', _crear_indices(INDICES_DASHBOARD)),
+    (9, 'Índices del reporte de finanzas por lotes', _crear_indices(INDICES_REPORTES)),
+    (10, 'Fecha de última modificación de cada asistencia', _columna_actualizado_asistencia),
+]
+
+
+def versiones_aplicadas(conn):
+    return {v for (v,) in conn.execute(db.select(EsquemaVersion.version))}
+
+
+def aplicar_migraciones():
+    """Aplicar en orden las migraciones pendientes; devuelve las versiones aplicadas"""
+    EsquemaVersion.__table__.create(bind=db.engine, checkfirst=True)
+    aplicadas = []
+    for version, descripcion, migrar in MIGRACIONES:
+        try:
+            with db.engine.begin() as conn:
+                if conn.dialect.name == 'postgresql':
+                    conn.execute(db.text('SELECT pg_advisory_xact_lock(:clave)'), {'clave': CLAVE_BLOQUEO})
+                # Releer dentro de la transacción: otro worker pudo aplicarla
+                if version in versiones_aplicadas(conn):
+                    continue
+                migrar(conn)
+                conn.execute(EsquemaVersion.__table__.insert().values(
+                    version=version, descripcion=descripcion, aplicada_en=datetime.utcnow()
+                ))
+        except IntegrityError:
+            # Sin advisory lock (SQLite) otro proceso la registró primero
+            with db.engine.connect() as conn:
+                if version not in versiones_aplicadas(conn):
+                    raise
+            continue
+        aplicadas.append(version)
+    return aplicadas
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Migraciones del esquema de Camley')
+    parser.add_argument('--estado', action='store_true', help='solo listar el estado')
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.estado:
+            EsquemaVersion.__table__.create(bind=db.engine, checkfirst=True)
+            with db.engine.connect() as conn:
+                hechas = versiones_aplicadas(conn)
+            for version, descripcion, _ in MIGRACIONES:
+                marca = '✅' if version in hechas else '⏳'
+                print(f'{marca} {version:03d} {descripcion}')
+            return
+
+        db.create_all()
+        aplicadas = aplicar_migraciones()
+        if aplicadas:
+            print(f'✅ Migraciones aplicadas: {", ".join(map(str, aplicadas))}')
+        else:
+            print('✅ El esquema ya está al día')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,390 @@
+"""
+Envío de notificaciones Web Push fuera del ciclo de la petición.
+
+`encolar_push` solo agrega una fila a la tabla `push_pendiente` dentro de la
+transacción actual. Un hilo despachador por proceso toma las filas
+pendientes, reparte los envíos a `pywebpush.webpush` en un pool de hilos y
+reintenta con backoff exponencial las suscripciones que fallan.
+
+Los fallos se clasifican por código HTTP: 404/410 significan que la
+suscripción ya no existe y se elimina; 400/413 rechazan ese mensaje sin
+reintentarlo; el resto (429, 5xx, red) se reintenta. Cada suscripción lleva
+su cuenta de fallos consecutivos: tras UMBRAL_PAUSA se salta durante
+PAUSA_SUSCRIPCION y al llegar a MAX_FALLOS_SUSCRIPCION se elimina. Si faltan
+las claves VAPID el fallo es del servidor, no de la suscripción: el
+despachador no reclama trabajos y estos esperan pendientes a que se
+configuren, sin tocar ninguna suscripción.
+
+Varios workers pueden despachar a la vez: cada uno reclama filas con un
+UPDATE condicional (estado + token en `bloqueado_por`), y si un proceso
+muere a mitad de un envío la fila se libera al vencer `bloqueado_hasta`.
+Antes de enviar, el bloqueo se alarga según la cantidad de envíos de la
+pasada (duracion_bloqueo), así una pasada lenta no deja que otro worker
+reclame y reenvíe los mismos trabajos; al terminar solo se actualizan las
+filas que siguen bloqueadas con el token propio.
+
+Variables de entorno:
+    VAPID_PUBLIC_KEY / VAPID_PRIVATE_KEY / VAPID_EMAIL
+    PUSH_HILOS            envíos concurrentes (8)
+    PUSH_MAX_INTENTOS     intentos antes de marcar 'fallido' (5)
+    PUSH_TIMEOUT          timeout HTTP por envío en segundos (10)
+    PUSH_MAX_FALLOS_SUSCRIPCION  fallos seguidos antes de eliminar (10)
+"""
+
+import json
+import math
+import os
+import random
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from pywebpush import webpush, WebPushException
+
+from database import app, db, PushPendiente, PushSubscription, PushSuscripcionPodada
+
+HILOS = int(os.getenv('PUSH_HILOS', '8'))
+MAX_INTENTOS = int(os.getenv('PUSH_MAX_INTENTOS', '5'))
+TIMEOUT_ENVIO = float(os.getenv('PUSH_TIMEOUT', '10'))
+LOTE_TRABAJOS = 50
+INTERVALO_SONDEO = 15
+DURACION_BLOQUEO = timedelta(minutes=5)
+MARGEN_BLOQUEO = timedelta(minutes=1)
+BACKOFF_BASE = 30
+BACKOFF_MAXIMO = 3600
+RETENCION_ENVIADOS = timedelta(days=7)
+UMBRAL_PAUSA = 3
+PAUSA_SUSCRIPCION = timedelta(hours=6)
+MAX_FALLOS_SUSCRIPCION = int(os.getenv('PUSH_MAX_FALLOS_SUSCRIPCION', '10'))
+CODIGOS_EXPIRADA = {404, 410}
+CODIGOS_RECHAZADA = {400, 413}
+
+
+def credenciales_vapid():
+    """(clave privada, email) o None si Web Push no está configurado"""
+    privada = os.getenv('VAPID_PRIVATE_KEY')
+    if not os.getenv('VAPID_PUBLIC_KEY') or not privada:
+        return None
+    return privada, os.getenv('VAPID_EMAIL', 'mailto:admin@camley.com')
+
+
+def encolar_push(destinatarios, titulo, mensaje, url=None):
+    """Agregar un envío push a la cola. No hace commit.
+
+    Devuelve la fila creada, o None si Web Push no está configurado.
+    """
+    if credenciales_vapid() is None:
+        return None
+    ids = sorted({int(u) for u in destinatarios if u})
+    if not ids:
+        return None
+    trabajo = PushPendiente(
+        destinatarios=json.dumps(ids),
+        titulo=titulo,
+        mensaje=mensaje,
+        url=url,
+        estado='pendiente',
+        intentos=0,
+        proximo_intento=datetime.utcnow()
+    )
+    db.session.add(trabajo)
+    return trabajo
+
+
+def encolar_push_individuales(mensajes, titulo, url=None):
+    """Encolar un push distinto por usuario ({usuario_id: mensaje}) con un solo INSERT.
+
+    No hace commit. Devuelve cuántos envíos se encolaron (0 sin Web Push).
+    """
+    if credenciales_vapid() is None or not mensajes:
+        return 0
+    ahora = datetime.utcnow()
+    db.session.execute(PushPendiente.__table__.insert(), [{
+        'destinatarios': json.dumps([int(usuario_id)]),
+        'titulo': titulo,
+        'mensaje': mensaje,
+        'url': url,
+        'estado': 'pendiente',
+        'intentos': 0,
+        'proximo_intento': ahora,
+        'fecha': ahora
+    } for usuario_id, mensaje in mensajes.items()])
+    return len(mensajes)
+
+
+def duracion_bloqueo(envios):
+    """Lo que puede tardar una pasada con `envios` envíos en el peor caso (cada
+    ronda de HILOS envíos agota el timeout de conexión y el de lectura), con margen"""
+    rondas = math.ceil(envios / HILOS)
+    return timedelta(seconds=rondas * 2 * TIMEOUT_ENVIO) + MARGEN_BLOQUEO
+
+
+def calcular_backoff(intentos):
+    """Segundos de espera antes del siguiente intento (exponencial con jitter)"""
+    espera = min(BACKOFF_MAXIMO, BACKOFF_BASE * (2 ** max(0, intentos - 1)))
+    return espera * random.uniform(0.8, 1.2)
+
+
+def clasificar_fallo(codigo):
+    """'expirada', 'rechazada' o 'transitoria' según el código HTTP"""
+    if codigo in CODIGOS_EXPIRADA:
+        return 'expirada'
+    if codigo in CODIGOS_RECHAZADA:
+        return 'rechazada'
+    return 'transitoria'
+
+
+def enviar_webpush(suscripcion, payload, vapid):
+    """Enviar un push a una suscripción.
+
+    Devuelve None si salió bien o una tupla (código HTTP o None, mensaje).
+    """
+    privada, email = vapid
+    try:
+        webpush(
+            subscription_info={
+                "endpoint": suscripcion['endpoint'],
+                "keys": {
+                    "p256dh": suscripcion['p256dh'],
+                    "auth": suscripcion['auth']
+                }
+            },
+            data=payload,
+            vapid_private_key=privada,
+            vapid_claims={"sub": email},
+            timeout=TIMEOUT_ENVIO
+        )
+        return None
+    except WebPushException as e:
+        codigo = e.response.status_code if e.response is not None else None
+        return codigo, str(e)
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}'
+
+
+def estadisticas_suscripciones():
+    """Conteo de suscripciones activas, en pausa y eliminadas"""
+    limite_pausa = datetime.utcnow() - PAUSA_SUSCRIPCION
+    total = PushSubscription.query.count()
+    en_pausa = PushSubscription.query.filter(
+        PushSubscription.fallos_consecutivos >= UMBRAL_PAUSA,
+        PushSubscription.ultimo_fallo > limite_pausa
+    ).count()
+    podadas = dict(db.session.query(
+        PushSuscripcionPodada.motivo, db.func.count(PushSuscripcionPodada.id)
+    ).group_by(PushSuscripcionPodada.motivo).all())
+    return {
+        'activas': total - en_pausa,
+        'en_pausa': en_pausa,
+        'podadas': sum(podadas.values()),
+        'podadas_por_motivo': podadas
+    }
+
+
+class DespachadorPush:
+    """Hilo que vacía la cola push de este proceso"""
+
+    def __init__(self):
+        self._evento = threading.Event()
+        self._hilo = None
+        self._pid = None
+        self._pool = None
+        self._ultima_limpieza = datetime.min
+
+    def iniciar(self):
+        if self._hilo is not None and self._hilo.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._pool = ThreadPoolExecutor(max_workers=HILOS, thread_name_prefix='push-envio')
+        self._hilo = threading.Thread(target=self._bucle, name='push-despachador', daemon=True)
+        self._hilo.start()
+
+    def despertar(self):
+        """Avisar que hay trabajo nuevo (llamar después del commit)"""
+        self.iniciar()
+        self._evento.set()
+
+    def _bucle(self):
+        while True:
+            self._evento.wait(INTERVALO_SONDEO)
+            self._evento.clear()
+            try:
+                while self.procesar_pendientes() == LOTE_TRABAJOS:
+                    pass
+            except Exception as e:
+                app.logger.warning('Error despachando push: %s', e)
+
+    def _reclamar(self, ahora):
+        """Bloquear hasta LOTE_TRABAJOS filas para este proceso; devuelve (token, filas)"""
+        token = uuid.uuid4().hex
+        disponibles = db.or_(
+            db.and_(PushPendiente.estado == 'pendiente', PushPendiente.proximo_intento <= ahora),
+            db.and_(PushPendiente.estado == 'enviando', PushPendiente.bloqueado_hasta < ahora)
+        )
+        ids = [fila[0] for fila in db.session.query(PushPendiente.id).filter(disponibles)
+               .order_by(PushPendiente.proximo_intento).limit(LOTE_TRABAJOS).all()]
+        if not ids:
+            return token, []
+        PushPendiente.query.filter(PushPendiente.id.in_(ids), disponibles).update({
+            'estado': 'enviando',
+            'bloqueado_por': token,
+            'bloqueado_hasta': ahora + DURACION_BLOQUEO
+        }, synchronize_session=False)
+        db.session.commit()
+        return token, PushPendiente.query.filter_by(bloqueado_por=token, estado='enviando').all()
+
+    def _alargar_bloqueo(self, token, envios):
+        """Extender el bloqueo de las filas del token a lo que pueden tardar `envios` envíos"""
+        duracion = duracion_bloqueo(envios)
+        if duracion <= DURACION_BLOQUEO:
+            return
+        PushPendiente.query.filter_by(bloqueado_por=token, estado='enviando').update({
+            'bloqueado_hasta': datetime.utcnow() + duracion
+        }, synchronize_session=False)
+        db.session.commit()
+
+    def procesar_pendientes(self):
+        """Hacer una pasada sobre la cola. Devuelve cuántos trabajos tomó."""
+        vapid = credenciales_vapid()
+        with app.app_context():
+            ahora = datetime.utcnow()
+            if vapid is None:
+                self._limpiar(ahora)
+                return 0
+            token, trabajos = self._reclamar(ahora)
+            if not trabajos:
+                self._limpiar(ahora)
+                return 0
+
+            usuarios = set()
+            for t in trabajos:
+                usuarios.update(json.loads(t.destinatarios))
+            limite_pausa = ahora - PAUSA_SUSCRIPCION
+            subs_por_usuario = {}
+            for s in PushSubscription.query.filter(PushSubscription.usuario_id.in_(usuarios)).all():
+                en_pausa = (s.fallos_consecutivos or 0) >= UMBRAL_PAUSA and \
+                    s.ultimo_fallo is not None and s.ultimo_fallo > limite_pausa
+                if en_pausa:
+                    continue
+                subs_por_usuario.setdefault(s.usuario_id, []).append({
+                    'id': s.id, 'usuario_id': s.usuario_id, 'endpoint': s.endpoint,
+                    'p256dh': s.p256dh, 'auth': s.auth, 'fallos': s.fallos_consecutivos or 0
+                })
+
+            envios = []
+            for t in trabajos:
+                pendientes = set(json.loads(t.suscripciones)) if t.suscripciones else None
+                payload = json.dumps({'title': t.titulo, 'body': t.mensaje, 'url': t.url or '/'})
+                for uid in json.loads(t.destinatarios):
+                    for sub in subs_por_usuario.get(uid, []):
+                        if pendientes is None or sub['id'] in pendientes:
+                            envios.append((t, sub, payload))
+
+            self._alargar_bloqueo(token, len(envios))
+            resultados = list(self._pool_actual().map(
+                lambda e: enviar_webpush(e[1], e[2], vapid), envios
+            ))
+
+            fallidas = {t.id: [] for t in trabajos}
+            errores = {}
+            subs_ok = set()
+            subs_fallo = {}
+            subs_expiradas = {}
+            for (t, sub, _), resultado in zip(envios, resultados):
+                if resultado is None:
+                    subs_ok.add(sub['id'])
+                    continue
+                codigo, error = resultado
+                tipo = clasificar_fallo(codigo)
+                errores[t.id] = error
+                if tipo == 'expirada':
+                    subs_expiradas[sub['id']] = (sub, codigo)
+                    continue
+                subs_fallo[sub['id']] = (sub, codigo)
+                if tipo == 'transitoria':
+                    fallidas[t.id].append(sub['id'])
+
+            ahora = datetime.utcnow()
+            self._actualizar_suscripciones(ahora, subs_ok, subs_fallo, subs_expiradas)
+            propios = {t.id: t for t in PushPendiente.query.filter(
+                PushPendiente.id.in_(list(fallidas)),
+                PushPendiente.bloqueado_por == token
+            ).all()}
+            for trabajo_id in fallidas:
+                t = propios.get(trabajo_id)
+                if t is None:
+                    # El bloqueo venció y otro worker la reclamó: ese worker la cierra
+                    app.logger.warning('Trabajo push %s reclamado por otro worker durante el envío', trabajo_id)
+                    continue
+                t.bloqueado_por = None
+                t.bloqueado_hasta = None
+                if not fallidas[t.id]:
+                    t.estado = 'enviado'
+                    t.suscripciones = None
+                    continue
+                t.intentos = (t.intentos or 0) + 1
+                t.ultimo_error = errores[t.id]
+                t.suscripciones = json.dumps(fallidas[t.id])
+                if t.intentos >= MAX_INTENTOS:
+                    t.estado = 'fallido'
+                else:
+                    t.estado = 'pendiente'
+                    t.proximo_intento = ahora + timedelta(seconds=calcular_backoff(t.intentos))
+            db.session.commit()
+            return len(trabajos)
+
+    def _actualizar_suscripciones(self, ahora, subs_ok, subs_fallo, subs_expiradas):
+        """Reiniciar, sumar fallos o eliminar suscripciones según el resultado"""
+        reiniciar = [sid for sid in subs_ok if sid not in subs_fallo]
+        if reiniciar:
+            PushSubscription.query.filter(
+                PushSubscription.id.in_(reiniciar),
+                PushSubscription.fallos_consecutivos > 0
+            ).update({'fallos_consecutivos': 0, 'ultimo_fallo': None}, synchronize_session=False)
+
+        podar = {sid: (sub, codigo, 'expirada') for sid, (sub, codigo) in subs_expiradas.items()}
+        sumar = []
+        for sid, (sub, codigo) in subs_fallo.items():
+            if sid in podar:
+                continue
+            if sub['fallos'] + 1 >= MAX_FALLOS_SUSCRIPCION:
+                podar[sid] = (sub, codigo, 'fallos')
+            else:
+                sumar.append(sid)
+        if sumar:
+            PushSubscription.query.filter(PushSubscription.id.in_(sumar)).update({
+                'fallos_consecutivos': db.func.coalesce(PushSubscription.fallos_consecutivos, 0) + 1,
+                'ultimo_fallo': ahora
+            }, synchronize_session=False)
+
+        if podar:
+            PushSubscription.query.filter(
+                PushSubscription.id.in_(list(podar))
+            ).delete(synchronize_session=False)
+            db.session.add_all([PushSuscripcionPodada(
+                usuario_id=sub['usuario_id'],
+                motivo=motivo,
+                codigo=codigo,
+                fecha=ahora
+            ) for sub, codigo, motivo in podar.values()])
+
+    def _pool_actual(self):
+        if self._pool is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._pool = ThreadPoolExecutor(max_workers=HILOS, thread_name_prefix='push-envio')
+        return self._pool
+
+    def _limpiar(self, ahora):
+        """Borrar de vez en cuando los envíos completados antiguos"""
+        if ahora - self._ultima_limpieza < timedelta(hours=1):
+            return
+        self._ultima_limpieza = ahora
+        PushPendiente.query.filter(
+            PushPendiente.estado == 'enviado',
+            PushPendiente.fecha < ahora - RETENCION_ENVIADOS
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+
+despachador_push = DespachadorPush()
@@ -0,0 +1,349 @@
+"""
+Almacén en memoria de la última posición de cada conductor.
+
+Las lecturas del mapa (admin y padres) se sirven desde aquí sin tocar la
+base de datos. Cada escritura actualiza el almacén al instante y marca al
+conductor como pendiente; un hilo en segundo plano vuelca las posiciones
+pendientes a `UbicacionVehiculo` cada pocos segundos.
+
+Backends (variable de entorno POSICIONES_BACKEND):
+    memoria  -> dict local del proceso (un solo worker, valor por defecto)
+    socket   -> dict compartido servido por un proceso/hilo en un socket
+                local (multiprocessing.managers), para varios workers de
+                gunicorn (es el que usa el Procfile). El primer worker que
+                logra abrir el socket lo sirve; el resto se conecta como
+                cliente. Si el worker que lo sirve se reinicia, el primero
+                que note la conexión caída vuelve a abrir el socket y la
+                tabla nueva se recarga desde `UbicacionVehiculo` (como mucho
+                se pierden los últimos INTERVALO_VOLCADO segundos, que el
+                siguiente punto de cada conductor repone).
+
+El gestor de multiprocessing deserializa con pickle lo que recibe, así que
+quien pueda hablarle puede ejecutar código en el proceso. Por eso el backend
+socket exige su propia clave en POSICIONES_SOCKET_CLAVE (nunca la SECRET_KEY
+de Flask) y solo escucha en una dirección de loopback; sin clave, o con otro
+host, la aplicación no arranca.
+"""
+
+import atexit
+import ipaddress
+import os
+import threading
+import time
+from multiprocessing.managers import BaseManager
+
+from database import app, db, UbicacionVehiculo
+from geoespacial import IndiceGrilla
+
+BACKEND = os.getenv('POSICIONES_BACKEND', 'memoria')
+SOCKET_HOST = os.getenv('POSICIONES_SOCKET_HOST', '127.0.0.1')
+SOCKET_PUERTO = int(os.getenv('POSICIONES_SOCKET_PUERTO', '50555'))
+SOCKET_CLAVE = os.getenv('POSICIONES_SOCKET_CLAVE', '')
+INTERVALO_VOLCADO = float(os.getenv('POSICIONES_VOLCADO_SEGUNDOS', '5'))
+INTENTOS_RECONEXION = 3
+# Lo que lanza un proxy de multiprocessing cuando el proceso que sirve la tabla murió
+CONEXION_PERDIDA = (EOFError, OSError)
+
+
+class TablaPosiciones:
+    """Tabla conductor_id -> posición; solo acepta posiciones más nuevas.
+
+    Mantiene a la par un índice espacial para búsquedas por cercanía.
+    """
+
+    def __init__(self):
+        self._datos = {}
+        self._indice = IndiceGrilla()
+        self._version = 0
+        self._cargada = False
+        self._lock = threading.Lock()
+
+    def actualizar(self, conductor_id, lat, lng, fecha):
+        """Guardar la posición si es más reciente. Devuelve True si se aplicó."""
+        with self._lock:
+            actual = self._datos.get(conductor_id)
+            if actual and actual['ultima_actualizacion'] and actual['ultima_actualizacion'] > fecha:
+                return False
+            self._version += 1
+            self._datos[conductor_id] = {
+                'conductor_id': conductor_id,
+                'lat': lat,
+                'lng': lng,
+                'ultima_actualizacion': fecha,
+                'version': self._version
+            }
+            self._indice.actualizar(conductor_id, lat, lng)
+            return True
+
+    def obtener(self, conductor_id):
+        with self._lock:
+            pos = self._datos.get(conductor_id)
+            return dict(pos) if pos else None
+
+    def obtener_varios(self, conductor_ids):
+        with self._lock:
+            return {cid: dict(self._datos[cid]) for cid in conductor_ids if cid in self._datos}
+
+    def todas(self):
+        with self._lock:
+            return [dict(p) for p in self._datos.values()]
+
+    def version(self):
+        return self._version
+
+    def cercanos(self, lat, lng, n, radio_metros=None):
+        """Las `n` posiciones más cercanas, con `distancia_metros`"""
+        with self._lock:
+            return [dict(self._datos[cid], distancia_metros=round(d, 1))
+                    for d, cid in self._indice.cercanos(lat, lng, n, radio_metros)]
+
+    def en_radio(self, lat, lng, radio_metros):
+        """Posiciones dentro del radio, de la más cercana a la más lejana"""
+        with self._lock:
+            return [dict(self._datos[cid], distancia_metros=round(d, 1))
+                    for d, cid in self._indice.en_radio(lat, lng, radio_metros)]
+
+    def cambios_desde(self, version, conductor_ids=None):
+        """Posiciones modificadas después de `version` y la versión actual.
+
+        Si se indica `conductor_ids` solo se devuelven esos conductores.
+        """
+        with self._lock:
+            if conductor_ids is None:
+                candidatas = self._datos.values()
+            else:
+                candidatas = [self._datos[cid] for cid in conductor_ids if cid in self._datos]
+            return [dict(p) for p in candidatas if p['version'] > version], self._version
+
+    def cargada(self):
+        return self._cargada
+
+    def cargar(self, posiciones):
+        """Precargar desde la base de datos sin pisar datos más nuevos"""
+        for p in posiciones:
+            self.actualizar(p['conductor_id'], p['lat'], p['lng'], p['ultima_actualizacion'])
+        self._cargada = True
+
+
+class _GestorPosiciones(BaseManager):
+    pass
+
+
+_tabla_servidor = TablaPosiciones()
+_GestorPosiciones.register('tabla', callable=lambda: _tabla_servidor)
+
+
+def _es_loopback(host):
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def _validar_socket():
+    """Negarse a servir la tabla sin clave propia o fuera de loopback"""
+    if not SOCKET_CLAVE:
+        raise RuntimeError('POSICIONES_BACKEND=socket requiere POSICIONES_SOCKET_CLAVE')
+    if not _es_loopback(SOCKET_HOST):
+        raise RuntimeError(f'POSICIONES_SOCKET_HOST debe ser una dirección de loopback, no {SOCKET_HOST!r}')
+
+
+def _conectar_socket():
+    """Conectarse al almacén compartido o, si nadie lo sirve, servirlo aquí"""
+    direccion = (SOCKET_HOST, SOCKET_PUERTO)
+    clave = SOCKET_CLAVE.encode()
+    try:
+        gestor = _GestorPosiciones(address=direccion, authkey=clave)
+        servidor = gestor.get_server()
+    except OSError:
+        servidor = None
+
+    if servidor is not None:
+        hilo = threading.Thread(target=servidor.serve_forever, name='posiciones-servidor', daemon=True)
+        hilo.start()
+
+    cliente = _GestorPosiciones(address=direccion, authkey=clave)
+    cliente.connect()
+    return cliente.tabla()
+
+
+class AlmacenPosiciones:
+    """Fachada usada por app.py; oculta el backend y el volcado a la BD"""
+
+    def __init__(self, backend=BACKEND):
+        if backend == 'socket':
+            _validar_socket()
+        self.backend = backend
+        self._tabla = None
+        self._pendientes = set()
+        self._lock = threading.Lock()
+        self._cambio = threading.Condition()
+        self._hilo = None
+        self._pid = None
+        self._lock_conexion = threading.Lock()
+
+    @property
+    def tabla(self):
+        with self._lock_conexion:
+            # Tras un fork (gunicorn) el proxy y el hilo heredados no sirven
+            if self._tabla is None or self._pid != os.getpid():
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self._pendientes = set()
+                    self._hilo = None
+                if self.backend == 'socket':
+                    self._tabla = _conectar_socket()
+                else:
+                    self._tabla = TablaPosiciones()
+            return self._tabla
+
+    def _usar(self, operacion):
+        """Ejecutar operacion(tabla) sobre la tabla cargada.
+
+        Con el backend compartido, si se cortó la conexión (el worker que
+        servía la tabla se reinició) se reconecta, o se pasa a servirla
+        aquí, y se reintenta.
+        """
+        for intento in range(INTENTOS_RECONEXION):
+            tabla = None
+            try:
+                tabla = self.tabla
+                return operacion(self._asegurar_cargada(tabla))
+            except CONEXION_PERDIDA as e:
+                if self.backend != 'socket' or intento == INTENTOS_RECONEXION - 1:
+                    raise
+                app.logger.warning('Almacén de posiciones desconectado (%s), reconectando', e)
+                with self._lock_conexion:
+                    if self._tabla is tabla:
+                        self._tabla = None
+                time.sleep(0.1 * (intento + 1))
+
+    def _asegurar_cargada(self, tabla):
+        if tabla.cargada():
+            return tabla
+        with app.app_context():
+            filas = UbicacionVehiculo.query.all()
+            tabla.cargar([{
+                'conductor_id': u.conductor_id,
+                'lat': u.lat,
+                'lng': u.lng,
+                'ultima_actualizacion': u.ultima_actualizacion
+            } for u in filas])
+        return tabla
+
+    def actualizar(self, conductor_id, lat, lng, fecha):
+        """Registrar una posición nueva y programar su volcado a la BD"""
+        aplicada = self._usar(lambda t: t.actualizar(conductor_id, lat, lng, fecha))
+        if aplicada:
+            with self._lock:
+                self._pendientes.add(conductor_id)
+            with self._cambio:
+                self._cambio.notify_all()
+            self._iniciar_volcado()
+        return aplicada
+
+    def obtener(self, conductor_id):
+        return self._usar(lambda t: t.obtener(conductor_id))
+
+    def obtener_varios(self, conductor_ids):
+        ids = list(conductor_ids)
+        return self._usar(lambda t: t.obtener_varios(ids))
+
+    def todas(self):
+        return self._usar(lambda t: t.todas())
+
+    def version(self):
+        return self._usar(lambda t: t.version())
+
+    def cercanos(self, lat, lng, n, radio_metros=None):
+        return self._usar(lambda t: t.cercanos(lat, lng, n, radio_metros))
+
+    def en_radio(self, lat, lng, radio_metros):
+        return self._usar(lambda t: t.en_radio(lat, lng, radio_metros))
+
+    def cambios_desde(self, version, conductor_ids=None):
+        """Cambios posteriores a `version` y la versión actual.
+
+        Si la versión actual es menor que la pedida, la tabla es nueva (otro
+        worker pasó a servirla) y quien escucha debe pedir todo desde 0.
+        """
+        ids = list(conductor_ids) if conductor_ids is not None else None
+        return self._usar(lambda t: t.cambios_desde(version, ids))
+
+    def esperar_cambio(self, timeout):
+        """Bloquear hasta que este proceso reciba una posición o venza el timeout.
+
+        Con el backend compartido las escrituras de otros workers no
+        despiertan esta espera, por eso quien escucha debe usar un timeout
+        corto y consultar `cambios_desde` al despertar.
+        """
+        with self._cambio:
+            self._cambio.wait(timeout)
+
+    def _iniciar_volcado(self):
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        self._hilo = threading.Thread(target=self._bucle_volcado, name='posiciones-volcado', daemon=True)
+        self._hilo.start()
+
+    def _bucle_volcado(self):
+        while True:
+            time.sleep(INTERVALO_VOLCADO)
+            try:
+                self.volcar()
+            except Exception as e:
+                app.logger.warning('Error volcando posiciones: %s', e)
+
+    def volcar(self):
+        """Escribir en UbicacionVehiculo las posiciones pendientes de este proceso"""
+        with self._lock:
+            pendientes = self._pendientes
+            self._pendientes = set()
+        if not pendientes:
+            return 0
+
+        try:
+            posiciones = self.obtener_varios(pendientes)
+        except Exception:
+            with self._lock:
+                self._pendientes |= pendientes
+            raise
+        with app.app_context():
+            try:
+                existentes = {
+                    u.conductor_id: u for u in
+                    UbicacionVehiculo.query.filter(UbicacionVehiculo.conductor_id.in_(list(posiciones))).all()
+                }
+                for cid, pos in posiciones.items():
+                    registro = existentes.get(cid)
+                    if registro is None:
+                        db.session.add(UbicacionVehiculo(
+                            conductor_id=cid,
+                            lat=pos['lat'],
+                            lng=pos['lng'],
+                            ultima_actualizacion=pos['ultima_actualizacion']
+                        ))
+                    elif not registro.ultima_actualizacion or registro.ultima_actualizacion <= pos['ultima_actualizacion']:
+                        registro.lat = pos['lat']
+                        registro.lng = pos['lng']
+                        registro.ultima_actualizacion = pos['ultima_actualizacion']
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                with self._lock:
+                    self._pendientes |= pendientes
+                raise
+        return len(posiciones)
+
+
+almacen_posiciones = AlmacenPosiciones()
+
+
+@atexit.register
+def _volcar_al_salir():
+    try:
+        almacen_posiciones.volcar()
+    except Exception:
+        pass
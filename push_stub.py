@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Servidor push de prueba para desarrollo local.
+
+Acepta los POST que hace pywebpush y responde con el código que se le
+indique, sin contactar a ningún servicio real. Al iniciar imprime una
+suscripción válida (claves p256dh/auth generadas al vuelo) que se puede
+registrar con POST /api/push/subscribe estando logueado.
+
+Uso:
+    python push_stub.py                    # responde 201 en el puerto 8765
+    python push_stub.py --estado 410       # simular suscripción expirada
+    python push_stub.py --estado 503 --demora 2
+"""
+
+import argparse
+import base64
+import json
+import secrets
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+
+def b64url(datos):
+    return base64.urlsafe_b64encode(datos).rstrip(b'=').decode()
+
+
+def generar_suscripcion(puerto):
+    clave = ec.generate_private_key(ec.SECP256R1())
+    publica = clave.public_key().public_bytes(
+        serialization.Encoding.X962,
+        serialization.PublicFormat.UncompressedPoint
+    )
+    return {
+        'endpoint': f'http://127.0.0.1:{puerto}/push/{secrets.token_hex(8)}',
+        'keys': {'p256dh': b64url(publica), 'auth': b64url(secrets.token_bytes(16))}
+    }
+
+
+def crear_manejador(estado, demora):
+    class Manejador(BaseHTTPRequestHandler):
+        def do_POST(self):
+            largo = int(self.headers.get('Content-Length', 0))
+            self.rfile.read(largo)
+            if demora:
+                time.sleep(demora)
+            print(f'📨 {self.path} ({largo} bytes) -> {estado}', flush=True)
+            self.send_response(estado)
+            self.end_headers()
+
+        def log_message(self, formato, *args):
+            pass
+
+    return Manejador
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor push de prueba')
+    parser.add_argument('--puerto', type=int, default=8765)
+    parser.add_argument('--estado', type=int, default=201, help='código HTTP a responder')
+    parser.add_argument('--demora', type=float, default=0, help='segundos de espera por envío')
+    args = parser.parse_args()
+
+    print('Suscripción de prueba:')
+    print(json.dumps(generar_suscripcion(args.puerto), indent=2))
+    print(f'🚀 Servidor push de prueba en http://127.0.0.1:{args.puerto} (responde {args.estado})')
+    servidor = ThreadingHTTPServer(('127.0.0.1', args.puerto), crear_manejador(args.estado, args.demora))
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+"""
+Reportes PDF por partes, con memoria acotada.
+
+SimpleDocTemplate (y el canvas de reportlab) guardan el contenido de todas
+las páginas hasta el final del build, así que un reporte con años de
+movimientos tiene que caber completo en memoria. Aquí el PDF se escribe en
+orden: cada página terminada se comprime y se entrega de inmediato, y solo
+se recuerdan los offsets de los objetos para la tabla xref del final. Los
+movimientos se leen en lotes de LOTE filas paginando por (fecha, id), sin
+crear objetos del ORM.
+
+Los reportes son generadores de bytes: sirven igual para una respuesta HTTP
+en streaming que para escribir un archivo temporal (guardar()).
+
+Se usan las fuentes estándar Helvetica (no se incrustan) con codificación
+WinAnsi y las métricas de reportlab para medir y recortar el texto.
+
+El escritor de PDF y la maquetación están en maquetacion_pdf.py, que no
+toca la base. Los reportes de asistencia por lote (muchos conductores y
+días) maquetan en un pool de procesos forkserver que solo carga ese módulo:
+cada proceso devuelve las páginas ya comprimidas y el proceso principal las
+escribe en un ZIP o en un único PDF.
+
+Variables de entorno:
+    REPORTES_PROCESOS   procesos para los lotes de asistencia (hasta 4)
+"""
+
+import multiprocessing
+import os
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time, timedelta
+from itertools import groupby
+
+from werkzeug.utils import secure_filename
+
+from database import db, Usuario, Estudiante, Asistencia, Ingreso, Gasto
+import finanzas
+from maquetacion_pdf import ALTO_FILA, EscritorPDF, Maquetador, maquetar_asistencia, paginas_asistencia
+
+LOTE = 2000
+CONDUCTORES_POR_LOTE = 20
+REPORTES_POR_TAREA = 20
+PROCESOS = int(os.getenv('REPORTES_PROCESOS', str(min(4, os.cpu_count() or 1))))
+
+_contexto = {'valor': None, 'lock': threading.Lock()}
+
+def _rango_fechas(columna, desde, hasta):
+    condiciones = [columna.isnot(None)]
+    if desde:
+        condiciones.append(columna >= datetime.combine(desde, time.min))
+    if hasta:
+        condiciones.append(columna < datetime.combine(hasta + timedelta(days=1), time.min))
+    return condiciones
+
+
+def lotes_movimientos(modelo, concepto, desde=None, hasta=None, lote=LOTE):
+    """Filas (id, fecha, descripcion, concepto, monto) de a `lote`, en orden (fecha, id)"""
+    base = db.select(modelo.id, modelo.fecha, modelo.descripcion, concepto, modelo.monto).where(
+        *_rango_fechas(modelo.fecha, desde, hasta)
+    ).order_by(modelo.fecha, modelo.id).limit(lote)
+    consulta = base
+    while True:
+        filas = db.session.execute(consulta).all()
+        if filas:
+            yield filas
+        if len(filas) < lote:
+            return
+        fecha, ultimo_id = filas[-1].fecha, filas[-1].id
+        consulta = base.where(db.or_(
+            modelo.fecha > fecha, db.and_(modelo.fecha == fecha, modelo.id > ultimo_id)))
+
+
+def _texto_periodo(desde, hasta):
+    if desde and hasta:
+        return f'Del {desde:%d/%m/%Y} al {hasta:%d/%m/%Y}'
+    if desde:
+        return f'Desde el {desde:%d/%m/%Y}'
+    if hasta:
+        return f'Hasta el {hasta:%d/%m/%Y}'
+    return 'Todo el historial'
+
+
+def reporte_finanzas(desde=None, hasta=None, lote=LOTE):
+    """Generador de bytes del PDF de finanzas entre `desde` y `hasta` (date, inclusive).
+
+    Primero los totales (del resumen diario) y luego el detalle completo de
+    ingresos y gastos del periodo.
+    """
+    periodo = _texto_periodo(desde, hasta)
+    maq = Maquetador(f'Reporte de Finanzas - {periodo}')
+    maq.parrafo('Reporte de Finanzas - Sistema de Transporte', 16, 'negrita')
+    maq.parrafo(f"Generado: {datetime.now().strftime('%d/%m/%Y %H:%M')}", separacion=10)
+    maq.parrafo(f'Periodo: {periodo}', separacion=6)
+
+    por_concepto = finanzas.totales_por_concepto(desde, hasta)
+    total_ingresos = sum(total for tipo, _, total, _ in por_concepto if tipo == 'ingreso')
+    total_gastos = sum(total for tipo, _, total, _ in por_concepto if tipo == 'gasto')
+
+    maq.y -= ALTO_FILA
+    maq.tabla([('Concepto', 300, 'izquierda'), ('Monto', 212, 'derecha')])
+    maq.fila(['Total Ingresos', f'C$ {total_ingresos:,.2f}'])
+    maq.fila(['Total Gastos', f'C$ {total_gastos:,.2f}'])
+    maq.fila(['Balance', f'C$ {total_ingresos - total_gastos:,.2f}'], 'negrita')
+    maq.fin_tabla()
+
+    if por_concepto:
+        maq.parrafo('Totales por fuente y categoría', 12, 'negrita', 10)
+        maq.tabla([('Tipo', 100, 'izquierda'), ('Fuente / Categoría', 200, 'izquierda'),
+                   ('Movimientos', 90, 'derecha'), ('Monto', 122, 'derecha')])
+        for tipo, concepto, total, cantidad in por_concepto:
+            maq.fila([tipo.capitalize(), concepto or '-', f'{cantidad:,}', f'C$ {total:,.2f}'])
+        maq.fin_tabla()
+    yield from maq.vaciar()
+
+    for titulo, modelo, concepto, encabezado in (
+        ('Ingresos', Ingreso, Ingreso.fuente, 'Fuente'),
+        ('Gastos', Gasto, Gasto.categoria, 'Categoría'),
+    ):
+        maq.parrafo(titulo, 12, 'negrita', 14)
+        maq.tabla([('Fecha', 70, 'izquierda'), ('Descripción', 250, 'izquierda'),
+                   (encabezado, 100, 'izquierda'), ('Monto', 92, 'derecha')])
+        suma = cantidad = 0
+        for filas in lotes_movimientos(modelo, concepto, desde, hasta, lote):
+            for f in filas:
+                maq.fila([f.fecha.strftime('%d/%m/%Y'), f.descripcion or '', f[3] or '-', f'C$ {f.monto:,.2f}'])
+                suma += f.monto
+            cantidad += len(filas)
+            yield from maq.vaciar()
+        if not cantidad:
+            maq.fila(['', 'Sin movimientos en el periodo', '', ''])
+        maq.fila(['', f'{cantidad:,} movimientos', 'Total', f'C$ {suma:,.2f}'], 'negrita')
+        maq.fin_tabla()
+
+    yield from maq.cerrar()
+
+
+def filas_asistencia(conductor_id, fecha):
+    """(id, estudiante, estado, hora, observaciones) del conductor en el día"""
+    return db.session.query(
+        Asistencia.id, Estudiante.nombre, Asistencia.estado, Asistencia.hora, Asistencia.observaciones
+    ).join(Estudiante, Estudiante.id == Asistencia.estudiante_id).filter(
+        Asistencia.conductor_id == conductor_id, Asistencia.fecha == fecha
+    ).order_by(Asistencia.id).all()
+
+
+def reporte_asistencia(conductor_id, fecha):
+    """Generador de bytes del PDF de asistencias de un conductor en un día"""
+    nombre = db.session.query(Usuario.nombre).filter_by(id=conductor_id).scalar()
+    filas = [(a.nombre, a.estado, a.hora.strftime('%H:%M') if a.hora else None, a.observaciones)
+             for a in filas_asistencia(conductor_id, fecha)]
+    maq = Maquetador(f'Reporte de Asistencia - {nombre} - {fecha:%d/%m/%Y}')
+    maquetar_asistencia(maq, nombre, fecha, filas)
+    yield from maq.cerrar()
+
+
+def lotes_asistencia(conductor_ids, desde, hasta, conductores_por_lote=CONDUCTORES_POR_LOTE):
+    """Reportes (conductor_id, nombre, fecha, filas) de conductor y día con asistencias.
+
+    Una consulta por cada grupo de `conductores_por_lote` conductores cubre
+    todo el rango; devuelve una lista de reportes por grupo.
+    """
+    for i in range(0, len(conductor_ids), conductores_por_lote):
+        consulta = db.session.query(
+            Asistencia.conductor_id, Usuario.nombre, Asistencia.fecha, Estudiante.nombre,
+            Asistencia.estado, Asistencia.hora, Asistencia.observaciones
+        ).join(Estudiante, Estudiante.id == Asistencia.estudiante_id).join(
+            Usuario, Usuario.id == Asistencia.conductor_id
+        ).filter(
+            Asistencia.conductor_id.in_(conductor_ids[i:i + conductores_por_lote]),
+            Asistencia.fecha >= desde, Asistencia.fecha <= hasta
+        ).order_by(Asistencia.conductor_id, Asistencia.fecha, Asistencia.id)
+        lote = []
+        for (conductor_id, fecha), filas in groupby(consulta, key=lambda f: (f[0], f[2])):
+            filas = list(filas)
+            lote.append((conductor_id, filas[0][1], fecha, [
+                (f[3], f[4], f[5].strftime('%H:%M') if f[5] else None, f[6]) for f in filas]))
+        if lote:
+            yield lote
+
+
+class _Sumidero:
+    """Archivo de solo escritura para zipfile; acumula lo escrito hasta vaciar()"""
+
+    def __init__(self):
+        self._partes = []
+        self._posicion = 0
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        self._posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self._posicion
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        partes, self._partes = self._partes, []
+        return partes
+
+
+def _contexto_pool():
+    """forkserver (o spawn donde no existe) con maquetacion_pdf precargado.
+
+    No se usa fork: este proceso ya tiene hilos (servidor, despachadores) y
+    un hijo copiado a mitad de un lock o de una conexión queda colgado. Con
+    gunicorn los hijos solo cargan maquetacion_pdf, no app.py ni la base
+    (con `python app.py` multiprocessing sí reimporta el script principal).
+    """
+    with _contexto['lock']:
+        if _contexto['valor'] is None:
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                contexto = multiprocessing.get_context('forkserver')
+                contexto.set_forkserver_preload(['maquetacion_pdf'])
+            else:
+                contexto = multiprocessing.get_context('spawn')
+            _contexto['valor'] = contexto
+        return _contexto['valor']
+
+
+def reporte_asistencia_lote(conductor_ids, desde, hasta, formato='zip', procesos=PROCESOS):
+    """Generador de bytes con los reportes de asistencia de varios conductores y días.
+
+    formato 'zip': un PDF por conductor y día; 'pdf': un solo PDF con todos,
+    en orden de conductor y fecha. Los datos salen de lotes_asistencia() y
+    las páginas se maquetan en un pool de procesos (reportlab no suelta el
+    GIL); como mucho hay 2 tareas por proceso en vuelo.
+    """
+    if formato == 'pdf':
+        combinado = EscritorPDF()
+        yield combinado.iniciar()
+    else:
+        sumidero = _Sumidero()
+        archivo_zip = zipfile.ZipFile(sumidero, 'w', zipfile.ZIP_STORED)
+
+    def escribir(tarea, futuro):
+        for (conductor_id, nombre, fecha, _), paginas in zip(tarea, futuro.result()):
+            if formato == 'pdf':
+                yield b''.join(combinado.pagina_comprimida(p) for p in paginas)
+                continue
+            pdf = EscritorPDF()
+            datos = pdf.iniciar() + b''.join(pdf.pagina_comprimida(p) for p in paginas) + pdf.cerrar()
+            archivo_zip.writestr(
+                f'{fecha:%Y-%m-%d}/asistencia_{conductor_id}_{secure_filename(nombre) or "conductor"}.pdf', datos)
+            yield from sumidero.vaciar()
+
+    with ProcessPoolExecutor(max_workers=procesos, mp_context=_contexto_pool()) as pool:
+        en_vuelo = deque()
+        for lote in lotes_asistencia(conductor_ids, desde, hasta):
+            for i in range(0, len(lote), REPORTES_POR_TAREA):
+                tarea = lote[i:i + REPORTES_POR_TAREA]
+                en_vuelo.append((tarea, pool.submit(paginas_asistencia, [(n, f, filas) for _, n, f, filas in tarea])))
+                while len(en_vuelo) > procesos * 2:
+                    yield from escribir(*en_vuelo.popleft())
+        while en_vuelo:
+            yield from escribir(*en_vuelo.popleft())
+
+    if formato == 'pdf':
+        yield combinado.cerrar()
+    else:
+        archivo_zip.close()
+        yield from sumidero.vaciar()
+
+
+def guardar(partes, destino):
+    """Escribir los bytes de un reporte en `destino` (ruta o archivo abierto); devuelve el tamaño"""
+    if isinstance(destino, str):
+        with open(destino, 'wb') as archivo:
+            return guardar(partes, archivo)
+    total = 0
+    for parte in partes:
+        destino.write(parte)
+        total += len(parte)
+    return total
@@ -1,8 +1,12 @@
-const CACHE_NAME = 'camley-transporte-v2.2';
+importScripts('/static/js/cola_offline.js');
+
+const CACHE_NAME = 'camley-transporte-v2.4';
+const TAG_SINCRONIZACION = 'sync-operaciones';
 const urlsToCache = [
 '/static/css/style.css',
 '/static/js/admin.js',
 '/static/js/app.js',
+'/static/js/cola_offline.js',
 '/manifest.json'
 ];
 
@@ -202,20 +206,61 @@ event.waitUntil(
 self.addEventListener('sync', event => {
 console.log('🔄 Sincronización en segundo plano:', event.tag);
 
-if (event.tag === 'sync-data') {
+if (event.tag === 'sync-data' || event.tag === TAG_SINCRONIZACION) {
     event.waitUntil(syncData());
 }
 });
 
+// Enviar la cola offline del conductor (asistencia y GPS guardados sin señal)
 async function syncData() {
 console.log('📡 Sincronizando datos...');
-  // Aquí puedes agregar lógica para sincronizar datos offline
+const resultado = await ColaOffline.sincronizar();
+console.log(`✅ ${resultado.enviadas} operaciones sincronizadas, ${resultado.pendientes} pendientes`);
+await avisarClientes(resultado);
+return resultado;
+}
+
+async function avisarClientes(resultado) {
+const ventanas = await clients.matchAll({ type: 'window' });
+ventanas.forEach(cliente => cliente.postMessage(Object.assign({ type: 'COLA_OFFLINE' }, resultado)));
+}
+
+// Guardar operaciones en la cola y sincronizar ya si hay señal; si no, pedir
+// una sincronización en segundo plano (Background Sync) para cuando vuelva
+async function encolarOperaciones(operaciones) {
+const pendientes = await ColaOffline.encolar(operaciones);
+if (self.registration.sync) {
+    try {
+    await self.registration.sync.register(TAG_SINCRONIZACION);
+    } catch (error) {
+    console.log('⚠️ Background Sync no disponible:', error);
+    }
+}
+return { enviadas: 0, pendientes: pendientes };
+}
+
+function responder(event, trabajo) {
+event.waitUntil(
+    trabajo
+    .then(resultado => event.ports[0] && event.ports[0].postMessage(resultado))
+    .catch(error => event.ports[0] && event.ports[0].postMessage({ error: error.message }))
+);
 }
 
 // ==================== MENSAJES ====================
 self.addEventListener('message', event => {
 console.log('📨 Mensaje recibido en Service Worker:', event.data);
 
+if (event.data.type === 'ENCOLAR_OPERACIONES') {
+    responder(event, encolarOperaciones(event.data.operaciones));
+    return;
+}
+
+if (event.data.type === 'SINCRONIZAR') {
+    responder(event, syncData());
+    return;
+}
+
 if (event.data.type === 'CACHE_ASSETS') {
     // Cachear recursos adicionales
     caches.open(CACHE_NAME)
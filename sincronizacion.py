@@ -0,0 +1,157 @@
+"""
+Sincronización de operaciones que los conductores hicieron sin conexión.
+
+El teléfono guarda cada marca de asistencia y cada punto GPS en una cola de
+IndexedDB (static/js/cola_offline.js, usada por service-worker.js) con un
+id generado en el cliente y la hora original, y al recuperar la señal los
+envía en lotes a /conductor/sincronizar.
+
+Idempotencia: cada id procesado queda en `operacion_sincronizada` con su
+resultado (aplicada, descartada o rechazada), único por conductor. Si el
+teléfono reintenta un lote que ya llegó (se cortó la respuesta), esas
+operaciones no se vuelven a aplicar y se responde el mismo resultado.
+
+Conflictos de asistencia: por estudiante y día gana la marca con la hora
+original más reciente, venga de la lista en línea o de la cola offline. Las
+marcas de un lote se aplican ordenadas por (hora, id), así el resultado no
+depende del orden de llegada; ante la misma hora se conserva la que ya
+estaba guardada. Las marcas que pierden quedan como 'descartada'.
+
+Los ids procesados se guardan RETENCION; el teléfono no envía operaciones
+más viejas que MAX_ANTIGUEDAD, que coincide con los días de historial GPS
+crudo (los más viejos ya están compactados).
+"""
+
+import time
+from datetime import datetime, timedelta
+
+from database import db, Estudiante, Ruta, Asistencia, OperacionSincronizada
+from historial_gps import DIAS_CRUDOS
+
+MAX_OPERACIONES = 1000
+MAX_ANTIGUEDAD = timedelta(days=DIAS_CRUDOS)
+RETENCION = timedelta(days=30)
+INTERVALO_LIMPIEZA = 3600
+TIPOS = ('asistencia', 'ubicacion')
+
+_limpieza = {'ultima': 0.0}
+
+
+def ya_procesadas(conductor_id, cliente_ids):
+    """{cliente_id: (resultado, error)} de las operaciones que ya llegaron antes"""
+    if not cliente_ids:
+        return {}
+    filas = db.session.execute(
+        db.select(OperacionSincronizada.cliente_id, OperacionSincronizada.resultado, OperacionSincronizada.error)
+        .where(OperacionSincronizada.conductor_id == conductor_id,
+               OperacionSincronizada.cliente_id.in_(list(cliente_ids)))
+    ).all()
+    return {cliente_id: (resultado, error) for cliente_id, resultado, error in filas}
+
+
+def aplicar_asistencias(conductor_id, marcas):
+    """Aplicar marcas offline con "gana la más reciente". No hace commit.
+
+    `marcas`: dicts con id, fecha (datetime UTC original), estudiante_id,
+    estado y observaciones. Una consulta trae los estudiantes de las rutas
+    del conductor y su asistencia de esos días; luego hay un INSERT y un
+    UPDATE en bloque.
+
+    Devuelve ({id: (resultado, error)}, [(padre_id, nombre, estado, dia)])
+    con los cambios que hay que avisar a los padres.
+    """
+    if not marcas:
+        return {}, []
+    dias = {m['fecha'].date() for m in marcas}
+    filas = db.session.query(
+        Estudiante.id, Estudiante.nombre, Estudiante.padre_id,
+        Asistencia.id, Asistencia.fecha, Asistencia.hora, Asistencia.estado
+    ).join(Ruta, Estudiante.ruta_id == Ruta.id).outerjoin(
+        Asistencia, (Asistencia.estudiante_id == Estudiante.id) & Asistencia.fecha.in_(dias)
+    ).filter(
+        Ruta.conductor_id == conductor_id,
+        Estudiante.id.in_({m['estudiante_id'] for m in marcas})
+    ).all()
+
+    estudiantes = {}
+    actuales = {}  # (estudiante_id, dia) -> {'id', 'momento', 'estado', 'original'}
+    for estudiante_id, nombre, padre_id, asistencia_id, dia, hora, estado in filas:
+        estudiantes[estudiante_id] = (nombre, padre_id)
+        if asistencia_id is not None and (estudiante_id, dia) not in actuales:
+            actuales[(estudiante_id, dia)] = {
+                'id': asistencia_id,
+                'momento': datetime.combine(dia, hora or datetime.min.time()),
+                'estado': estado,
+                'original': estado
+            }
+
+    resultados = {}
+    for marca in sorted(marcas, key=lambda m: (m['fecha'], m['id'])):
+        if marca['estudiante_id'] not in estudiantes:
+            resultados[marca['id']] = ('rechazada', 'Estudiante no en tu ruta')
+            continue
+        clave = (marca['estudiante_id'], marca['fecha'].date())
+        actual = actuales.get(clave)
+        if actual is not None and actual['momento'] >= marca['fecha']:
+            resultados[marca['id']] = ('descartada', 'Hay una marca más reciente')
+            continue
+        if actual is None:
+            actual = actuales[clave] = {'id': None, 'original': None}
+        actual.update(momento=marca['fecha'], estado=marca['estado'],
+                      observaciones=marca['observaciones'], aplicar=True)
+        resultados[marca['id']] = ('aplicada', None)
+
+    nuevas, cambios, avisos = [], [], []
+    for (estudiante_id, dia), actual in actuales.items():
+        if not actual.get('aplicar'):
+            continue
+        valores = {
+            'hora': actual['momento'].time(),
+            'estado': actual['estado'],
+            'observaciones': actual['observaciones'],
+            'conductor_id': conductor_id
+        }
+        if actual['id'] is None:
+            nuevas.append(dict(valores, estudiante_id=estudiante_id, fecha=dia))
+        else:
+            cambios.append(dict(valores, id=actual['id']))
+        nombre, padre_id = estudiantes[estudiante_id]
+        if padre_id and actual['estado'] != actual['original']:
+            avisos.append((padre_id, nombre, actual['estado'], dia))
+
+    if nuevas:
+        db.session.execute(Asistencia.__table__.insert(), nuevas)
+    if cambios:
+        db.session.execute(db.update(Asistencia), cambios)
+    return resultados, avisos
+
+
+def registrar(conductor_id, operaciones, resultados):
+    """Guardar el resultado de cada operación nueva con un solo INSERT. No hace commit.
+
+    `operaciones`: {cliente_id: tipo}; `resultados`: {cliente_id: (resultado, error)}.
+    """
+    if not resultados:
+        return
+    ahora = datetime.utcnow()
+    db.session.execute(OperacionSincronizada.__table__.insert(), [{
+        'conductor_id': conductor_id,
+        'cliente_id': cliente_id,
+        'tipo': operaciones[cliente_id],
+        'resultado': resultado,
+        'error': error,
+        'fecha': ahora
+    } for cliente_id, (resultado, error) in resultados.items()])
+
+
+def limpiar_si_toca():
+    """Borrar los ids más viejos que RETENCION, como mucho una vez por hora por proceso"""
+    ahora = time.monotonic()
+    if _limpieza['ultima'] and ahora - _limpieza['ultima'] < INTERVALO_LIMPIEZA:
+        return 0
+    _limpieza['ultima'] = ahora
+    borradas = OperacionSincronizada.query.filter(
+        OperacionSincronizada.fecha < datetime.utcnow() - RETENCION
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return borradas
@@ -4,16 +4,16 @@
 function checkNotifications() {
     if (!window.currentUserId) return;
     
-    fetch(`/api/notificaciones/${window.currentUserId}`)
+    fetch(`/api/notificaciones/count/${window.currentUserId}`)
         .then(response => response.json())
-        .then(notifications => {
-            const unread = notifications.filter(n => !n.leida);
+        .then(data => {
+            const unread = data.count || 0;
             
             // Actualizar contador
             const badge = document.getElementById('notificationBadge');
             if (badge) {
-                if (unread.length > 0) {
-                    badge.textContent = unread.length;
+                if (unread > 0) {
+                    badge.textContent = unread;
                     badge.classList.remove('d-none');
                 } else {
                     badge.classList.add('d-none');
@@ -21,11 +21,11 @@ function checkNotifications() {
             }
             
             // Sonido para nuevas notificaciones
-            if (unread.length > window.lastNotificationCount) {
+            if (unread > window.lastNotificationCount) {
                 playNotificationSound();
             }
             
-            window.lastNotificationCount = unread.length;
+            window.lastNotificationCount = unread;
         })
         .catch(error => console.error('Error checking notifications:', error));
 }
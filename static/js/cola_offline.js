@@ -0,0 +1,163 @@
+// Cola offline del conductor: marcas de asistencia y puntos GPS en IndexedDB.
+//
+// La usa service-worker.js (importScripts) y, si todavía no hay un service
+// worker controlando la página (primera visita, localhost), la propia página.
+// Cada operación lleva un id generado aquí y la hora original; el servidor
+// (/conductor/sincronizar) es idempotente por id, así que reenviar un lote
+// que ya llegó no duplica nada. Las operaciones con resultado (también las
+// rechazadas) se borran; las que el servidor no acepta ni responde pasan al
+// almacén 'apartadas' para no reintentar para siempre el mismo lote.
+(function (global) {
+    const BD = 'camley-offline';
+    const ALMACEN = 'operaciones';
+    const APARTADAS = 'apartadas';
+    const URL_SINCRONIZAR = '/conductor/sincronizar';
+    const LOTE = 500;
+
+    let conexion = null;
+    let sincronizando = null;
+
+    function abrir() {
+        if (!conexion) {
+            conexion = new Promise((resolve, reject) => {
+                const peticion = indexedDB.open(BD, 2);
+                peticion.onupgradeneeded = () => {
+                    const bd = peticion.result;
+                    if (!bd.objectStoreNames.contains(ALMACEN)) {
+                        bd.createObjectStore(ALMACEN, { keyPath: 'id' }).createIndex('fecha', 'fecha');
+                    }
+                    if (!bd.objectStoreNames.contains(APARTADAS)) {
+                        bd.createObjectStore(APARTADAS, { keyPath: 'id' });
+                    }
+                };
+                peticion.onsuccess = () => resolve(peticion.result);
+                peticion.onerror = () => {
+                    conexion = null;
+                    reject(peticion.error);
+                };
+            });
+        }
+        return conexion;
+    }
+
+    // `trabajo` recibe el almacén, o la transacción si se piden varios
+    function transaccion(modo, trabajo, almacenes) {
+        return abrir().then(bd => new Promise((resolve, reject) => {
+            const tx = bd.transaction(almacenes || ALMACEN, modo);
+            const resultado = trabajo(almacenes ? tx : tx.objectStore(ALMACEN));
+            tx.oncomplete = () => resolve(resultado && 'result' in resultado ? resultado.result : resultado);
+            tx.onerror = () => reject(tx.error);
+            tx.onabort = () => reject(tx.error);
+        }));
+    }
+
+    function nuevoId() {
+        if (global.crypto && global.crypto.randomUUID) {
+            return global.crypto.randomUUID();
+        }
+        return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2, 12);
+    }
+
+    function contar() {
+        return transaccion('readonly', almacen => almacen.count());
+    }
+
+    // operaciones: [{ id, tipo: 'asistencia'|'ubicacion', fecha (epoch ms), datos }]
+    function encolar(operaciones) {
+        return transaccion('readwrite', almacen => {
+            operaciones.forEach(op => almacen.put(op));
+        }).then(contar);
+    }
+
+    // Las operaciones más antiguas primero
+    function siguienteLote() {
+        return transaccion('readonly', almacen => {
+            const lote = [];
+            almacen.index('fecha').openCursor().onsuccess = event => {
+                const cursor = event.target.result;
+                if (cursor && lote.length < LOTE) {
+                    lote.push(cursor.value);
+                    cursor.continue();
+                }
+            };
+            return lote;
+        });
+    }
+
+    function eliminar(ids) {
+        return transaccion('readwrite', almacen => {
+            ids.forEach(id => almacen.delete(id));
+        });
+    }
+
+    // Sacar de la cola operaciones que no se pueden aplicar, guardando el motivo
+    function apartar(operaciones, motivo) {
+        return transaccion('readwrite', tx => {
+            const apartadas = tx.objectStore(APARTADAS);
+            const cola = tx.objectStore(ALMACEN);
+            operaciones.forEach(op => {
+                apartadas.put(Object.assign({}, op, { motivo: motivo, apartada: Date.now() }));
+                cola.delete(op.id);
+            });
+        }, [ALMACEN, APARTADAS]);
+    }
+
+    function leerJson(respuesta) {
+        return respuesta.json().catch(() => null);
+    }
+
+    // Enviar la cola en lotes de LOTE; una sola petición si caben todas.
+    // Si ya hay una sincronización en curso se devuelve esa misma.
+    function sincronizar() {
+        if (sincronizando) {
+            return sincronizando;
+        }
+        sincronizando = (async () => {
+            let enviadas = 0;
+            let apartadas = 0;
+            for (;;) {
+                const lote = await siguienteLote();
+                if (!lote.length) {
+                    break;
+                }
+                const respuesta = await fetch(URL_SINCRONIZAR, {
+                    method: 'POST',
+                    credentials: 'same-origin',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ operaciones: lote })
+                });
+                if (respuesta.status === 409) {
+                    break;  // el mismo lote se está aplicando en otra petición; se reintenta luego
+                }
+                const data = await leerJson(respuesta);
+                if (respuesta.status === 400 && data && data.success === false) {
+                    // El servidor no acepta el lote tal como está: reintentarlo no cambia nada
+                    await apartar(lote, data.error || 'Lote rechazado');
+                    apartadas += lote.length;
+                } else if (!data || !data.success) {
+                    // Error del servidor o sesión vencida: se reintenta en la próxima sincronización
+                    throw new Error((data && data.error) || 'Error sincronizando');
+                } else {
+                    // Todos los resultados son definitivos (también descartada/rechazada)
+                    const respondidas = new Set(data.resultados.map(r => String(r.id)));
+                    await eliminar(lote.filter(op => respondidas.has(String(op.id))).map(op => op.id));
+                    const sinRespuesta = lote.filter(op => !respondidas.has(String(op.id)));
+                    if (sinRespuesta.length) {
+                        await apartar(sinRespuesta, 'Sin resultado del servidor');
+                        apartadas += sinRespuesta.length;
+                    }
+                    enviadas += respondidas.size;
+                }
+                if (lote.length < LOTE) {
+                    break;
+                }
+            }
+            return { enviadas: enviadas, apartadas: apartadas, pendientes: await contar() };
+        })().finally(() => {
+            sincronizando = null;
+        });
+        return sincronizando;
+    }
+
+    global.ColaOffline = { nuevoId, encolar, contar, sincronizar };
+})(self);
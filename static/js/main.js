@@ -155,42 +155,6 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
     
-    // Panel de padres - Seguimiento
-    if (document.querySelector('.padres-dashboard')) {
-        console.log('👨‍👧 Panel de padres detectado');
-        
-        // Actualizar ubicación del vehículo
-        const updateVehicleLocation = (estudianteId) => {
-            if (!estudianteId) return;
-            
-            fetch(`/api/ubicacion/estudiante/${estudianteId}`)
-                .then(response => response.json())
-                .then(data => {
-                    if (data.success && data.ubicacion) {
-                        // Actualizar en la interfaz
-                        const locationElement = document.getElementById(`vehicle-location-${estudianteId}`);
-                        if (locationElement) {
-                            locationElement.innerHTML = 
-                                `📍 Lat: ${data.ubicacion.lat.toFixed(4)}, Lng: ${data.ubicacion.lng.toFixed(4)}`;
-                        }
-                        
-                        // Actualizar mapa
-                        if (window.updateVehicleOnMap && data.ubicacion) {
-                            window.updateVehicleOnMap(data.ubicacion.lat, data.ubicacion.lng);
-                        }
-                    }
-                })
-                .catch(error => console.error('Error actualizando ubicación:', error));
-        };
-        
-        // Configurar actualizaciones periódicas
-        document.querySelectorAll('[data-estudiante-id]').forEach(element => {
-            const estudianteId = element.getAttribute('data-estudiante-id');
-            // Actualizar cada 10 segundos
-            setInterval(() => updateVehicleLocation(estudianteId), 10000);
-        });
-    }
-    
     // ============ NOTIFICACIONES PUSH (SIMULACIÓN) ============
     
     // Solicitar permisos para notificaciones
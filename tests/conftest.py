@@ -0,0 +1,73 @@
+"""
+Configuración común de las pruebas.
+
+database.py lee DATABASE_URL al importarse, así que la base SQLite temporal
+se fija aquí antes de importar la aplicación; las bases de instance/ y
+data/ no se tocan.
+"""
+
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+_DIRECTORIO = tempfile.mkdtemp(prefix='camley-pruebas-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_DIRECTORIO, 'pruebas.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as aplicacion  # noqa: E402
+from database import db, Usuario, Estudiante, Ruta  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    aplicacion.config['TESTING'] = True
+    with aplicacion.app_context():
+        yield aplicacion
+        db.session.remove()
+
+
+@pytest.fixture
+def cliente_admin(app):
+    cliente = app.test_client()
+    respuesta = cliente.post('/login', data={'email': 'admin@camley.com', 'password': 'admin123'})
+    assert respuesta.status_code == 302
+    return cliente
+
+
+@pytest.fixture
+def conductor(app):
+    """Conductor nuevo para cada prueba: (cliente con la sesión iniciada, id)"""
+    email = f'conductor{uuid.uuid4().hex}@pruebas.com'
+    usuario = Usuario(nombre='Conductor pruebas', email=email, password='clave', rol='conductor', activo=True)
+    db.session.add(usuario)
+    db.session.commit()
+    cliente = app.test_client()
+    respuesta = cliente.post('/login', data={'email': email, 'password': 'clave'})
+    assert respuesta.status_code == 302
+    return cliente, usuario.id
+
+
+@pytest.fixture
+def ruta(conductor):
+    """Ruta del conductor con dos padres: el primero con dos hijos, el segundo con uno"""
+    _, conductor_id = conductor
+    sufijo = uuid.uuid4().hex[:8]
+    ruta = Ruta(nombre=f'Ruta {sufijo}', conductor_id=conductor_id, activa=True)
+    padres = [Usuario(nombre=f'Padre {i} {sufijo}', email=f'padre{i}{sufijo}@pruebas.com', password='clave',
+                      rol='padre', activo=True) for i in range(2)]
+    db.session.add_all([ruta] + padres)
+    db.session.flush()
+    estudiantes = [Estudiante(nombre=f'Hijo {i} {sufijo}', grado='1', edad=7, padre_id=padre.id,
+                              ruta_id=ruta.id, activo=True)
+                   for i, padre in enumerate([padres[0], padres[0], padres[1]])]
+    db.session.add_all(estudiantes)
+    db.session.commit()
+    return {
+        'id': ruta.id,
+        'conductor_id': conductor_id,
+        'padres': [p.id for p in padres],
+        'estudiantes': [e.id for e in estudiantes],
+    }
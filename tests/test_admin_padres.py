@@ -0,0 +1,65 @@
+"""admin_padres debe hacer la misma cantidad de consultas con 1 o con N padres."""
+
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from database import db, Usuario, Estudiante, Ruta, Vehiculo, Pago
+
+
+@contextmanager
+def contar_consultas():
+    """Cuenta las sentencias SQL ejecutadas en este hilo (los hilos de fondo no cuentan)"""
+    hilo = threading.get_ident()
+    conteo = {'consultas': 0}
+
+    def antes(conn, cursor, sentencia, parametros, contexto, varias):
+        if threading.get_ident() == hilo:
+            conteo['consultas'] += 1
+
+    event.listen(db.engine, 'before_cursor_execute', antes)
+    try:
+        yield conteo
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', antes)
+
+
+def crear_padres(cantidad, desde=0):
+    """Padres activos con dos hijos cada uno, en una ruta con vehículo y con dos pagos por hijo"""
+    ahora = datetime.utcnow()
+    for i in range(desde, desde + cantidad):
+        vehiculo = Vehiculo(placa=f'PR-{i:04d}', modelo='Bus', capacidad=30)
+        ruta = Ruta(nombre=f'Ruta prueba {i}', vehiculo=vehiculo)
+        padre = Usuario(nombre=f'Padre {i}', email=f'padre{i}@pruebas.com', password='x',
+                        rol='padre', activo=True)
+        db.session.add_all([vehiculo, ruta, padre])
+        db.session.flush()
+        for h in range(2):
+            hijo = Estudiante(nombre=f'Hijo {i}-{h}', grado='1', padre_id=padre.id, ruta_id=ruta.id)
+            db.session.add(hijo)
+            db.session.flush()
+            for semanas in (1, 2):
+                db.session.add(Pago(estudiante_id=hijo.id, monto=50, estado='pendiente',
+                                    fecha_vencimiento=ahora + timedelta(weeks=semanas)))
+    db.session.commit()
+
+
+def consultas_admin_padres(cliente):
+    with contar_consultas() as conteo:
+        respuesta = cliente.get('/admin/padres')
+    assert respuesta.status_code == 200
+    return conteo['consultas'], respuesta.get_data(as_text=True)
+
+
+def test_admin_padres_consultas_constantes(app, cliente_admin):
+    crear_padres(1)
+    con_uno, html = consultas_admin_padres(cliente_admin)
+    assert 'Hijo 0-1' in html
+
+    crear_padres(9, desde=1)
+    con_diez, html = consultas_admin_padres(cliente_admin)
+    assert 'Hijo 9-1' in html
+
+    assert con_diez == con_uno
@@ -0,0 +1,56 @@
+"""Dashboard de admin: dos consultas, caché con TTL e invalidación al escribir."""
+
+from contextlib import contextmanager
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event
+
+from app import resumen_dashboard, invalidar_resumen_dashboard
+from database import db, Estudiante, Ruta, Usuario, Pago
+
+
+@contextmanager
+def contar_consultas():
+    consultas = []
+
+    def anotar(conn, cursor, sentencia, *args):
+        consultas.append(sentencia)
+
+    event.listen(db.engine, 'before_cursor_execute', anotar)
+    try:
+        yield consultas
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', anotar)
+
+
+def test_contadores_en_una_consulta(app):
+    invalidar_resumen_dashboard()
+    with contar_consultas() as consultas:
+        datos = resumen_dashboard()
+    # Los contadores y los últimos pagos con su estudiante
+    assert len(consultas) == 2
+
+    assert datos['estudiantes'] == Estudiante.query.count()
+    assert datos['rutas'] == Ruta.query.filter_by(activa=True).count()
+    assert datos['conductores'] == Usuario.query.filter_by(rol='conductor', activo=True).count()
+    assert datos['pagos_pendientes'] == Pago.query.filter_by(estado='pendiente').count()
+    assert datos['pagos_vencidos'] == Pago.query.filter(Pago.estado == 'pendiente',
+                                                        Pago.fecha_vencimiento < datetime.utcnow()).count()
+    assert len(datos['ultimos_pagos']) == min(5, Pago.query.count())
+
+    with contar_consultas() as consultas:
+        assert resumen_dashboard() is datos
+    assert consultas == []
+
+
+def test_escribir_invalida_el_cache(cliente_admin):
+    assert cliente_admin.get('/admin/dashboard').status_code == 200
+    antes = resumen_dashboard()
+    respuesta = cliente_admin.post('/admin/finanzas/agregar_gasto',
+                                   data={'descripcion': 'Peaje', 'monto': '7.5', 'categoria': 'otros'})
+    assert respuesta.get_json()['success'] is True
+
+    despues = resumen_dashboard()
+    assert despues is not antes
+    assert despues['gastos_semana'] == pytest.approx(antes['gastos_semana'] + 7.5)
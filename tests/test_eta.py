@@ -0,0 +1,88 @@
+"""ETA: el viaje solo avanza, los tramos vividos corrigen el modelo y el aprendizaje se reclama una vez."""
+
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import eta
+from database import db, Estudiante, EstadoEtaRuta, UbicacionHistorial
+
+# Tres paradas hacia el sur, a unos 1100 m una de otra
+PARADAS = [(-12.00, -77.0), (-12.01, -77.0), (-12.02, -77.0)]
+
+
+@pytest.fixture
+def ruta_con_paradas(ruta, monkeypatch):
+    # Sin hilo de aprendizaje: cada prueba lo llama a mano
+    monkeypatch.setattr(eta.aprendizaje_eta, 'despertar', lambda: None)
+    for orden, (estudiante_id, (lat, lng)) in enumerate(zip(ruta['estudiantes'], PARADAS), 1):
+        estudiante = db.session.get(Estudiante, estudiante_id)
+        estudiante.parada_lat, estudiante.parada_lng, estudiante.orden_parada = lat, lng, orden
+    db.session.commit()
+    return ruta
+
+
+def punto(indice, fecha):
+    lat, lng = PARADAS[indice]
+    return {'lat': lat, 'lng': lng, 'fecha': fecha}
+
+
+def test_secuencia_respeta_el_orden(ruta_con_paradas):
+    paradas = eta.secuencia_paradas(ruta_con_paradas['id'])
+    assert [(p['lat'], p['lng']) for p in paradas] == PARADAS
+    assert [p['estudiantes'] for p in paradas] == [[e] for e in ruta_con_paradas['estudiantes']]
+
+
+def test_viaje_avanza_y_aprende_en_vivo(ruta_con_paradas):
+    ruta_id, conductor_id = ruta_con_paradas['id'], ruta_con_paradas['conductor_id']
+    motor = eta.MotorETA()
+    inicio = datetime(2026, 3, 2, 7, 0)
+    motor.procesar(conductor_id, [punto(0, inicio), punto(1, inicio + timedelta(seconds=200))])
+
+    fila = db.session.get(EstadoEtaRuta, ruta_id, populate_existing=True)
+    assert fila.siguiente == 2 and fila.modelo_fecha is None
+    assert json.loads(fila.segmentos) == [200.0, None]
+
+    # Un punto viejo que llega tarde no hace retroceder el viaje
+    motor.procesar(conductor_id, [punto(0, inicio + timedelta(seconds=100))])
+    estimacion = motor.estimacion(ruta_id, conductor_id)
+    assert estimacion['siguiente_parada'] == 3
+    assert [p['pasada'] for p in estimacion['paradas']] == [True, True, False]
+    assert estimacion['paradas'][2]['segundos'] > 0
+
+    # Otra pasada por el mismo tramo se mezcla con media móvil
+    otro = inicio + timedelta(hours=2)
+    motor.procesar(conductor_id, [punto(0, otro), punto(1, otro + timedelta(seconds=300))])
+    fila = db.session.get(EstadoEtaRuta, ruta_id, populate_existing=True)
+    assert json.loads(fila.segmentos)[0] == pytest.approx(0.7 * 200 + 0.3 * 300)
+
+    # Tras una pausa larga empieza un viaje nuevo
+    motor.procesar(conductor_id, [{'lat': -11.9, 'lng': -77.0, 'fecha': otro + timedelta(hours=1)}])
+    assert db.session.get(EstadoEtaRuta, ruta_id, populate_existing=True).siguiente == 0
+
+
+def test_aprender_pendientes_usa_la_mediana(ruta_con_paradas):
+    ruta_id, conductor_id = ruta_con_paradas['id'], ruta_con_paradas['conductor_id']
+    ahora = datetime(2021, 6, 10, 12, 0)
+    for dia, tramos in ((8, (100, 200)), (9, (140, 220))):
+        inicio = datetime(2021, 6, dia, 7, 0)
+        for indice, segundos in enumerate((0, tramos[0], tramos[0] + tramos[1])):
+            lat, lng = PARADAS[indice]
+            db.session.add(UbicacionHistorial(conductor_id=conductor_id, lat=lat, lng=lng,
+                                              fecha=inicio + timedelta(seconds=segundos)))
+    db.session.add(EstadoEtaRuta(ruta_id=ruta_id, conductor_id=conductor_id,
+                                 firma=eta.firma_paradas(eta.secuencia_paradas(ruta_id))))
+    db.session.commit()
+
+    assert eta.aprender_pendientes(ahora) >= 1
+    fila = db.session.get(EstadoEtaRuta, ruta_id, populate_existing=True)
+    assert json.loads(fila.segmentos) == [120, 210] and fila.modelo_fecha == ahora
+    # La velocidad solo cuenta tramos de hasta 120 s entre puntos: el de 100 s
+    assert fila.velocidad == pytest.approx(1111.95 / 100, rel=0.01)
+
+    # Ya reclamada y vigente: la siguiente pasada no la vuelve a aprender
+    fila.segmentos = json.dumps([1, 1])
+    db.session.commit()
+    eta.aprender_pendientes(ahora + timedelta(minutes=5))
+    assert json.loads(db.session.get(EstadoEtaRuta, ruta_id, populate_existing=True).segmentos) == [1, 1]
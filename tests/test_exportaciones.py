@@ -0,0 +1,170 @@
+"""Exportación Parquet: el archivo que arma escritor_parquet debe poder leerse.
+
+La lectura completa usa pyarrow (dependencia opcional de las pruebas:
+`pip install pyarrow`); sin pyarrow esas pruebas se saltan y queda la
+verificación del pie, que decodifica el Thrift a mano.
+"""
+
+import io
+import struct
+import uuid
+from datetime import date, datetime, time
+
+import pytest
+
+import exportaciones
+from database import db, Estudiante, Asistencia, Pago
+from escritor_parquet import EscritorParquet, MAGIA, INT64, DOUBLE, BYTE_ARRAY, BOOLEAN, INT32
+
+COLUMNAS = [
+    ('id', 'entero'),
+    ('monto', 'decimal'),
+    ('nombre', 'texto'),
+    ('pagado', 'booleano'),
+    ('dia', 'fecha'),
+    ('momento', 'fecha_hora'),
+    ('hora', 'hora'),
+]
+
+FILAS = [
+    (1, 10.5, 'Ñandú', True, date(2024, 2, 29), datetime(2024, 2, 29, 13, 45, 1, 123000), time(7, 5, 9, 250000)),
+    (2, None, None, False, None, None, None),
+    (None, -3.25, '', None, date(1969, 12, 31), datetime(1970, 1, 1), time(0, 0)),
+    (2 ** 40, 0.0, 'x' * 300, True, date(2100, 1, 1), datetime(2038, 1, 19, 3, 14, 8), time(23, 59, 59, 999000)),
+]
+
+
+def parquet(columnas, filas, filas_grupo):
+    return b''.join(exportaciones.parquet_por_partes(columnas, [filas], filas_grupo))
+
+
+# ==================== THRIFT COMPACT (solo lo que escribe el escritor) ====================
+
+def _varint(datos, i):
+    n = desplazamiento = 0
+    while True:
+        byte = datos[i]
+        i += 1
+        n |= (byte & 0x7F) << desplazamiento
+        desplazamiento += 7
+        if byte < 0x80:
+            return n, i
+
+
+def _valor(datos, i, tipo):
+    if tipo in (5, 6):
+        n, i = _varint(datos, i)
+        return (n >> 1) ^ -(n & 1), i
+    if tipo == 8:
+        largo, i = _varint(datos, i)
+        return datos[i:i + largo], i + largo
+    if tipo == 9:
+        cabecera = datos[i]
+        i += 1
+        cantidad, elemento = cabecera >> 4, cabecera & 0x0F
+        if cantidad == 15:
+            cantidad, i = _varint(datos, i)
+        lista = []
+        for _ in range(cantidad):
+            valor, i = _valor(datos, i, elemento)
+            lista.append(valor)
+        return lista, i
+    if tipo == 12:
+        return _struct(datos, i)
+    raise AssertionError(f'tipo thrift inesperado {tipo}')
+
+
+def _struct(datos, i=0):
+    campos, campo = {}, 0
+    while datos[i]:
+        campo += datos[i] >> 4
+        tipo = datos[i] & 0x0F
+        campos[campo], i = _valor(datos, i + 1, tipo)
+    return campos, i + 1
+
+
+def pie(archivo):
+    assert archivo[:4] == MAGIA and archivo[-4:] == MAGIA
+    largo = struct.unpack('<I', archivo[-8:-4])[0]
+    metadatos, fin = _struct(archivo[-8 - largo:-8])
+    assert fin == largo
+    return metadatos
+
+
+# ==================== PRUEBAS ====================
+
+def test_pie_describe_esquema_y_grupos():
+    archivo = parquet(COLUMNAS, FILAS, filas_grupo=3)
+    metadatos = pie(archivo)
+
+    assert metadatos[1] == 1
+    raiz, *esquema = metadatos[2]
+    assert raiz[4] == b'schema' and raiz[5] == len(COLUMNAS)
+    assert [(c[4].decode(), c[1]) for c in esquema] == [
+        ('id', INT64), ('monto', DOUBLE), ('nombre', BYTE_ARRAY), ('pagado', BOOLEAN),
+        ('dia', INT32), ('momento', INT64), ('hora', INT32)]
+    assert metadatos[3] == len(FILAS)
+    assert [g[3] for g in metadatos[4]] == [3, 1]
+
+    # Cada columna apunta a la cabecera de su página, con tantos valores como filas
+    for grupo in metadatos[4]:
+        for (nombre, _), columna in zip(COLUMNAS, grupo[1]):
+            meta = columna[3]
+            assert meta[3] == [nombre.encode()]
+            pagina, _ = _struct(archivo, meta[9])
+            assert pagina[5][1] == grupo[3] == meta[5]
+
+
+def test_archivo_vacio():
+    metadatos = pie(parquet(COLUMNAS, [], filas_grupo=10))
+    assert metadatos[3] == 0 and metadatos[4] == []
+
+
+def test_lectura_con_pyarrow():
+    pq = pytest.importorskip('pyarrow.parquet')
+    tabla = pq.read_table(io.BytesIO(parquet(COLUMNAS, FILAS, filas_grupo=3)))
+
+    assert tabla.column_names == [nombre for nombre, _ in COLUMNAS]
+    leidas = [tuple(f.values()) for f in tabla.to_pylist()]
+    # fecha_hora se guarda como TIMESTAMP en UTC
+    leidas = [f[:5] + (f[5].replace(tzinfo=None) if f[5] else None,) + f[6:] for f in leidas]
+    assert leidas == FILAS
+
+
+def test_muchas_columnas_y_filas_con_pyarrow():
+    pq = pytest.importorskip('pyarrow.parquet')
+    columnas = [(f'c{i}', 'entero') for i in range(20)]
+    filas = [tuple(None if (r + i) % 7 == 0 else r * i for i in range(20)) for r in range(1000)]
+    tabla = pq.read_table(io.BytesIO(parquet(columnas, filas, filas_grupo=400)))
+    assert [tuple(f.values()) for f in tabla.to_pylist()] == filas
+
+
+def test_exportar_asistencias_y_pagos_con_pyarrow(app):
+    pq = pytest.importorskip('pyarrow.parquet')
+    estudiante = Estudiante(nombre=f'Exportado {uuid.uuid4().hex[:6]}', grado='3')
+    db.session.add(estudiante)
+    db.session.flush()
+    db.session.add_all([
+        Asistencia(estudiante_id=estudiante.id, fecha=date(2019, 5, 6), hora=time(7, 10),
+                   estado='presente', observaciones='Con mochila nueva'),
+        Asistencia(estudiante_id=estudiante.id, fecha=date(2019, 5, 7), estado='ausente'),
+        Pago(estudiante_id=estudiante.id, monto=120.5, estado='pagado', fecha_vencimiento=datetime(2019, 5, 6),
+             fecha_pago=datetime(2019, 5, 5, 10, 0), visto_padre=True),
+        Pago(estudiante_id=estudiante.id, monto=120.5, estado='pendiente', fecha_vencimiento=datetime(2019, 5, 7)),
+    ])
+    db.session.commit()
+
+    desde, hasta = date(2019, 5, 6), date(2019, 5, 7)
+    asistencias = pq.read_table(io.BytesIO(b''.join(
+        exportaciones.exportar('asistencias', 'parquet', desde, hasta)))).to_pylist()
+    propias = [a for a in asistencias if a['estudiante_id'] == estudiante.id]
+    assert [(a['fecha'], a['hora'], a['estado'], a['observaciones']) for a in propias] == [
+        (date(2019, 5, 6), time(7, 10), 'presente', 'Con mochila nueva'),
+        (date(2019, 5, 7), None, 'ausente', None)]
+
+    pagos = pq.read_table(io.BytesIO(b''.join(
+        exportaciones.exportar('pagos', 'parquet', desde, hasta)))).to_pylist()
+    propios = [p for p in pagos if p['estudiante_id'] == estudiante.id]
+    assert [(p['monto'], p['estado'], p['fecha_pago'] and p['fecha_pago'].replace(tzinfo=None), p['visto_padre'])
+            for p in propios] == [(120.5, 'pagado', datetime(2019, 5, 5, 10, 0), True),
+                                  (120.5, 'pendiente', None, False)]
@@ -0,0 +1,74 @@
+"""Resumen diario de finanzas: los totales acumulados coinciden con un recálculo completo."""
+
+import uuid
+from datetime import date, datetime
+
+import pytest
+
+import finanzas
+from app import obtener_semana_actual, obtener_mes_actual
+from database import db, Gasto, ResumenFinanzasDia
+
+
+@pytest.fixture
+def concepto():
+    # Cada prueba con su propio concepto: la base es compartida
+    return f'prueba-{uuid.uuid4().hex[:8]}'
+
+
+def por_concepto(concepto):
+    return {tipo: (round(total, 2), cantidad) for tipo, c, total, cantidad in finanzas.totales_por_concepto()
+            if c == concepto}
+
+
+def diferencias_de(concepto):
+    return [d for d in finanzas.verificar(db.session.connection()) if d[2] == concepto]
+
+
+def test_altas_y_bajas_mantienen_el_resumen(cliente_admin, concepto):
+    ids = [cliente_admin.post('/admin/finanzas/agregar_ingreso',
+                              data={'descripcion': 'Aporte', 'monto': monto, 'fuente': concepto}
+                              ).get_json()['ingreso_id'] for monto in ('100.25', '49.75', '30')]
+    gasto = cliente_admin.post('/admin/finanzas/agregar_gasto',
+                               data={'descripcion': 'Llantas', 'monto': '40.10', 'categoria': concepto}).get_json()
+    assert gasto['success'] is True
+    assert cliente_admin.post(f'/admin/finanzas/ingresos/{ids[2]}/eliminar').get_json()['success'] is True
+
+    assert por_concepto(concepto) == {'ingreso': (150.0, 2), 'gasto': (40.1, 1)}
+    assert diferencias_de(concepto) == []
+    respuesta = cliente_admin.get('/api/admin/finanzas/verificar').get_json()
+    assert all(d['concepto'] != concepto for d in respuesta['diferencias'])
+
+
+def test_verificar_detecta_y_recalcular_corrige(cliente_admin, concepto):
+    # Un gasto escrito sin pasar por acumular(): el resumen queda desfasado
+    db.session.add(Gasto(descripcion='Sin resumen', monto=12.5, categoria=concepto, fecha=datetime(2024, 2, 3, 9)))
+    db.session.commit()
+    assert diferencias_de(concepto) == [(date(2024, 2, 3), 'gasto', concepto, 0, 12.5)]
+    respuesta = cliente_admin.get('/api/admin/finanzas/verificar').get_json()
+    assert respuesta['coincide'] is False
+    assert {'dia': '2024-02-03', 'tipo': 'gasto', 'concepto': concepto, 'resumen': 0, 'real': 12.5} \
+        in respuesta['diferencias']
+
+    assert cliente_admin.post('/api/admin/finanzas/recalcular').get_json()['success'] is True
+    assert cliente_admin.get('/api/admin/finanzas/verificar').get_json()['coincide'] is True
+    assert por_concepto(concepto) == {'gasto': (12.5, 1)}
+
+
+def test_acumular_suma_sobre_la_misma_fila(app, concepto):
+    inicio_semana, inicio_mes = obtener_semana_actual()[0], obtener_mes_actual()[0]
+    antes = finanzas.totales_periodos(inicio_semana, inicio_mes)['ingreso']
+    for monto in (10, 5.5, -3):
+        finanzas.acumular('ingreso', concepto, datetime(2000, 1, 1, 8), monto, 1 if monto > 0 else -1)
+    db.session.commit()
+
+    assert ResumenFinanzasDia.query.filter_by(concepto=concepto).count() == 1
+    assert por_concepto(concepto) == {'ingreso': (12.5, 1)}
+    # Un día viejo suma al histórico pero no al mes ni a la semana
+    despues = finanzas.totales_periodos(inicio_semana, inicio_mes)['ingreso']
+    assert despues['total'] == pytest.approx(antes['total'] + 12.5)
+    assert (despues['mes'], despues['semana']) == (pytest.approx(antes['mes']), pytest.approx(antes['semana']))
+
+    # Deshacer lo que no viene de la tabla ingreso para no desfasar la base compartida
+    ResumenFinanzasDia.query.filter_by(concepto=concepto).delete()
+    db.session.commit()
@@ -0,0 +1,70 @@
+"""Geocercas: sin evento al encender dentro, antirrebote en el borde y puntos atrasados."""
+
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from database import db, Geocerca, Ruta, EstadoGeocerca, UbicacionHistorial
+from geocercas import MotorGeocercas
+
+DENTRO = (-12.0, -77.0)
+FUERA = (-12.01, -77.0)
+INICIO = datetime(2026, 4, 6, 7, 0)
+
+
+def cuadrado(lat, lng, lado=0.001):
+    return json.dumps([[lat - lado, lng - lado], [lat - lado, lng + lado],
+                       [lat + lado, lng + lado], [lat + lado, lng - lado]])
+
+
+@pytest.fixture
+def escuela(ruta):
+    otra = Ruta(nombre=f'Otra {ruta["id"]}', activa=True)
+    db.session.add(otra)
+    db.session.flush()
+    propia = Geocerca(nombre='Escuela', tipo='escuela', poligono=cuadrado(*DENTRO), ruta_id=ruta['id'])
+    ajena = Geocerca(nombre='Ajena', tipo='escuela', poligono=cuadrado(*DENTRO), ruta_id=otra.id)
+    db.session.add_all([propia, ajena])
+    db.session.commit()
+    return {'conductor_id': ruta['conductor_id'], 'id': propia.id, 'ajena': ajena.id}
+
+
+def pasar(motor, conductor_id, *puntos):
+    """Como publicar_ubicaciones: el lote ya está en el historial cuando se procesa"""
+    lote = [{'lat': lat, 'lng': lng, 'fecha': INICIO + timedelta(seconds=s)} for s, (lat, lng) in puntos]
+    db.session.execute(UbicacionHistorial.__table__.insert(), [dict(p, conductor_id=conductor_id) for p in lote])
+    eventos = motor.procesar(conductor_id, lote)
+    db.session.commit()
+    return [(e['geocerca_id'], e['evento'], int((e['fecha'] - INICIO).total_seconds())) for e in eventos]
+
+
+def test_encender_dentro_no_es_llegada(escuela):
+    motor, conductor_id = MotorGeocercas(), escuela['conductor_id']
+    assert pasar(motor, conductor_id, (0, DENTRO)) == []
+    # Solo la geocerca de su ruta
+    assert motor.dentro(conductor_id) == {escuela['id']}
+
+
+def test_antirrebote_en_el_borde(escuela):
+    motor, conductor_id, g = MotorGeocercas(), escuela['conductor_id'], escuela['id']
+    pasar(motor, conductor_id, (0, DENTRO))
+    assert pasar(motor, conductor_id, (60, FUERA)) == [(g, 'salida', 60)]
+    # Vuelve a entrar a los 30 s del aviso: se ignora y sigue fuera
+    assert pasar(motor, conductor_id, (90, DENTRO)) == []
+    assert motor.dentro(conductor_id) == set()
+    # Pasado SEGUNDOS_ENTRE_EVENTOS el mismo cambio sí avisa, una sola vez
+    assert pasar(motor, conductor_id, (200, DENTRO), (210, DENTRO)) == [(g, 'entrada', 200)]
+    estado = EstadoGeocerca.query.filter_by(conductor_id=conductor_id, geocerca_id=g).one()
+    assert estado.dentro is True and estado.ultimo_evento == INICIO + timedelta(seconds=200)
+
+
+def test_puntos_atrasados_y_pausas(escuela):
+    motor, conductor_id, g = MotorGeocercas(), escuela['conductor_id'], escuela['id']
+    pasar(motor, conductor_id, (0, DENTRO), (600, DENTRO))
+    # Un lote offline más viejo que lo ya procesado no avisa ni cambia el estado
+    assert pasar(motor, conductor_id, (300, FUERA)) == []
+    assert motor.dentro(conductor_id) == {g}
+    # Tras una pausa larga el primer punto solo fija el estado
+    assert pasar(motor, conductor_id, (600 + 3600, FUERA)) == []
+    assert motor.dentro(conductor_id) == set()
@@ -0,0 +1,48 @@
+"""API de historial de un conductor: ventanas de fechas y validación."""
+
+import uuid
+from datetime import datetime
+
+import pytest
+
+from database import db, Usuario, UbicacionHistorial
+
+
+@pytest.fixture
+def conductor_id(app):
+    conductor = Usuario(nombre='Conductor historial', email=f'hist{uuid.uuid4().hex}@pruebas.com',
+                        password='x', rol='conductor', activo=True)
+    db.session.add(conductor)
+    db.session.flush()
+    for hora in (6, 12, 23):
+        db.session.add(UbicacionHistorial(conductor_id=conductor.id, lat=-12.0 - hora / 1000, lng=-77.0,
+                                          fecha=datetime(2026, 9, 10, hora, 30)))
+    db.session.add(UbicacionHistorial(conductor_id=conductor.id, lat=-12.5, lng=-77.0,
+                                      fecha=datetime(2026, 9, 11, 0, 30)))
+    db.session.commit()
+    return conductor.id
+
+
+def test_hasta_sin_hora_incluye_todo_el_dia(cliente_admin, conductor_id):
+    respuesta = cliente_admin.get(f'/api/conductores/{conductor_id}/historial?desde=2026-09-10&hasta=2026-09-10')
+    assert respuesta.status_code == 200
+    fechas = [p['fecha'] for p in respuesta.get_json()['puntos']]
+    assert fechas == ['2026-09-10 06:30:00', '2026-09-10 12:30:00', '2026-09-10 23:30:00']
+
+
+def test_hasta_con_hora_es_exacto(cliente_admin, conductor_id):
+    respuesta = cliente_admin.get(
+        f'/api/conductores/{conductor_id}/historial?desde=2026-09-10&hasta=2026-09-10T12:30:00')
+    assert [p['fecha'] for p in respuesta.get_json()['puntos']] == ['2026-09-10 06:30:00', '2026-09-10 12:30:00']
+
+
+@pytest.mark.parametrize('consulta', ['hasta=garbage', 'desde=2026-13-01&hasta=2026-09-10'])
+def test_fecha_invalida_en_castellano(cliente_admin, conductor_id, consulta):
+    respuesta = cliente_admin.get(f'/api/conductores/{conductor_id}/historial?{consulta}')
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()['error'] == 'Fecha inválida'
+
+
+def test_desde_posterior_a_hasta(cliente_admin, conductor_id):
+    respuesta = cliente_admin.get(f'/api/conductores/{conductor_id}/historial?desde=2026-09-11&hasta=2026-09-10')
+    assert respuesta.status_code == 400
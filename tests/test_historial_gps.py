@@ -0,0 +1,74 @@
+"""Historial GPS: compactación por día, puntos tardíos y lectura mixta."""
+
+import json
+from datetime import date, datetime, timedelta
+
+import historial_gps
+from database import db, UbicacionHistorial, UbicacionHistorialDia
+
+
+def agregar(conductor_id, inicio, cantidad, paso_segundos=10):
+    """Puntos en línea recta hacia el norte: Douglas-Peucker deja los extremos"""
+    for i in range(cantidad):
+        db.session.add(UbicacionHistorial(conductor_id=conductor_id, lat=-12.0 + i * 0.0001, lng=-77.0,
+                                          fecha=inicio + timedelta(seconds=i * paso_segundos)))
+    db.session.commit()
+
+
+def test_simplificar_conserva_extremos_y_esquinas():
+    puntos = [[0, 0, 0], [0, 0.0005, 1], [0, 0.001, 2], [0.001, 0.001, 3]]
+    assert historial_gps.simplificar(puntos, 10) == [puntos[0], puntos[2], puntos[3]]
+    assert historial_gps.muestrear([[0, 0, t] for t in range(0, 100, 10)], 30) == \
+        [[0, 0, t] for t in (0, 30, 60, 90)]
+    assert historial_gps.a_epoch(datetime(1970, 1, 1, 0, 0, 1, 500000)) == 1.5
+
+
+def test_compactar_funde_puntos_tardios(conductor):
+    _, conductor_id = conductor
+    dia = date(2020, 1, 2)
+    agregar(conductor_id, datetime(2020, 1, 2, 7, 0), 20)
+
+    resumen = historial_gps.compactar(hoy=date(2020, 1, 20))
+    assert resumen['crudos'] >= 20
+    assert UbicacionHistorial.query.filter_by(conductor_id=conductor_id).count() == 0
+    fila = UbicacionHistorialDia.query.filter_by(conductor_id=conductor_id, dia=dia).one()
+    assert fila.cantidad_original == 20 and fila.cantidad == 2 == len(json.loads(fila.puntos))
+
+    # Un punto que llega tarde se mezcla con la fila existente, sin duplicarla
+    db.session.add(UbicacionHistorial(conductor_id=conductor_id, lat=-11.9, lng=-76.9,
+                                      fecha=datetime(2020, 1, 2, 9, 0)))
+    db.session.commit()
+    historial_gps.compactar(hoy=date(2020, 1, 20))
+    filas = UbicacionHistorialDia.query.filter_by(conductor_id=conductor_id).all()
+    assert len(filas) == 1 and filas[0].cantidad_original == 21 and filas[0].cantidad == 3
+
+    # Lo reciente no se toca
+    agregar(conductor_id, datetime(2020, 1, 19, 7, 0), 3)
+    historial_gps.compactar(hoy=date(2020, 1, 20))
+    assert UbicacionHistorial.query.filter_by(conductor_id=conductor_id).count() == 3
+
+
+def test_recorrido_mezcla_compactados_y_crudos(conductor):
+    _, conductor_id = conductor
+    agregar(conductor_id, datetime(2020, 2, 1, 7, 0), 10)
+    historial_gps.compactar(hoy=date(2020, 2, 20))
+    agregar(conductor_id, datetime(2020, 2, 15, 7, 0), 3)
+
+    puntos = historial_gps.recorrido(conductor_id, datetime(2020, 2, 1), datetime(2020, 2, 16))
+    fechas = [p[2] for p in puntos]
+    assert fechas == sorted(fechas) and len(puntos) == 2 + 3
+    assert fechas[0] == datetime(2020, 2, 1, 7, 0) and fechas[1] == datetime(2020, 2, 1, 7, 1, 30)
+
+    # El rango recorta dentro de los días compactados
+    assert historial_gps.recorrido(conductor_id, datetime(2020, 2, 1, 7, 1), datetime(2020, 2, 15, 7, 0)) == \
+        [puntos[1], puntos[2]]
+
+
+def test_retencion_borra_recorridos_viejos(conductor):
+    _, conductor_id = conductor
+    agregar(conductor_id, datetime(2001, 3, 1, 7, 0), 3)
+    historial_gps.compactar(hoy=date(2001, 3, 20))
+    assert UbicacionHistorialDia.query.filter_by(conductor_id=conductor_id).count() == 1
+    assert historial_gps.aplicar_retencion(hoy=date(2001, 3, 1) + timedelta(days=historial_gps.RETENCION_DIAS)) == 0
+    assert historial_gps.aplicar_retencion(hoy=date(2001, 3, 2) + timedelta(days=historial_gps.RETENCION_DIAS)) >= 1
+    assert UbicacionHistorialDia.query.filter_by(conductor_id=conductor_id).count() == 0
@@ -0,0 +1,78 @@
+"""Importación de estudiantes por CSV: validación por fila y primer pago."""
+
+import io
+import uuid
+from datetime import timedelta
+
+import app as modulo_app
+from database import db, Usuario, Estudiante, Pago
+
+
+def importar(cliente, texto, **campos):
+    datos = dict(campos, archivo=(io.BytesIO(texto.encode('utf-8')), 'estudiantes.csv'))
+    return cliente.post('/admin/estudiantes/importar', data=datos, content_type='multipart/form-data',
+                        headers={'X-Requested-With': 'XMLHttpRequest'})
+
+
+def csv_prueba(sufijo):
+    return (
+        'Nombre;Edad;Grado;Género;Escuela;Padre_email;Padre_nombre;Padre_password\n'
+        f'Ana {sufijo};7;2do;femenino;Colegio Sol;p{sufijo}@pruebas.com;Padre {sufijo};clave\n'
+        f'Luis {sufijo};siete;2do;masculino;Colegio Sol;;;\n'
+        f'Eva {sufijo};8;3ro;otro;Colegio Sol;;;\n'
+        f'Rita {sufijo};8;3ro;femenino;Colegio Sol;nuevo{sufijo}@pruebas.com;;\n'
+        f'Ana {sufijo};7;2do;femenino;Colegio Sol;p{sufijo}@pruebas.com;Padre {sufijo};clave\n'
+        f'Teo {sufijo};9;4to;masculino;Colegio Sol;;;\n'
+    )
+
+
+def test_filas_invalidas_se_informan_y_no_detienen_al_resto(app, cliente_admin):
+    sufijo = uuid.uuid4().hex[:8]
+    respuesta = importar(cliente_admin, csv_prueba(sufijo))
+    assert respuesta.status_code == 200
+    datos = respuesta.get_json()
+
+    assert datos['importados'] == 2 and datos['padres_creados'] == 1
+    assert [(e['fila'], e['error']) for e in datos['errores']] == [
+        (3, 'Edad inválida'),
+        (4, 'Género inválido (masculino o femenino)'),
+        (5, f'Padre nuevo{sufijo}@pruebas.com no registrado (indique padre_nombre y padre_password para crearlo)'),
+        (6, 'Estudiante repetido en el archivo'),
+    ]
+    padre = Usuario.query.filter_by(email=f'p{sufijo}@pruebas.com').one()
+    assert padre.rol == 'padre'
+    assert [e.nombre for e in Estudiante.query.filter_by(padre_id=padre.id)] == [f'Ana {sufijo}']
+    assert Usuario.query.filter_by(email=f'nuevo{sufijo}@pruebas.com').count() == 0
+
+
+def test_primer_pago_igual_que_el_alta_manual(app, cliente_admin):
+    sufijo = uuid.uuid4().hex[:8]
+    importar(cliente_admin, csv_prueba(sufijo))
+
+    estudiante = Estudiante.query.filter_by(nombre=f'Teo {sufijo}').one()
+    pago = Pago.query.filter_by(estudiante_id=estudiante.id).one()
+    assert pago.monto == modulo_app.MONTO_INSCRIPCION
+    assert pago.estado == 'pendiente' and pago.meses_cubiertos == 1
+    assert abs(pago.fecha_vencimiento - modulo_app.calcular_vencimiento(1)) < timedelta(minutes=1)
+
+
+def test_estudiante_existente_se_rechaza(app, cliente_admin):
+    sufijo = uuid.uuid4().hex[:8]
+    importar(cliente_admin, csv_prueba(sufijo))
+    datos = importar(cliente_admin, csv_prueba(sufijo)).get_json()
+    assert datos['importados'] == 0
+    assert (7, 'Estudiante ya existe con los mismos datos') in [(e['fila'], e['error']) for e in datos['errores']]
+
+
+def test_solo_validar_no_guarda(app, cliente_admin):
+    sufijo = uuid.uuid4().hex[:8]
+    datos = importar(cliente_admin, csv_prueba(sufijo), solo_validar='1').get_json()
+    assert datos['validos'] == 2 and datos['importados'] == 0
+    db.session.expire_all()
+    assert Estudiante.query.filter(Estudiante.nombre.like(f'% {sufijo}')).count() == 0
+
+
+def test_faltan_columnas_obligatorias(cliente_admin):
+    respuesta = importar(cliente_admin, 'nombre,edad\nAna,7\n')
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()['error'] == 'Faltan columnas obligatorias: grado, genero'
@@ -0,0 +1,64 @@
+"""Lista de asistencia en una petición: todo o nada, solo cambios y un aviso por padre."""
+
+import pytest
+
+from database import db, Asistencia, Estudiante, Notificacion
+from notificaciones_push import despachador_push
+
+
+@pytest.fixture(autouse=True)
+def sin_despachador(monkeypatch):
+    monkeypatch.setattr(despachador_push, 'despertar', lambda: None)
+
+
+def enviar(cliente, marcas):
+    respuesta = cliente.post('/conductor/asistencia/lista', json={
+        'asistencias': [{'estudiante_id': e, 'estado': estado} for e, estado in marcas]})
+    return respuesta.status_code, respuesta.get_json()
+
+
+def avisos(padre_id):
+    return [n.mensaje for n in Notificacion.query.filter_by(usuario_id=padre_id, tipo='asistencia')
+            .order_by(Notificacion.id)]
+
+
+def test_lista_completa_y_reenvio(ruta, conductor):
+    cliente, _ = conductor
+    estudiantes, padres = ruta['estudiantes'], ruta['padres']
+    estado, datos = enviar(cliente, [(e, 'presente') for e in estudiantes])
+    assert estado == 200
+    assert (datos['registradas'], datos['actualizadas'], datos['padres_notificados']) == (3, 0, 2)
+    assert Asistencia.query.filter(Asistencia.estudiante_id.in_(estudiantes)).count() == 3
+    # El padre con dos hijos recibe un solo aviso con ambos
+    assert len(avisos(padres[0])) == 1 and avisos(padres[0])[0].count('presente') == 2
+
+    estado, datos = enviar(cliente, [(estudiantes[0], 'presente'), (estudiantes[1], 'presente'),
+                                     (estudiantes[2], 'ausente')])
+    assert (datos['registradas'], datos['actualizadas'], datos['sin_cambios']) == (0, 1, 2)
+    assert len(avisos(padres[0])) == 1 and len(avisos(padres[1])) == 2
+    assert db.session.query(Asistencia.estado).filter_by(estudiante_id=estudiantes[2]).scalar() == 'ausente'
+
+
+def test_fuera_de_ruta_no_guarda_nada(ruta, conductor):
+    cliente, _ = conductor
+    ajeno = Estudiante(nombre='Ajeno', grado='1')
+    db.session.add(ajeno)
+    db.session.commit()
+
+    estado, datos = enviar(cliente, [(ruta['estudiantes'][0], 'presente'), (ajeno.id, 'presente')])
+    assert estado == 400 and datos['estudiantes'] == [ajeno.id]
+    assert Asistencia.query.filter(Asistencia.estudiante_id.in_(ruta['estudiantes'])).count() == 0
+
+
+@pytest.mark.parametrize('marcas, error', [
+    ([(0, 'dormido')], 'Estado inválido: dormido'),
+    ([(0, 'presente'), (0, 'ausente')], 'repetido'),
+])
+def test_lista_invalida(ruta, conductor, marcas, error):
+    cliente, _ = conductor
+    estado, datos = enviar(cliente, [(ruta['estudiantes'][i], e) for i, e in marcas])
+    assert estado == 400 and error in datos['error']
+
+
+def test_solo_conductores(cliente_admin):
+    assert cliente_admin.post('/conductor/asistencia/lista', json={'asistencias': []}).status_code == 403
@@ -0,0 +1,54 @@
+"""Métricas por endpoint: cuentan solo las consultas de cada petición."""
+
+from flask import Flask, render_template_string
+from flask_sqlalchemy import SQLAlchemy
+
+import metricas
+
+
+def test_desactivadas_no_instalan_nada(monkeypatch):
+    monkeypatch.setattr(metricas, 'ACTIVAS', False)
+    assert metricas.instalar_metricas(Flask('sin_metricas'), None) is False
+
+
+def test_admin_metricas_desactivadas(cliente_admin, monkeypatch):
+    monkeypatch.setattr(metricas, 'ACTIVAS', False)
+    assert cliente_admin.get('/admin/metricas').status_code == 404
+
+
+def test_consultas_y_render_por_endpoint(monkeypatch):
+    monkeypatch.setattr(metricas, 'ACTIVAS', True)
+    aplicacion = Flask('metricas_prueba')
+    aplicacion.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    base = SQLAlchemy(aplicacion)
+
+    @aplicacion.route('/tres')
+    def tres():
+        for _ in range(3):
+            base.session.execute(base.text('SELECT 1'))
+        return render_template_string('{{ n }}', n=3)
+
+    @aplicacion.route('/nada')
+    def nada():
+        return 'ok'
+
+    metricas.reiniciar()
+    try:
+        assert metricas.instalar_metricas(aplicacion, base) is True
+        cliente = aplicacion.test_client()
+        cliente.get('/tres')
+        cliente.get('/tres')
+        cliente.get('/nada')
+        # Fuera de una petición (hilos de fondo) no se cuenta
+        with aplicacion.app_context():
+            base.session.execute(base.text('SELECT 1'))
+
+        filas = {f['endpoint']: f for f in metricas.resumen()}
+        assert filas['tres']['peticiones'] == 2
+        assert filas['tres']['consultas'] == 6 and filas['tres']['max_consultas'] == 3
+        assert filas['tres']['bytes_promedio'] == 1
+        assert filas['nada']['consultas'] == 0
+        assert sum(f['peticiones'] for f in filas.values()) == 3
+    finally:
+        metricas.reiniciar()
+    assert metricas.resumen() == []
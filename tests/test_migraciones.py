@@ -0,0 +1,38 @@
+"""Migraciones versionadas: idempotentes y al día con los modelos."""
+
+from sqlalchemy import create_engine, inspect, text
+
+import migraciones
+from database import db
+
+
+def test_segunda_pasada_no_aplica_nada(app):
+    assert migraciones.aplicar_migraciones() == []
+    with db.engine.connect() as conn:
+        assert migraciones.versiones_aplicadas(conn) == {v for v, _, _ in migraciones.MIGRACIONES}
+
+
+def test_versiones_consecutivas():
+    versiones = [v for v, _, _ in migraciones.MIGRACIONES]
+    assert versiones == list(range(1, len(versiones) + 1))
+
+
+def test_indices_declarados_existen(app):
+    inspector = inspect(db.engine)
+    for nombre, tabla, columnas in (migraciones.INDICES_PAGINACION + migraciones.INDICES_BUSQUEDAS +
+                                    migraciones.INDICES_DASHBOARD + migraciones.INDICES_REPORTES):
+        existentes = {i['name']: i['column_names'] for i in inspector.get_indexes(tabla)}
+        assert existentes.get(nombre) == columnas, nombre
+
+
+def test_agregar_columna_a_una_tabla_antigua(tmp_path):
+    motor = create_engine(f'sqlite:///{tmp_path / "antigua.db"}')
+    with motor.begin() as conn:
+        conn.execute(text('CREATE TABLE estudiante (id INTEGER PRIMARY KEY, nombre VARCHAR(100))'))
+        conn.execute(text("INSERT INTO estudiante (nombre) VALUES ('Ana')"))
+        # Dos veces: la segunda no debe fallar
+        migraciones._columnas_parada_estudiante(conn)
+        migraciones._columnas_parada_estudiante(conn)
+        columnas = {c['name'] for c in inspect(conn).get_columns('estudiante')}
+        assert {'parada_lat', 'parada_lng'} <= columnas
+        assert conn.execute(text('SELECT nombre, parada_lat FROM estudiante')).one() == ('Ana', None)
@@ -0,0 +1,36 @@
+"""Avisos a toda una ruta: una notificación por padre y un solo trabajo push."""
+
+import json
+
+from app import crear_notificaciones_masivas
+from database import db, Usuario, Notificacion, PushPendiente
+from notificaciones_push import despachador_push
+
+
+def sin_leer(usuario_id):
+    return db.session.query(Usuario.notificaciones_sin_leer).filter_by(id=usuario_id).scalar()
+
+
+def test_retraso_notifica_una_vez_a_cada_padre(ruta, conductor, monkeypatch):
+    monkeypatch.setenv('VAPID_PUBLIC_KEY', 'publica')
+    monkeypatch.setenv('VAPID_PRIVATE_KEY', 'privada')
+    # Sin despertar al despachador: con estas claves de prueba no hay que enviar nada
+    monkeypatch.setattr(despachador_push, 'despertar', lambda: None)
+    cliente, _ = conductor
+    antes = PushPendiente.query.count()
+
+    respuesta = cliente.post('/conductor/notificar_retraso', data={'motivo': 'Tráfico'})
+    assert respuesta.get_json()['success'] is True
+
+    for padre_id in ruta['padres']:
+        avisos = Notificacion.query.filter_by(usuario_id=padre_id, tipo='retraso').all()
+        assert len(avisos) == 1 and 'Tráfico' in avisos[0].mensaje
+        assert sin_leer(padre_id) == 1
+    # Los padres van juntos en un trabajo; el aviso al admin es otro
+    trabajos = PushPendiente.query.order_by(PushPendiente.id).all()[antes:]
+    assert sorted(json.loads(trabajos[0].destinatarios)) == sorted(ruta['padres'])
+    assert len(trabajos) == 2
+
+
+def test_masivas_sin_destinatarios(app):
+    assert crear_notificaciones_masivas([None, 0], 'sistema', 'Nada') == 0
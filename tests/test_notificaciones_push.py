@@ -0,0 +1,108 @@
+"""Despacho push: clasificación de fallos y cuenta de fallos por suscripción."""
+
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import notificaciones_push
+from database import db, Usuario, PushPendiente, PushSubscription, PushSuscripcionPodada
+from notificaciones_push import despachador_push
+
+
+@pytest.fixture
+def suscripcion(app):
+    usuario = Usuario(nombre='Padre push', email=f'push{datetime.utcnow().timestamp()}@pruebas.com',
+                      password='x', rol='padre', activo=True)
+    db.session.add(usuario)
+    db.session.flush()
+    sub = PushSubscription(usuario_id=usuario.id, endpoint=f'https://push.pruebas/{usuario.id}',
+                           p256dh='p', auth='a', fallos_consecutivos=0)
+    db.session.add(sub)
+    db.session.commit()
+    return {'id': sub.id, 'usuario_id': usuario.id}
+
+
+def encolar(suscripcion):
+    trabajo = PushPendiente(destinatarios=json.dumps([suscripcion['usuario_id']]), titulo='Aviso',
+                            mensaje='Mensaje', estado='pendiente', intentos=0,
+                            proximo_intento=datetime.utcnow())
+    db.session.add(trabajo)
+    db.session.commit()
+    return trabajo.id
+
+
+def con_vapid(monkeypatch):
+    monkeypatch.setenv('VAPID_PUBLIC_KEY', 'publica')
+    monkeypatch.setenv('VAPID_PRIVATE_KEY', 'privada')
+
+
+def test_sin_vapid_no_toca_suscripciones_ni_trabajos(suscripcion, monkeypatch):
+    monkeypatch.delenv('VAPID_PUBLIC_KEY', raising=False)
+    monkeypatch.delenv('VAPID_PRIVATE_KEY', raising=False)
+    trabajo_id = encolar(suscripcion)
+
+    for _ in range(notificaciones_push.MAX_FALLOS_SUSCRIPCION + 1):
+        despachador_push.procesar_pendientes()
+
+    db.session.expire_all()
+    assert db.session.get(PushPendiente, trabajo_id).estado == 'pendiente'
+    sub = db.session.get(PushSubscription, suscripcion['id'])
+    assert sub is not None
+    assert sub.fallos_consecutivos == 0
+
+
+def test_fallo_transitorio_suma_y_reintenta(suscripcion, monkeypatch):
+    con_vapid(monkeypatch)
+    monkeypatch.setattr(notificaciones_push, 'enviar_webpush', lambda s, p, v: (503, 'no disponible'))
+    trabajo_id = encolar(suscripcion)
+
+    despachador_push.procesar_pendientes()
+
+    db.session.expire_all()
+    trabajo = db.session.get(PushPendiente, trabajo_id)
+    assert trabajo.estado == 'pendiente'
+    assert trabajo.intentos == 1
+    assert json.loads(trabajo.suscripciones) == [suscripcion['id']]
+    assert db.session.get(PushSubscription, suscripcion['id']).fallos_consecutivos == 1
+
+
+def test_suscripcion_expirada_se_elimina(suscripcion, monkeypatch):
+    con_vapid(monkeypatch)
+    monkeypatch.setattr(notificaciones_push, 'enviar_webpush', lambda s, p, v: (410, 'gone'))
+    trabajo_id = encolar(suscripcion)
+
+    despachador_push.procesar_pendientes()
+
+    db.session.expire_all()
+    assert db.session.get(PushPendiente, trabajo_id).estado == 'enviado'
+    assert db.session.get(PushSubscription, suscripcion['id']) is None
+    assert PushSuscripcionPodada.query.filter_by(usuario_id=suscripcion['usuario_id'], motivo='expirada').count() == 1
+
+
+def test_encolar_sin_vapid_no_crea_trabajo(app, monkeypatch):
+    monkeypatch.delenv('VAPID_PUBLIC_KEY', raising=False)
+    assert notificaciones_push.encolar_push([1], 'Aviso', 'Mensaje') is None
+
+
+def test_un_trabajo_reclamado_no_se_reclama_dos_veces(suscripcion):
+    trabajo_id = encolar(suscripcion)
+    ahora = datetime.utcnow()
+
+    _, primeros = despachador_push._reclamar(ahora)
+    _, segundos = despachador_push._reclamar(ahora)
+    assert trabajo_id in [t.id for t in primeros]
+    assert trabajo_id not in [t.id for t in segundos]
+
+    # Si el proceso que lo reclamó muere, se libera al vencer el bloqueo
+    vencido = ahora + notificaciones_push.DURACION_BLOQUEO + timedelta(seconds=1)
+    token, terceros = despachador_push._reclamar(vencido)
+    assert trabajo_id in [t.id for t in terceros]
+    PushPendiente.query.filter_by(bloqueado_por=token).update({'estado': 'enviado'})
+    db.session.commit()
+
+
+def test_bloqueo_cubre_la_pasada_mas_lenta():
+    hilos, timeout = notificaciones_push.HILOS, notificaciones_push.TIMEOUT_ENVIO
+    assert notificaciones_push.duracion_bloqueo(hilos * 10) == \
+        timedelta(seconds=10 * 2 * timeout) + notificaciones_push.MARGEN_BLOQUEO
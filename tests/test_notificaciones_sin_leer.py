@@ -0,0 +1,50 @@
+"""Contador de notificaciones sin leer del badge de la barra."""
+
+import uuid
+
+import pytest
+
+from app import crear_notificacion, ajustar_sin_leer
+from database import db, Usuario, Notificacion
+
+
+@pytest.fixture
+def padre(app):
+    email = f'badge{uuid.uuid4().hex}@pruebas.com'
+    usuario = Usuario(nombre='Padre badge', email=email, password='clave', rol='padre', activo=True)
+    db.session.add(usuario)
+    db.session.commit()
+    cliente = app.test_client()
+    assert cliente.post('/login', data={'email': email, 'password': 'clave'}).status_code == 302
+    return cliente, usuario.id
+
+
+def contador(cliente, usuario_id):
+    return cliente.get(f'/api/notificaciones/count/{usuario_id}').get_json()['count']
+
+
+def test_contador_sigue_a_las_notificaciones(padre):
+    cliente, padre_id = padre
+    ids = [crear_notificacion(padre_id, 'sistema', f'Aviso {i}').id for i in range(3)]
+    assert contador(cliente, padre_id) == 3
+
+    for _ in range(2):  # marcar dos veces la misma solo descuenta una
+        assert cliente.post(f'/api/notificaciones/marcar_leida/{ids[0]}').status_code == 200
+    assert contador(cliente, padre_id) == 2
+    assert contador(cliente, padre_id) == Notificacion.query.filter_by(usuario_id=padre_id, leida=False).count()
+
+    cliente.post('/api/notificaciones/marcar_todas_leidas')
+    assert contador(cliente, padre_id) == 0
+
+
+def test_contador_nunca_baja_de_cero(padre):
+    _, padre_id = padre
+    ajustar_sin_leer([padre_id], -5)
+    db.session.commit()
+    assert db.session.get(Usuario, padre_id).notificaciones_sin_leer == 0
+
+
+def test_contador_ajeno_no_autorizado(padre, conductor):
+    _, padre_id = padre
+    cliente_conductor, _ = conductor
+    assert cliente_conductor.get(f'/api/notificaciones/count/{padre_id}').status_code == 403
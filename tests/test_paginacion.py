@@ -0,0 +1,66 @@
+"""Paginación por cursor (fecha, id): cada fila sale una sola vez y en orden."""
+
+import uuid
+from datetime import date, datetime
+
+from app import paginar_keyset, codificar_cursor, decodificar_cursor
+from database import db, Usuario, Estudiante, Notificacion, Asistencia
+
+
+def recorrer(cliente, url):
+    vistas, cursor, paginas = [], None, 0
+    while True:
+        respuesta = cliente.get(url + (f'&cursor={cursor}' if cursor else ''))
+        assert respuesta.status_code == 200
+        datos = respuesta.get_json()
+        vistas += [n['id'] for n in datos['notificaciones']]
+        paginas += 1
+        cursor = datos['siguiente_cursor']
+        if not cursor:
+            return vistas, paginas
+
+
+def test_notificaciones_por_paginas_con_empates(cliente_admin):
+    usuario = Usuario(nombre='Paginado', email=f'pag{uuid.uuid4().hex}@pruebas.com', password='x',
+                      rol='padre', activo=True)
+    db.session.add(usuario)
+    db.session.flush()
+    # Tres con la misma fecha: el id desempata
+    fechas = [datetime(2026, 5, 1, 8, 0)] * 3 + [datetime(2026, 5, 2, 8, 0), datetime(2026, 4, 30, 8, 0)]
+    notificaciones = [Notificacion(usuario_id=usuario.id, tipo='sistema', mensaje=f'n{i}', fecha=f)
+                      for i, f in enumerate(fechas)]
+    db.session.add_all(notificaciones)
+    db.session.commit()
+
+    esperado = [n.id for n in sorted(notificaciones, key=lambda n: (n.fecha, n.id), reverse=True)]
+    vistas, paginas = recorrer(cliente_admin, f'/api/notificaciones/{usuario.id}?limite=2')
+    assert vistas == esperado and paginas == 3
+
+
+def test_cursor_invalido(cliente_admin):
+    respuesta = cliente_admin.get('/api/notificaciones/1?cursor=no-es-un-cursor')
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()['error'] == 'Cursor inválido'
+
+
+def test_cursor_de_columna_fecha(conductor):
+    _, conductor_id = conductor
+    assert decodificar_cursor(codificar_cursor(date(2026, 5, 1), 7), solo_fecha=True) == (date(2026, 5, 1), 7)
+
+    estudiante = Estudiante(nombre='Paginado', grado='1')
+    db.session.add(estudiante)
+    db.session.flush()
+    for dia in (3, 1, 2, 2):
+        db.session.add(Asistencia(estudiante_id=estudiante.id, fecha=date(2019, 1, dia), estado='presente',
+                                  conductor_id=conductor_id))
+    db.session.commit()
+
+    consulta = Asistencia.query.filter_by(conductor_id=conductor_id)
+    vistas, cursor = [], None
+    while True:
+        filas, cursor = paginar_keyset(consulta, Asistencia.fecha, Asistencia.id, cursor, limite=1,
+                                       descendente=False)
+        vistas += [(a.fecha.day, a.id) for a in filas]
+        if not cursor:
+            break
+    assert vistas == sorted(vistas) and len(vistas) == 4
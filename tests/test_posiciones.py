@@ -0,0 +1,49 @@
+"""Almacén de posiciones en vivo: solo avanza en el tiempo y se vuelca a la BD."""
+
+from datetime import datetime, timedelta
+
+from posiciones import AlmacenPosiciones, TablaPosiciones
+from database import UbicacionVehiculo
+
+T0 = datetime(2026, 10, 1, 8, 0)
+
+
+def test_tabla_ignora_posiciones_mas_viejas():
+    tabla = TablaPosiciones()
+    assert tabla.actualizar(1, -12.0, -77.0, T0)
+    assert not tabla.actualizar(1, -13.0, -78.0, T0 - timedelta(seconds=1))
+    assert tabla.obtener(1)['lat'] == -12.0
+    assert tabla.actualizar(1, -12.1, -77.1, T0 + timedelta(seconds=1))
+    assert tabla.obtener(1)['lat'] == -12.1
+
+
+def test_cambios_desde_una_version():
+    tabla = TablaPosiciones()
+    tabla.actualizar(1, -12.0, -77.0, T0)
+    _, version = tabla.cambios_desde(0)
+    tabla.actualizar(2, -12.2, -77.2, T0)
+    cambios, actual = tabla.cambios_desde(version)
+    assert [c['conductor_id'] for c in cambios] == [2] and actual == version + 1
+    assert tabla.cambios_desde(actual) == ([], actual)
+    # Filtrar por conductores visibles
+    assert tabla.cambios_desde(0, [1])[0][0]['conductor_id'] == 1
+
+
+def test_precarga_no_pisa_datos_mas_nuevos():
+    tabla = TablaPosiciones()
+    tabla.actualizar(1, -12.5, -77.5, T0)
+    tabla.cargar([{'conductor_id': 1, 'lat': 0.0, 'lng': 0.0, 'ultima_actualizacion': T0 - timedelta(hours=1)}])
+    assert tabla.cargada() and tabla.obtener(1)['lat'] == -12.5
+
+
+def test_volcado_escribe_la_ultima_posicion(conductor):
+    _, conductor_id = conductor
+    almacen = AlmacenPosiciones('memoria')
+    almacen.actualizar(conductor_id, -12.0, -77.0, T0)
+    almacen.actualizar(conductor_id, -12.3, -77.3, T0 + timedelta(seconds=5))
+    assert almacen.volcar() == 1
+    assert almacen.volcar() == 0  # sin pendientes
+
+    fila = UbicacionVehiculo.query.filter_by(conductor_id=conductor_id).one()
+    assert (fila.lat, fila.lng, fila.ultima_actualizacion) == (-12.3, -77.3, T0 + timedelta(seconds=5))
+
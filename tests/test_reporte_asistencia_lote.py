@@ -0,0 +1,67 @@
+"""Reportes de asistencia por lote: un PDF por conductor y día, maquetados en el pool de procesos."""
+
+import io
+import re
+import uuid
+import zipfile
+import zlib
+from datetime import date, time
+
+import pytest
+
+import reportes
+from database import db, Usuario, Estudiante, Asistencia
+
+DIAS = [date(2018, 9, 3), date(2018, 9, 4)]
+
+
+@pytest.fixture
+def asistencias(app):
+    """Dos conductores; el primero con asistencias los dos días y el segundo solo el primero"""
+    sufijo = uuid.uuid4().hex[:8]
+    conductores = [Usuario(nombre=f'Chofer {i} {sufijo}', email=f'chofer{i}{sufijo}@pruebas.com', password='x',
+                           rol='conductor', activo=True) for i in range(2)]
+    estudiantes = [Estudiante(nombre=f'Alumno {i} {sufijo}', grado='2') for i in range(3)]
+    db.session.add_all(conductores + estudiantes)
+    db.session.flush()
+    for conductor, dias in ((conductores[0], DIAS), (conductores[1], DIAS[:1])):
+        for dia in dias:
+            for estudiante in estudiantes:
+                db.session.add(Asistencia(estudiante_id=estudiante.id, fecha=dia, hora=time(7, 15),
+                                          estado='presente', conductor_id=conductor.id))
+    db.session.commit()
+    return {'conductores': [c.id for c in conductores], 'nombres': [c.nombre for c in conductores],
+            'estudiantes': [e.nombre for e in estudiantes]}
+
+
+def textos(pdf):
+    resultado = []
+    for flujo in re.findall(rb'stream\n(.*?)\nendstream', pdf, re.S):
+        resultado += [t.decode('cp1252') for t in re.findall(rb'\((.*?)\) Tj', zlib.decompress(flujo))]
+    return resultado
+
+
+def test_zip_con_un_pdf_por_conductor_y_dia(asistencias, monkeypatch):
+    # Una tarea por reporte: varias en vuelo a la vez
+    monkeypatch.setattr(reportes, 'REPORTES_POR_TAREA', 1)
+    primero, segundo = asistencias['conductores']
+    datos = b''.join(reportes.reporte_asistencia_lote([primero, segundo], DIAS[0], DIAS[-1], 'zip', procesos=1))
+
+    with zipfile.ZipFile(io.BytesIO(datos)) as archivo:
+        nombres = sorted(archivo.namelist())
+        assert [n.split('/')[0] for n in nombres] == ['2018-09-03', '2018-09-03', '2018-09-04']
+        assert sum(f'asistencia_{primero}_' in n for n in nombres) == 2
+        for nombre in nombres:
+            pdf = archivo.read(nombre)
+            assert pdf.startswith(b'%PDF-') and pdf.endswith(b'%%EOF\n')
+            texto = textos(pdf)
+            assert all(e in texto for e in asistencias['estudiantes'])
+
+
+def test_pdf_unico_en_orden(asistencias):
+    pdf = b''.join(reportes.reporte_asistencia_lote(asistencias['conductores'], DIAS[0], DIAS[-1], 'pdf',
+                                                    procesos=1))
+    assert int(re.search(rb'/Type /Pages /Kids \[.*?\] /Count (\d+)', pdf).group(1)) == 3
+    texto = ' '.join(textos(pdf))
+    posiciones = [texto.index(n) for n in asistencias['nombres']]
+    assert posiciones == sorted(posiciones)
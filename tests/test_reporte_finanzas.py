@@ -0,0 +1,71 @@
+"""PDF de finanzas por partes: lotes por (fecha, id), un PDF válido y el detalle completo del periodo."""
+
+import re
+import zlib
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import finanzas
+import reportes
+from database import db, Ingreso, Gasto
+
+DESDE, HASTA = date(1999, 3, 1), date(1999, 3, 5)
+
+
+@pytest.fixture
+def movimientos(app):
+    """Cinco días de 1999 con varios ingresos a la misma hora (empates de fecha) y un gasto"""
+    existentes = Ingreso.query.filter(Ingreso.descripcion.like('Cuota 1999-%')).all()
+    if not existentes:
+        for i in range(45):
+            fecha = datetime.combine(DESDE, datetime.min.time()) + timedelta(days=i % 5, hours=8)
+            existentes.append(Ingreso(descripcion=f'Cuota 1999-{i:03d}', monto=10 + i, fuente='pago_estudiante',
+                                      fecha=fecha))
+        # Fuera del periodo
+        existentes.append(Ingreso(descripcion='Cuota 1999-fuera', monto=999, fuente='pago_estudiante',
+                                  fecha=datetime(1999, 3, 6, 8)))
+        db.session.add_all(existentes)
+        gasto = Gasto(descripcion='Gasolina 1999', monto=35.5, categoria='combustible', fecha=datetime(1999, 3, 2, 9))
+        db.session.add(gasto)
+        for movimiento in existentes:
+            finanzas.registrar_ingreso(movimiento)
+        finanzas.registrar_gasto(gasto)
+        db.session.commit()
+    return [i for i in existentes if i.fecha.date() <= HASTA]
+
+
+def textos(pdf):
+    """Cadenas de todas las páginas, en orden"""
+    resultado = []
+    for flujo in re.findall(rb'stream\n(.*?)\nendstream', pdf, re.S):
+        resultado += [t.decode('cp1252') for t in re.findall(rb'\((.*?)\) Tj', zlib.decompress(flujo))]
+    return resultado
+
+
+def test_lotes_por_fecha_e_id(movimientos):
+    vistos = [f.id for filas in reportes.lotes_movimientos(Ingreso, Ingreso.fuente, DESDE, HASTA, lote=4)
+              for f in filas]
+    esperados = [i.id for i in sorted(movimientos, key=lambda i: (i.fecha, i.id))]
+    assert vistos == esperados
+
+
+def test_pdf_por_partes_con_el_detalle_completo(movimientos):
+    partes = list(reportes.reporte_finanzas(DESDE, HASTA, lote=4))
+    assert len(partes) > 3 and partes[0].startswith(b'%PDF-')
+    pdf = b''.join(partes)
+
+    # Cada entrada de la xref apunta al inicio de su objeto
+    inicio_xref = int(re.search(rb'startxref\n(\d+)\n%%EOF\n$', pdf).group(1))
+    entradas = re.findall(rb'(\d{10}) 00000 n ', pdf[inicio_xref:])
+    assert entradas
+    for numero, offset in enumerate(entradas, 1):
+        assert pdf[int(offset):].startswith(b'%d 0 obj\n' % numero)
+
+    texto = textos(pdf)
+    descripciones = [t for t in texto if t.startswith('Cuota 1999-')]
+    assert sorted(descripciones) == sorted(i.descripcion for i in movimientos)
+    suma = sum(i.monto for i in movimientos)
+    assert f'C$ {suma:,.2f}' in texto and '45 movimientos' in texto
+    assert 'Gasolina 1999' in texto and f'C$ {suma - 35.5:,.2f}' in texto
+    assert 'Del 01/03/1999 al 05/03/1999' in ' '.join(texto)
@@ -0,0 +1,98 @@
+"""Cola offline del conductor: reintentos idempotentes y "gana la marca más reciente"."""
+
+import uuid
+from datetime import datetime, time, timedelta
+
+import pytest
+
+from database import db, Asistencia, Notificacion, OperacionSincronizada, UbicacionHistorial
+from notificaciones_push import despachador_push
+
+AYER = datetime.combine(datetime.utcnow().date() - timedelta(days=1), time(10, 0))
+
+
+@pytest.fixture(autouse=True)
+def sin_despachador(monkeypatch):
+    monkeypatch.setattr(despachador_push, 'despertar', lambda: None)
+
+
+def op(tipo, minutos, cliente_id=None, **datos):
+    return {'id': cliente_id or uuid.uuid4().hex, 'tipo': tipo,
+            'fecha': (AYER + timedelta(minutes=minutos)).isoformat() + 'Z', 'datos': datos}
+
+
+def sincronizar(cliente, operaciones):
+    respuesta = cliente.post('/conductor/sincronizar', json={'operaciones': operaciones})
+    datos = respuesta.get_json()
+    return respuesta.status_code, datos, {r['id']: r for r in datos.get('resultados', [])}
+
+
+def marcas_de(estudiante_id):
+    return db.session.query(Asistencia.estado, Asistencia.hora).filter_by(
+        estudiante_id=estudiante_id, fecha=AYER.date()).all()
+
+
+def test_reintento_no_aplica_dos_veces(ruta, conductor):
+    cliente, conductor_id = conductor
+    estudiante, padre = ruta['estudiantes'][2], ruta['padres'][1]
+    lote = [op('asistencia', 0, estudiante_id=estudiante, estado='presente'),
+            op('ubicacion', 1, lat=-12.05, lng=-77.04),
+            op('ubicacion', 2, lat=-12.06, lng=-77.05)]
+
+    estado, datos, resultados = sincronizar(cliente, lote)
+    assert estado == 200 and datos['aplicadas'] == 3 and datos['padres_notificados'] == 1
+    assert all(r['resultado'] == 'aplicada' and not r['repetida'] for r in resultados.values())
+
+    # La respuesta se perdió y el teléfono reenvía el mismo lote
+    estado, datos, repetidos = sincronizar(cliente, lote)
+    assert estado == 200 and datos['aplicadas'] == 0 and datos['padres_notificados'] == 0
+    assert all(r['repetida'] and r['resultado'] == 'aplicada' for r in repetidos.values())
+    assert repetidos.keys() == resultados.keys()
+
+    assert marcas_de(estudiante) == [('presente', time(10, 0))]
+    assert UbicacionHistorial.query.filter_by(conductor_id=conductor_id).count() == 2
+    assert Notificacion.query.filter_by(usuario_id=padre, tipo='asistencia').count() == 1
+    assert OperacionSincronizada.query.filter_by(conductor_id=conductor_id).count() == 3
+
+
+def test_gana_la_marca_mas_reciente(ruta, conductor):
+    cliente, _ = conductor
+    estudiante = ruta['estudiantes'][0]
+    # Llegan desordenadas: se aplican por hora original, igual que si hubieran llegado en dos lotes
+    tarde = op('asistencia', 10, estudiante_id=estudiante, estado='ausente')
+    temprano = op('asistencia', 5, estudiante_id=estudiante, estado='presente')
+    _, _, resultados = sincronizar(cliente, [tarde, temprano])
+    assert {r['resultado'] for r in resultados.values()} == {'aplicada'}
+    assert marcas_de(estudiante) == [('ausente', time(10, 10))]
+
+    # Un lote posterior con una marca más vieja no pisa la guardada; una más nueva sí
+    vieja = op('asistencia', 7, estudiante_id=estudiante, estado='tardanza')
+    misma_hora = op('asistencia', 10, estudiante_id=estudiante, estado='presente')
+    _, _, resultados = sincronizar(cliente, [vieja, misma_hora])
+    assert {r['resultado'] for r in resultados.values()} == {'descartada'}
+    nueva = op('asistencia', 20, estudiante_id=estudiante, estado='justificado')
+    assert sincronizar(cliente, [nueva])[2][nueva['id']]['resultado'] == 'aplicada'
+    assert marcas_de(estudiante) == [('justificado', time(10, 20))]
+
+
+def test_operaciones_invalidas_se_rechazan_una_a_una(ruta, conductor):
+    cliente, _ = conductor
+    valida = op('ubicacion', 0, lat=-12.0, lng=-77.0)
+    invalidas = {
+        'fecha': dict(op('ubicacion', 0, lat=-12.0, lng=-77.0), fecha='ayer'),
+        'antigua': dict(op('ubicacion', 0, lat=-12.0, lng=-77.0),
+                        fecha=(AYER - timedelta(days=20)).isoformat()),
+        'coordenadas': op('ubicacion', 0, lat=120, lng=-77.0),
+        'tipo': op('pago', 0),
+        'ruta': op('asistencia', 0, estudiante_id=0, estado='presente'),
+        'estado': op('asistencia', 0, estudiante_id=ruta['estudiantes'][0], estado='dormido'),
+        'id': op('ubicacion', 0, cliente_id='x' * 65, lat=-12.0, lng=-77.0),
+    }
+    estado, datos, resultados = sincronizar(cliente, [valida, {'tipo': 'ubicacion'}, 'basura']
+                                            + list(invalidas.values()))
+    assert estado == 200 and datos['aplicadas'] == 1 and datos['ignoradas'] == 2
+    assert resultados[valida['id']]['resultado'] == 'aplicada'
+    for motivo, operacion in invalidas.items():
+        assert resultados[operacion['id']]['resultado'] == 'rechazada', motivo
+    # Un id demasiado largo no se guarda en el registro
+    assert OperacionSincronizada.query.filter_by(cliente_id='x' * 65).count() == 0
@@ -0,0 +1,68 @@
+"""Stream SSE de posiciones: alcance por rol, cupo por worker y almacén compartido."""
+
+import json
+import threading
+import uuid
+from datetime import datetime
+
+import pytest
+
+import app as modulo_app
+import posiciones
+from database import db, Usuario
+from posiciones import AlmacenPosiciones, almacen_posiciones
+
+
+def test_stream_por_encima_del_cupo_responde_503(cliente_admin, monkeypatch):
+    monkeypatch.setattr(modulo_app, 'cupos_stream', threading.BoundedSemaphore(1))
+
+    abierta = cliente_admin.get('/api/ubicaciones/stream')
+    assert abierta.status_code == 200
+    assert abierta.mimetype == 'text/event-stream'
+
+    rechazada = cliente_admin.get('/api/ubicaciones/stream')
+    assert rechazada.status_code == 503
+    assert rechazada.headers['Retry-After'] == '60'
+
+    # Cerrar la conexión devuelve el cupo
+    abierta.close()
+    otra = cliente_admin.get('/api/ubicaciones/stream')
+    assert otra.status_code == 200
+    otra.close()
+
+
+def leer_snapshot(respuesta):
+    """Primer evento `snapshot` del stream, sin esperar los siguientes"""
+    for parte in respuesta.response:
+        texto = parte.decode() if isinstance(parte, bytes) else parte
+        if texto.startswith('event: snapshot'):
+            return json.loads(texto.split('data: ', 1)[1])
+    raise AssertionError('El stream no envió snapshot')
+
+
+def test_conductor_solo_se_ve_a_si_mismo(conductor):
+    cliente, conductor_id = conductor
+    otro = Usuario(nombre='Otro conductor', email=f'otro{uuid.uuid4().hex}@pruebas.com', password='x',
+                   rol='conductor', activo=True)
+    db.session.add(otro)
+    db.session.commit()
+    ahora = datetime.utcnow()
+    almacen_posiciones.actualizar(conductor_id, -12.01, -77.01, ahora)
+    almacen_posiciones.actualizar(otro.id, -12.02, -77.02, ahora)
+
+    respuesta = cliente.get('/api/ubicaciones/stream')
+    try:
+        snapshot = leer_snapshot(respuesta)
+    finally:
+        respuesta.close()
+    assert [(p['conductor_id'], p['lat']) for p in snapshot] == [(conductor_id, -12.01)]
+
+
+def test_socket_exige_clave_y_loopback(monkeypatch):
+    monkeypatch.setattr(posiciones, 'SOCKET_CLAVE', '')
+    with pytest.raises(RuntimeError, match='POSICIONES_SOCKET_CLAVE'):
+        AlmacenPosiciones('socket')
+    monkeypatch.setattr(posiciones, 'SOCKET_CLAVE', 'clave')
+    monkeypatch.setattr(posiciones, 'SOCKET_HOST', '0.0.0.0')
+    with pytest.raises(RuntimeError, match='loopback'):
+        AlmacenPosiciones('socket')
@@ -0,0 +1,72 @@
+"""La clave del caché de reportes debe cambiar con cualquier dato que el reporte muestre."""
+
+import uuid
+from datetime import date, time
+
+import pytest
+
+from database import db, Usuario, Estudiante, Asistencia
+from trabajos_reportes import _clave
+
+DIA = date(2020, 3, 2)
+
+
+@pytest.fixture
+def lote(app):
+    conductor = Usuario(nombre='Conductor lote', email=f'lote{uuid.uuid4().hex}@pruebas.com', password='x',
+                        rol='conductor', activo=True)
+    db.session.add(conductor)
+    db.session.flush()
+    estudiantes = [Estudiante(nombre=f'Alumno lote {i}', grado='2') for i in range(2)]
+    db.session.add_all(estudiantes)
+    db.session.flush()
+    asistencias = [Asistencia(estudiante_id=e.id, fecha=DIA, hora=time(7, 30), estado=estado,
+                              conductor_id=conductor.id)
+                   for e, estado in zip(estudiantes, ('presente', 'ausente'))]
+    db.session.add_all(asistencias)
+    db.session.commit()
+    parametros = {'conductor_ids': [conductor.id], 'desde': DIA.isoformat(), 'hasta': DIA.isoformat(),
+                  'formato': 'zip'}
+    return parametros, conductor, estudiantes, asistencias
+
+
+def clave(parametros):
+    return _clave('asistencia_lote', parametros)
+
+
+def test_clave_estable_sin_cambios(lote):
+    parametros = lote[0]
+    assert clave(parametros) == clave(parametros)
+
+
+def test_clave_cambia_con_observaciones(lote):
+    parametros, _, _, asistencias = lote
+    antes = clave(parametros)
+    asistencias[0].observaciones = 'Llegó con fiebre'
+    db.session.commit()
+    assert clave(parametros) != antes
+
+
+def test_clave_cambia_al_intercambiar_estados(lote):
+    parametros, _, _, asistencias = lote
+    antes = clave(parametros)
+    # Mismo UPDATE masivo que usan la toma de lista y la sincronización offline
+    db.session.execute(db.update(Asistencia), [
+        {'id': asistencias[0].id, 'estado': 'ausente'},
+        {'id': asistencias[1].id, 'estado': 'presente'},
+    ])
+    db.session.commit()
+    assert clave(parametros) != antes
+
+
+def test_clave_cambia_al_renombrar(lote):
+    parametros, conductor, estudiantes, _ = lote
+    antes = clave(parametros)
+    estudiantes[1].nombre = 'Alumno renombrado'
+    db.session.commit()
+    despues_estudiante = clave(parametros)
+    assert despues_estudiante != antes
+
+    conductor.nombre = 'Conductor renombrado'
+    db.session.commit()
+    assert clave(parametros) != despues_estudiante
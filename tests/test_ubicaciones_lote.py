@@ -0,0 +1,79 @@
+"""Ingreso de puntos GPS por lote y validación de la hora del dispositivo."""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import parsear_fecha_dispositivo, TOLERANCIA_RELOJ_DISPOSITIVO, MAX_PUNTOS_LOTE
+from database import UbicacionHistorial
+
+AHORA = datetime(2026, 10, 1, 12, 0, 0)
+
+
+@pytest.mark.parametrize('valor, esperado', [
+    ('2026-10-01T11:59:00Z', datetime(2026, 10, 1, 11, 59)),
+    ('2026-10-01T06:59:00-05:00', datetime(2026, 10, 1, 11, 59)),
+    (1790855940000, datetime(2026, 10, 1, 11, 59)),        # epoch en milisegundos
+    ('1790855940.5', datetime(2026, 10, 1, 11, 59, 0, 500000)),  # epoch en segundos, con fracción
+    (None, AHORA),
+])
+def test_fecha_dispositivo_valida(valor, esperado):
+    assert parsear_fecha_dispositivo(valor, AHORA) == esperado
+
+
+def test_fecha_adelantada_se_recorta_a_la_del_servidor():
+    dentro = AHORA + TOLERANCIA_RELOJ_DISPOSITIVO - timedelta(seconds=1)
+    assert parsear_fecha_dispositivo(dentro.isoformat(), AHORA) == dentro
+    lejos = AHORA + timedelta(days=400)
+    assert parsear_fecha_dispositivo(lejos.isoformat(), AHORA) == AHORA
+
+
+@pytest.mark.parametrize('valor, mensaje', [
+    (0, 'Fecha demasiado antigua'),
+    ('2020-01-01T00:00:00', 'Fecha demasiado antigua'),
+    (True, 'Fecha inválida'),
+    ('ayer', 'Fecha inválida'),
+    (10 ** 20, 'Fecha fuera de rango'),
+])
+def test_fecha_dispositivo_rechazada(valor, mensaje):
+    with pytest.raises(ValueError, match=mensaje):
+        parsear_fecha_dispositivo(valor, AHORA)
+
+
+def test_historial_acepta_fechas_antiguas():
+    assert parsear_fecha_dispositivo('2020-01-01T00:00:00', AHORA, max_antiguedad=None) == datetime(2020, 1, 1)
+
+
+def test_lote_guarda_validos_y_cuenta_rechazados(conductor):
+    cliente, conductor_id = conductor
+    ahora = datetime.utcnow().replace(microsecond=0)
+    puntos = [
+        {'lat': -12.05, 'lng': -77.04, 'fecha': (ahora - timedelta(seconds=20)).isoformat()},
+        {'lat': -12.06, 'lng': -77.05, 'fecha': (ahora - timedelta(seconds=10)).isoformat()},
+        {'lat': 95, 'lng': -77.05},                          # latitud fuera de rango
+        {'lat': -12.07, 'lng': -77.06, 'fecha': 0},          # reloj en 0
+        {'lat': -12.07, 'lng': -77.06, 'fecha': 'mañana'},
+        'no es un punto',
+    ]
+    respuesta = cliente.post('/conductor/ubicacion/lote', json={'puntos': puntos})
+    assert respuesta.status_code == 200
+    assert respuesta.get_json() == {'success': True, 'guardados': 2, 'rechazados': 4}
+
+    guardados = UbicacionHistorial.query.filter_by(conductor_id=conductor_id).order_by(UbicacionHistorial.fecha).all()
+    assert [(u.lat, u.lng) for u in guardados] == [(-12.05, -77.04), (-12.06, -77.05)]
+
+
+def test_lote_sin_puntos_validos_o_demasiado_grande(conductor):
+    cliente, _ = conductor
+    respuesta = cliente.post('/conductor/ubicacion/lote', json={'puntos': [{'lat': 'x', 'lng': 1}]})
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()['rechazados'] == 1
+
+    punto = {'lat': -12.05, 'lng': -77.04}
+    respuesta = cliente.post('/conductor/ubicacion/lote', json={'puntos': [punto] * (MAX_PUNTOS_LOTE + 1)})
+    assert respuesta.status_code == 400
+
+
+def test_lote_solo_para_conductores(cliente_admin):
+    respuesta = cliente_admin.post('/conductor/ubicacion/lote', json={'puntos': [{'lat': 1, 'lng': 1}]})
+    assert respuesta.status_code == 403
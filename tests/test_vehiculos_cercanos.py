@@ -0,0 +1,19 @@
+"""Búsqueda de vehículos cercanos: los parámetros inválidos se rechazan, no se ignoran."""
+
+import pytest
+
+URL = '/api/vehiculos/cercanos?lat=-12.05&lng=-77.04'
+
+
+@pytest.mark.parametrize('extra', ['&radio=abc', '&radio=', '&radio=-5', '&radio=nan', '&radio=inf',
+                                   '&n=abc', '&n=2.5', '&n=0'])
+def test_parametros_invalidos_responden_400(cliente_admin, extra):
+    respuesta = cliente_admin.get(URL + extra)
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()['success'] is False
+
+
+def test_parametros_validos(cliente_admin):
+    respuesta = cliente_admin.get(URL + '&radio=1500&n=3')
+    assert respuesta.status_code == 200
+    assert respuesta.get_json()['success'] is True
@@ -0,0 +1,405 @@
+"""
+Reportes PDF generados en segundo plano, con caché por contenido.
+
+Pedir un reporte (solicitar) no lo genera dentro de la petición. Se calcula
+la clave sha256(tipo, parámetros, versión de los datos) y:
+  - si ya existe REPORTES_DIR/<clave>.<pdf|zip>, el trabajo nace 'listo'
+    y se sirve ese archivo;
+  - si otro trabajo con la misma clave está en curso, se devuelve ese;
+  - si no, se agrega una fila 'pendiente' a trabajo_reporte.
+
+Un hilo por proceso reclama los pendientes con un UPDATE condicional (igual
+que el despachador push, así dos workers no generan el mismo reporte) y los
+genera en un pool de hilos. El archivo se escribe a un temporal y se renombra,
+de modo que nunca se sirve un archivo a medias. Si un proceso muere
+generando, el trabajo se libera al vencer `bloqueado_hasta`.
+
+La versión de los datos es una consulta barata que cambia cuando cambia lo
+que el reporte muestra: para finanzas, los totales del resumen diario del
+periodo y el último id de ingresos y gastos; para asistencia, las filas del
+conductor en el día; en los lotes, la cantidad, el último id y la última
+`Asistencia.actualizado` (cada INSERT o UPDATE la renueva, así que cambiar
+un estado o una observación cambia la clave) sin leer las filas, más los
+nombres de los estudiantes y conductores del lote, que son pocos y también
+salen en el reporte. Si los datos cambian entre la solicitud y la
+generación, el trabajo se guarda con la clave nueva.
+
+Variables de entorno:
+    REPORTES_DIR     carpeta del caché (instance/reportes)
+    REPORTES_HILOS   reportes generados a la vez por proceso (2)
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from database import app, db, Usuario, Estudiante, Asistencia, Ingreso, Gasto, ResumenFinanzasDia, TrabajoReporte
+import reportes
+
+DIRECTORIO = os.getenv('REPORTES_DIR', os.path.join(app.instance_path, 'reportes'))
+HILOS = int(os.getenv('REPORTES_HILOS', '2'))
+MAX_INTENTOS = 3
+INTERVALO_SONDEO = 30
+DURACION_BLOQUEO = timedelta(minutes=30)
+RETENCION_TRABAJOS = timedelta(days=7)
+RETENCION_ARCHIVOS = timedelta(days=7)
+ESTADOS_EN_CURSO = ('pendiente', 'generando')
+
+
+def _fecha(valor, mensaje='Fechas inválidas para el reporte'):
+    try:
+        return datetime.strptime(valor, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise ValueError(mensaje)
+
+
+# ---------------------------------------------------------------- finanzas
+
+def _parametros_finanzas(datos):
+    fechas = {c: _fecha(datos[c]).isoformat() if datos.get(c) else None for c in ('desde', 'hasta')}
+    if fechas['desde'] and fechas['hasta'] and fechas['desde'] > fechas['hasta']:
+        raise ValueError('La fecha inicial del reporte es posterior a la final')
+    return fechas
+
+
+def _rango(parametros):
+    return tuple(date.fromisoformat(parametros[c]) if parametros[c] else None for c in ('desde', 'hasta'))
+
+
+def _version_finanzas(parametros):
+    desde, hasta = _rango(parametros)
+    resumen = db.session.query(
+        db.func.count(), db.func.sum(ResumenFinanzasDia.cantidad), db.func.sum(ResumenFinanzasDia.total))
+    if desde:
+        resumen = resumen.filter(ResumenFinanzasDia.dia >= desde)
+    if hasta:
+        resumen = resumen.filter(ResumenFinanzasDia.dia <= hasta)
+    filas, cantidad, total = resumen.one()
+    return [filas, cantidad, round(total or 0, 2),
+            db.session.query(db.func.max(Ingreso.id)).scalar(),
+            db.session.query(db.func.max(Gasto.id)).scalar()]
+
+
+def _nombre_finanzas(parametros):
+    return f"reporte_finanzas_{parametros['desde'] or 'inicio'}_{parametros['hasta'] or 'hoy'}.pdf"
+
+
+# -------------------------------------------------------------- asistencia
+
+def _parametros_asistencia(datos):
+    conductor_id = str(datos.get('conductor_id') or '')
+    if not conductor_id.isdigit():
+        raise ValueError('Conductor inválido')
+    if not db.session.query(Usuario.id).filter_by(id=int(conductor_id), rol='conductor').first():
+        raise ValueError('Conductor no encontrado')
+    return {'conductor_id': int(conductor_id), 'fecha': _fecha(datos.get('fecha'), 'Fecha inválida').isoformat()}
+
+
+def _version_asistencia(parametros):
+    filas = reportes.filas_asistencia(parametros['conductor_id'], date.fromisoformat(parametros['fecha']))
+    nombre = db.session.query(Usuario.nombre).filter_by(id=parametros['conductor_id']).scalar()
+    return [nombre] + [[a.id, a.nombre, a.estado, str(a.hora), a.observaciones] for a in filas]
+
+
+def _nombre_asistencia(parametros):
+    nombre = db.session.query(Usuario.nombre).filter_by(id=parametros['conductor_id']).scalar()
+    return f"reporte_asistencia_{nombre}_{parametros['fecha'].replace('-', '')}.pdf"
+
+
+# ------------------------------------------------------ asistencia por lote
+
+MAX_DIAS_LOTE = 93
+FORMATOS_LOTE = ('zip', 'pdf')
+
+
+def _parametros_asistencia_lote(datos):
+    desde, hasta = _fecha(datos.get('desde')), _fecha(datos.get('hasta'))
+    if desde > hasta:
+        raise ValueError('La fecha inicial del reporte es posterior a la final')
+    if (hasta - desde).days >= MAX_DIAS_LOTE:
+        raise ValueError(f'El periodo del lote no puede pasar de {MAX_DIAS_LOTE} días')
+    formato = datos.get('formato') or 'zip'
+    if formato not in FORMATOS_LOTE:
+        raise ValueError('Formato inválido')
+
+    valores = datos.get('conductor_ids') or []
+    if not isinstance(valores, list) or not all(str(v).isdigit() for v in valores):
+        raise ValueError('Conductor inválido')
+    ids = sorted({int(v) for v in valores})
+    if ids and db.session.query(Usuario.id).filter(
+        Usuario.id.in_(ids), Usuario.rol == 'conductor'
+    ).count() != len(ids):
+        raise ValueError('Conductor no encontrado')
+
+    parametros = {'conductor_ids': ids, 'desde': desde.isoformat(), 'hasta': hasta.isoformat(), 'formato': formato}
+    if not _conductores_lote(parametros):
+        raise ValueError('No hay asistencias de esos conductores en el periodo')
+    return parametros
+
+
+def _conductores_lote(parametros):
+    """Los conductores pedidos, o todos los que tienen asistencias en el periodo"""
+    desde, hasta = _rango(parametros)
+    consulta = db.session.query(Asistencia.conductor_id).filter(
+        Asistencia.fecha >= desde, Asistencia.fecha <= hasta, Asistencia.conductor_id.isnot(None))
+    if parametros['conductor_ids']:
+        consulta = consulta.filter(Asistencia.conductor_id.in_(parametros['conductor_ids']))
+    return sorted(c for (c,) in consulta.distinct())
+
+
+def _version_asistencia_lote(parametros):
+    """Cantidad, último id y última modificación de las asistencias del lote,
+    más los nombres de los estudiantes y conductores que aparecen en él"""
+    desde, hasta = _rango(parametros)
+    filtro = [Asistencia.fecha >= desde, Asistencia.fecha <= hasta, Asistencia.conductor_id.isnot(None)]
+    if parametros['conductor_ids']:
+        filtro.append(Asistencia.conductor_id.in_(parametros['conductor_ids']))
+    cantidad, ultimo_id, actualizado = db.session.query(
+        db.func.count(), db.func.max(Asistencia.id), db.func.max(Asistencia.actualizado)
+    ).filter(*filtro).one()
+    estudiantes = db.session.query(Estudiante.id, Estudiante.nombre).filter(
+        Estudiante.id.in_(db.select(Asistencia.estudiante_id).where(*filtro))
+    ).order_by(Estudiante.id).all()
+    conductores = db.session.query(Usuario.id, Usuario.nombre).filter(
+        Usuario.id.in_(db.select(Asistencia.conductor_id).where(*filtro))
+    ).order_by(Usuario.id).all()
+    return [cantidad, ultimo_id, str(actualizado) if actualizado else None,
+            [list(e) for e in estudiantes], [list(c) for c in conductores]]
+
+
+def _nombre_asistencia_lote(parametros):
+    return f"asistencias_{parametros['desde']}_{parametros['hasta']}.{parametros['formato']}"
+
+
+TIPOS = {
+    'finanzas': {
+        'parametros': _parametros_finanzas,
+        'version': _version_finanzas,
+        'nombre': _nombre_finanzas,
+        'generar': lambda p: reportes.reporte_finanzas(*_rango(p)),
+    },
+    'asistencia': {
+        'parametros': _parametros_asistencia,
+        'version': _version_asistencia,
+        'nombre': _nombre_asistencia,
+        'generar': lambda p: reportes.reporte_asistencia(p['conductor_id'], date.fromisoformat(p['fecha'])),
+    },
+    'asistencia_lote': {
+        'parametros': _parametros_asistencia_lote,
+        'version': _version_asistencia_lote,
+        'nombre': _nombre_asistencia_lote,
+        'generar': lambda p: reportes.reporte_asistencia_lote(_conductores_lote(p), *_rango(p), p['formato']),
+    },
+}
+
+
+def _clave(tipo, parametros):
+    version = TIPOS[tipo]['version'](parametros)
+    datos = json.dumps([tipo, parametros, version], sort_keys=True, default=str)
+    return hashlib.sha256(datos.encode()).hexdigest()
+
+
+def ruta_archivo(clave, nombre):
+    """Archivo del caché para la clave, con la extensión del nombre de descarga"""
+    return os.path.join(DIRECTORIO, clave + os.path.splitext(nombre)[1])
+
+
+def disponible(trabajo):
+    return trabajo.estado == 'listo' and os.path.exists(ruta_archivo(trabajo.clave, trabajo.nombre))
+
+
+def solicitar(tipo, datos, usuario_id):
+    """Trabajo (nuevo o en curso) para el reporte pedido. Hace commit.
+
+    Lanza ValueError con un mensaje para el usuario si el tipo o los
+    parámetros no son válidos.
+    """
+    if tipo not in TIPOS:
+        raise ValueError('Tipo de reporte desconocido')
+    parametros = TIPOS[tipo]['parametros'](datos or {})
+    clave = _clave(tipo, parametros)
+
+    en_curso = TrabajoReporte.query.filter(
+        TrabajoReporte.clave == clave, TrabajoReporte.estado.in_(ESTADOS_EN_CURSO)
+    ).order_by(TrabajoReporte.id).first()
+    if en_curso:
+        return en_curso
+
+    nombre = TIPOS[tipo]['nombre'](parametros)
+    archivo = ruta_archivo(clave, nombre)
+    listo = os.path.exists(archivo)
+    if listo:
+        os.utime(archivo)  # la limpieza borra por antigüedad de uso
+    trabajo = TrabajoReporte(
+        tipo=tipo,
+        parametros=json.dumps(parametros, sort_keys=True),
+        clave=clave,
+        nombre=nombre,
+        usuario_id=usuario_id,
+        estado='listo' if listo else 'pendiente',
+        tamano=os.path.getsize(archivo) if listo else None,
+        fecha_fin=datetime.utcnow() if listo else None
+    )
+    db.session.add(trabajo)
+    db.session.commit()
+    if not listo:
+        generador_reportes.despertar()
+    return trabajo
+
+
+def serializar(trabajo):
+    return {
+        'id': trabajo.id,
+        'tipo': trabajo.tipo,
+        'parametros': json.loads(trabajo.parametros),
+        'estado': trabajo.estado,
+        'nombre': trabajo.nombre,
+        'tamano': trabajo.tamano,
+        'error': trabajo.error,
+        'fecha_creacion': trabajo.fecha_creacion.isoformat() if trabajo.fecha_creacion else None,
+        'fecha_fin': trabajo.fecha_fin.isoformat() if trabajo.fecha_fin else None
+    }
+
+
+class GeneradorReportes:
+    """Hilo que genera los reportes pendientes de este proceso.
+
+    `notificar(trabajo)`, si se asigna, se llama cuando un reporte queda listo.
+    """
+
+    def __init__(self):
+        self._evento = threading.Event()
+        self._hilo = None
+        self._pid = None
+        self._pool = None
+        self._ultima_limpieza = datetime.min
+        self.notificar = None
+
+    def iniciar(self):
+        if self._hilo is not None and self._hilo.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._pool = ThreadPoolExecutor(max_workers=HILOS, thread_name_prefix='reporte')
+        self._hilo = threading.Thread(target=self._bucle, name='reportes-generador', daemon=True)
+        self._hilo.start()
+
+    def despertar(self):
+        """Avisar que hay trabajo nuevo (llamar después del commit)"""
+        self.iniciar()
+        self._evento.set()
+
+    def _bucle(self):
+        while True:
+            self._evento.wait(INTERVALO_SONDEO)
+            self._evento.clear()
+            try:
+                while self.procesar_pendientes() == HILOS:
+                    pass
+            except Exception as e:
+                app.logger.warning('Error generando reportes: %s', e)
+
+    def _reclamar(self, ahora):
+        token = uuid.uuid4().hex
+        disponibles = db.or_(
+            TrabajoReporte.estado == 'pendiente',
+            db.and_(TrabajoReporte.estado == 'generando', TrabajoReporte.bloqueado_hasta < ahora)
+        )
+        ids = [fila[0] for fila in db.session.query(TrabajoReporte.id).filter(disponibles)
+               .order_by(TrabajoReporte.fecha_creacion).limit(HILOS).all()]
+        if not ids:
+            return []
+        TrabajoReporte.query.filter(TrabajoReporte.id.in_(ids), disponibles).update({
+            'estado': 'generando',
+            'intentos': db.func.coalesce(TrabajoReporte.intentos, 0) + 1,
+            'bloqueado_por': token,
+            'bloqueado_hasta': ahora + DURACION_BLOQUEO
+        }, synchronize_session=False)
+        db.session.commit()
+        return [fila[0] for fila in db.session.query(TrabajoReporte.id).filter_by(
+            bloqueado_por=token, estado='generando').all()]
+
+    def procesar_pendientes(self):
+        """Hacer una pasada sobre la cola. Devuelve cuántos trabajos tomó."""
+        with app.app_context():
+            ahora = datetime.utcnow()
+            ids = self._reclamar(ahora)
+            if not ids:
+                self._limpiar(ahora)
+                return 0
+        # Cada reporte en su hilo y con su propia sesión
+        list(self._pool_actual().map(self.generar, ids))
+        return len(ids)
+
+    def generar(self, trabajo_id):
+        """Generar un trabajo ya reclamado y dejarlo listo (o en error)"""
+        with app.app_context():
+            trabajo = db.session.get(TrabajoReporte, trabajo_id)
+            try:
+                parametros = json.loads(trabajo.parametros)
+                clave = _clave(trabajo.tipo, parametros)
+                archivo = ruta_archivo(clave, trabajo.nombre)
+                if not os.path.exists(archivo):
+                    os.makedirs(DIRECTORIO, exist_ok=True)
+                    temporal = f'{archivo}.{uuid.uuid4().hex}.tmp'
+                    try:
+                        reportes.guardar(TIPOS[trabajo.tipo]['generar'](parametros), temporal)
+                        os.replace(temporal, archivo)
+                    finally:
+                        if os.path.exists(temporal):
+                            os.remove(temporal)
+                trabajo.clave = clave
+                trabajo.estado = 'listo'
+                trabajo.tamano = os.path.getsize(archivo)
+                trabajo.error = None
+                trabajo.fecha_fin = datetime.utcnow()
+                trabajo.bloqueado_por = trabajo.bloqueado_hasta = None
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.warning('Error generando el reporte %s: %s', trabajo_id, e)
+                trabajo.estado = 'error' if (trabajo.intentos or 0) >= MAX_INTENTOS else 'pendiente'
+                trabajo.error = str(e)[:500]
+                trabajo.bloqueado_por = trabajo.bloqueado_hasta = None
+                db.session.commit()
+                return
+            if self.notificar:
+                try:
+                    self.notificar(trabajo)
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.warning('Error avisando el reporte %s: %s', trabajo_id, e)
+
+    def _pool_actual(self):
+        if self._pool is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._pool = ThreadPoolExecutor(max_workers=HILOS, thread_name_prefix='reporte')
+        return self._pool
+
+    def _limpiar(self, ahora):
+        """Borrar de vez en cuando los trabajos y archivos del caché antiguos"""
+        if ahora - self._ultima_limpieza < timedelta(hours=1):
+            return
+        self._ultima_limpieza = ahora
+        TrabajoReporte.query.filter(
+            TrabajoReporte.estado.notin_(ESTADOS_EN_CURSO),
+            TrabajoReporte.fecha_creacion < ahora - RETENCION_TRABAJOS
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        if not os.path.isdir(DIRECTORIO):
+            return
+        limite = time.time() - RETENCION_ARCHIVOS.total_seconds()
+        for nombre in os.listdir(DIRECTORIO):
+            ruta = os.path.join(DIRECTORIO, nombre)
+            try:
+                if os.path.getmtime(ruta) < limite:
+                    os.remove(ruta)
+            except OSError:
+                pass
+
+
+generador_reportes = GeneradorReportes()